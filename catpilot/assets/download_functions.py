@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
+import hashlib
 import requests
-import tempfile
+import threading
+import time
+import urllib3
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from pathlib import Path
 
 from catpilot.catpilot.common.catpilot_utilities import delete_file, is_url_pingable
 from catpilot.catpilot.common.catpilot_variables import RESOURCES_REPO, params_memory
@@ -11,6 +14,54 @@ from catpilot.catpilot.common.catpilot_variables import RESOURCES_REPO, params_m
 GITHUB_URL = f"https://raw.githubusercontent.com/{RESOURCES_REPO}"
 GITLAB_URL = f"https://gitlab.com/{RESOURCES_REPO}/-/raw"
 
+CHUNK_SIZE_MIN = 64 * 1024
+CHUNK_SIZE_MAX = 1024 * 1024
+MAX_CONCURRENT_DOWNLOADS = 3
+MAX_RESUME_ATTEMPTS = 5
+PROGRESS_INTERVAL = 0.25
+
+# shared by the model and theme downloads so together they never open more than a few connections
+download_queue = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS, thread_name_prefix="download")
+worker_sessions = threading.local()
+
+class DownloadProgress:
+  # overall progress of a batch of downloads, written to params_memory a few times a second at most
+  def __init__(self, progress_param, cancel_param, files=1):
+    self.cancel_param = cancel_param
+    self.files = files
+    self.progress_param = progress_param
+
+    self.cancelled = False
+    self.fractions = {}
+    self.last_update = 0
+    self.lock = threading.Lock()
+
+  def update(self, key, fraction, force=False):
+    with self.lock:
+      self.fractions[key] = fraction
+
+      now = time.monotonic()
+      if not force and now - self.last_update < PROGRESS_INTERVAL:
+        return self.cancelled
+      self.last_update = now
+
+      overall_progress = sum(self.fractions.values()) / self.files * 100
+      if overall_progress < 100:
+        params_memory.put(self.progress_param, f"{overall_progress:.0f}%")
+      else:
+        params_memory.put(self.progress_param, "Verifying authenticity...")
+
+      self.cancelled = params_memory.get_bool(self.cancel_param)
+      return self.cancelled
+
+def worker_session(session):
+  # requests.Session isn't thread safe, so each download worker keeps its own with the caller's headers
+  worker = getattr(worker_sessions, "session", None)
+  if worker is None:
+    worker = worker_sessions.session = requests.Session()
+  worker.headers.update(session.headers)
+  return worker
+
 def check_github_rate_limit(session):
   try:
     response = session.get("https://api.github.com/rate_limit", timeout=10)
@@ -30,54 +81,115 @@ def check_github_rate_limit(session):
     print(f"Error checking GitHub rate limit: {exception}")
     return False
 
-def download_file(cancel_param, destination, progress_param, url, download_param, session, files=1, file_number=1):
+def download_file(cancel_param, destination, progress_param, url, download_param, session, checksum=None, progress=None):
+  # streams into a partial file next to the destination, resuming it with range requests when the connection drops,
+  # and only moves it into place once its size and git blob checksum (when known) match
   try:
     destination.parent.mkdir(parents=True, exist_ok=True)
+    session = worker_session(session)
 
-    total_size = get_remote_file_size(url, session)
+    total_size, validator = get_remote_file_info(url, session)
     if total_size == 0:
       if not url.endswith(".gif"):
         handle_error(None, "Download invalid...", "Download invalid...", download_param, progress_param)
-      return
-
-    with session.get(url, stream=True, timeout=10) as response:
-      response.raise_for_status()
-
-      with tempfile.NamedTemporaryFile(delete=False, dir=destination.parent) as temp_file:
-        temp_file_path = Path(temp_file.name)
-
-        downloaded_size = 0
-        for chunk in response.iter_content(chunk_size=16384):
-          if params_memory.get_bool(cancel_param):
-            temp_file_path.unlink(missing_ok=True)
-            handle_error(None, "Download cancelled...", "Download cancelled...", download_param, progress_param)
-            return
-
-          if chunk:
-            temp_file.write(chunk)
-            downloaded_size += len(chunk)
-
-            file_progress = downloaded_size / total_size
-            overall_progress = ((file_number - 1) + file_progress) / files * 100
-
-            if overall_progress != 100:
-              params_memory.put(progress_param, f"{overall_progress:.0f}%")
-            else:
-              params_memory.put(progress_param, "Verifying authenticity...")
-
-        temp_file_path.rename(destination)
+      return False
+
+    if progress is None:
+      progress = DownloadProgress(progress_param, cancel_param)
+
+    partial_path = destination.parent / f"tmp_{destination.name}.partial"
+    validator_path = partial_path.with_name(f"{partial_path.name}.validator")
+
+    # a partial is only resumed against the same version of the file it was started from
+    if not validator or not validator_path.is_file() or validator_path.read_text() != validator:
+      remove_partial(partial_path)
+      if validator:
+        validator_path.write_text(validator)
+
+    for attempt in range(MAX_RESUME_ATTEMPTS):
+      offset = partial_path.stat().st_size if partial_path.is_file() and validator else 0
+      if offset >= total_size:
+        offset = 0
+
+      headers = {"Accept-Encoding": "identity"}
+      if offset:
+        headers["Range"] = f"bytes={offset}-"
+        headers["If-Range"] = validator
+
+      try:
+        with session.get(url, headers=headers, stream=True, timeout=10) as response:
+          response.raise_for_status()
+          if response.status_code != 206:
+            offset = 0
+
+          with open(partial_path, "r+b" if offset else "wb") as partial_file:
+            hasher = git_blob_hasher(total_size) if checksum else None
+            if hasher:
+              while partial_file.tell() < offset:
+                hasher.update(partial_file.read(min(CHUNK_SIZE_MAX, offset - partial_file.tell())))
+            partial_file.seek(offset)
+            partial_file.truncate()
+
+            downloaded_size = offset
+            chunk_size = CHUNK_SIZE_MIN
+            while True:
+              start_time = time.monotonic()
+              chunk = response.raw.read(chunk_size)
+              if not chunk:
+                break
+              read_time = time.monotonic() - start_time
+
+              partial_file.write(chunk)
+              if hasher:
+                hasher.update(chunk)
+              downloaded_size += len(chunk)
+
+              # grow the reads while they fill quickly and shrink them again when they stall
+              if len(chunk) == chunk_size and read_time < 0.05:
+                chunk_size = min(chunk_size * 2, CHUNK_SIZE_MAX)
+              elif read_time > 0.5:
+                chunk_size = max(chunk_size // 2, CHUNK_SIZE_MIN)
+
+              if progress.update(destination, min(downloaded_size / total_size, 1)):
+                remove_partial(partial_path)
+                handle_error(None, "Download cancelled...", "Download cancelled...", download_param, progress_param)
+                return False
+
+        if downloaded_size < total_size:
+          raise requests.ConnectionError(f"Connection closed after {downloaded_size} of {total_size} bytes")
+      except (requests.ConnectionError, requests.Timeout, urllib3.exceptions.HTTPError) as exception:
+        if attempt == MAX_RESUME_ATTEMPTS - 1:
+          raise requests.ConnectionError(exception) from exception
+        print(f"Download of {destination.name} interrupted ({exception}), resuming...")
+        time.sleep(min(2 ** attempt, 10))
+        continue
+
+      progress.update(destination, 1, force=True)
+
+      if downloaded_size != total_size:
+        print(f"File size mismatch for {destination}")
+      elif hasher and hasher.hexdigest() != checksum:
+        print(f"Checksum mismatch for {destination}")
+      else:
+        partial_path.replace(destination)
+        remove_partial(partial_path)
+        return True
+
+      remove_partial(partial_path)
+      return False
 
   except Exception as exception:
     handle_request_error(exception, destination, download_param, progress_param)
+  return False
 
-def get_remote_file_size(url, session):
+def get_remote_file_info(url, session):
   try:
     response = session.head(url, headers={"Accept-Encoding": "identity"}, timeout=10)
     response.raise_for_status()
-    return int(response.headers.get("Content-Length", 0))
+    return int(response.headers.get("Content-Length", 0)), response.headers.get("ETag") or response.headers.get("Last-Modified")
   except Exception as exception:
     handle_request_error(exception, None, None, None)
-    return 0
+    return 0, None
 
 def get_repository_url(session):
   if is_url_pingable("https://github.com"):
@@ -107,19 +219,10 @@ def handle_request_error(error, destination, download_param, progress_param):
   error_message = error_map.get(type(error), "Unexpected error")
   handle_error(destination, f"Failed: {error_message}", error, download_param, progress_param)
 
-def verify_download(file_path, url, session):
-  remote_file_size = get_remote_file_size(url, session)
-
-  if remote_file_size == 0:
-    print(f"Error fetching remote size for {file_path}")
-    return False
-
-  if not file_path.is_file():
-    print(f"File not found: {file_path}")
-    return False
-
-  if remote_file_size != file_path.stat().st_size:
-    print(f"File size mismatch for {file_path}")
-    return False
+def remove_partial(partial_path):
+  partial_path.unlink(missing_ok=True)
+  partial_path.with_name(f"{partial_path.name}.validator").unlink(missing_ok=True)
 
-  return True
+def git_blob_hasher(size):
+  # GitHub and GitLab list files by their git blob id, the sha1 of a "blob <size>" header followed by the contents
+  return hashlib.sha1(f"blob {size}\0".encode())
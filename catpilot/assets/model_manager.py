@@ -6,10 +6,11 @@ import shutil
 import time
 import urllib.parse
 
+from concurrent.futures import wait
 from pathlib import Path
 
 from catpilot.common.basedir import BASEDIR
-from catpilot.catpilot.assets.download_functions import GITLAB_URL, download_file, get_repository_url, handle_error, handle_request_error, verify_download
+from catpilot.catpilot.assets.download_functions import GITLAB_URL, DownloadProgress, download_file, download_queue, get_repository_url, handle_error, handle_request_error
 from catpilot.catpilot.common.catpilot_utilities import delete_file
 from catpilot.catpilot.common.catpilot_variables import DEFAULT_CLASSIC_MODEL, DEFAULT_MODEL, DEFAULT_TINYGRAD_MODEL, MODELS_PATH, RESOURCES_REPO, TINYGRAD_FILES, \
                                                            params, params_default, params_memory
@@ -31,6 +32,8 @@ class ModelManager:
     self.available_model_names = (params.get("AvailableModelNames", encoding="utf-8") or "").split(",")
     self.model_versions = (params.get("ModelVersions", encoding="utf-8") or "").split(",")
 
+    self.model_checksums = {}
+
     self.model_sizes_path = MODELS_PATH / "model_sizes.json"
 
     self.session = requests.Session()
@@ -50,8 +53,9 @@ class ModelManager:
         print(f"Deleting .onnx file: {onnx_file}")
         delete_file(onnx_file)
 
+    # partial downloads and their validators are kept so the next download resumes them, the loop above drops those of removed models
     for tmp_file in MODELS_PATH.glob("tmp*"):
-      if tmp_file.is_file():
+      if tmp_file.is_file() and ".partial" not in tmp_file.suffixes:
         delete_file(tmp_file)
 
     if params.get("Model", encoding="utf-8") not in self.available_models:
@@ -109,26 +113,39 @@ class ModelManager:
         print(f"Copied the tinygrad {description} from {source} to {target}")
 
   def download_all_models(self):
+    self.downloading_model = True
+
     repo_url = get_repository_url(self.session)
     if not repo_url:
       handle_error(None, "GitHub and GitLab are offline...", "Repository unavailable", MODEL_DOWNLOAD_PARAM, DOWNLOAD_PROGRESS_PARAM)
+      self.downloading_model = False
       return
 
     self.fetch_models(f"{repo_url}/Versions/model_names_{VERSION}.json", repo_url)
+    self.update_model_checksums(repo_url)
 
+    models_to_download = []
     for model in self.available_models:
-      if params_memory.get_bool(CANCEL_DOWNLOAD_PARAM):
-        handle_error(None, "Download cancelled...", "Download cancelled...", MODEL_DOWNLOAD_ALL_PARAM, DOWNLOAD_PROGRESS_PARAM)
-        return
-
-      already_downloaded = [model_file for model_file in MODELS_PATH.iterdir() if model_file.is_file() and model in model_file.name]
+      already_downloaded = [model_file for model_file in MODELS_PATH.iterdir() if model_file.is_file() and model in model_file.name and not model_file.name.startswith("tmp")]
       if already_downloaded:
         continue
 
       print(f"Model {model} is not downloaded. Preparing to download...")
-      params_memory.put(DOWNLOAD_PROGRESS_PARAM, f"Downloading \"{self.available_model_names[self.available_models.index(model)]}\"...")
+      models_to_download.append(model)
 
-      self.download_model(model)
+    params_memory.put(DOWNLOAD_PROGRESS_PARAM, f"Downloading {len(models_to_download)} models...")
+
+    progress = DownloadProgress(DOWNLOAD_PROGRESS_PARAM, CANCEL_DOWNLOAD_PARAM, files=len(models_to_download))
+    downloads = [download_queue.submit(self.download_model_file, model, repo_url, progress) for model in models_to_download]
+    wait(downloads)
+    self.downloading_model = False
+
+    for download in downloads:
+      download.result()
+
+    if params_memory.get_bool(CANCEL_DOWNLOAD_PARAM):
+      handle_error(None, "Download cancelled...", "Download cancelled...", MODEL_DOWNLOAD_ALL_PARAM, DOWNLOAD_PROGRESS_PARAM)
+      return
 
     params_memory.put(DOWNLOAD_PROGRESS_PARAM, "All models downloaded!")
 
@@ -141,58 +158,55 @@ class ModelManager:
       self.downloading_model = False
       return
 
+    self.update_model_checksums(repo_url)
+
+    progress = DownloadProgress(DOWNLOAD_PROGRESS_PARAM, CANCEL_DOWNLOAD_PARAM)
+    try:
+      download_queue.submit(self.download_model_file, model_to_download, repo_url, progress).result()
+    finally:
+      self.downloading_model = False
+
+  def download_model_file(self, model_to_download, repo_url, progress):
+    if params_memory.get_bool(CANCEL_DOWNLOAD_PARAM):
+      return
+
     if self.model_versions[self.available_models.index(model_to_download)] in {"v1", "v2", "v3", "v4", "v5", "v6"}:
       model_path = MODELS_PATH / f"{model_to_download}.thneed"
       model_url = f"{repo_url}/Models/{model_to_download}.thneed"
+      checksum = self.model_checksums.get(model_path.name)
 
       print(f"Downloading model: {model_to_download}")
-      download_file(CANCEL_DOWNLOAD_PARAM, model_path, DOWNLOAD_PROGRESS_PARAM, model_url, MODEL_DOWNLOAD_PARAM, self.session)
-
-      if params_memory.get_bool(CANCEL_DOWNLOAD_PARAM):
-        handle_error(None, "Download cancelled...", "Download cancelled...", MODEL_DOWNLOAD_PARAM, DOWNLOAD_PROGRESS_PARAM)
-        self.downloading_model = False
-        return
-
-      if verify_download(model_path, model_url, self.session):
+      if download_file(CANCEL_DOWNLOAD_PARAM, model_path, DOWNLOAD_PROGRESS_PARAM, model_url, MODEL_DOWNLOAD_PARAM, self.session, checksum, progress):
         print(f"Model {model_to_download} downloaded and verified successfully!")
         self.update_model_size(model_path)
         params_memory.put(DOWNLOAD_PROGRESS_PARAM, "Downloaded!")
         params_memory.remove(MODEL_DOWNLOAD_PARAM)
-        self.downloading_model = False
         return
 
-      print(f"Verification failed for model {model_to_download}. Retrying from GitLab...")
-      fallback_url = f"{GITLAB_URL}/Models/{model_to_download}.thneed"
-      download_file(CANCEL_DOWNLOAD_PARAM, model_path, DOWNLOAD_PROGRESS_PARAM, fallback_url, MODEL_DOWNLOAD_PARAM, self.session)
-
       if params_memory.get_bool(CANCEL_DOWNLOAD_PARAM):
         handle_error(None, "Download cancelled...", "Download cancelled...", MODEL_DOWNLOAD_PARAM, DOWNLOAD_PROGRESS_PARAM)
-        self.downloading_model = False
         return
 
-      if verify_download(model_path, fallback_url, self.session):
+      print(f"Verification failed for model {model_to_download}. Retrying from GitLab...")
+      fallback_url = f"{GITLAB_URL}/Models/{model_to_download}.thneed"
+      if download_file(CANCEL_DOWNLOAD_PARAM, model_path, DOWNLOAD_PROGRESS_PARAM, fallback_url, MODEL_DOWNLOAD_PARAM, self.session, checksum, progress):
         print(f"Model {model_to_download} downloaded and verified successfully from GitLab!")
         self.update_model_size(model_path)
         params_memory.put(DOWNLOAD_PROGRESS_PARAM, "Downloaded!")
         params_memory.remove(MODEL_DOWNLOAD_PARAM)
-        self.downloading_model = False
+        return
+
+      if params_memory.get_bool(CANCEL_DOWNLOAD_PARAM):
+        handle_error(None, "Download cancelled...", "Download cancelled...", MODEL_DOWNLOAD_PARAM, DOWNLOAD_PROGRESS_PARAM)
       else:
         handle_error(model_path, "Verification failed...", "GitLab verification failed", MODEL_DOWNLOAD_PARAM, DOWNLOAD_PROGRESS_PARAM)
-        self.downloading_model = False
 
   def fetch_all_model_sizes(self, repo_url):
-    if "github" in repo_url:
-      api_url = f"https://api.github.com/repos/{RESOURCES_REPO}/contents?ref=Models"
-    elif "gitlab" in repo_url:
-      api_url = f"https://gitlab.com/api/v4/projects/{urllib.parse.quote_plus(RESOURCES_REPO)}/repository/tree?ref=Models"
-    else:
+    if "github" not in repo_url and "gitlab" not in repo_url:
       return {}
 
     try:
-      response = self.session.get(api_url)
-      response.raise_for_status()
-
-      model_files = [file for file in response.json() if "." in file["name"]]
+      model_files = self.fetch_model_files(repo_url)
 
       if "gitlab" in repo_url:
         model_sizes = {}
@@ -209,6 +223,21 @@ class ModelManager:
       handle_request_error(f"Failed to fetch model sizes from {'GitHub' if 'github' in repo_url else 'GitLab'}: {exception}", None, None, None)
       return {}
 
+  def fetch_model_files(self, repo_url):
+    if "github" in repo_url:
+      api_url = f"https://api.github.com/repos/{RESOURCES_REPO}/contents?ref=Models"
+    else:
+      api_url = f"https://gitlab.com/api/v4/projects/{urllib.parse.quote_plus(RESOURCES_REPO)}/repository/tree?ref=Models"
+
+    response = self.session.get(api_url, timeout=10)
+    response.raise_for_status()
+
+    model_files = [file for file in response.json() if "." in file["name"]]
+
+    # both list the git blob id of each file, which downloads are verified against
+    self.model_checksums = {file["name"]: file.get("sha") or file.get("id") for file in model_files}
+    return model_files
+
   def fetch_models(self, url, repo_url, boot_run=False):
     try:
       response = self.session.get(url, timeout=10)
@@ -228,6 +257,15 @@ class ModelManager:
         return json.load(f)
     return {}
 
+  def update_model_checksums(self, repo_url):
+    if self.model_checksums or ("github" not in repo_url and "gitlab" not in repo_url):
+      return
+
+    try:
+      self.fetch_model_files(repo_url)
+    except Exception as exception:
+      print(f"Failed to fetch model checksums, verifying by size only: {exception}")
+
   def update_model_params(self, model_info):
     self.available_models = [model["id"] for model in model_info]
     self.available_model_names = [model["name"] for model in model_info]
@@ -0,0 +1,131 @@
+import hashlib
+import http.server
+import os
+import threading
+
+import pytest
+import requests
+
+from catpilot.catpilot.assets import download_functions
+
+FILE_SIZE = 300 * 1024
+
+
+class FileHandler(http.server.BaseHTTPRequestHandler):
+  # serves server.data under any path, honouring Range and If-Range unless told not to, and
+  # cuts the body short for the first server.drops downloads
+  def send_head(self):
+    data, etag = self.server.data, self.server.etag
+    start = 0
+    range_header = self.headers.get("Range")
+    if_range = self.headers.get("If-Range")
+    if range_header and not self.server.ignore_range and if_range in (None, etag):
+      start = int(range_header.removeprefix("bytes=").split("-")[0])
+      self.send_response(206)
+      self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+    else:
+      self.send_response(200)
+    self.send_header("Content-Length", str(len(data) - start))
+    self.send_header("ETag", etag)
+    self.end_headers()
+    return data[start:]
+
+  def do_HEAD(self):
+    self.send_head()
+
+  def do_GET(self):
+    self.server.requests.append(dict(self.headers))
+    body = self.send_head()
+    if self.server.drops > 0:
+      self.server.drops -= 1
+      body = body[:len(body) // 3]
+      self.close_connection = True
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+class FakeParams:
+  def __init__(self):
+    self.values = {}
+
+  def put(self, key, value):
+    self.values[key] = value
+
+  def get_bool(self, key):
+    return bool(self.values.get(key))
+
+  def remove(self, key):
+    self.values.pop(key, None)
+
+
+def git_blob_sha(data):
+  return hashlib.sha1(f"blob {len(data)}\0".encode() + data).hexdigest()
+
+
+class TestDownloadFile:
+  @pytest.fixture(autouse=True)
+  def setup(self, tmp_path, monkeypatch):
+    self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+    self.server.requests, self.server.drops, self.server.ignore_range = [], 0, False
+    self.serve(os.urandom(FILE_SIZE), '"v1"')
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    self.params = FakeParams()
+    monkeypatch.setattr(download_functions, "params_memory", self.params)
+    monkeypatch.setattr(download_functions.time, "sleep", lambda seconds: None)
+
+    self.destination = tmp_path / "models" / "model.thneed"
+    self.url = f"http://127.0.0.1:{self.server.server_address[1]}/model.thneed"
+    self.session = requests.Session()
+    yield
+    self.server.shutdown()
+    self.server.server_close()
+
+  def serve(self, data, etag):
+    self.server.data, self.server.etag = data, etag
+
+  def download(self, checksum=None):
+    checksum = checksum or git_blob_sha(self.server.data)
+    return download_functions.download_file("Cancel", self.destination, "Progress", self.url, "Download", self.session, checksum)
+
+  def tmp_files(self):
+    return sorted(path.name for path in self.destination.parent.glob("tmp*"))
+
+  def test_resume(self):
+    self.server.drops = 1
+    assert self.download()
+    assert self.destination.read_bytes() == self.server.data
+    assert self.tmp_files() == []
+
+    # the second request picks up where the dropped one stopped
+    assert "Range" not in self.server.requests[0]
+    assert self.server.requests[1]["Range"] == f"bytes={FILE_SIZE // 3}-"
+    assert self.server.requests[1]["If-Range"] == '"v1"'
+
+  def test_range_ignored(self):
+    # a server that answers every range request with the whole file still gets a complete download
+    self.server.drops, self.server.ignore_range = 2, True
+    assert self.download()
+    assert self.destination.read_bytes() == self.server.data
+    assert len(self.server.requests) == 3
+
+  def test_etag_change(self):
+    self.server.drops = download_functions.MAX_RESUME_ATTEMPTS
+    assert not self.download()
+    assert self.tmp_files() == ["tmp_model.thneed.partial", "tmp_model.thneed.partial.validator"]
+
+    # the partial belongs to the old version, so the next download starts over
+    self.server.requests.clear()
+    self.serve(os.urandom(FILE_SIZE), '"v2"')
+    assert self.download()
+    assert "Range" not in self.server.requests[0]
+    assert self.destination.read_bytes() == self.server.data
+    assert self.tmp_files() == []
+
+  def test_checksum_mismatch(self):
+    self.server.drops = 1
+    assert not self.download(checksum=git_blob_sha(b"something else"))
+    assert not self.destination.exists()
+    assert self.tmp_files() == []
@@ -5,11 +5,12 @@ import random
 import requests
 import shutil
 
+from concurrent.futures import wait
 from datetime import date, timedelta
 from dateutil import easter
 from pathlib import Path
 
-from catpilot.catpilot.assets.download_functions import GITLAB_URL, download_file, get_repository_url, handle_error, handle_request_error, verify_download
+from catpilot.catpilot.assets.download_functions import GITLAB_URL, DownloadProgress, download_file, download_queue, get_repository_url, handle_error, handle_request_error
 from catpilot.catpilot.common.catpilot_utilities import delete_file, extract_zip
 from catpilot.catpilot.common.catpilot_variables import ACTIVE_THEME_PATH, RANDOM_EVENTS_PATH, RESOURCES_REPO, THEME_SAVE_PATH, params, params_memory, update_catpilot_toggles
 
@@ -218,6 +219,7 @@ class ThemeManager:
 
     self.holiday_theme = "stock"
 
+    self.asset_checksums = {}
     self.previous_asset_mappings = {}
 
     self.session = requests.Session()
@@ -292,7 +294,7 @@ class ThemeManager:
 
       self.theme_updated = True
 
-  def handle_verification_failure(self, ext, theme_component, theme_name, theme_param, theme_path, download_path):
+  def handle_verification_failure(self, ext, theme_component, theme_name, theme_param, theme_path, download_path, checksum, progress):
     if theme_component == "steering_wheels":
       download_link = f"{GITLAB_URL}/Steering-Wheels/{theme_name}"
     else:
@@ -303,14 +305,13 @@ class ThemeManager:
 
     theme_url = download_link + ext
     print(f"Downloading theme from GitLab: {theme_name}")
-    download_file(CANCEL_DOWNLOAD_PARAM, theme_path, DOWNLOAD_PROGRESS_PARAM, theme_url, theme_param, self.session)
+    downloaded = download_file(CANCEL_DOWNLOAD_PARAM, theme_path, DOWNLOAD_PROGRESS_PARAM, theme_url, theme_param, self.session, checksum, progress)
 
     if params_memory.get_bool(CANCEL_DOWNLOAD_PARAM):
       handle_error(None, "Download cancelled...", "Download cancelled...", theme_param, DOWNLOAD_PROGRESS_PARAM)
-      self.downloading_theme = False
-      return
+      return True
 
-    if verify_download(theme_path, theme_url, self.session):
+    if downloaded:
       print(f"Theme {theme_name} downloaded and verified successfully from GitLab!")
       if ext == ".zip":
         params_memory.put(DOWNLOAD_PROGRESS_PARAM, "Unpacking theme...")
@@ -321,20 +322,37 @@ class ThemeManager:
       return False
 
   def download_theme(self, theme_component, theme_name, theme_param):
+    self.download_themes([(theme_component, theme_name, theme_param)])
+
+  def download_themes(self, themes):
     self.downloading_theme = True
 
     repo_url = get_repository_url(self.session)
     if not repo_url:
-      handle_error(None, "GitHub and GitLab are offline...", "Repository unavailable", theme_param, DOWNLOAD_PROGRESS_PARAM)
+      for _, _, theme_param in themes:
+        handle_error(None, "GitHub and GitLab are offline...", "Repository unavailable", theme_param, DOWNLOAD_PROGRESS_PARAM)
       self.downloading_theme = False
       return
 
+    progress = DownloadProgress(DOWNLOAD_PROGRESS_PARAM, CANCEL_DOWNLOAD_PARAM, files=len(themes))
+    downloads = [download_queue.submit(self.download_theme_files, theme_component, theme_name, theme_param, repo_url, progress)
+                 for theme_component, theme_name, theme_param in themes]
+    wait(downloads)
+    self.downloading_theme = False
+
+    for download in downloads:
+      download.result()
+
+  def download_theme_files(self, theme_component, theme_name, theme_param, repo_url, progress):
+    if params_memory.get_bool(CANCEL_DOWNLOAD_PARAM):
+      return
+
     if theme_component == "steering_wheels":
-      download_link = f"{repo_url}/Steering-Wheels/{theme_name}"
+      asset_path = f"Steering-Wheels/{theme_name}"
       download_path = THEME_SAVE_PATH / theme_component / theme_name
       extensions = [".gif", ".png"]
     else:
-      download_link = f"{repo_url}/Themes/{theme_name}/{theme_component}"
+      asset_path = f"Themes/{theme_name}/{theme_component}"
       download_path = THEME_SAVE_PATH / "theme_packs" / theme_name / theme_component
       extensions = [".zip"]
 
@@ -343,29 +361,26 @@ class ThemeManager:
       if theme_path.is_file():
         delete_file(theme_path)
 
-      theme_url = download_link + ext
+      theme_url = f"{repo_url}/{asset_path}{ext}"
+      checksum = self.asset_checksums.get(f"{asset_path}{ext}")
       print(f"Downloading theme from GitHub: {theme_name}")
-      download_file(CANCEL_DOWNLOAD_PARAM, theme_path, DOWNLOAD_PROGRESS_PARAM, theme_url, theme_param, self.session)
+      downloaded = download_file(CANCEL_DOWNLOAD_PARAM, theme_path, DOWNLOAD_PROGRESS_PARAM, theme_url, theme_param, self.session, checksum, progress)
 
       if params_memory.get_bool(CANCEL_DOWNLOAD_PARAM):
         handle_error(None, "Download cancelled...", "Download cancelled...", theme_param, DOWNLOAD_PROGRESS_PARAM)
-        self.downloading_theme = False
         return
 
-      if verify_download(theme_path, theme_url, self.session):
+      if downloaded:
         print(f"Theme {theme_name} downloaded and verified successfully from GitHub!")
         if ext == ".zip":
           params_memory.put(DOWNLOAD_PROGRESS_PARAM, "Unpacking theme...")
           extract_zip(theme_path, download_path)
         params_memory.put(DOWNLOAD_PROGRESS_PARAM, "Downloaded!")
-        self.downloading_theme = False
         return
-      elif self.handle_verification_failure(ext, theme_component, theme_name, theme_param, theme_path, download_path):
-        self.downloading_theme = False
+      elif self.handle_verification_failure(ext, theme_component, theme_name, theme_param, theme_path, download_path, checksum, progress):
         return
 
     handle_error(download_path, "Download failed...", "Download failed...", theme_param, DOWNLOAD_PROGRESS_PARAM)
-    self.downloading_theme = False
 
   def fetch_assets(self, repo_url):
     branches = ["Distance-Icons", "Steering-Wheels", "Themes"]
@@ -397,6 +412,9 @@ class ThemeManager:
           if item["type"] != "blob":
             continue
 
+          # the git blob id, which downloads are verified against
+          self.asset_checksums[f"{branch}/{item['path']}"] = item.get("sha") or item.get("id")
+
           if branch == "Steering-Wheels":
             assets["wheels"].append(item["path"])
           elif branch == "Themes":
@@ -448,6 +466,7 @@ class ThemeManager:
       "WheelIcon": ("steering_wheels", catpilot_toggles.wheel_image, downloadable_wheels)
     }
 
+    themes_to_download = []
     for theme_param, (theme_component, theme_name, downloadable_list) in asset_mappings.items():
       if not downloadable_list:
         continue
@@ -460,8 +479,7 @@ class ThemeManager:
         matching_files = list(theme_path.parent.glob(f"{theme_name}.*"))
         if not matching_files:
           print(f"  {theme_name} for {theme_component} not found. Downloading...")
-          self.download_theme(theme_component, theme_name, theme_param)
-          update_catpilot_toggles()
+          themes_to_download.append((theme_component, theme_name, theme_param))
         elif theme_name.replace("_", " ").split(".")[0].title() not in downloadable_list:
           if theme_path.exists():
             print(f"{theme_name} for {theme_component} is outdated. Deleting...")
@@ -471,14 +489,17 @@ class ThemeManager:
         theme_path = THEME_SAVE_PATH / "theme_packs" / theme_name / theme_component
         if not theme_path.exists():
           print(f"  {theme_name} for {theme_component} not found. Downloading...")
-          self.download_theme(theme_component, theme_name, theme_param)
-          update_catpilot_toggles()
+          themes_to_download.append((theme_component, theme_name, theme_param))
         elif theme_name.replace("_", " ").split(".")[0].title() not in downloadable_list:
           if theme_path.exists():
             print(f"{theme_name} for {theme_component} is outdated. Deleting...")
             delete_file(theme_path)
           continue
 
+    if themes_to_download:
+      self.download_themes(themes_to_download)
+      update_catpilot_toggles()
+
     for dir_path in THEME_SAVE_PATH.glob("**/*"):
       if dir_path.is_dir() and not any(dir_path.iterdir()):
         print(f"Deleting empty folder: {dir_path}")
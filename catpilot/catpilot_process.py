@@ -14,9 +14,10 @@ from catpilot.catpilot.assets.model_manager import ModelManager, MODEL_DOWNLOAD_
 from catpilot.catpilot.assets.theme_manager import ThemeManager
 from catpilot.catpilot.common.catpilot_functions import backup_toggles
 from catpilot.catpilot.common.catpilot_utilities import flash_panda, is_url_pingable, lock_doors, run_thread_with_lock, update_maps, update_catpilot
-from catpilot.catpilot.common.catpilot_variables import ERROR_LOGS_PATH, CatPilotVariables, get_catpilot_toggles, params, params_cache, params_memory
+from catpilot.catpilot.common.catpilot_variables import ERROR_LOGS_PATH, TRACKING_STATS_PATH, CatPilotVariables, get_catpilot_toggles, params, params_cache, params_memory
+from catpilot.catpilot.common.stats_store import StatsStore
 from catpilot.catpilot.controls.catpilot_planner import CatPilotPlanner
-from catpilot.catpilot.controls.lib.catpilot_tracking import CatPilotTracking
+from catpilot.catpilot.controls.lib.catpilot_tracking import TRACKING_COUNTERS, CatPilotTracking, legacy_tracking_stats
 from catpilot.catpilot.system.catpilot_stats import send_stats
 
 ASSET_CHECK_RATE = (1 / DT_MDL)
@@ -79,6 +80,7 @@ def catpilot_thread():
   catpilot_variables = CatPilotVariables()
   model_manager = ModelManager()
   theme_manager = ThemeManager()
+  tracking_stats = StatsStore(TRACKING_STATS_PATH, TRACKING_COUNTERS, seed=legacy_tracking_stats)
 
   toggles_last_updated = datetime.datetime.now()
 
@@ -105,7 +107,7 @@ def catpilot_thread():
       run_update_checks = True
 
       catpilot_variables.update(theme_manager.holiday_theme, started)
-      catpilot_toggles = get_catpilot_toggles()
+      catpilot_toggles.refresh()
 
       if catpilot_toggles.lock_doors_timer:
         run_thread_with_lock("lock_doors", lock_doors, (catpilot_toggles.lock_doors_timer, sm), report=False)
@@ -120,7 +122,7 @@ def catpilot_thread():
 
     elif started and not started_previously:
       catpilot_planner = CatPilotPlanner()
-      catpilot_tracking = CatPilotTracking()
+      catpilot_tracking = CatPilotTracking(tracking_stats)
 
       if error_log.is_file():
         error_log.unlink()
@@ -148,7 +150,7 @@ def catpilot_thread():
       previous_random_themes = catpilot_toggles.random_themes
 
       catpilot_variables.update(theme_manager.holiday_theme, started)
-      catpilot_toggles = get_catpilot_toggles()
+      catpilot_toggles.refresh()
 
       randomize_theme = catpilot_toggles.holiday_themes != previous_holiday_themes
       randomize_theme |= catpilot_toggles.random_themes != previous_random_themes
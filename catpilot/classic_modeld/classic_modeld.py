@@ -337,7 +337,7 @@ def main(demo=False):
 
     # Update CatPilot variables
     if sm['catpilotPlan'].togglesUpdated:
-      catpilot_toggles = get_catpilot_toggles()
+      catpilot_toggles.refresh()
 
 if __name__ == "__main__":
   try:
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+import shutil
+import stat
+import subprocess
+import tarfile
+import zstandard as zstd
+
+import numpy as np
+
+from pathlib import Path
+
+COMPRESSION_LEVEL = 2
+COMPRESSION_THREADS = 2  # leave the remaining cores to the processes running alongside the boot backup
+
+CHUNK_SIZE_MIN = 16 * 1024
+CHUNK_SIZE_MAX = 256 * 1024
+CHUNK_MASK = np.uint32(0xFFFE0000)  # 15 bits, a boundary every ~32 KiB past the minimum
+READ_SIZE = 4 * 1024 * 1024
+
+# Gear table for the rolling hash, derived from sha256 so the boundaries never change between versions
+GEAR = np.array([int.from_bytes(hashlib.sha256(bytes([i])).digest()[:4], "little") for i in range(256)], dtype=np.uint32)
+
+def privileged_tar(source, arcname=".", options=()):
+  # the tree is read as root like the rsync this replaced, it can hold files the current user can't read
+  return subprocess.Popen(["sudo", "tar", "-C", str(source), "--transform", f"s,^\\.,{arcname},S", *options, "-cf", "-", "."], stdout=subprocess.PIPE)
+
+def fsync_directory(path):
+  fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+  try:
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+
+def check_tar(process):
+  # 1 means a file changed while it was read, which a backup of a live tree can't avoid
+  if process.returncode not in (0, 1):
+    raise subprocess.CalledProcessError(process.returncode, process.args)
+
+def write_archive(source, destination, arcname, level=COMPRESSION_LEVEL, threads=COMPRESSION_THREADS, privileged=False):
+  with open(destination, "wb") as f:
+    cctx = zstd.ZstdCompressor(level=level, threads=threads)
+    with cctx.stream_writer(f) as compressor:
+      if privileged:
+        with privileged_tar(source, arcname) as process:
+          shutil.copyfileobj(process.stdout, compressor, READ_SIZE)
+        check_tar(process)
+      else:
+        with tarfile.open(fileobj=compressor, mode="w|") as tar:
+          tar.add(source, arcname=arcname)
+
+def chunk_boundaries(data, final):
+  # Gear hash of the 32 bytes ending at each position, built up by doubling the window instead of byte by byte
+  h = GEAR[np.frombuffer(data, dtype=np.uint8)]
+  shift = 1
+  while shift < 32:
+    h[shift:] += h[:-shift] << shift
+    shift *= 2
+
+  boundaries = []
+  start = 0
+  for cut in (np.flatnonzero((h & CHUNK_MASK) == 0) + 1).tolist():
+    while cut - start > CHUNK_SIZE_MAX:
+      start += CHUNK_SIZE_MAX
+      boundaries.append(start)
+    if cut - start >= CHUNK_SIZE_MIN:
+      boundaries.append(cut)
+      start = cut
+
+  while len(data) - start > CHUNK_SIZE_MAX:
+    start += CHUNK_SIZE_MAX
+    boundaries.append(start)
+  if final and start < len(data):
+    boundaries.append(len(data))
+  return boundaries
+
+def walk_entries(source):
+  source = Path(source)
+  st = source.stat()
+  yield {"path": ".", "type": "dir", "mode": stat.S_IMODE(st.st_mode), "mtime_ns": st.st_mtime_ns}, None
+
+  for root, dirs, files in os.walk(source):
+    dirs.sort()
+    root = Path(root)
+    for entry_name in sorted(dirs + files):
+      path = root / entry_name
+      st = path.lstat()
+      entry = {"path": path.relative_to(source).as_posix(), "mode": stat.S_IMODE(st.st_mode), "mtime_ns": st.st_mtime_ns}
+
+      if stat.S_ISLNK(st.st_mode):
+        yield {**entry, "type": "symlink", "target": os.readlink(path)}, None
+      elif stat.S_ISDIR(st.st_mode):
+        yield {**entry, "type": "dir"}, None
+      elif stat.S_ISREG(st.st_mode):
+        yield {**entry, "type": "file", "size": st.st_size}, lambda path=path: open(path, "rb")
+
+def pax_mtime_ns(member):
+  # pax headers hold the exact time as a decimal string, member.mtime is a float that loses the last digits
+  seconds, _, fraction = member.pax_headers.get("mtime", str(int(member.mtime))).partition(".")
+  return int(seconds) * 1_000_000_000 + int(fraction[:9].ljust(9, "0"))
+
+def tar_entries(source):
+  # same entries as walk_entries, read from a privileged tar stream in the pax format for nanosecond times,
+  # a file rewritten within the same second as the previous snapshot would otherwise keep its old chunks
+  with privileged_tar(source, options=("--format=posix", "--pax-option=delete=atime,delete=ctime")) as process:
+    try:
+      with tarfile.open(fileobj=process.stdout, mode="r|") as tar:
+        for member in tar:
+          entry = {"path": os.path.normpath(member.name), "mode": member.mode, "mtime_ns": pax_mtime_ns(member)}
+          if member.issym():
+            yield {**entry, "type": "symlink", "target": member.linkname}, None
+          elif member.isdir():
+            yield {**entry, "type": "dir"}, None
+          elif member.isfile():
+            # only valid until the next member, the stream can't seek back
+            yield {**entry, "type": "file", "size": member.size}, lambda member=member: tar.extractfile(member)
+    except BaseException:
+      process.kill()
+      raise
+  check_tar(process)
+
+def iter_chunks(f):
+  # Chunks always start at a boundary and the first bytes of a chunk can't be one, so cutting the file
+  # into reads gives the same chunks as hashing it whole
+  pending = b""
+  while True:
+    data = f.read(READ_SIZE)
+    buffer = pending + data if pending else data
+    if len(buffer) <= CHUNK_SIZE_MIN:
+      if not data:
+        if buffer:
+          yield buffer
+        return
+      pending = buffer
+      continue
+
+    start = 0
+    for cut in chunk_boundaries(buffer, final=not data):
+      yield buffer[start:cut]
+      start = cut
+    pending = buffer[start:]
+    if not data:
+      return
+
+class BackupStore:
+  """Incremental backups of a directory, deduplicated into a content-defined chunk store.
+
+  Each backup is a manifest of the files it holds and the chunks they're made of, and successive
+  backups only write the chunks that changed. Files whose size and modification time match the
+  previous backup reuse its chunks without being read.
+  """
+  def __init__(self, directory):
+    self.directory = Path(directory)
+    self.chunks_path = self.directory / "chunks"
+
+  def manifest_path(self, name):
+    return self.directory / f"{name}.manifest.zst"
+
+  def exists(self, name):
+    return self.manifest_path(name).exists()
+
+  def chunk_path(self, chunk_id):
+    return self.chunks_path / chunk_id[:2] / chunk_id
+
+  def manifests(self):
+    return sorted((path for path in self.directory.glob("*.manifest.zst") if "_in_progress" not in path.name), key=lambda path: path.stat().st_mtime)
+
+  def load_manifest(self, path):
+    with open(path, "rb") as f:
+      return json.loads(zstd.ZstdDecompressor().stream_reader(f).read())
+
+  def write_chunk(self, chunk, cctx):
+    chunk_id = hashlib.sha256(chunk).hexdigest()
+    path = self.chunk_path(chunk_id)
+    if path.exists():
+      return chunk_id, 0
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    compressed = cctx.compress(chunk)
+    temp_path = path.with_name(f"{chunk_id}.tmp")
+    with open(temp_path, "wb") as f:
+      f.write(compressed)
+      os.fsync(f.fileno())
+    temp_path.replace(path)
+    return chunk_id, len(compressed)
+
+  def snapshot(self, source, name, privileged=False):
+    manifests = self.manifests()
+    previous = {entry["path"]: entry for entry in self.load_manifest(manifests[-1])["entries"]} if manifests else {}
+
+    cctx = zstd.ZstdCompressor(level=COMPRESSION_LEVEL)
+    entries = []
+    written = 0
+    chunk_directories = set()
+    for entry, open_file in (tar_entries(source) if privileged else walk_entries(source)):
+      if entry["type"] == "file":
+        cached = previous.get(entry["path"])
+        if cached and cached.get("size") == entry["size"] and cached["mtime_ns"] == entry["mtime_ns"] and all(self.chunk_path(c).exists() for c in cached["chunks"]):
+          entry["chunks"] = cached["chunks"]
+        else:
+          entry["chunks"] = []
+          with open_file() as f:
+            for chunk in iter_chunks(f):
+              chunk_id, chunk_size = self.write_chunk(chunk, cctx)
+              entry["chunks"].append(chunk_id)
+              written += chunk_size
+              if chunk_size:
+                chunk_directories.add(self.chunk_path(chunk_id).parent)
+
+      entries.append(entry)
+
+    # a chunk only counts as stored once it survives a power loss, the next snapshot reuses what the manifest lists
+    for directory in chunk_directories:
+      fsync_directory(directory)
+    if chunk_directories:
+      fsync_directory(self.chunks_path)
+
+    in_progress_manifest = self.manifest_path(f"{name}_in_progress")
+    with open(in_progress_manifest, "wb") as f:
+      f.write(cctx.compress(json.dumps({"name": name, "entries": entries}).encode()))
+      os.fsync(f.fileno())
+    written += in_progress_manifest.stat().st_size
+    in_progress_manifest.rename(self.manifest_path(name))
+    fsync_directory(self.directory)
+    return written
+
+  def stored_size(self, name):
+    # what the snapshot would take to write from scratch, its manifest and every chunk it references once
+    chunks = {chunk_id for entry in self.load_manifest(self.manifest_path(name))["entries"] for chunk_id in entry.get("chunks", [])}
+    return self.manifest_path(name).stat().st_size + sum(self.chunk_path(chunk_id).stat().st_size for chunk_id in chunks)
+
+  def restore(self, name, destination):
+    destination = Path(destination)
+    dctx = zstd.ZstdDecompressor()
+
+    directories = []
+    for entry in self.load_manifest(self.manifest_path(name))["entries"]:
+      path = destination / entry["path"]
+      if entry["type"] == "dir":
+        path.mkdir(parents=True, exist_ok=True)
+        directories.append((path, entry))
+        continue
+
+      path.parent.mkdir(parents=True, exist_ok=True)
+      if path.is_symlink() or path.exists():
+        path.unlink()
+
+      if entry["type"] == "symlink":
+        os.symlink(entry["target"], path)
+        continue
+
+      with open(path, "wb") as f:
+        for chunk_id in entry["chunks"]:
+          f.write(dctx.decompress(self.chunk_path(chunk_id).read_bytes()))
+      os.chmod(path, entry["mode"])
+      os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+    # Directory times last, writing their files changes them
+    for path, entry in reversed(directories):
+      os.chmod(path, entry["mode"])
+      os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+  def collect_garbage(self):
+    if not self.chunks_path.exists():
+      return
+
+    referenced = set()
+    for manifest in self.manifests():
+      for entry in self.load_manifest(manifest)["entries"]:
+        referenced.update(entry.get("chunks", []))
+
+    for path in self.chunks_path.glob("*/*"):
+      if path.name not in referenced:
+        path.unlink(missing_ok=True)
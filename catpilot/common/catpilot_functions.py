@@ -9,10 +9,8 @@ import random
 import shutil
 import string
 import subprocess
-import tarfile
 import threading
 import time
-import zstandard as zstd
 
 from catpilot.common.basedir import BASEDIR
 from catpilot.common.params import Params
@@ -22,6 +20,7 @@ from catpilot.system.hardware import HARDWARE
 
 from catpilot.catpilot.assets.model_manager import ModelManager
 from catpilot.catpilot.assets.theme_manager import HOLIDAY_THEME_PATH, ThemeManager
+from catpilot.catpilot.common.backup_store import BackupStore, write_archive
 from catpilot.catpilot.common.catpilot_utilities import delete_file, run_cmd, use_konik_server
 from catpilot.catpilot.common.catpilot_variables import (
   ERROR_LOGS_PATH, EXCLUDED_KEYS, HD_LOGS_PATH, KONIK_LOGS_PATH, MODELS_PATH, SCREEN_RECORDINGS_PATH,
@@ -29,37 +28,37 @@ from catpilot.catpilot.common.catpilot_variables import (
 )
 from catpilot.catpilot.system.catpilot_stats import send_stats
 
-def backup_directory(backup, destination, success_message, fail_message, minimum_backup_size=0, compressed=False):
-  in_progress_destination = destination.parent / (destination.name + "_in_progress")
-  in_progress_destination.mkdir(parents=True, exist_ok=True)
+def backup_directory(backup, destination, success_message, fail_message, minimum_backup_size=0, compressed=False, incremental=False):
+  if incremental:
+    store = BackupStore(destination.parent)
+    if store.exists(destination.name):
+      print("Backup already exists. Aborting...")
+      return
+
+    try:
+      written = store.snapshot(backup, destination.name, privileged=True)
+    except (OSError, subprocess.CalledProcessError) as error:
+      print(f"{fail_message}: {error}")
+      return
+    print(f"{success_message} ({written} bytes written)")
 
-  if compressed:
+    # a snapshot after an update can rewrite most of the tree, keep room for all of it
+    stored_size = store.stored_size(destination.name)
+    if minimum_backup_size == 0 or stored_size < minimum_backup_size:
+      params.put_int("MinimumBackupSize", stored_size)
+  elif compressed:
     destination_compressed = destination.parent / (destination.name + ".tar.zst")
     if destination_compressed.exists():
-      delete_file(in_progress_destination, report=False)
       print("Backup already exists. Aborting...")
       return
 
-    run_cmd(["sudo", "rsync", "-avq", f"{backup}/.", in_progress_destination], "", fail_message, report=False)
-
-    tar_file = destination.parent / (destination.name + "_in_progress.tar")
-    with tarfile.open(tar_file, "w") as tar:
-      tar.add(in_progress_destination, arcname=destination.name)
-
-    delete_file(in_progress_destination, report=False)
-
     compressed_file = destination.parent / (destination.name + "_in_progress.tar.zst")
-    with open(compressed_file, "wb") as f:
-      cctx = zstd.ZstdCompressor(level=2)
-      with open(tar_file, "rb") as tar_f:
-        with cctx.stream_writer(f) as compressor:
-          while True:
-            chunk = tar_f.read(65536)
-            if not chunk:
-              break
-            compressor.write(chunk)
-
-    tar_file.unlink(missing_ok=True)
+    try:
+      write_archive(backup, compressed_file, destination.name, privileged=True)
+    except (OSError, subprocess.CalledProcessError) as error:
+      compressed_file.unlink(missing_ok=True)
+      print(f"{fail_message}: {error}")
+      return
 
     compressed_file.rename(destination_compressed)
     print(f"Backup saved: {destination_compressed}")
@@ -68,6 +67,9 @@ def backup_directory(backup, destination, success_message, fail_message, minimum
     if minimum_backup_size == 0 or compressed_backup_size < minimum_backup_size:
       params.put_int("MinimumBackupSize", compressed_backup_size)
   else:
+    in_progress_destination = destination.parent / (destination.name + "_in_progress")
+    in_progress_destination.mkdir(parents=True, exist_ok=True)
+
     if destination.exists():
       delete_file(in_progress_destination, report=False)
       print("Backup already exists. Aborting...")
@@ -86,6 +88,8 @@ def cleanup_backups(directory, limit, compressed=False):
   for oldest_backup in backups[limit:]:
     delete_file(oldest_backup, report=False)
 
+  BackupStore(directory).collect_garbage()
+
 def backup_catpilot(build_metadata):
   backup_path = Path("/data/backups")
   maximum_backups = 3
@@ -96,7 +100,7 @@ def backup_catpilot(build_metadata):
   if free > minimum_backup_size * maximum_backups:
     directory = Path(BASEDIR)
     destination_directory = backup_path / f"{build_metadata.channel}_{build_metadata.catpilot.git_commit_date[12:-16]}_auto"
-    backup_directory(directory, destination_directory, f"Successfully backed up CatPilot to {destination_directory}", f"Failed to backup CatPilot to {destination_directory}", minimum_backup_size, compressed=True)
+    backup_directory(directory, destination_directory, f"Successfully backed up CatPilot to {destination_directory}", f"Failed to backup CatPilot to {destination_directory}", minimum_backup_size, incremental=True)
 
 def backup_toggles(params_cache):
   params_backup = Params("/data/params_backup")
@@ -125,7 +129,7 @@ def backup_toggles(params_cache):
 
   directory = Path("/data/params_backup/d")
   destination_directory = backup_path / f"{datetime.datetime.now().strftime('%Y-%m-%d_%I-%M%p').lower()}_auto"
-  backup_directory(directory, destination_directory, f"Successfully backed up toggles to {destination_directory}", f"Failed to backup toggles to {destination_directory}")
+  backup_directory(directory, destination_directory, f"Successfully backed up toggles to {destination_directory}", f"Failed to backup toggles to {destination_directory}", incremental=True)
 
 def convert_params(params_cache):
   print("Starting to convert params")
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+import json
+import mmap
+import os
+import struct
+import time
+import numpy as np
+
+from types import SimpleNamespace
+
+TOGGLE_BLOCK_PATH = "/dev/shm/catpilot_toggles" + os.environ.get("CATPILOT_PREFIX", "")
+TOGGLE_BLOCK_SIZE = 1024 * 1024
+
+BLOCK_MAGIC = b"CPTB"
+BLOCK_FORMAT_VERSION = 1
+
+# magic, format version, sequence, layout version, field count, layout length, values length, heap length
+HEADER = struct.Struct("<4sIQIIIII")
+SEQUENCE_OFFSET = 8
+SEQUENCE = struct.Struct("<Q")
+HEADER_SIZE = (HEADER.size + 7) // 8 * 8
+
+# field type codes and how each one is stored in the values region, strings and JSON live in the heap
+FIELD_FORMATS = {"?": "?", "q": "q", "d": "d", "s": "II", "j": "II"}
+
+
+def field_type(value):
+  if isinstance(value, bool):
+    return "?"
+  elif isinstance(value, int) and -2**63 <= value < 2**63:
+    return "q"
+  elif isinstance(value, float):
+    return "d"
+  elif isinstance(value, str):
+    return "s"
+  return "j"
+
+
+class BlockLayout:
+  """Field names and types of a published block, and the struct used to unpack its values in one call.
+
+  Scalars are laid out first so a snapshot can zip them straight out of the unpacked tuple, strings and
+  JSON values follow as (offset, length) pairs into the heap.
+  """
+  def __init__(self, fields: list[tuple[str, str]]):
+    self.fields = sorted(fields, key=lambda field: field[1] in ("s", "j"))
+    self.types = dict(fields)
+    self.names = [name for name, _ in self.fields]
+    self.index = {name: i for i, name in enumerate(self.names)}
+    self.values = struct.Struct("<" + "".join(FIELD_FORMATS[code] for _, code in self.fields))
+    self.generations = struct.Struct(f"<{len(self.fields)}I")
+    self.encoded = json.dumps(self.fields).encode()
+
+    self.scalar_count = sum(code not in ("s", "j") for _, code in self.fields)
+    self.scalar_names = self.names[:self.scalar_count]
+    self.heap_fields = [(name, code, self.scalar_count + 2 * i) for i, (name, code) in enumerate(self.fields[self.scalar_count:])]
+
+    # byte offset and struct of every field inside the values region, for single field reads
+    self.field_structs = []
+    offset = 0
+    for _, code in self.fields:
+      field_struct = struct.Struct("<" + FIELD_FORMATS[code])
+      self.field_structs.append((offset, field_struct))
+      offset += field_struct.size
+
+  @classmethod
+  def decode(cls, dat: bytes) -> 'BlockLayout':
+    return cls([(name, code) for name, code in json.loads(dat)])
+
+  @staticmethod
+  def decode_value(code, dat):
+    return dat.decode() if code == "s" else json.loads(dat)
+
+  def unpack(self, values, heap: bytes) -> dict:
+    ret = dict(zip(self.scalar_names, values, strict=False))
+    for name, code, slot in self.heap_fields:
+      start = values[slot]
+      ret[name] = self.decode_value(code, heap[start:start + values[slot + 1]])
+    return ret
+
+
+class ToggleBlockWriter:
+  """Publishes the toggles into a fixed-layout block in /dev/shm guarded by a seqlock.
+
+  The sequence number is odd while a write is in progress, readers retry until they see the same even
+  sequence before and after copying. Each field also carries a generation counter that only moves when
+  that field's value changes, so consumers can react to the toggles they care about.
+  """
+  def __init__(self, path=TOGGLE_BLOCK_PATH, size=TOGGLE_BLOCK_SIZE):
+    self.size = size
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+      os.ftruncate(fd, size)
+      self.buf = mmap.mmap(fd, size)
+    finally:
+      os.close(fd)
+
+    self.layout: BlockLayout | None = None
+    self.layout_version = 0
+    self.sequence = 0
+    self.previous: dict = {}
+    self.generations: list[int] = []
+
+    magic, _, sequence, layout_version, *_ = HEADER.unpack_from(self.buf)
+    if magic == BLOCK_MAGIC:
+      # continue the counters of an existing block so readers never see them go backwards
+      self.sequence = sequence + (sequence & 1)
+      self.layout_version = layout_version
+
+  def publish(self, toggles: dict) -> None:
+    fields = [(name, field_type(value)) for name, value in toggles.items()]
+    if self.layout is None or dict(fields) != self.layout.types:
+      self.layout = BlockLayout(fields)
+      self.layout_version += 1
+      self.previous = {}
+      self.generations = [0] * len(fields)
+
+    layout = self.layout
+    previous = self.previous
+    for i, name in enumerate(layout.names):
+      if name not in previous or previous[name] != toggles[name]:
+        self.generations[i] += 1
+    self.previous = dict(toggles)
+
+    values = [toggles[name] for name in layout.scalar_names]
+    heap = bytearray()
+    for name, code, _ in layout.heap_fields:
+      encoded = toggles[name].encode() if code == "s" else json.dumps(toggles[name]).encode()
+      values += [len(heap), len(encoded)]
+      heap += encoded
+
+    layout_dat = layout.encoded
+    values_offset = HEADER_SIZE + len(layout_dat)
+    generations_offset = values_offset + layout.values.size
+    heap_offset = generations_offset + layout.generations.size
+    if heap_offset + len(heap) > self.size:
+      raise ValueError(f"toggles need {heap_offset + len(heap)} bytes, toggle block is {self.size}")
+
+    self.sequence += 1
+    SEQUENCE.pack_into(self.buf, SEQUENCE_OFFSET, self.sequence)
+
+    HEADER.pack_into(self.buf, 0, BLOCK_MAGIC, BLOCK_FORMAT_VERSION, self.sequence, self.layout_version,
+                     len(layout.fields), len(layout_dat), layout.values.size, len(heap))
+    self.buf[HEADER_SIZE:values_offset] = layout_dat
+    layout.values.pack_into(self.buf, values_offset, *values)
+    layout.generations.pack_into(self.buf, generations_offset, *(g & 0xFFFFFFFF for g in self.generations))
+    self.buf[heap_offset:heap_offset + len(heap)] = heap
+
+    self.sequence += 1
+    SEQUENCE.pack_into(self.buf, SEQUENCE_OFFSET, self.sequence)
+
+  def close(self) -> None:
+    self.buf.close()
+
+
+class ToggleBlockReader:
+  """Zero-copy view of the toggle block, the layout is only re-parsed when the writer changes it."""
+  def __init__(self, path=TOGGLE_BLOCK_PATH):
+    self.path = path
+    self.buf: mmap.mmap | None = None
+    self.layout: BlockLayout | None = None
+    self.layout_version = -1
+
+  def _open(self) -> bool:
+    if self.buf is not None:
+      return True
+    try:
+      fd = os.open(self.path, os.O_RDONLY)
+    except FileNotFoundError:
+      return False
+    try:
+      if os.fstat(fd).st_size < HEADER_SIZE:
+        return False
+      self.buf = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    finally:
+      os.close(fd)
+    return True
+
+  @property
+  def sequence(self) -> int:
+    """Changes on every publish, a single read that's cheap enough to poll from any loop."""
+    if not self._open():
+      return 0
+    return SEQUENCE.unpack_from(self.buf, SEQUENCE_OFFSET)[0]
+
+  def _read(self):
+    while True:
+      sequence = SEQUENCE.unpack_from(self.buf, SEQUENCE_OFFSET)[0]
+      if sequence & 1:
+        time.sleep(0)
+        continue
+
+      magic, _, _, layout_version, _, layout_len, values_len, heap_len = HEADER.unpack_from(self.buf)
+      if magic != BLOCK_MAGIC:
+        return None
+
+      if layout_version != self.layout_version:
+        layout_dat = self.buf[HEADER_SIZE:HEADER_SIZE + layout_len]
+        try:
+          layout = BlockLayout.decode(layout_dat)
+        except ValueError:
+          continue
+        if SEQUENCE.unpack_from(self.buf, SEQUENCE_OFFSET)[0] != sequence:
+          continue
+        self.layout, self.layout_version = layout, layout_version
+
+      values_offset = HEADER_SIZE + layout_len
+      generations_offset = values_offset + values_len
+      heap_offset = generations_offset + self.layout.generations.size
+
+      try:
+        values = self.layout.values.unpack_from(self.buf, values_offset)
+        generations = self.layout.generations.unpack_from(self.buf, generations_offset)
+      except struct.error:
+        continue
+      heap = self.buf[heap_offset:heap_offset + heap_len]
+
+      if SEQUENCE.unpack_from(self.buf, SEQUENCE_OFFSET)[0] == sequence:
+        return self.layout, values, generations, heap
+
+  def read(self, block=True) -> dict:
+    while not self._open() or self.sequence == 0:
+      if not block:
+        return {}
+      time.sleep(0.01)
+
+    snapshot = self._read()
+    if snapshot is None:
+      return {}
+    layout, values, _, heap = snapshot
+    return layout.unpack(values, heap)
+
+  def get(self, name: str, default=None):
+    """Typed read of a single field straight from the block, without unpacking the rest."""
+    if not self._open() or self.sequence == 0:
+      return default
+
+    while True:
+      sequence = SEQUENCE.unpack_from(self.buf, SEQUENCE_OFFSET)[0]
+      if sequence & 1:
+        time.sleep(0)
+        continue
+
+      layout_version, layout_len, heap_len = self._layout_header()
+      if layout_version != self.layout_version and self._read() is None:
+        return default
+      if layout_version != self.layout_version:
+        continue
+
+      i = self.layout.index.get(name)
+      if i is None:
+        return default
+      code = self.layout.fields[i][1]
+      offset, field_struct = self.layout.field_structs[i]
+      values_offset = HEADER_SIZE + layout_len
+      value = field_struct.unpack_from(self.buf, values_offset + offset)
+      if code in ("s", "j"):
+        heap_offset = values_offset + self.layout.values.size + self.layout.generations.size
+        start, length = value
+        dat = self.buf[heap_offset + start:heap_offset + start + length]
+
+      if SEQUENCE.unpack_from(self.buf, SEQUENCE_OFFSET)[0] == sequence:
+        return self.layout.decode_value(code, dat) if code in ("s", "j") else value[0]
+
+  def _layout_header(self):
+    _, _, _, layout_version, _, layout_len, _, heap_len = HEADER.unpack_from(self.buf)
+    return layout_version, layout_len, heap_len
+
+  def generations(self) -> dict[str, int]:
+    if not self._open() or self.sequence == 0:
+      return {}
+    snapshot = self._read()
+    if snapshot is None:
+      return {}
+    layout, _, generations, _ = snapshot
+    return {f"{self.layout_version}:{name}": generation for name, generation in zip(layout.names, generations, strict=True)}
+
+  def changed_fields(self, previous_generations: dict[str, int]) -> tuple[set[str], dict[str, int]]:
+    """Names of the toggles that changed since previous_generations, and the generations to pass next time."""
+    current = self.generations()
+    changed = {key.split(":", 1)[1] for key, generation in current.items() if previous_generations.get(key) != generation}
+    return changed, current
+
+  def refresh(self, toggles: 'BlockToggles', block=True) -> set[str]:
+    """Brings toggles up to date and returns the names of the fields that changed.
+
+    Only the fields whose generation moved since toggles was last refreshed are decoded, all of them
+    are re-read when the writer changed the layout.
+    """
+    while not self._open() or self.sequence == 0:
+      if not block:
+        return set()
+      time.sleep(0.01)
+
+    while True:
+      sequence = SEQUENCE.unpack_from(self.buf, SEQUENCE_OFFSET)[0]
+      if sequence & 1:
+        time.sleep(0)
+        continue
+
+      layout_version, layout_len, _ = self._layout_header()
+      if layout_version != toggles._layout_version or layout_version != self.layout_version:
+        snapshot = self._read()
+        if snapshot is None:
+          return set()
+        layout, values, generations, heap = snapshot
+        fields = layout.unpack(values, heap)
+        toggles.__dict__.clear()
+        toggles.__dict__.update(fields)
+        toggles._layout_version, toggles._generations = self.layout_version, np.array(generations, dtype=np.uint32)
+        return set(fields)
+
+      layout = self.layout
+      values_offset = HEADER_SIZE + layout_len
+      generations_offset = values_offset + layout.values.size
+      heap_offset = generations_offset + layout.generations.size
+      generations = np.frombuffer(self.buf, dtype=np.uint32, count=len(layout.fields), offset=generations_offset).copy()
+      changed = np.flatnonzero(generations != toggles._generations).tolist()
+      if not changed:
+        if SEQUENCE.unpack_from(self.buf, SEQUENCE_OFFSET)[0] == sequence:
+          return set()
+        continue
+
+      updates = {}
+      for i in changed:
+        name, code = layout.fields[i]
+        offset, field_struct = layout.field_structs[i]
+        value = field_struct.unpack_from(self.buf, values_offset + offset)
+        if code in ("s", "j"):
+          start, length = value
+          updates[name] = (code, self.buf[heap_offset + start:heap_offset + start + length])
+        else:
+          updates[name] = (code, value[0])
+
+      # heap values are only decoded once the copy is known to be consistent
+      if SEQUENCE.unpack_from(self.buf, SEQUENCE_OFFSET)[0] == sequence:
+        for name, (code, value) in updates.items():
+          setattr(toggles, name, layout.decode_value(code, value) if code in ("s", "j") else value)
+        toggles._generations = generations
+        return set(updates)
+
+
+class BlockToggles(SimpleNamespace):
+  """The toggles as attributes of one long lived object, refreshed in place from the block.
+
+  refresh() only decodes the toggles that changed, so a consumer keeps the same object instead of
+  rebuilding every field on each update. The bookkeeping lives in slots, vars() only holds toggles.
+  """
+  __slots__ = ("_reader", "_layout_version", "_generations")
+
+  def __init__(self, reader: ToggleBlockReader):
+    super().__init__()
+    self._reader = reader
+    self._layout_version = -1
+    self._generations = np.zeros(0, dtype=np.uint32)
+
+  def refresh(self, block=True) -> set[str]:
+    return self._reader.refresh(self, block)
+
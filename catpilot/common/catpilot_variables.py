@@ -5,7 +5,6 @@ import random
 
 from functools import cache
 from pathlib import Path
-from types import SimpleNamespace
 
 from cereal import car, custom, log
 from catpilot.common.basedir import BASEDIR
@@ -25,12 +24,16 @@ from catpilot.system.hardware.power_monitoring import VBATT_PAUSE_CHARGING
 from catpilot.system.version import get_build_metadata
 from panda import ALTERNATIVE_EXPERIENCE, Panda
 
+from catpilot.catpilot.common.catpilot_toggle_block import BlockToggles, ToggleBlockReader, ToggleBlockWriter
+
 params = Params()
 params_cache = Params("/cache/params")
 params_default = Params("/dev/shm/params_default")
 params_memory = Params("/dev/shm/params")
 params_tracking = Params("/cache/tracking")
 
+toggle_block = ToggleBlockReader()
+
 GearShifter = car.CarState.GearShifter
 SafetyModel = car.CarParams.SafetyModel
 
@@ -50,9 +53,12 @@ METADATAS_PATH = Path(__file__).parents[1] / "assets/model_metadata"
 MODELS_PATH = Path("/data/models")
 RANDOM_EVENTS_PATH = Path(__file__).parents[1] / "assets/random_events"
 THEME_SAVE_PATH = Path("/data/themes")
+TRACKING_STATS_PATH = Path("/cache/tracking_stats")
 
 ERROR_LOGS_PATH = Path("/data/error_logs")
 SCREEN_RECORDINGS_PATH = Path("/data/media/screen_recordings")
+ROUTE_CATALOG_PATH = Path("/data/the_pond/route_catalog.db")
+SPEED_LIMITS_PATH = Path("/data/speed_limits.db")
 
 BACKUP_PATH = Path("/cache/on_backup")
 
@@ -124,7 +130,10 @@ def nnff_supported(car_fingerprint):
   return False
 
 def get_catpilot_toggles(block=True):
-  return SimpleNamespace(**json.loads(params_memory.get("CatPilotToggles", block=block) or "{}"))
+  # keep the returned toggles and call refresh() on them when they're updated, it only reads what changed
+  toggles = BlockToggles(toggle_block)
+  toggles.refresh(block)
+  return toggles
 
 def update_catpilot_toggles():
   params_memory.put_bool("CatPilotTogglesUpdated", True)
@@ -456,6 +465,7 @@ misc_tuning_levels: list[tuple[str, str | bytes, int, str]] = [
 class CatPilotVariables:
   def __init__(self):
     self.catpilot_toggles = get_catpilot_toggles(block=False)
+    self.toggle_block = ToggleBlockWriter()
     self.tuning_levels = {key: lvl for key, _, lvl, _ in catpilot_default_params + misc_tuning_levels}
 
     short_branch = get_build_metadata().channel
@@ -981,5 +991,5 @@ class CatPilotVariables:
 
     toggle.volt_sng = toggle.car_model == "CHEVROLET_VOLT" and (params.get_bool("VoltSNG") if tuning_level >= level["VoltSNG"] else default.get_bool("VoltSNG"))
 
-    params_memory.put("CatPilotToggles", json.dumps(toggle.__dict__))
+    self.toggle_block.publish(toggle.__dict__)
     params_memory.remove("CatPilotTogglesUpdated")
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+import json
+import os
+import threading
+import zlib
+
+from collections.abc import Callable
+from pathlib import Path
+
+from catpilot.common.file_helpers import atomic_write_in_dir
+
+COMPACT_RECORDS = 64  # journal records to append before folding them into the snapshot
+
+SNAPSHOT_NAME = "counters.json"
+JOURNAL_NAME = "journal"
+
+
+def encode_record(sequence: int, changes: dict) -> bytes:
+  payload = json.dumps([sequence, changes], separators=(",", ":")).encode()
+  return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+
+def read_journal(path: Path) -> tuple[list[tuple[int, dict]], int]:
+  """Returns the intact records of a journal and the length they span, stopping at the first torn or corrupt one."""
+  records, length = [], 0
+  try:
+    dat = path.read_bytes()
+  except FileNotFoundError:
+    return records, length
+
+  for line in dat.splitlines(keepends=True):
+    if not line.endswith(b"\n") or len(line) < 10:
+      break
+    crc, payload = line[:8], line[9:-1]
+    try:
+      if int(crc, 16) != zlib.crc32(payload):
+        break
+      sequence, changes = json.loads(payload)
+    except ValueError:
+      break
+    records.append((sequence, changes))
+    length += len(line)
+  return records, length
+
+
+def read_stats(path: str | Path) -> tuple[dict, int, int, int]:
+  """Loads the counters of a store, from its snapshot and the journal records newer than it.
+
+  Returns the counters, the last sequence number, the journal records still to be compacted and
+  the length of the intact journal. The journal is read before the snapshot, so a compaction in
+  between is seen as a newer snapshot that the skipped records are already part of.
+  """
+  path = Path(path)
+  records, length = read_journal(path / JOURNAL_NAME)
+  try:
+    snapshot = json.loads((path / SNAPSHOT_NAME).read_text())
+  except (FileNotFoundError, ValueError):
+    snapshot = {"sequence": 0, "counters": {}}
+
+  counters, sequence = snapshot["counters"], snapshot["sequence"]
+  pending = 0
+  for record_sequence, changes in records:
+    if record_sequence > sequence:
+      counters.update(changes)
+      sequence = record_sequence
+      pending += 1
+  return counters, sequence, pending, length
+
+
+class StatsStore:
+  """Typed counters accumulated in memory and written behind by one flush thread.
+
+  add() and set() only touch memory, flush() wakes the thread, which coalesces everything that
+  changed since its last write into one journal record appended and synced in a single write.
+  Records hold absolute values with a sequence number and a CRC, so a record torn by a crash is
+  dropped on load and replaying one twice is harmless. Every COMPACT_RECORDS records the counters
+  are written atomically into the snapshot and the journal is emptied.
+
+  Other processes read the counters with read_stats().
+  """
+  def __init__(self, path: str | Path, counters: dict[str, type], seed: Callable[[], dict] | None = None):
+    self.path = Path(path)
+    self.path.mkdir(parents=True, exist_ok=True)
+    self.types = counters
+    self.lock = threading.Lock()
+
+    values, self.sequence, self.records, self.length = read_stats(self.path)
+    self.values = {name: counter_type(values.get(name, 0)) for name, counter_type in counters.items()}
+    self.dirty: set[str] = set()
+
+    self.journal = os.open(self.path / JOURNAL_NAME, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    # drop a record torn by a crash, appending behind it would make the next one unreadable
+    os.ftruncate(self.journal, self.length)
+
+    if self.sequence == 0 and seed is not None:
+      for name, value in seed().items():
+        self.set(name, value)
+
+    self.wake = threading.Event()
+    self.closing = False
+    self.thread = threading.Thread(target=self.flush_thread, name="stats_store", daemon=True)
+    self.thread.start()
+    self.flush()
+
+  def add(self, name: str, amount):
+    self.set(name, self.values[name] + amount)
+
+  def set(self, name: str, value):
+    with self.lock:
+      self.values[name] = self.types[name](value)
+      self.dirty.add(name)
+
+  def get(self, name: str):
+    return self.values[name]
+
+  def flush(self):
+    self.wake.set()
+
+  def flush_thread(self):
+    while not self.closing:
+      self.wake.wait()
+      self.wake.clear()
+      self.write_pending()
+
+  def write_pending(self):
+    # only the swap is locked, callers never wait on the disk
+    with self.lock:
+      dirty, self.dirty = self.dirty, set()
+      changes = {name: self.values[name] for name in sorted(dirty)}
+    if not changes:
+      return
+
+    self.sequence += 1
+    record = encode_record(self.sequence, changes)
+    try:
+      os.write(self.journal, record)
+      os.fsync(self.journal)
+    except OSError as exception:
+      print(f"Failed to write stats to {self.path}: {exception}")
+      try:
+        os.ftruncate(self.journal, self.length)
+      except OSError:
+        pass
+      with self.lock:
+        self.dirty |= dirty
+      return
+
+    self.length += len(record)
+    self.records += 1
+    if self.records >= COMPACT_RECORDS:
+      self.compact()
+
+  def compact(self):
+    with self.lock:
+      counters = dict(self.values)
+    snapshot = {"sequence": self.sequence, "counters": counters}
+    try:
+      with atomic_write_in_dir(str(self.path / SNAPSHOT_NAME), overwrite=True) as f:
+        json.dump(snapshot, f)
+        f.flush()
+        os.fsync(f.fileno())
+      os.ftruncate(self.journal, 0)
+      self.length = 0
+      self.records = 0
+    except OSError as exception:
+      print(f"Failed to compact stats in {self.path}: {exception}")
+
+  def close(self):
+    self.closing = True
+    self.wake.set()
+    self.thread.join()
+    self.write_pending()
+    os.close(self.journal)
@@ -5,13 +5,32 @@ from catpilot.common.realtime import DT_MDL
 
 from catpilot.catpilot.common.catpilot_variables import params, params_tracking
 
-class CatPilotTracking:
-  def __init__(self):
-    self.catpilot_stats = json.loads(params.get("CatPilotStats") or "{}")
+TRACKING_COUNTERS = {
+  "CatPilotDrives": int,
+  "CatPilotKilometers": float,
+  "CatPilotMinutes": float,
+  "TotalAOLTime": float,
+  "TotalLateralTime": float,
+  "TotalLongitudinalTime": float,
+  "TotalTrackedTime": float,
+}
+
+def legacy_tracking_stats():
+  # seeds a new store with what was tracked in Params before
+  catpilot_stats = json.loads(params.get("CatPilotStats") or "{}")
+  return {
+    "CatPilotDrives": params_tracking.get_int("CatPilotDrives"),
+    "CatPilotKilometers": params_tracking.get_float("CatPilotKilometers"),
+    "CatPilotMinutes": params_tracking.get_float("CatPilotMinutes"),
+    "TotalAOLTime": catpilot_stats.get("TotalAOLTime", 0),
+    "TotalLateralTime": catpilot_stats.get("TotalLateralTime", 0),
+    "TotalLongitudinalTime": catpilot_stats.get("TotalLongitudinalTime", 0),
+    "TotalTrackedTime": catpilot_stats.get("TotalTrackedTime", 0),
+  }
 
-    self.total_drives = params_tracking.get_int("CatPilotDrives")
-    self.total_kilometers = params_tracking.get_float("CatPilotKilometers")
-    self.total_minutes = params_tracking.get_float("CatPilotMinutes")
+class CatPilotTracking:
+  def __init__(self, stats):
+    self.stats = stats
 
     self.drive_added = False
     self.enabled = False
@@ -22,11 +41,6 @@ class CatPilotTracking:
     self.lateral_engaged_time = 0
     self.longitudinal_engaged_time = 0
 
-    self.total_aol_engaged = self.catpilot_stats.get("TotalAOLTime", 0)
-    self.total_lateral_engaged = self.catpilot_stats.get("TotalLateralTime", 0)
-    self.total_longitudinal_engaged = self.catpilot_stats.get("TotalLongitudinalTime", 0)
-    self.total_tracked_time = self.catpilot_stats.get("TotalTrackedTime", 0)
-
   def update(self, sm):
     self.enabled |= sm["controlsState"].enabled or sm["catpilotCarState"].alwaysOnLateralEnabled
 
@@ -41,31 +55,22 @@ class CatPilotTracking:
       self.aol_engaged_time += DT_MDL
 
     if self.drive_time > 60 and sm["carState"].standstill and self.enabled:
-      self.total_kilometers += self.drive_distance / 1000
-      params_tracking.put_float_nonblocking("CatPilotKilometers", self.total_kilometers)
-      self.drive_distance = 0
-
-      self.total_minutes += self.drive_time / 60
-      params_tracking.put_float_nonblocking("CatPilotMinutes", self.total_minutes)
+      self.stats.add("CatPilotKilometers", self.drive_distance / 1000)
+      self.stats.add("CatPilotMinutes", self.drive_time / 60)
 
-      self.total_aol_engaged += self.aol_engaged_time
-      self.total_lateral_engaged += self.lateral_engaged_time
-      self.total_longitudinal_engaged += self.longitudinal_engaged_time
-      self.total_tracked_time += self.drive_time
-
-      self.catpilot_stats["TotalAOLTime"] = self.total_aol_engaged
-      self.catpilot_stats["TotalLateralTime"] = self.total_lateral_engaged
-      self.catpilot_stats["TotalLongitudinalTime"] = self.total_longitudinal_engaged
-      self.catpilot_stats["TotalTrackedTime"] = self.total_tracked_time
-
-      params.put("CatPilotStats", json.dumps(self.catpilot_stats))
+      self.stats.add("TotalAOLTime", self.aol_engaged_time)
+      self.stats.add("TotalLateralTime", self.lateral_engaged_time)
+      self.stats.add("TotalLongitudinalTime", self.longitudinal_engaged_time)
+      self.stats.add("TotalTrackedTime", self.drive_time)
 
       self.aol_engaged_time = 0
+      self.drive_distance = 0
       self.drive_time = 0
       self.lateral_engaged_time = 0
       self.longitudinal_engaged_time = 0
 
       if not self.drive_added:
-        self.total_drives += 1
-        params_tracking.put_int_nonblocking("CatPilotDrives", self.total_drives)
+        self.stats.add("CatPilotDrives", 1)
         self.drive_added = True
+
+      self.stats.flush()
@@ -2,6 +2,7 @@
 # Twilsonco's Lateral Neural Network Feedforward
 from collections import deque
 from difflib import SequenceMatcher
+from functools import cache
 
 import json
 import math
@@ -88,6 +89,13 @@ class FluxModel:
     output = self.forward((np.array(input_array, dtype=np.float32) - self.input_mean) / self.input_std)
     return float(output[0, 0])
 
+  def evaluate_batch(self, inputs):
+    """Evaluate every row of a (n, input_size) float32 matrix in one pass, returns the n outputs.
+    The rows are normalized in place so the caller's buffer is reused across ticks."""
+    inputs -= self.input_mean
+    inputs /= self.input_std
+    return self.forward(inputs)[:, 0]
+
   def forward(self, x):
     for weights, bias, activation in self.layers:
       x = getattr(self, activation)(x @ weights + bias)
@@ -114,14 +122,22 @@ def get_nn_model(car, eps_firmware) -> FluxModel | None:
     return FluxModel(model_path)
   return None
 
+@cache
+def get_nn_model_index() -> dict[str, str]:
+  return {model: os.path.join(TORQUE_NN_MODEL_PATH, f"{model}.json") for model in get_nnff_model_files()}
+
 def get_nn_model_path(car, eps_firmware) -> str | None:
   def best_model_path(query):
-    candidates = get_nnff_model_files()
-    if not candidates:
+    index = get_nn_model_index()
+    if not index:
       return None, 0.0
 
-    best = max(candidates, key=lambda model: similarity(model, query))
-    return os.path.join(TORQUE_NN_MODEL_PATH, f"{best}.json"), similarity(best, query)
+    # an exact name is always the best fuzzy match, so only fall back to scoring every model without one
+    if query in index:
+      return index[query], 1.0
+
+    best = max(index, key=lambda model: similarity(model, query))
+    return index[best], similarity(best, query)
 
   def find_valid_model(*queries):
     for query in queries:
@@ -200,6 +216,9 @@ class NeuralNetworkFeedforward:
     self.past_future_len = len(self.past_times) + len(self.nn_future_times)
     self.roll_deque = deque(maxlen=history_check_frames[0])
 
+    # rows of the batched NN evaluation: setpoint, measurement, error response and feedforward
+    self.nn_inputs = np.zeros((4, self.lat_torque_nn_model.input_size if self.lat_torque_nn_model else 0), dtype=np.float32)
+
     self.nnLog = []
 
   def update_live_delay(self, lateral_delay):
@@ -259,30 +278,37 @@ class NeuralNetworkFeedforward:
       past_lateral_accels_desired = [self.lateral_accel_desired_deque[min(len(self.lateral_accel_desired_deque)-1, offset)] for offset in self.history_frame_offsets]
       future_lateral_accels = [interp(time, ModelConstants.T_IDXS[:CONTROL_N], model_data.acceleration.y) for time in adjusted_future_times]
 
-      base_input = [CS.vEgo, roll]
       nnff_common = past_rolls + future_rolls
+      past_future_end = 4 + self.past_future_len
 
-      # compute NNFF error response
-      nnff_setpoint_input = base_input[:1] + [setpoint, lateral_jerk_setpoint] + base_input[1:] + [setpoint] * self.past_future_len + nnff_common
-      nnff_measurement_input = base_input[:1] + [measurement, lateral_jerk_measurement] + base_input[1:] + [measurement] * self.past_future_len + nnff_common
+      # compute feedforward (same as nn setpoint output)
+      error = setpoint - measurement
+      friction_input = self.lat_accel_friction_factor * error + self.lat_jerk_friction_factor * lookahead_lateral_jerk
 
-      torque_from_setpoint = self.lat_torque_nn_model.evaluate(nnff_setpoint_input)
-      torque_from_measurement = self.lat_torque_nn_model.evaluate(nnff_measurement_input)
+      # stack the tick's queries and run the network once
+      nn_inputs = self.nn_inputs
+      nn_inputs.fill(0.0)
+      nn_inputs[:, 0] = CS.vEgo
+      nn_inputs[0, 1:4] = (setpoint, lateral_jerk_setpoint, roll)
+      nn_inputs[0, 4:past_future_end] = setpoint
+      nn_inputs[1, 1:4] = (measurement, lateral_jerk_measurement, roll)
+      nn_inputs[1, 4:past_future_end] = measurement
+      nn_inputs[2, 1:3] = (setpoint - measurement, lateral_jerk_setpoint - lateral_jerk_measurement)
+      nn_inputs[3, 1:4] = (desired_lateral_accel, friction_input, roll)
+      nn_inputs[3, 4:past_future_end] = past_lateral_accels_desired + future_lateral_accels
+      nn_inputs[(0, 1, 3), past_future_end:] = nnff_common
+      nn_input, nnff_setpoint_input, nnff_measurement_input = nn_inputs[3].tolist(), nn_inputs[0].tolist(), nn_inputs[1].tolist()
+
+      torque_from_setpoint, torque_from_measurement, torque_from_error, ff = self.lat_torque_nn_model.evaluate_batch(nn_inputs).tolist()
 
+      # compute NNFF error response
       pid_log.error = torque_from_setpoint - torque_from_measurement
 
       error_blend = interp(abs(desired_lateral_accel), [1.0, 2.0], [0.0, 1.0])
       if error_blend > 0.0:  # blend in stronger error response when in high lat accel
-        torque_from_error = self.lat_torque_nn_model.evaluate([CS.vEgo, setpoint - measurement, lateral_jerk_setpoint - lateral_jerk_measurement, 0.0])
         if sign(pid_log.error) == sign(torque_from_error) and abs(pid_log.error) < abs(torque_from_error):
           pid_log.error = pid_log.error * (1.0 - error_blend) + torque_from_error * error_blend
 
-      # compute feedforward (same as nn setpoint output)
-      error = setpoint - measurement
-      friction_input = self.lat_accel_friction_factor * error + self.lat_jerk_friction_factor * lookahead_lateral_jerk
-      nn_input = [CS.vEgo, desired_lateral_accel, friction_input, roll] + past_lateral_accels_desired + future_lateral_accels + nnff_common
-      ff = self.lat_torque_nn_model.evaluate(nn_input)
-
       # apply friction override for cars with low NN friction response
       if self.nn_friction_override:
         pid_log.error += self.torque_from_lateral_accel(LatControlInputs(0.0, 0.0, CS.vEgo, CS.aEgo), self.lat_control_torque.torque_params,
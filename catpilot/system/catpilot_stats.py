@@ -13,7 +13,8 @@ from catpilot.system.hardware import HARDWARE
 from catpilot.system.version import get_build_metadata
 
 from catpilot.catpilot.common.catpilot_utilities import run_cmd
-from catpilot.catpilot.common.catpilot_variables import get_catpilot_toggles, params, params_tracking
+from catpilot.catpilot.common.catpilot_variables import TRACKING_STATS_PATH, get_catpilot_toggles, params
+from catpilot.catpilot.common.stats_store import read_stats
 
 BASE_URL = "https://nominatim.openstreetmap.org"
 MINIMUM_POPULATION = 100_000
@@ -135,7 +136,7 @@ def send_stats():
     token = os.environ.get("STATS_TOKEN", "")
     url = os.environ.get("STATS_URL", "")
 
-    catpilot_stats = json.loads(params.get("CatPilotStats") or "{}")
+    catpilot_stats, _, _, _ = read_stats(TRACKING_STATS_PATH)
 
     location = json.loads(params.get("LastGPSPosition") or "{}")
     if not (location.get("latitude") and location.get("longitude")):
@@ -166,9 +167,9 @@ def send_stats():
       .field("device", HARDWARE.get_device_type())
       .field("driving_model", catpilot_toggles.model_name.replace("🗺️", "").replace("📡", "").replace("👀", "").replace("(Default)", "").strip())
       .field("event", 1)
-      .field("catpilot_drives", params_tracking.get_int("CatPilotDrives"))
-      .field("catpilot_hours", params_tracking.get_int("CatPilotMinutes") / 60)
-      .field("catpilot_miles", params_tracking.get_int("CatPilotKilometers") * CV.KPH_TO_MPH)
+      .field("catpilot_drives", int(catpilot_stats.get("CatPilotDrives", 0)))
+      .field("catpilot_hours", int(catpilot_stats.get("CatPilotMinutes", 0)) / 60)
+      .field("catpilot_miles", int(catpilot_stats.get("CatPilotKilometers", 0)) * CV.KPH_TO_MPH)
       .field("goat_scream", catpilot_toggles.goat_scream_alert)
       .field("has_cc_long", catpilot_toggles.has_cc_long)
       .field("has_catpilot_longitudinal", catpilot_toggles.catpilot_longitudinal)
@@ -4,7 +4,7 @@ import math
 import requests
 import time
 
-from collections import OrderedDict, deque
+from collections import defaultdict, deque
 from datetime import datetime, timedelta, timezone
 
 import catpilot.system.sentry as sentry
@@ -13,14 +13,15 @@ from cereal import log, messaging
 
 from catpilot.catpilot.common.catpilot_utilities import calculate_distance_to_point, calculate_lane_width, is_url_pingable
 from catpilot.catpilot.common.catpilot_variables import params, params_memory
+from catpilot.catpilot.system.speed_limit_store import MAX_ENTRIES, SpeedLimitStore
 
 NetworkType = log.DeviceState.NetworkType
 
 BOUNDING_BOX_RADIUS_DEGREE = 0.1
-MAX_ENTRIES = 1_000_000
 MAX_OVERPASS_DATA_BYTES = 1_073_741_824
 MAX_OVERPASS_REQUESTS = 10_000
 METERS_PER_DEG_LAT = 111_320
+SEGMENT_GRID_DEGREE = 0.005
 VETTING_INTERVAL_DAYS = 7
 
 OVERPASS_API_URL = "https://overpass-api.de/api/interpreter"
@@ -32,6 +33,7 @@ class MapSpeedLogger:
     self.previous_coordinates = None
 
     self.cached_segments = {}
+    self.segment_grid = defaultdict(list)
 
     self.dataset_additions = deque(maxlen=MAX_ENTRIES)
 
@@ -46,6 +48,9 @@ class MapSpeedLogger:
 
     self.sm = messaging.SubMaster(["deviceState", "catpilotCarState", "catpilotNavigation", "catpilotPlan", "liveLocationKalman", "modelV2"])
 
+    self.store = SpeedLimitStore()
+    self.store.migrate_from_params(params)
+
   @property
   def can_make_overpass_request(self):
     return self.overpass_requests["total_bytes"] < MAX_OVERPASS_DATA_BYTES and self.overpass_requests["total_requests"] < MAX_OVERPASS_REQUESTS
@@ -55,25 +60,10 @@ class MapSpeedLogger:
     return self.sm["deviceState"].started or not params_memory.get_bool("UpdateSpeedLimits")
 
   @staticmethod
-  def cleanup_dataset(dataset):
-    cleaned_data = OrderedDict()
-
-    for item in dataset:
-      if "last_vetted" in item:
-        required = {"incorrect_limit", "last_vetted", "segment_id", "source", "speed_limit", "start_coordinates"}
-      else:
-        required = {"bearing", "end_coordinates", "incorrect_limit", "road_name", "road_width", "source", "speed_limit", "start_coordinates"}
-
-      if not required.issubset(item.keys()):
-        continue
-
-      entry_copy = item.copy()
-      entry_copy.pop("last_vetted", None)
-
-      key = json.dumps(entry_copy, sort_keys=True)
-      cleaned_data[key] = item
-
-    return deque(cleaned_data.values(), maxlen=MAX_ENTRIES)
+  def grid_cells(min_lat, max_lat, min_lon, max_lon):
+    for lat_cell in range(math.floor(min_lat / SEGMENT_GRID_DEGREE), math.floor(max_lat / SEGMENT_GRID_DEGREE) + 1):
+      for lon_cell in range(math.floor(min_lon / SEGMENT_GRID_DEGREE), math.floor(max_lon / SEGMENT_GRID_DEGREE) + 1):
+        yield lat_cell, lon_cell
 
   @staticmethod
   def meters_to_deg_lat(meters):
@@ -113,10 +103,9 @@ class MapSpeedLogger:
         "total_bytes": 0,
       })
 
-  def update_params(self, dataset, filtered_dataset):
+  def update_params(self):
     params.put("OverpassRequests", json.dumps(self.overpass_requests))
-    params.put("SpeedLimits", json.dumps(list(dataset)))
-    params.put("SpeedLimitsFiltered", json.dumps(list(filtered_dataset)))
+    self.store.commit()
 
   def wait_for_api(self):
     while not is_url_pingable(OVERPASS_STATUS_URL):
@@ -136,7 +125,7 @@ class MapSpeedLogger:
     max_lon = longitude + BOUNDING_BOX_RADIUS_DEGREE
 
     self.cached_box = {"min_latitude": min_lat, "max_latitude": max_lat, "min_longitude": min_lon, "max_longitude": max_lon}
-    self.cached_segments.clear()
+    self.clear_cached_segments()
 
     query = (
       f"[out:json][timeout:90][maxsize:{MAX_OVERPASS_DATA_BYTES // 10}];"
@@ -163,9 +152,13 @@ class MapSpeedLogger:
       return response.json().get("elements", [])
     except requests.exceptions.RequestException as exception:
       print(f"Overpass API request failed: {exception}")
-      self.cached_segments.clear()
+      self.clear_cached_segments()
       return []
 
+  def clear_cached_segments(self):
+    self.cached_segments.clear()
+    self.segment_grid.clear()
+
   def filter_segments_for_entry(self, entry):
     bearing_rad = math.radians(entry["bearing"])
     start_lat, start_lon = entry["start_coordinates"]["latitude"], entry["start_coordinates"]["longitude"]
@@ -187,15 +180,16 @@ class MapSpeedLogger:
     min_lon = min(start_lon, end_lon) - abs(delta_lon_fwd) - abs(delta_lon_side)
     max_lon = max(start_lon, end_lon) + abs(delta_lon_fwd) + abs(delta_lon_side)
 
-    relevant_segments = []
-    for segment in self.cached_segments.values():
-      if not segment or "nodes" not in segment:
-        continue
-
-      latitudes = [node[0] for node in segment["nodes"]]
-      longitudes = [node[1] for node in segment["nodes"]]
+    # only the segments registered in the grid cells under the entry's bounding box need the exact check
+    candidate_ids = set()
+    for cell in self.grid_cells(min_lat, max_lat, min_lon, max_lon):
+      candidate_ids.update(self.segment_grid.get(cell, ()))
 
-      if not (max(latitudes) < min_lat or min(latitudes) > max_lat or max(longitudes) < min_lon or min(longitudes) > max_lon):
+    relevant_segments = []
+    for segment_id in sorted(candidate_ids):
+      segment = self.cached_segments[segment_id]
+      seg_min_lat, seg_max_lat, seg_min_lon, seg_max_lon = segment["bounds"]
+      if not (seg_max_lat < min_lat or seg_min_lat > max_lat or seg_max_lon < min_lon or seg_min_lon > max_lon):
         relevant_segments.append(segment)
 
     return relevant_segments
@@ -253,12 +247,12 @@ class MapSpeedLogger:
 
     self.previous_coordinates = {"latitude": current_latitude, "longitude": current_longitude}
 
-  def process_new_entries(self, dataset, filtered_dataset):
-    existing_segment_ids = {entry["segment_id"] for entry in filtered_dataset if "segment_id" in entry}
-    entries_to_process = list(dataset)
+  def process_new_entries(self):
+    # pending observations come back grouped by geohash so consecutive entries reuse the cached Overpass box
+    entries_to_process = self.store.pending_observations()
     total_entries = len(entries_to_process)
 
-    for i, entry in enumerate(entries_to_process):
+    for i, (row_id, entry) in enumerate(entries_to_process):
       self.sm.update()
 
       if self.should_stop_processing:
@@ -275,18 +269,19 @@ class MapSpeedLogger:
       self.update_cached_segments(start_coords["latitude"], start_coords["longitude"])
       segments = self.filter_segments_for_entry(entry)
 
-      dataset.remove(entry)
+      self.store.remove_observation(row_id)
 
+      new_entries = []
       for segment in segments:
         segment_id = segment["segment_id"]
-        if segment_id in existing_segment_ids:
+        if self.store.has_segment(segment_id):
           continue
         if segment["maxspeed"] and not entry.get("incorrect_limit"):
           continue
         if segment["road_name"] != entry.get("road_name"):
           continue
 
-        filtered_dataset.append({
+        new_entries.append({
           "incorrect_limit": entry.get("incorrect_limit"),
           "last_vetted": datetime.now(timezone.utc).isoformat(),
           "segment_id": segment_id,
@@ -294,10 +289,10 @@ class MapSpeedLogger:
           "speed_limit": entry["speed_limit"],
           "start_coordinates": entry["start_coordinates"],
         })
-        existing_segment_ids.add(segment_id)
+      self.store.put_filtered(new_entries)
 
       if i % 100 == 0:
-        self.update_params(dataset, filtered_dataset)
+        self.update_params()
 
   def process_speed_limits(self):
     self.reset_daily_api_limits()
@@ -305,20 +300,19 @@ class MapSpeedLogger:
     if not self.wait_for_api():
       return
 
-    self.cached_box, self.cached_segments = None, {}
-
-    dataset = self.cleanup_dataset(json.loads(params.get("SpeedLimits") or "[]"))
-    filtered_dataset = self.cleanup_dataset(json.loads(params.get("SpeedLimitsFiltered") or "[]"))
+    self.cached_box = None
+    self.clear_cached_segments()
 
-    filtered_dataset = self.vet_entries(filtered_dataset)
-    self.update_params(dataset, filtered_dataset)
+    self.vet_entries()
+    self.update_params()
 
-    if dataset and not self.should_stop_processing:
-      self.cached_box, self.cached_segments = None, {}
+    if self.store.count_observations() and not self.should_stop_processing:
+      self.cached_box = None
+      self.clear_cached_segments()
       params_memory.put("UpdateSpeedLimitsStatus", "Calculating...")
-      self.process_new_entries(dataset, filtered_dataset)
+      self.process_new_entries()
 
-    self.update_params(dataset, filtered_dataset)
+    self.update_params()
     params_memory.put("UpdateSpeedLimitsStatus", "Completed!")
     params_memory.remove("UpdateSpeedLimits")
 
@@ -331,47 +325,51 @@ class MapSpeedLogger:
           if vetting:
             self.cached_segments[segment_id] = tags.get("maxspeed")
           elif "geometry" in way and (nodes := way["geometry"]):
+            latitudes = [node["lat"] for node in nodes]
+            longitudes = [node["lon"] for node in nodes]
+            bounds = (min(latitudes), max(latitudes), min(longitudes), max(longitudes))
+
             self.cached_segments[segment_id] = {
+              "bounds": bounds,
               "maxspeed": tags.get("maxspeed"),
-              "nodes": [(node["lat"], node["lon"]) for node in nodes],
+              "nodes": list(zip(latitudes, longitudes)),
               "road_name": tags.get("name"),
               "segment_id": segment_id,
             }
+            for cell in self.grid_cells(*bounds):
+              self.segment_grid[cell].append(segment_id)
 
-  def vet_entries(self, filtered_dataset):
-    dataset_list = list(filtered_dataset)
-    total_to_vet = len(filtered_dataset)
-    vetted_entries = deque(maxlen=MAX_ENTRIES)
+  def vet_entries(self):
+    # only entries older than the vetting interval are loaded, the rest of the dataset is never touched
+    vetted_before = (datetime.now(timezone.utc) - timedelta(days=VETTING_INTERVAL_DAYS)).isoformat()
+    entries_to_vet = self.store.entries_to_vet(vetted_before)
+    total_to_vet = len(entries_to_vet)
 
-    for i, entry in enumerate(dataset_list):
+    for i, entry in enumerate(entries_to_vet):
       self.sm.update()
 
       if self.should_stop_processing:
-        vetted_entries.extend(dataset_list[i:])
         break
 
       if not self.can_make_overpass_request:
         params_memory.put("UpdateSpeedLimitsStatus", "Hit API limit...")
         time.sleep(5)
-        vetted_entries.extend(dataset_list[i:])
         break
 
       params_memory.put("UpdateSpeedLimitsStatus", f"Vetting: {i + 1} / {total_to_vet}")
 
-      last_vetted_time = datetime.fromisoformat(entry["last_vetted"])
-      if datetime.now(timezone.utc) - last_vetted_time < timedelta(days=VETTING_INTERVAL_DAYS):
-        vetted_entries.append(entry)
-        continue
-
       start_coords = entry["start_coordinates"]
       self.update_cached_segments(start_coords["latitude"], start_coords["longitude"], vetting=True)
 
       current_maxspeed = self.cached_segments.get(entry["segment_id"])
       if current_maxspeed is None or (entry.get("incorrect_limit") and current_maxspeed != entry.get("speed_limit")):
         entry["last_vetted"] = datetime.now(timezone.utc).isoformat()
-        vetted_entries.append(entry)
+        self.store.put_filtered([entry])
+      else:
+        self.store.remove_filtered(entry["segment_id"])
 
-    return self.cleanup_dataset(list(vetted_entries))
+      if i % 100 == 0:
+        self.update_params()
 
 def main():
   logger = MapSpeedLogger()
@@ -387,11 +385,7 @@ def main():
 
         previously_started = True
       elif previously_started:
-        existing_dataset = json.loads(params.get("SpeedLimits") or "[]")
-        existing_dataset.extend(logger.dataset_additions)
-
-        new_dataset = logger.cleanup_dataset(existing_dataset)
-        params.put("SpeedLimits", json.dumps(list(new_dataset)))
+        logger.store.add_observations(logger.dataset_additions)
 
         if logger.sm["deviceState"].networkType in (NetworkType.ethernet, NetworkType.wifi):
           params_memory.put_bool("UpdateSpeedLimits", True)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+import json
+import sqlite3
+
+from catpilot.catpilot.common.catpilot_variables import SPEED_LIMITS_PATH
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 6  # ~1.2 km x 0.6 km cells
+
+MAX_ENTRIES = 1_000_000
+
+OBSERVATION_KEYS = {"bearing", "end_coordinates", "incorrect_limit", "road_name", "road_width", "source", "speed_limit", "start_coordinates"}
+FILTERED_KEYS = {"incorrect_limit", "last_vetted", "segment_id", "source", "speed_limit", "start_coordinates"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS observations (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  dedup_key TEXT NOT NULL UNIQUE,
+  geohash TEXT NOT NULL,
+  data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS observations_geohash ON observations (geohash);
+
+CREATE TABLE IF NOT EXISTS filtered (
+  segment_id INTEGER PRIMARY KEY,
+  geohash TEXT NOT NULL,
+  last_vetted TEXT NOT NULL,
+  data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS filtered_geohash ON filtered (geohash);
+CREATE INDEX IF NOT EXISTS filtered_last_vetted ON filtered (last_vetted);
+"""
+
+def geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+  lat_range = [-90.0, 90.0]
+  lon_range = [-180.0, 180.0]
+
+  code = []
+  bits = 0
+  bit_count = 0
+  even = True
+  while len(code) < precision:
+    value, value_range = (longitude, lon_range) if even else (latitude, lat_range)
+    mid = (value_range[0] + value_range[1]) / 2
+    if value >= mid:
+      bits = (bits << 1) | 1
+      value_range[0] = mid
+    else:
+      bits <<= 1
+      value_range[1] = mid
+    even = not even
+
+    bit_count += 1
+    if bit_count == 5:
+      code.append(GEOHASH_ALPHABET[bits])
+      bits = 0
+      bit_count = 0
+  return "".join(code)
+
+def entry_geohash(entry):
+  return geohash(entry["start_coordinates"]["latitude"], entry["start_coordinates"]["longitude"])
+
+class SpeedLimitStore:
+  """SQLite backed storage for the speed limit dataset.
+
+  Raw observations recorded while driving wait in "observations" until they're matched to map segments,
+  and the matched results live in "filtered" keyed by segment ID. Both tables are indexed by geohash so
+  entries can be processed area by area, which keeps consecutive lookups inside the same Overpass box.
+  """
+  def __init__(self, path=SPEED_LIMITS_PATH):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    self.db.executescript(SCHEMA)
+    self.db.commit()
+
+  def close(self):
+    self.db.close()
+
+  def commit(self):
+    self.db.commit()
+
+  def migrate_from_params(self, params):
+    # one time import of the JSON blobs previously stored in Params
+    observations = json.loads(params.get("SpeedLimits") or "[]")
+    filtered = json.loads(params.get("SpeedLimitsFiltered") or "[]")
+    if not observations and not filtered:
+      return
+
+    self.add_observations(observations)
+    self.put_filtered(filtered)
+    self.commit()
+
+    params.remove("SpeedLimits")
+    params.remove("SpeedLimitsFiltered")
+
+  def add_observations(self, entries):
+    rows = []
+    for entry in entries:
+      if not OBSERVATION_KEYS.issubset(entry.keys()):
+        continue
+      rows.append((json.dumps(entry, sort_keys=True), entry_geohash(entry)))
+
+    self.db.executemany("INSERT OR IGNORE INTO observations (dedup_key, geohash, data) VALUES (?1, ?2, ?1)", rows)
+
+    # keep the newest MAX_ENTRIES, row IDs only ever grow so this is a range delete on the primary key
+    self.db.execute("DELETE FROM observations WHERE id <= (SELECT MAX(id) FROM observations) - ?", (MAX_ENTRIES,))
+    self.commit()
+
+  def pending_observations(self):
+    rows = self.db.execute("SELECT id, data FROM observations ORDER BY geohash, id").fetchall()
+    return [(row_id, json.loads(data)) for row_id, data in rows]
+
+  def count_observations(self):
+    return self.db.execute("SELECT COUNT(*) FROM observations").fetchone()[0]
+
+  def remove_observation(self, row_id):
+    self.db.execute("DELETE FROM observations WHERE id = ?", (row_id,))
+
+  def has_segment(self, segment_id):
+    return self.db.execute("SELECT 1 FROM filtered WHERE segment_id = ?", (segment_id,)).fetchone() is not None
+
+  def put_filtered(self, entries):
+    rows = []
+    for entry in entries:
+      if not FILTERED_KEYS.issubset(entry.keys()):
+        continue
+      data = {key: value for key, value in entry.items() if key != "last_vetted"}
+      rows.append((entry["segment_id"], entry_geohash(entry), entry["last_vetted"], json.dumps(data)))
+
+    self.db.executemany("INSERT OR REPLACE INTO filtered (segment_id, geohash, last_vetted, data) VALUES (?, ?, ?, ?)", rows)
+
+  def remove_filtered(self, segment_id):
+    self.db.execute("DELETE FROM filtered WHERE segment_id = ?", (segment_id,))
+
+  def entries_to_vet(self, vetted_before):
+    rows = self.db.execute("SELECT last_vetted, data FROM filtered WHERE last_vetted < ? ORDER BY geohash", (vetted_before,)).fetchall()
+    return [{**json.loads(data), "last_vetted": last_vetted} for last_vetted, data in rows]
+
+  def set_all_vetted(self, last_vetted):
+    self.db.execute("UPDATE filtered SET last_vetted = ?", (last_vetted,))
+    self.commit()
+
+  def iter_filtered(self):
+    for last_vetted, data in self.db.execute("SELECT last_vetted, data FROM filtered ORDER BY segment_id"):
+      yield {**json.loads(data), "last_vetted": last_vetted}
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+import json
+import os
+import sqlite3
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from catpilot.system.loggerd.config import CAMERA_FPS
+from catpilot.tools.lib.vidindex import HevcIndexer
+
+from catpilot.catpilot.common.catpilot_variables import ROUTE_CATALOG_PATH
+from catpilot.catpilot.system.the_pond import utilities
+
+DEFAULT_SEGMENT_DURATION = 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+  segment_path TEXT PRIMARY KEY,
+  footage_path TEXT NOT NULL,
+  route TEXT NOT NULL,
+  segment_num INTEGER NOT NULL,
+  ctime_ns INTEGER NOT NULL,
+  locked INTEGER NOT NULL,
+  duration REAL,
+  fcamera_mtime_ns INTEGER,
+  cameras TEXT NOT NULL,
+  custom_name TEXT,
+  start_time TEXT,
+  is_preserved INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_route ON segments (route, footage_path, segment_num);
+"""
+
+class RouteCatalog:
+  """SQLite index of the recorded segments and their route metadata.
+
+  Segments are keyed by path and only re-read when the directory's ctime moves, which covers new
+  files, renames and preserve xattr changes. Segments still being recorded are re-read on every
+  refresh. Durations come from the fcamera.hevc frame count and thumbnails and previews are
+  rendered on a background pool, both only once per file. The fcamera.hevc of a segment that's
+  still recording is indexed incrementally, so each view only scans what was written since the last.
+  """
+  def __init__(self, footage_paths, path=ROUTE_CATALOG_PATH):
+    self.footage_paths = footage_paths
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    self.db.executescript(SCHEMA)
+    self.db.commit()
+
+    self.lock = threading.Lock()
+    self.previews = ThreadPoolExecutor(max_workers=2)
+    self.preview_futures: dict[str, Future] = {}
+
+    self.index_lock = threading.Lock()
+    self.recording_indexers: dict[str, HevcIndexer] = {}
+
+  def _scan_segment(self, footage_path, entry, ctime_ns, fcamera_mtime_ns, duration):
+    segment_path = os.path.join(footage_path, entry)
+    names = os.listdir(segment_path)
+
+    custom_name = next((name for name in names if not name.endswith((".hevc", ".ts", ".png", ".gif")) and name not in utilities.LOG_CANDIDATES), None)
+    start_time = utilities.get_route_start_time(os.path.join(segment_path, "rlog"))
+
+    route, segment_num = entry.rsplit("--", 1)
+    return (
+      segment_path, footage_path, route, int(segment_num), ctime_ns, any(name.endswith(".lock") for name in names),
+      duration, fcamera_mtime_ns, json.dumps(utilities.get_available_cameras(segment_path)), custom_name,
+      start_time.isoformat() if start_time else None, utilities.has_preserve_attr(segment_path),
+    )
+
+  def refresh(self):
+    with self.lock:
+      known = {row[0]: row[1:] for row in self.db.execute("SELECT segment_path, ctime_ns, locked, fcamera_mtime_ns, duration FROM segments")}
+
+      rows = []
+      present = set()
+      for footage_path in self.footage_paths:
+        if not os.path.isdir(footage_path):
+          continue
+
+        for entry in os.listdir(footage_path):
+          if not utilities.SEGMENT_RE.fullmatch(entry):
+            continue
+
+          segment_path = os.path.join(footage_path, entry)
+          try:
+            ctime_ns = os.stat(segment_path).st_ctime_ns
+          except OSError:
+            continue
+          present.add(segment_path)
+
+          cached = known.get(segment_path)
+          if cached is not None and cached[0] == ctime_ns and not cached[1]:
+            continue
+
+          try:
+            rows.append(self._scan_segment(footage_path, entry, ctime_ns, *(cached[2:] if cached else (None, None))))
+          except OSError:
+            present.discard(segment_path)
+
+      self.db.executemany(f"INSERT OR REPLACE INTO segments VALUES ({', '.join('?' * 12)})", rows)
+      self.db.executemany("DELETE FROM segments WHERE segment_path = ?", [(path,) for path in known.keys() - present])
+      self.db.commit()
+
+  def routes(self):
+    query = """
+      SELECT footage_path, route, custom_name, start_time, is_preserved FROM segments
+      WHERE segment_num = 0 ORDER BY route DESC
+    """
+    with self.lock:
+      rows = self.db.execute(query).fetchall()
+
+    return [{
+      "footage_path": footage_path,
+      "name": route,
+      "gif": f"/thumbnails/{route}--0/preview.gif",
+      "png": f"/thumbnails/{route}--0/preview.png",
+      "timestamp": custom_name or start_time,
+      "is_preserved": bool(is_preserved),
+    } for footage_path, route, custom_name, start_time, is_preserved in rows]
+
+  def hevc_duration(self, path, recording):
+    # frame count from the NAL unit index, no need to spawn ffprobe for a fixed frame rate stream
+    with self.index_lock:
+      try:
+        indexer = self.recording_indexers.pop(path, None) or HevcIndexer(path)
+        indexer.update(final=not recording)
+        if recording:
+          self.recording_indexers[path] = indexer
+        frame_types = indexer.frame_types
+      except Exception:
+        return None
+    return len(frame_types) / CAMERA_FPS
+
+  def _update_durations(self, segments):
+    # durations are worked out on first view of a route and kept until fcamera.hevc changes
+    updates = []
+    for segment_path, _, _, fcamera_mtime_ns, _, locked in segments:
+      fcamera_path = os.path.join(segment_path, "fcamera.hevc")
+      try:
+        mtime_ns = os.stat(fcamera_path).st_mtime_ns
+      except OSError:
+        continue
+      if mtime_ns != fcamera_mtime_ns:
+        updates.append((self.hevc_duration(fcamera_path, bool(locked)), mtime_ns, segment_path))
+
+    if updates:
+      with self.lock:
+        self.db.executemany("UPDATE segments SET duration = ?, fcamera_mtime_ns = ? WHERE segment_path = ?", updates)
+        self.db.commit()
+    return {segment_path: duration for duration, _, segment_path in updates}
+
+  def route(self, name):
+    query = """
+      SELECT segment_path, segment_num, duration, fcamera_mtime_ns, cameras, locked FROM segments
+      WHERE route = ? AND footage_path = ? ORDER BY segment_num
+    """
+    for footage_path in self.footage_paths:
+      with self.lock:
+        segments = self.db.execute(query, (name, footage_path)).fetchall()
+      if not segments or segments[0][1] != 0:
+        continue
+
+      durations = {segment_path: duration for segment_path, _, duration, _, _, _ in segments}
+      durations.update(self._update_durations(segments))
+
+      return {
+        "footage_path": footage_path,
+        "segments": [f"{name}--{segment_num}" for _, segment_num, _, _, _, _ in segments],
+        "total_duration": sum(DEFAULT_SEGMENT_DURATION if duration is None else duration for duration in durations.values()),
+        "available_cameras": json.loads(segments[0][4]),
+      }
+    return None
+
+  def _render_previews(self, footage_path, route):
+    segment_path = os.path.join(footage_path, f"{route}--0")
+    qcamera_path = os.path.join(segment_path, "qcamera.ts")
+
+    png_output_path = os.path.join(segment_path, "preview.png")
+    if not os.path.exists(png_output_path):
+      utilities.video_to_png(qcamera_path, png_output_path)
+
+    gif_output_path = os.path.join(segment_path, "preview.gif")
+    if not os.path.exists(gif_output_path):
+      utilities.video_to_gif(qcamera_path, gif_output_path)
+
+  def has_preview(self, route):
+    # the gif is rendered after the png and can fail on its own, a route missing it goes back through render_previews
+    segment_path = os.path.join(route["footage_path"], f"{route['name']}--0")
+    return all(os.path.exists(os.path.join(segment_path, name)) for name in ("preview.png", "preview.gif"))
+
+  def render_previews(self, route) -> Future:
+    key = os.path.join(route["footage_path"], route["name"])
+    with self.lock:
+      future = self.preview_futures.get(key)
+      if future is None or future.done():
+        future = self.preview_futures[key] = self.previews.submit(self._render_previews, route["footage_path"], route["name"])
+    return future
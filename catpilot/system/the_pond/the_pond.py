@@ -31,7 +31,9 @@ from panda import Panda
 from catpilot.catpilot.common.catpilot_utilities import delete_file, get_lock_status, run_cmd
 from catpilot.catpilot.common.catpilot_variables import ERROR_LOGS_PATH, EXCLUDED_KEYS, SCREEN_RECORDINGS_PATH,\
                                                            catpilot_default_params, params, update_catpilot_toggles
+from catpilot.catpilot.system.speed_limit_store import SpeedLimitStore
 from catpilot.catpilot.system.the_pond import utilities
+from catpilot.catpilot.system.the_pond.route_catalog import RouteCatalog
 
 FOOTAGE_PATHS = [
   Paths.log_root(HD=True, raw=True),
@@ -49,6 +51,8 @@ KEYS = {
 TMUX_LOGS_PATH = Path("/data/tmux_logs")
 
 def setup(app):
+  route_catalog = RouteCatalog(FOOTAGE_PATHS)
+
   @app.errorhandler(404)
   def not_found(_):
     return render_template("index.html")
@@ -296,22 +300,28 @@ def setup(app):
   @app.route("/api/routes", methods=["GET"])
   def list_routes():
     def generate():
-      routes = [(path, name) for path in FOOTAGE_PATHS for name in utilities.get_routes_names(path)]
+      route_catalog.refresh()
+      routes = route_catalog.routes()
       total = len(routes)
       yield f"data: {json.dumps({'progress': 0, 'total': total})}\n\n"
 
-      with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {executor.submit(utilities.process_route, path, name): (path, name) for path, name in routes}
-        for processed, future in enumerate(as_completed(futures), start=1):
-          try:
-            result = future.result()
-            yield f"data: {json.dumps({'routes': [result]})}\n\n"
-          except Exception as exception:
-            print(f"Error processing route: {exception}")
-          yield f"data: {json.dumps({'progress': processed, 'total': total})}\n\n"
+      def result(route):
+        return {key: value for key, value in route.items() if key != "footage_path"}
 
-        for path, name in routes:
-          utilities.process_route_gif(path, name)
+      # routes with a thumbnail are sent straight from the catalog, the rest once their thumbnail is rendered
+      ready = [route for route in routes if route_catalog.has_preview(route)]
+      if ready:
+        yield f"data: {json.dumps({'routes': [result(route) for route in ready]})}\n\n"
+        yield f"data: {json.dumps({'progress': len(ready), 'total': total})}\n\n"
+
+      futures = {route_catalog.render_previews(route): route for route in routes if not route_catalog.has_preview(route)}
+      for processed, future in enumerate(as_completed(futures), start=len(ready) + 1):
+        try:
+          future.result()
+          yield f"data: {json.dumps({'routes': [result(futures[future])]})}\n\n"
+        except Exception as exception:
+          print(f"Error processing route: {exception}")
+        yield f"data: {json.dumps({'progress': processed, 'total': total})}\n\n"
 
     return Response(generate(), mimetype="text/event-stream")
 
@@ -372,23 +382,18 @@ def setup(app):
 
   @app.route("/api/routes/<name>", methods=["GET"])
   def get_route(name):
-    for footage_path in FOOTAGE_PATHS:
-      base_path = f"{footage_path}{name}--0"
-      if os.path.exists(base_path):
-        segments = utilities.get_segments_in_route(name, footage_path)
-        if not segments:
-          break
-
-        segment_urls = [f"/video/{segment}" for segment in segments]
-        total_duration = sum(utilities.get_video_duration(f"{footage_path}{name}--{i}/fcamera.hevc") for i in range(len(segment_urls)))
-        return {
-          "name": name,
-          "segment_urls": segment_urls,
-          "total_duration": round(total_duration),
-          "date": utilities.get_route_start_time(footage_path),
-          "available_cameras": utilities.get_available_cameras(base_path),
-        }, 200
-    return {"error": "Route not found"}, 404
+    route_catalog.refresh()
+    route = route_catalog.route(name)
+    if route is None:
+      return {"error": "Route not found"}, 404
+
+    return {
+      "name": name,
+      "segment_urls": [f"/video/{segment}" for segment in route["segments"]],
+      "total_duration": round(route["total_duration"]),
+      "date": utilities.get_route_start_time(route["footage_path"]),
+      "available_cameras": route["available_cameras"],
+    }, 200
 
   @app.route("/api/routes/clear_name", methods=["POST"])
   def clear_route_name():
@@ -566,15 +571,23 @@ def setup(app):
 
   @app.route("/api/speed_limits", methods=["GET"])
   def speed_limits():
-    data = json.loads(params.get("SpeedLimitsFiltered") or "[]")
-    current_time = (datetime.now(timezone.utc) - timedelta(days=6, hours=23)).isoformat()
-    data = [{**e, "last_vetted": current_time} for e in data]
+    store = SpeedLimitStore()
+    store.migrate_from_params(params)
 
-    params.put("SpeedLimitsFiltered", json.dumps(data))
+    current_time = (datetime.now(timezone.utc) - timedelta(days=6, hours=23)).isoformat()
+    store.set_all_vetted(current_time)
 
-    buffer = BytesIO(json.dumps(data, indent=2).encode())
-    buffer.seek(0)
-    return send_file(buffer, as_attachment=True, download_name="speed_limits.json", mimetype="application/json")
+    def generate():
+      try:
+        yield "[\n"
+        for i, entry in enumerate(store.iter_filtered()):
+          yield ("" if i == 0 else ",\n") + json.dumps(entry, indent=2)
+        yield "\n]"
+      finally:
+        store.close()
+
+    headers = {"Content-Disposition": "attachment; filename=speed_limits.json"}
+    return Response(generate(), mimetype="application/json", headers=headers)
 
   @app.route("/api/stats", methods=["GET"])
   def get_stats():
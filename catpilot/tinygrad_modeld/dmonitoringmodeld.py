@@ -24,7 +24,7 @@ from catpilot.common.realtime import config_realtime_process
 from catpilot.common.transformations.model import dmonitoringmodel_intrinsics, DM_INPUT_SIZE
 from catpilot.common.transformations.camera import _ar_ox_fisheye, _os_fisheye
 from catpilot.catpilot.tinygrad_modeld.models.commonmodel_pyx import CLContext, MonitoringModelFrame
-from catpilot.catpilot.tinygrad_modeld.parse_model_outputs import sigmoid
+from catpilot.selfdrive.modeld.parse_model_outputs import sigmoid
 from catpilot.system import sentry
 
 MODEL_WIDTH, MODEL_HEIGHT = DM_INPUT_SIZE
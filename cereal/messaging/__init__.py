@@ -4,12 +4,12 @@ from msgq.ipc_pyx import Context, Poller, SubSocket, PubSocket, SocketEventHandl
 from msgq.ipc_pyx import MultiplePublishersError, IpcError
 from msgq import fake_event_handle, pub_sock, sub_sock, drain_sock_raw, context
 
+import math
 import os
 import capnp
 import time
 
-from typing import Optional, List, Union, Dict, Deque
-from collections import deque
+from typing import Optional, List, Union, Dict
 
 from cereal import log
 from cereal.services import SERVICE_LIST
@@ -22,13 +22,17 @@ def log_from_bytes(dat: bytes) -> capnp.lib.capnp._DynamicStructReader:
     return msg
 
 
-def new_message(service: Optional[str], size: Optional[int] = None, **kwargs) -> capnp.lib.capnp._DynamicStructBuilder:
+def new_message(service: Optional[str], size: Optional[int] = None, first_segment_words: Optional[int] = None,
+                **kwargs) -> capnp.lib.capnp._DynamicStructBuilder:
   args = {
     'valid': False,
     'logMonoTime': int(time.monotonic() * 1e9),
     **kwargs
   }
-  dat = log.Event.new_message(**args)
+  if first_segment_words is None:
+    dat = log.Event.new_message(**args)
+  else:
+    dat = log.Event.new_message(num_first_segment_words=first_segment_words, **args)
   if service is not None:
     if size is None:
       dat.init(service)
@@ -37,6 +41,29 @@ def new_message(service: Optional[str], size: Optional[int] = None, **kwargs) ->
   return dat
 
 
+class MessageBuilder:
+  """Builds and serializes the messages of one service, sized from the ones before.
+
+  capnp starts every message with a 1024 word segment and adds segments as it fills up, so a small message
+  pays for zeroing 8 KiB and a large one like modelV2 is spread over several allocations that to_bytes()
+  then has to flatten. The builder remembers the largest message it serialized and starts the next one
+  with a single segment that fits it.
+  """
+  def __init__(self, service: str):
+    self.service = service
+    self.first_segment_words: Optional[int] = None
+
+  def new_message(self, size: Optional[int] = None, **kwargs) -> capnp.lib.capnp._DynamicStructBuilder:
+    return new_message(self.service, size, first_segment_words=self.first_segment_words, **kwargs)
+
+  def to_bytes(self, dat: capnp.lib.capnp._DynamicStructBuilder) -> bytes:
+    dat = dat.to_bytes()
+    words = len(dat) // 8
+    if self.first_segment_words is None or words > self.first_segment_words:
+      self.first_segment_words = words
+    return dat
+
+
 def drain_sock(sock: SubSocket, wait_for_one: bool = False) -> List[capnp.lib.capnp._DynamicStructReader]:
   """Receive all message currently available on the queue"""
   msgs = drain_sock_raw(sock, wait_for_one=wait_for_one)
@@ -87,6 +114,62 @@ def recv_one_retry(sock: SubSocket) -> capnp.lib.capnp._DynamicStructReader:
       return log_from_bytes(dat)
 
 
+class RollingStats:
+  """Mean and standard deviation over the last maxlen samples, and the mean over the most recent tenth of them.
+
+  Samples live in a ring buffer with running sums, so appending and querying are O(1). The sums are
+  rebuilt from the buffer once per lap to keep floating point error from accumulating.
+  """
+  __slots__ = ('maxlen', 'recent_len', 'buf', 'count', 'total', 'total_sq', 'recent_total')
+
+  def __init__(self, maxlen: int):
+    self.maxlen = maxlen
+    self.recent_len = int(maxlen / 10) or maxlen
+    self.buf = [0.] * maxlen
+    self.count = 0
+    self.total = 0.
+    self.total_sq = 0.
+    self.recent_total = 0.
+
+  def __len__(self) -> int:
+    return min(self.count, self.maxlen)
+
+  def append(self, x: float) -> None:
+    i = self.count % self.maxlen
+    if self.count >= self.recent_len:
+      self.recent_total -= self.buf[(self.count - self.recent_len) % self.maxlen]
+    if self.count >= self.maxlen:
+      old = self.buf[i]
+      self.total -= old
+      self.total_sq -= old * old
+
+    self.buf[i] = x
+    self.count += 1
+    self.total += x
+    self.total_sq += x * x
+    self.recent_total += x
+
+    if self.count % self.maxlen == 0:
+      self.total = math.fsum(self.buf)
+      self.total_sq = math.fsum(v * v for v in self.buf)
+      self.recent_total = math.fsum(self.buf[-self.recent_len:])
+
+  def mean(self) -> float:
+    n = len(self)
+    return self.total / n if n else 0.
+
+  def recent_mean(self) -> float:
+    n = min(self.count, self.recent_len)
+    return self.recent_total / n if n else 0.
+
+  def std(self) -> float:
+    n = len(self)
+    if n < 2:
+      return 0.
+    mean = self.total / n
+    return math.sqrt(max(self.total_sq / n - mean * mean, 0.))
+
+
 class SubMaster:
   def __init__(self, services: List[str], poll: Optional[str] = None,
                ignore_alive: Optional[List[str]] = None, ignore_avg_freq: Optional[List[str]] = None,
@@ -98,7 +181,8 @@ class SubMaster:
     self.recv_frame = {s: 0 for s in services}
     self.alive = {s: False for s in services}
     self.freq_ok = {s: False for s in services}
-    self.recv_dts: Dict[str, Deque[float]] = {}
+    self.recv_dts: Dict[str, RollingStats] = {}
+    self.recv_latency: Dict[str, RollingStats] = {}
     self.sock = {}
     self.data = {}
     self.valid = {}
@@ -148,7 +232,12 @@ class SubMaster:
           min_freq = min(freq, freq / 2.)
       self.max_freq[s] = max_freq*1.2
       self.min_freq[s] = min_freq*0.8
-      self.recv_dts[s] = deque(maxlen=int(10*freq))
+      self.recv_dts[s] = RollingStats(int(10*freq))
+      self.recv_latency[s] = RollingStats(int(10*freq))
+
+    # services whose alive and freq_ok checks depend on receive times
+    self.checked_services = [s for s in services if SERVICE_LIST[s].frequency > 1e-5 and not self.simulation]
+    self.unchecked_services = [s for s in services if s not in self.checked_services]
 
   def __getitem__(self, s: str) -> capnp.lib.capnp._DynamicStructReader:
     return self.data[s]
@@ -179,37 +268,63 @@ class SubMaster:
 
       if self.recv_time[s] > 1e-5:
         self.recv_dts[s].append(cur_time - self.recv_time[s])
+        self._update_freq_ok(s)
       self.recv_time[s] = cur_time
       self.recv_frame[s] = self.frame
       self.data[s] = getattr(msg, s)
       self.logMonoTime[s] = msg.logMonoTime
       self.valid[s] = msg.valid
+      self.recv_latency[s].append(cur_time - msg.logMonoTime * 1e-9)
+
+    for s in self.checked_services:
+      # alive if delay is within 10x the expected frequency
+      self.alive[s] = (cur_time - self.recv_time[s]) < (10. / SERVICE_LIST[s].frequency)
 
-    for s in self.data:
-      if SERVICE_LIST[s].frequency > 1e-5 and not self.simulation:
-        # alive if delay is within 10x the expected frequency
-        self.alive[s] = (cur_time - self.recv_time[s]) < (10. / SERVICE_LIST[s].frequency)
-
-        # check average frequency; slow to fall, quick to recover
-        dts = self.recv_dts[s]
-        assert dts.maxlen is not None
-        recent_dts = list(dts)[-int(dts.maxlen / 10):]
-        try:
-          avg_freq = 1 / (sum(dts) / len(dts))
-          avg_freq_recent = 1 / (sum(recent_dts) / len(recent_dts))
-        except ZeroDivisionError:
-          avg_freq = 0
-          avg_freq_recent = 0
-
-        avg_freq_ok = self.min_freq[s] <= avg_freq <= self.max_freq[s]
-        recent_freq_ok = self.min_freq[s] <= avg_freq_recent <= self.max_freq[s]
-        self.freq_ok[s] = avg_freq_ok or recent_freq_ok
+    for s in self.unchecked_services:
+      self.freq_ok[s] = True
+      if self.simulation:
+        self.alive[s] = self.seen[s] # alive is defined as seen when simulation flag set
       else:
-        self.freq_ok[s] = True
-        if self.simulation:
-          self.alive[s] = self.seen[s] # alive is defined as seen when simulation flag set
-        else:
-          self.alive[s] = True
+        self.alive[s] = True
+
+  def _update_freq_ok(self, s: str) -> None:
+    # the averages only move when a message arrives, so this runs per message rather than per update
+    if SERVICE_LIST[s].frequency <= 1e-5 or self.simulation:
+      return
+
+    # check average frequency; slow to fall, quick to recover
+    dts = self.recv_dts[s]
+    try:
+      avg_freq = 1 / dts.mean()
+      avg_freq_recent = 1 / dts.recent_mean()
+    except ZeroDivisionError:
+      avg_freq = 0
+      avg_freq_recent = 0
+
+    avg_freq_ok = self.min_freq[s] <= avg_freq <= self.max_freq[s]
+    recent_freq_ok = self.min_freq[s] <= avg_freq_recent <= self.max_freq[s]
+    self.freq_ok[s] = avg_freq_ok or recent_freq_ok
+
+  def frequency(self, s: str, recent: bool = False) -> float:
+    """Average receive frequency of s over the last 10s, or the last 1s with recent=True"""
+    mean = self.recv_dts[s].recent_mean() if recent else self.recv_dts[s].mean()
+    return 1 / mean if mean > 0 else 0.
+
+  def jitter(self, s: str) -> float:
+    """Standard deviation of the time between messages of s, in seconds"""
+    return self.recv_dts[s].std()
+
+  def latency(self, s: str) -> float:
+    """Average time from logMonoTime to receipt for s, in seconds"""
+    return self.recv_latency[s].mean()
+
+  def service_stats(self, s: str) -> Dict[str, float]:
+    return {
+      'frequency': self.frequency(s),
+      'recent_frequency': self.frequency(s, recent=True),
+      'jitter': self.jitter(s),
+      'latency': self.latency(s),
+    }
 
   def all_alive(self, service_list: Optional[List[str]] = None) -> bool:
     if service_list is None:
@@ -233,12 +348,22 @@ class SubMaster:
 class PubMaster:
   def __init__(self, services: List[str]):
     self.sock = {}
+    self.builders: Dict[str, MessageBuilder] = {}
     for s in services:
       self.sock[s] = pub_sock(s)
 
+  def builder(self, s: str) -> MessageBuilder:
+    if s not in self.builders:
+      self.builders[s] = MessageBuilder(s)
+    return self.builders[s]
+
+  def new_message(self, s: str, size: Optional[int] = None, **kwargs) -> capnp.lib.capnp._DynamicStructBuilder:
+    """Same as messaging.new_message, with the first segment sized to hold the service's previous messages."""
+    return self.builder(s).new_message(size, **kwargs)
+
   def send(self, s: str, dat: Union[bytes, capnp.lib.capnp._DynamicStructBuilder]) -> None:
     if not isinstance(dat, bytes):
-      dat = dat.to_bytes()
+      dat = self.builder(s).to_bytes(dat)
     self.sock[s].send(dat)
 
   def wait_for_readers_to_update(self, s: str, timeout: int, dt: float = 0.05) -> bool:
@@ -44,9 +44,13 @@ class SwagFormatter(logging.Formatter):
       except (ValueError, TypeError):
         record_dict['msg'] = [record.msg]+record.args
 
-    record_dict['ctx'] = self.swaglogger.get_ctx()
+    # handlers that format off the logging thread capture its context and traceback up front
+    ctx = getattr(record, 'swaglog_ctx', None)
+    record_dict['ctx'] = self.swaglogger.get_ctx() if ctx is None else ctx
 
-    if record.exc_info:
+    if record.exc_text:
+      record_dict['exc_info'] = record.exc_text
+    elif record.exc_info:
       record_dict['exc_info'] = self.formatException(record.exc_info)
 
     record_dict['level'] = record.levelname
@@ -1,13 +1,16 @@
 import logging
+import multiprocessing.util
 import os
+import threading
 import time
 import warnings
+from collections import deque
 from pathlib import Path
 from logging.handlers import BaseRotatingHandler
 
 import zmq
 
-from catpilot.common.logging_extra import SwagLogger, SwagFormatter, SwagLogFileFormatter
+from catpilot.common.logging_extra import NiceOrderedDict, SwagLogger, SwagFormatter, SwagLogFileFormatter
 from catpilot.system.hardware.hw import Paths
 
 
@@ -64,6 +67,21 @@ class SwaglogRotatingFileHandler(BaseRotatingHandler):
           os.remove(to_delete)
 
 class UnixDomainSocketHandler(logging.Handler):
+  """Sends records to logmessaged from a background thread.
+
+  emit() only captures the record's context and traceback and appends it to a bounded per-process
+  buffer, a deque whose append and popleft are atomic so the logging thread never takes a lock. The
+  sender thread formats the JSON and sends up to BATCH_SIZE records as one multipart message every
+  SEND_INTERVAL, or sooner once the buffer is half full. When the buffer is full new records are
+  dropped, like when the socket is full, and both are counted and reported in the log.
+
+  Since formatting is deferred, objects passed to a log call are serialized as they are when the
+  record is sent, not when it was logged.
+  """
+  BUFFER_SIZE = 4096
+  BATCH_SIZE = 256
+  SEND_INTERVAL = 0.05
+
   def __init__(self, formatter):
     logging.Handler.__init__(self)
     self.setFormatter(formatter)
@@ -72,36 +90,117 @@ class UnixDomainSocketHandler(logging.Handler):
     self.zctx = None
     self.sock = None
 
+    self.buffer: deque[logging.LogRecord] = deque()
+    self.wake = threading.Event()
+    self.sender: threading.Thread | None = None
+    self.closing = False
+    self.start_lock = threading.Lock()
+
+    self.dropped_buffer_full = 0
+    self.dropped_socket_full = 0
+    self.reported_drops = (0, 0)
+
   def __del__(self):
     self.close()
 
   def close(self):
-    if self.sock is not None:
-      self.sock.close()
-    if self.zctx is not None:
-      self.zctx.term()
+    if self.sender is not None and self.sender.is_alive() and self.pid == os.getpid():
+      self.flush()
+      self.closing = True
+      self.wake.set()
+      self.sender.join(1.)
+    logging.Handler.close(self)
 
   def connect(self):
     self.zctx = zmq.Context()
     self.sock = self.zctx.socket(zmq.PUSH)
     self.sock.setsockopt(zmq.LINGER, 10)
     self.sock.connect(Paths.swaglog_ipc())
-    self.pid = os.getpid()
 
-  def emit(self, record):
-    if os.getpid() != self.pid:
+  def start(self):
+    with self.start_lock:
+      if self.pid == os.getpid():
+        return
+
       # TODO suppresses warning about forking proc with zmq socket, fix root cause
       warnings.filterwarnings("ignore", category=ResourceWarning, message="unclosed.*<zmq.*>")
-      self.connect()
 
-    msg = self.format(record).rstrip('\n')
-    # print("SEND".format(repr(msg)))
+      # after a fork the parent's buffered records are still the parent's to send
+      self.buffer.clear()
+      self.closing = False
+      self.sender = threading.Thread(target=self.send_thread, name="swaglog", daemon=True)
+      self.pid = os.getpid()
+      self.sender.start()
+
+      # daemons exit through os._exit once their main returns, which skips atexit and logging.shutdown
+      # but still runs multiprocessing's finalizers, and those run from atexit everywhere else
+      multiprocessing.util.Finalize(self, self.close, exitpriority=0)
+
+  def emit(self, record):
+    if os.getpid() != self.pid:
+      self.start()
+
+    if len(self.buffer) >= self.BUFFER_SIZE:
+      self.dropped_buffer_full += 1
+      return
+
+    record.swaglog_ctx = self.formatter.swaglogger.get_ctx()
+    if record.exc_info and not record.exc_text:
+      record.exc_text = self.formatter.formatException(record.exc_info)
+    record.exc_info = None
+    self.buffer.append(record)
+
+    if len(self.buffer) == self.BUFFER_SIZE // 2:
+      self.wake.set()
+
+  def send_batch(self):
+    parts = []
+    while self.buffer and len(parts) < self.BATCH_SIZE:
+      record = self.buffer.popleft()
+      try:
+        msg = self.format(record).rstrip('\n')
+      except Exception:
+        self.handleError(record)
+        continue
+      parts.append((chr(record.levelno) + msg).encode('utf8'))
+
+    if parts:
+      try:
+        self.sock.send_multipart(parts, zmq.NOBLOCK)
+      except zmq.error.Again:
+        # drop :/
+        self.dropped_socket_full += len(parts)
+
+  def report_drops(self):
+    drops = (self.dropped_buffer_full, self.dropped_socket_full)
+    if drops != self.reported_drops:
+      self.reported_drops = drops
+      evt = NiceOrderedDict()
+      evt['event'] = "swaglog records dropped"
+      evt['buffer_full'], evt['socket_full'] = drops
+      self.formatter.swaglogger.warning(evt)
+
+  def send_thread(self):
+    self.connect()
     try:
-      s = chr(record.levelno)+msg
-      self.sock.send(s.encode('utf8'), zmq.NOBLOCK)
-    except zmq.error.Again:
-      # drop :/
-      pass
+      while not self.closing:
+        self.wake.wait(self.SEND_INTERVAL)
+        self.wake.clear()
+        while self.buffer:
+          self.send_batch()
+        self.report_drops()
+    finally:
+      self.sock.close()
+      self.zctx.term()
+
+  def flush(self):
+    # give the sender thread a moment to send what's buffered, e.g. at exit
+    if self.sender is None or not self.sender.is_alive():
+      return
+    deadline = time.monotonic() + 1.
+    while self.buffer and time.monotonic() < deadline:
+      self.wake.set()
+      time.sleep(0.001)
 
 
 def add_file_handler(log):
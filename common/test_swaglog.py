@@ -0,0 +1,43 @@
+import json
+import multiprocessing
+
+import pytest
+import zmq
+
+from catpilot.common import swaglog
+from catpilot.common.swaglog import cloudlog
+from catpilot.system.hardware.hw import Paths
+
+
+def log_and_exit(msg):
+  # returns right away, like a daemon's main does, with the record still in the handler's buffer
+  cloudlog.info(msg)
+
+
+class TestSwaglog:
+  @pytest.fixture(autouse=True)
+  def setup(self, tmp_path, monkeypatch):
+    monkeypatch.setenv("CATPILOT_PREFIX", f"_{tmp_path.name}")
+    # the sender would otherwise never get to it before the child exits
+    monkeypatch.setattr(swaglog.UnixDomainSocketHandler, "SEND_INTERVAL", 60.)
+
+    self.zctx = zmq.Context()
+    self.sock = self.zctx.socket(zmq.PULL)
+    self.sock.setsockopt(zmq.RCVTIMEO, 5000)
+    self.sock.bind(Paths.swaglog_ipc())
+    yield
+    self.sock.close(linger=0)
+    self.zctx.term()
+
+  def received(self):
+    msgs = []
+    while self.sock.poll(500):
+      msgs += [json.loads(part[1:]) for part in self.sock.recv_multipart()]
+    return msgs
+
+  def test_flush_on_child_exit(self):
+    proc = multiprocessing.get_context("fork").Process(target=log_and_exit, args=("child exiting",))
+    proc.start()
+    proc.join(10)
+    assert proc.exitcode == 0
+    assert "child exiting" in [msg["msg"] for msg in self.received()]
@@ -166,19 +166,19 @@ class Car:
 
     # carParams - logged every 50 seconds (> 1 per segment)
     if self.sm.frame % int(50. / DT_CTRL) == 0:
-      cp_send = messaging.new_message('carParams')
+      cp_send = self.pm.new_message('carParams')
       cp_send.valid = True
       cp_send.carParams = self.CP
       self.pm.send('carParams', cp_send)
 
     # publish new carOutput
-    co_send = messaging.new_message('carOutput')
+    co_send = self.pm.new_message('carOutput')
     co_send.valid = self.sm.all_checks(['carControl'])
     co_send.carOutput.actuatorsOutput = self.last_actuators_output
     self.pm.send('carOutput', co_send)
 
     # kick off controlsd step while we actuate the latest carControl packet
-    cs_send = messaging.new_message('carState')
+    cs_send = self.pm.new_message('carState')
     cs_send.valid = CS.canValid
     cs_send.carState = CS
     cs_send.carState.canErrorCounter = self.can_rcv_cum_timeout_counter
@@ -186,7 +186,7 @@ class Car:
     self.pm.send('carState', cs_send)
 
     # catpilotCarState
-    fpcs_send = messaging.new_message('catpilotCarState')
+    fpcs_send = self.pm.new_message('catpilotCarState')
     fpcs_send.valid = CS.canValid
     fpcs_send.catpilotCarState = FPCS
     self.pm.send('catpilotCarState', fpcs_send)
@@ -231,7 +231,7 @@ class Car:
 
       # Update CatPilot variables
       if self.sm['catpilotPlan'].togglesUpdated:
-        self.catpilot_toggles = get_catpilot_toggles()
+        self.catpilot_toggles.refresh()
 
 def main():
   config_realtime_process(4, Priority.CTRL_HIGH)
@@ -756,7 +756,7 @@ class Controls:
 
     # Update CatPilot variables
     if self.sm['catpilotPlan'].togglesUpdated:
-      self.catpilot_toggles = get_catpilot_toggles()
+      self.catpilot_toggles.refresh()
 
   def publish_logs(self, CS, start_time, CC, lac_log):
     """Send actuators and hud commands to the car, send controlsstate and MPC logging"""
@@ -842,7 +842,7 @@ class Controls:
     curvature = -self.VM.calc_curvature(steer_angle_without_offset, CS.vEgo, lp.roll)
 
     # controlsState
-    dat = messaging.new_message('controlsState')
+    dat = self.pm.new_message('controlsState')
     dat.valid = CS.canValid
     controlsState = dat.controlsState
     if current_alert:
@@ -889,14 +889,14 @@ class Controls:
 
     # onroadEvents - logged every second or on change
     if (self.sm.frame % int(1. / DT_CTRL) == 0) or (self.events.names != self.events_prev):
-      ce_send = messaging.new_message('onroadEvents', len(self.events))
+      ce_send = self.pm.new_message('onroadEvents', len(self.events))
       ce_send.valid = True
       ce_send.onroadEvents = self.events.to_msg()
       self.pm.send('onroadEvents', ce_send)
     self.events_prev = self.events.names.copy()
 
     # carControl
-    cc_send = messaging.new_message('carControl')
+    cc_send = self.pm.new_message('carControl')
     cc_send.valid = CS.canValid
     cc_send.carControl = CC
     self.pm.send('carControl', cc_send)
@@ -245,10 +245,13 @@ def gen_long_ocp():
 
 
 class LongitudinalMpc:
-  def __init__(self, mode='acc', dt=DT_MDL):
+  def __init__(self, mode='acc', dt=DT_MDL, shift_solution=False):
     self.mode = mode
     self.dt = dt
+    # warm start each solve from the last solution moved forward by dt, instead of from the solution itself
+    self.shift_solution = shift_solution
     self.solver = AcadosOcpSolverCython(MODEL_NAME, ACADOS_SOLVER_TYPE, N)
+    self.cost_weights = None
     self.reset()
     self.source = SOURCES[2]
 
@@ -261,14 +264,11 @@ class LongitudinalMpc:
     self.prev_a = np.array(self.a_solution)
     self.j_solution = np.zeros(N)
     self.yref = np.zeros((N+1, COST_DIM))
-    for i in range(N):
-      self.solver.cost_set(i, "yref", self.yref[i])
-    self.solver.cost_set(N, "yref", self.yref[N][:COST_E_DIM])
+    self.solver.set_all("yref", self.yref)
     self.x_sol = np.zeros((N+1, X_DIM))
     self.u_sol = np.zeros((N,1))
     self.params = np.zeros((N+1, PARAM_DIM))
-    for i in range(N+1):
-      self.solver.set(i, 'x', np.zeros(X_DIM))
+    self.solver.set_all('x', self.x_sol)
     self.last_cloudlog_t = 0
     self.status = False
     self.crash_cnt = 0.0
@@ -282,6 +282,11 @@ class LongitudinalMpc:
     self.set_weights()
 
   def set_cost_weights(self, cost_weights, constraint_cost_weights):
+    # the planner sets the weights every cycle, they rarely change
+    if self.cost_weights == (tuple(cost_weights), tuple(constraint_cost_weights)):
+      return
+    self.cost_weights = (tuple(cost_weights), tuple(constraint_cost_weights))
+
     W = np.asfortranarray(np.diag(cost_weights))
     for i in range(N):
       # TODO don't hardcode A_CHANGE_COST idx
@@ -315,8 +320,7 @@ class LongitudinalMpc:
     self.x0[1] = v
     self.x0[2] = a
     if abs(v_prev - v) > 2.:  # probably only helps if v < v_prev
-      for i in range(N+1):
-        self.solver.set(i, 'x', self.x0)
+      self.solver.set_all('x', np.tile(self.x0, (N+1, 1)))
 
   @staticmethod
   def extrapolate_lead(x_lead, v_lead, a_lead, a_lead_tau):
@@ -412,9 +416,6 @@ class LongitudinalMpc:
     self.yref[:,2] = v
     self.yref[:,3] = a
     self.yref[:,5] = j
-    for i in range(N):
-      self.solver.set(i, "yref", self.yref[i])
-    self.solver.set(N, "yref", self.yref[N][:COST_E_DIM])
 
     self.params[:,2] = np.min(x_obstacles, axis=1)
     self.params[:,3] = np.copy(self.prev_a)
@@ -439,8 +440,9 @@ class LongitudinalMpc:
   def run(self):
     # t0 = time.monotonic()
     # reset = 0
-    for i in range(N+1):
-      self.solver.set(i, 'p', self.params[i])
+    # the terminal row of yref is cut to COST_E_DIM by the solver
+    self.solver.set_all("yref", self.yref)
+    self.solver.set_all('p', self.params)
     self.solver.constraints_set(0, "lbx", self.x0)
     self.solver.constraints_set(0, "ubx", self.x0)
 
@@ -457,10 +459,8 @@ class LongitudinalMpc:
     # print(f"long_mpc residuals: {res[0]:.2e}, {res[1]:.2e}, {res[2]:.2e}, {res[3]:.2e}")
     # self.solver.print_statistics()
 
-    for i in range(N+1):
-      self.x_sol[i] = self.solver.get(i, 'x')
-    for i in range(N):
-      self.u_sol[i] = self.solver.get(i, 'u')
+    self.x_sol = self.solver.get_all('x')
+    self.u_sol = self.solver.get_all('u')
 
     self.v_solution = self.x_sol[:,1]
     self.a_solution = self.x_sol[:,2]
@@ -468,6 +468,14 @@ class LongitudinalMpc:
 
     self.prev_a = np.interp(T_IDXS + self.dt, T_IDXS, self.a_solution)
 
+    if self.shift_solution and self.solution_status == 0:
+      # the nodes are not evenly spaced, so the shifted guess is interpolated rather than moved by an index
+      t_shifted = T_IDXS + self.dt
+      x_shifted = np.column_stack([np.interp(t_shifted, T_IDXS, self.x_sol[:,i]) for i in range(X_DIM)])
+      u_shifted = np.interp(t_shifted[:N], T_IDXS[:N], self.u_sol[:,0])[:,None]
+      self.solver.set_all('x', x_shifted)
+      self.solver.set_all('u', u_shifted)
+
     t = time.monotonic()
     if self.solution_status != 0:
       if t > self.last_cloudlog_t + 5.0:
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from catpilot.selfdrive.controls.lib.longitudinal_mpc_lib.long_mpc import COST_DIM, COST_E_DIM, N, T_IDXS, X_DIM, LongitudinalMpc
+
+
+def per_stage_run(mpc):
+  # what run did before set_all and get_all, one set and get per horizon node
+  for i in range(N):
+    mpc.solver.set(i, "yref", mpc.yref[i])
+  mpc.solver.set(N, "yref", mpc.yref[N][:COST_E_DIM])
+  for i in range(N+1):
+    mpc.solver.set(i, 'p', mpc.params[i])
+  mpc.solver.constraints_set(0, "lbx", mpc.x0)
+  mpc.solver.constraints_set(0, "ubx", mpc.x0)
+
+  status = mpc.solver.solve()
+  x_sol = np.array([mpc.solver.get(i, 'x') for i in range(N+1)])
+  u_sol = np.array([mpc.solver.get(i, 'u') for i in range(N)])
+  return status, x_sol, u_sol
+
+
+def set_references(mpc, v_ego, lead_distance):
+  # a blended plan towards a lead, the terminal yref row is full width so set_all has to cut it
+  mpc.set_cur_state(v_ego, 0.)
+  mpc.yref[:,1] = v_ego * T_IDXS
+  mpc.yref[:,2] = v_ego
+  mpc.yref[:,3] = np.linspace(0., -0.5, N+1)
+  mpc.yref[:,5] = 0.1
+  mpc.params[:,0] = -3.5
+  mpc.params[:,1] = 2.0
+  mpc.params[:,2] = lead_distance + T_IDXS * (v_ego - 2.)
+  mpc.params[:,3] = np.copy(mpc.prev_a)
+  mpc.params[:,4] = 1.45
+  mpc.params[:,5] = 1.0
+
+
+class TestLongitudinalMpc:
+  @pytest.fixture(autouse=True)
+  def setup(self):
+    self.bulk = LongitudinalMpc(mode='blended')
+    self.per_stage = LongitudinalMpc(mode='blended')
+
+  def test_set_all_get_all_match_per_stage(self):
+    for v_ego, lead_distance in [(5., 30.), (20., 60.), (25., 15.), (0., 5.)]:
+      for mpc in (self.bulk, self.per_stage):
+        set_references(mpc, v_ego, lead_distance)
+      assert self.bulk.yref.shape == (N+1, COST_DIM)
+
+      status, x_sol, u_sol = per_stage_run(self.per_stage)
+      self.bulk.run()
+      assert self.bulk.solution_status == status
+      assert np.array_equal(self.bulk.x_sol, x_sol)
+      assert np.array_equal(self.bulk.u_sol, u_sol)
+
+  def test_get_all(self):
+    set_references(self.bulk, 15., 40.)
+    self.bulk.run()
+
+    x_sol = self.bulk.solver.get_all('x')
+    u_sol = self.bulk.solver.get_all('u')
+    assert x_sol.shape == (N+1, X_DIM)
+    assert u_sol.shape == (N, 1)
+    for i in range(N+1):
+      assert np.array_equal(x_sol[i], self.bulk.solver.get(i, 'x'))
+    for i in range(N):
+      assert np.array_equal(u_sol[i], self.bulk.solver.get(i, 'u'))
+
+  def test_set_all_x(self):
+    x = np.column_stack([T_IDXS * 10., np.full(N+1, 10.), np.zeros(N+1)])
+    self.bulk.solver.set_all('x', x)
+    assert np.array_equal(self.bulk.solver.get_all('x'), x)
+
+  def test_set_all_narrow_rows(self):
+    # cutting only goes one way, rows narrower than a stage are an error
+    with pytest.raises(Exception, match="mismatching dimension"):
+      self.bulk.solver.set_all('yref', np.zeros((N+1, COST_E_DIM)))
+    with pytest.raises(Exception, match="stages"):
+      self.bulk.solver.set_all('x', np.zeros((N+2, X_DIM)))
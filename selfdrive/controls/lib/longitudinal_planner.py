@@ -3,7 +3,6 @@ import math
 import numpy as np
 from catpilot.common.numpy_fast import clip, interp
 
-import cereal.messaging as messaging
 from catpilot.common.conversions import Conversions as CV
 from catpilot.common.filter_simple import FirstOrderFilter
 from catpilot.common.realtime import DT_MDL
@@ -241,7 +240,7 @@ class LongitudinalPlanner:
     self.v_desired_filter.x = self.v_desired_filter.x + self.dt * (self.a_desired + a_prev) / 2.0
 
   def publish(self, classic_model, tomb_raider, sm, pm, catpilot_toggles):
-    plan_send = messaging.new_message('longitudinalPlan')
+    plan_send = pm.new_message('longitudinalPlan')
 
     plan_send.valid = sm.all_checks(service_list=['carState', 'controlsState'])
 
@@ -49,7 +49,7 @@ def plannerd_thread():
 
     # Update CatPilot variables
     if sm['catpilotPlan'].togglesUpdated:
-      catpilot_toggles = get_catpilot_toggles()
+      catpilot_toggles.refresh()
 
 def main():
   plannerd_thread()
@@ -1,11 +1,11 @@
 #!/usr/bin/env python3
 import importlib
-import math
 from collections import deque
 from types import SimpleNamespace
 from typing import Any
 
 import capnp
+import numpy as np
 from cereal import messaging, log, car
 from catpilot.common.filter_simple import FirstOrderFilter
 from catpilot.common.numpy_fast import interp
@@ -13,8 +13,6 @@ from catpilot.common.params import Params
 from catpilot.common.realtime import DT_CTRL, DT_MDL, Ratekeeper, Priority, config_realtime_process
 from catpilot.common.swaglog import cloudlog
 
-from catpilot.common.simple_kalman import KF1D
-
 from catpilot.catpilot.common.catpilot_variables import get_catpilot_toggles
 
 # Default lead acceleration decay set to 50% at 1s
@@ -52,114 +50,179 @@ class KalmanParams:
     self.K = [[interp(dt, dts, K0)], [interp(dt, dts, K1)]]
 
 
-class Track:
-  def __init__(self, identifier: int, v_lead: float, kalman_params: KalmanParams):
-    self.identifier = identifier
-    self.cnt = 0
-    self.aLeadTau = FirstOrderFilter(_LEAD_ACCEL_TAU, 0.45, DT_MDL)
-    self.K_A = kalman_params.A
-    self.K_C = kalman_params.C
-    self.K_K = kalman_params.K
-    self.kf = KF1D([[v_lead], [0.0]], self.K_A, self.K_C, self.K_K)
-
-    # CatPilot variables
-    self.lead_track_id = 0
+class TrackTable:
+  """Struct-of-arrays storage for the radar tracks.
+
+  Every track owns a slot in a set of numpy arrays, so the Kalman updates, vision matching and lead
+  scoring run as one vectorized operation per cycle instead of one Python call per radar point.
+  Slots of dropped tracks are reused, and the arrays only grow when every slot is taken.
+  """
+  def __init__(self, kalman_params: KalmanParams, capacity: int = 32):
+    A, C, K = kalman_params.A, kalman_params.C, kalman_params.K
+    self.A_K = (A[0][0] - K[0][0] * C[0], A[0][1] - K[0][0] * C[1], A[1][0] - K[1][0] * C[0], A[1][1] - K[1][0] * C[1])
+    self.K = (K[0][0], K[1][0])
+    self.a_lead_tau_alpha = FirstOrderFilter(_LEAD_ACCEL_TAU, 0.45, DT_MDL).alpha
+
+    self.slots: dict[int, int] = {}
+    self.free: list[int] = []
+    self.next_order = 0
+    self._allocate(capacity)
+
+    self.active_slots = np.empty(0, dtype=np.int64)
+    self.last_identifiers = np.empty(0, dtype=np.int64)
+    self.last_slots = np.empty(0, dtype=np.int64)
+
+  def _allocate(self, capacity: int):
+    old = getattr(self, "capacity", 0)
+    self.capacity = capacity
+    for name, dtype in (("identifier", np.int64), ("order", np.int64), ("cnt", np.int64), ("lead_track_id", np.int64),
+                        ("dRel", np.float64), ("yRel", np.float64), ("vRel", np.float64), ("vLead", np.float64),
+                        ("measured", np.float64), ("vLeadK", np.float64), ("aLeadK", np.float64), ("aLeadTau", np.float64)):
+      arr = np.zeros(capacity, dtype=dtype)
+      if old:
+        arr[:old] = getattr(self, name)
+      setattr(self, name, arr)
+    self.free.extend(range(capacity - 1, old - 1, -1))
+
+  def __len__(self) -> int:
+    return len(self.slots)
+
+  def active(self) -> np.ndarray:
+    # slots in track creation order, so ties resolve the same way iterating a dict of tracks would
+    return self.active_slots
+
+  def _assign_slots(self, identifiers: np.ndarray, v_lead: np.ndarray) -> np.ndarray:
+    # *** remove missing points from meta data ***
+    present = set(identifiers.tolist())
+    for identifier in [i for i in self.slots if i not in present]:
+      self.free.append(self.slots.pop(identifier))
+
+    # create the track if it doesn't exist or it's a new track
+    slots = np.empty(len(identifiers), dtype=np.int64)
+    for i, identifier in enumerate(identifiers.tolist()):
+      slot = self.slots.get(identifier)
+      if slot is None:
+        if not self.free:
+          self._allocate(self.capacity * 2)
+        slot = self.slots[identifier] = self.free.pop()
+        self.identifier[slot] = identifier
+        self.order[slot] = self.next_order
+        self.next_order += 1
+        self.cnt[slot] = 0
+        self.lead_track_id[slot] = 0
+        self.vLeadK[slot] = v_lead[i]
+        self.aLeadK[slot] = 0.0
+        self.aLeadTau[slot] = _LEAD_ACCEL_TAU
+      slots[i] = slot
+
+    self.active_slots = slots[np.argsort(self.order[slots], kind="stable")]
+    return slots
+
+  def update(self, identifiers: np.ndarray, d_rel: np.ndarray, y_rel: np.ndarray, v_rel: np.ndarray, v_lead: np.ndarray, measured: np.ndarray):
+    # radars mostly report the same track IDs in the same order from one scan to the next
+    if np.array_equal(identifiers, self.last_identifiers):
+      slots = self.last_slots
+    else:
+      slots = self._assign_slots(identifiers, v_lead)
+      self.last_identifiers, self.last_slots = identifiers.copy(), slots
 
-  def update(self, d_rel: float, y_rel: float, v_rel: float, v_lead: float, measured: float):
     # relative values, copy
-    self.dRel = d_rel   # LONG_DIST
-    self.yRel = y_rel   # -LAT_DIST
-    self.vRel = v_rel   # REL_SPEED
-    self.vLead = v_lead
-    self.measured = measured   # measured or estimate
+    self.dRel[slots] = d_rel
+    self.yRel[slots] = y_rel
+    self.vRel[slots] = v_rel
+    self.vLead[slots] = v_lead
+    self.measured[slots] = measured
 
     # computed velocity and accelerations
-    if self.cnt > 0:
-      self.kf.update(self.vLead)
-
-    self.vLeadK = float(self.kf.x[SPEED][0])
-    self.aLeadK = float(self.kf.x[ACCEL][0])
+    kf_slots = slots[self.cnt[slots] > 0]
+    x0, x1 = self.vLeadK[kf_slots], self.aLeadK[kf_slots]
+    meas = self.vLead[kf_slots]
+    self.vLeadK[kf_slots] = self.A_K[0] * x0 + self.A_K[1] * x1 + self.K[0] * meas
+    self.aLeadK[kf_slots] = self.A_K[2] * x0 + self.A_K[3] * x1 + self.K[1] * meas
 
     # Learn if constant acceleration
-    if abs(self.aLeadK) < 0.5:
-      self.aLeadTau.x = _LEAD_ACCEL_TAU
-    else:
-      self.aLeadTau.update(0.0)
+    constant = np.abs(self.aLeadK[slots]) < 0.5
+    self.aLeadTau[slots] = np.where(constant, _LEAD_ACCEL_TAU, (1. - self.a_lead_tau_alpha) * self.aLeadTau[slots])
 
-    self.cnt += 1
+    self.cnt[slots] += 1
 
-  def get_RadarState(self, model_prob: float = 0.0):
+  def get_RadarState(self, slot: int, model_prob: float = 0.0):
     return {
-      "dRel": float(self.dRel),
-      "yRel": float(self.yRel),
-      "vRel": float(self.vRel),
-      "vLead": float(self.vLead),
-      "vLeadK": float(self.vLeadK),
-      "aLeadK": float(self.aLeadK),
-      "aLeadTau": float(self.aLeadTau.x),
+      "dRel": float(self.dRel[slot]),
+      "yRel": float(self.yRel[slot]),
+      "vRel": float(self.vRel[slot]),
+      "vLead": float(self.vLead[slot]),
+      "vLeadK": float(self.vLeadK[slot]),
+      "aLeadK": float(self.aLeadK[slot]),
+      "aLeadTau": float(self.aLeadTau[slot]),
       "status": True,
-      "fcw": self.is_potential_fcw(model_prob),
+      "fcw": is_potential_fcw(model_prob),
       "modelProb": model_prob,
       "radar": True,
-      "radarTrackId": self.identifier,
+      "radarTrackId": int(self.identifier[slot]),
       "farLead": False,
     }
 
-  def potential_adjacent_lead(self, left: bool, standstill: bool, model_data: capnp._DynamicStructReader):
-    if standstill or self.vLeadK < 1 or self.lead_track_id == self.identifier:
-      return False
+  def potential_adjacent_lead(self, slots: np.ndarray, left: bool, standstill: bool, model_data: capnp._DynamicStructReader) -> np.ndarray:
+    if standstill:
+      return np.zeros(len(slots), dtype=bool)
 
+    d_rel, y_rel = self.dRel[slots], self.yRel[slots]
+    candidates = (self.vLeadK[slots] >= 1) & (self.lead_track_id[slots] != self.identifier[slots])
     if left:
-      left_lane = interp(self.dRel, model_data.laneLines[1].x, model_data.laneLines[1].y)
-      return -self.yRel < left_lane
+      left_lane = np.interp(d_rel, model_data.laneLines[1].x, model_data.laneLines[1].y)
+      return candidates & (-y_rel < left_lane)
     else:
-      right_lane = interp(self.dRel, model_data.laneLines[2].x, model_data.laneLines[2].y)
-      return -self.yRel > right_lane
+      right_lane = np.interp(d_rel, model_data.laneLines[2].x, model_data.laneLines[2].y)
+      return candidates & (-y_rel > right_lane)
 
-  def potential_far_lead(self, standstill: bool, model_data: capnp._DynamicStructReader):
-    if standstill or self.vLeadK < 1 or abs(self.yRel) > 1:
-      return False
+  def potential_far_lead(self, slots: np.ndarray, standstill: bool, model_data: capnp._DynamicStructReader) -> np.ndarray:
+    if standstill:
+      return np.zeros(len(slots), dtype=bool)
 
-    left_lane = interp(self.dRel, model_data.laneLines[1].x, model_data.laneLines[1].y)
-    right_lane = interp(self.dRel, model_data.laneLines[2].x, model_data.laneLines[2].y)
+    d_rel, y_rel = self.dRel[slots], self.yRel[slots]
+    left_lane = np.interp(d_rel, model_data.laneLines[1].x, model_data.laneLines[1].y)
+    right_lane = np.interp(d_rel, model_data.laneLines[2].x, model_data.laneLines[2].y)
 
-    return left_lane < -self.yRel < right_lane
+    return (self.vLeadK[slots] >= 1) & (np.abs(y_rel) <= 1) & (left_lane < -y_rel) & (-y_rel < right_lane)
 
-  def potential_low_speed_lead(self, v_ego: float):
+  def potential_low_speed_lead(self, slots: np.ndarray, v_ego: float) -> np.ndarray:
     # stop for stuff in front of you and low speed, even without model confirmation
     # Radar points closer than 0.75, are almost always glitches on toyota radars
-    return abs(self.yRel) < 1.0 and (v_ego < V_EGO_STATIONARY) and (0.75 < self.dRel < 25)
+    d_rel = self.dRel[slots]
+    return (np.abs(self.yRel[slots]) < 1.0) & (v_ego < V_EGO_STATIONARY) & (0.75 < d_rel) & (d_rel < 25)
+
+  def closest(self, slots: np.ndarray, mask: np.ndarray) -> int | None:
+    if not mask.any():
+      return None
+    candidates = slots[mask]
+    return int(candidates[np.argmin(self.dRel[candidates])])
 
-  def is_potential_fcw(self, model_prob: float):
-    return model_prob > .9
 
-  def __str__(self):
-    ret = f"x: {self.dRel:4.1f}  y: {self.yRel:4.1f}  v: {self.vRel:4.1f}  a: {self.aLeadK:4.1f}"
-    return ret
+def is_potential_fcw(model_prob: float):
+  return model_prob > .9
 
 
-def laplacian_pdf(x: float, mu: float, b: float):
+def laplacian_pdf(x, mu: float, b: float):
   b = max(b, 1e-4)
-  return math.exp(-abs(x-mu)/b)
+  return np.exp(-np.abs(x-mu)/b)
 
 
-def match_vision_to_track(v_ego: float, lead: capnp._DynamicStructReader, tracks: dict[int, Track]):
+def match_vision_to_track(v_ego: float, lead: capnp._DynamicStructReader, tracks: TrackTable, slots: np.ndarray) -> int | None:
   offset_vision_dist = lead.x[0] - RADAR_TO_CAMERA
 
-  def prob(c):
-    prob_d = laplacian_pdf(c.dRel, offset_vision_dist, lead.xStd[0])
-    prob_y = laplacian_pdf(c.yRel, -lead.y[0], lead.yStd[0])
-    prob_v = laplacian_pdf(c.vRel + v_ego, lead.v[0], lead.vStd[0])
+  prob_d = laplacian_pdf(tracks.dRel[slots], offset_vision_dist, lead.xStd[0])
+  prob_y = laplacian_pdf(tracks.yRel[slots], -lead.y[0], lead.yStd[0])
+  prob_v = laplacian_pdf(tracks.vRel[slots] + v_ego, lead.v[0], lead.vStd[0])
 
-    # This isn't exactly right, but it's a good heuristic
-    return prob_d * prob_y * prob_v
-
-  track = max(tracks.values(), key=prob)
+  # This isn't exactly right, but it's a good heuristic
+  track = int(slots[np.argmax(prob_d * prob_y * prob_v)])
 
   # if no 'sane' match is found return -1
   # stationary radar points can be false positives
-  dist_sane = abs(track.dRel - offset_vision_dist) < max([(offset_vision_dist)*.25, 5.0])
-  vel_sane = (abs(track.vRel + v_ego - lead.v[0]) < 10) or (v_ego + track.vRel > 3)
+  d_rel, v_rel = tracks.dRel[track], tracks.vRel[track]
+  dist_sane = abs(d_rel - offset_vision_dist) < max([(offset_vision_dist)*.25, 5.0])
+  vel_sane = (abs(v_rel + v_ego - lead.v[0]) < 10) or (v_ego + v_rel > 3)
   if dist_sane and vel_sane:
     return track
   else:
@@ -185,41 +248,39 @@ def get_RadarState_from_vision(lead_msg: capnp._DynamicStructReader, v_ego: floa
   }
 
 
-def get_lead(v_ego: float, ready: bool, tracks: dict[int, Track], lead_msg: capnp._DynamicStructReader,
+def get_lead(v_ego: float, ready: bool, tracks: TrackTable, lead_msg: capnp._DynamicStructReader,
              model_v_ego: float, model_data: capnp._DynamicStructReader, standstill: bool,
              catpilot_toggles: SimpleNamespace, catpilotCarState: capnp._DynamicStructReader,
              low_speed_override: bool = True) -> dict[str, Any]:
+  slots = tracks.active()
+
   # Determine leads, this is where the essential logic happens
-  if len(tracks) > 0 and ready and lead_msg.prob > catpilot_toggles.lead_detection_probability:
-    track = match_vision_to_track(v_ego, lead_msg, tracks)
+  if len(slots) > 0 and ready and lead_msg.prob > catpilot_toggles.lead_detection_probability:
+    track = match_vision_to_track(v_ego, lead_msg, tracks, slots)
   else:
     track = None
 
   lead_dict = {'status': False}
   if track is not None:
-    lead_dict = track.get_RadarState(lead_msg.prob)
+    lead_dict = tracks.get_RadarState(track, lead_msg.prob)
   elif (track is None) and ready and (lead_msg.prob > catpilot_toggles.lead_detection_probability):
     lead_dict = get_RadarState_from_vision(lead_msg, v_ego, model_v_ego)
 
   if low_speed_override:
-    low_speed_tracks = [c for c in tracks.values() if c.potential_low_speed_lead(v_ego)]
-    if len(low_speed_tracks) > 0:
-      closest_track = min(low_speed_tracks, key=lambda c: c.dRel)
-
+    closest_track = tracks.closest(slots, tracks.potential_low_speed_lead(slots, v_ego))
+    if closest_track is not None:
       # Only choose new track if it is actually closer than the previous one
-      if (not lead_dict['status']) or (closest_track.dRel < lead_dict['dRel']):
-        lead_dict = closest_track.get_RadarState()
-
-    if not lead_dict['status'] and len(tracks) > 0:
-      far_lead_tracks = [c for c in tracks.values() if c.potential_far_lead(standstill, model_data)]
-      if len(far_lead_tracks) > 0:
-        closest_track = min(far_lead_tracks, key=lambda c: c.dRel)
-        lead_dict = closest_track.get_RadarState()
+      if (not lead_dict['status']) or (tracks.dRel[closest_track] < lead_dict['dRel']):
+        lead_dict = tracks.get_RadarState(closest_track)
+
+    if not lead_dict['status'] and len(slots) > 0:
+      closest_track = tracks.closest(slots, tracks.potential_far_lead(slots, standstill, model_data))
+      if closest_track is not None:
+        lead_dict = tracks.get_RadarState(closest_track)
         lead_dict['farLead'] = True
         lead_dict['vLead'] = lead_dict['vLeadK']
 
-  for track in tracks.values():
-    track.lead_track_id = lead_dict.get('radarTrackId', -1)
+  tracks.lead_track_id[slots] = lead_dict.get('radarTrackId', -1)
 
   if 'dRel' in lead_dict:
     lead_dict['dRel'] -= catpilot_toggles.increased_stopped_distance if not catpilotCarState.trafficModeEnabled else 0
@@ -227,13 +288,13 @@ def get_lead(v_ego: float, ready: bool, tracks: dict[int, Track], lead_msg: capn
   return lead_dict
 
 
-def get_adjacent_lead(tracks: dict[int, Track], standstill: bool, model_data: capnp._DynamicStructReader, left: bool = True) -> dict[str, Any]:
+def get_adjacent_lead(tracks: TrackTable, standstill: bool, model_data: capnp._DynamicStructReader, left: bool = True) -> dict[str, Any]:
   lead_dict = {'status': False}
 
-  adjacent_tracks = [c for c in tracks.values() if c.potential_adjacent_lead(left, standstill, model_data)]
-  if len(adjacent_tracks) > 0:
-    closest_track = min(adjacent_tracks, key=lambda c: c.dRel)
-    lead_dict = closest_track.get_RadarState()
+  slots = tracks.active()
+  closest_track = tracks.closest(slots, tracks.potential_adjacent_lead(slots, left, standstill, model_data))
+  if closest_track is not None:
+    lead_dict = tracks.get_RadarState(closest_track)
 
   return lead_dict
 
@@ -242,8 +303,8 @@ class RadarD:
   def __init__(self, radar_ts: float, delay: int = 0):
     self.current_time = 0.0
 
-    self.tracks: dict[int, Track] = {}
     self.kalman_params = KalmanParams(radar_ts)
+    self.tracks = TrackTable(self.kalman_params)
 
     self.v_ego = 0.0
     self.v_ego_hist = deque([0.0], maxlen=delay+1)
@@ -276,24 +337,15 @@ class RadarD:
 
     ar_pts = {}
     for pt in radar_points:
-      ar_pts[pt.trackId] = [pt.dRel, pt.yRel, pt.vRel, pt.measured]
-
-    # *** remove missing points from meta data ***
-    for ids in list(self.tracks.keys()):
-      if ids not in ar_pts:
-        self.tracks.pop(ids, None)
+      ar_pts[pt.trackId] = (pt.dRel, pt.yRel, pt.vRel, pt.measured)
 
     # *** compute the tracks ***
-    for ids in ar_pts:
-      rpt = ar_pts[ids]
-
-      # align v_ego by a fixed time to align it with the radar measurement
-      v_lead = rpt[2] + self.v_ego_hist[0]
+    identifiers = np.fromiter(ar_pts.keys(), dtype=np.int64, count=len(ar_pts))
+    points = np.array(list(ar_pts.values()), dtype=np.float64).reshape(-1, 4)
 
-      # create the track if it doesn't exist or it's a new track
-      if ids not in self.tracks:
-        self.tracks[ids] = Track(ids, v_lead, self.kalman_params)
-      self.tracks[ids].update(rpt[0], rpt[1], rpt[2], v_lead, rpt[3])
+    # align v_ego by a fixed time to align it with the radar measurement
+    v_lead = points[:, 2] + self.v_ego_hist[0]
+    self.tracks.update(identifiers, points[:, 0], points[:, 1], points[:, 2], v_lead, points[:, 3])
 
     # *** publish radarState ***
     self.radar_state_valid = sm.all_checks() and len(radar_errors) == 0
@@ -319,27 +371,30 @@ class RadarD:
 
     # Update CatPilot variables
     if sm['catpilotPlan'].togglesUpdated:
-      self.catpilot_toggles = get_catpilot_toggles()
+      self.catpilot_toggles.refresh()
 
   def publish(self, pm: messaging.PubMaster, lag_ms: float):
     assert self.radar_state is not None
 
-    radar_msg = messaging.new_message("radarState")
+    radar_msg = pm.new_message("radarState")
     radar_msg.valid = self.radar_state_valid
     radar_msg.radarState = self.radar_state
     radar_msg.radarState.cumLagMs = lag_ms
     pm.send("radarState", radar_msg)
 
     # publish tracks for UI debugging (keep last)
-    tracks_msg = messaging.new_message('liveTracks', len(self.tracks))
+    tracks_msg = pm.new_message("liveTracks", len(self.tracks))
     tracks_msg.valid = self.radar_state_valid
-    for index, tid in enumerate(sorted(self.tracks.keys())):
-      tracks_msg.liveTracks[index] = {
-        "trackId": tid,
-        "dRel": float(self.tracks[tid].dRel),
-        "yRel": float(self.tracks[tid].yRel),
-        "vRel": float(self.tracks[tid].vRel),
-      }
+    live_tracks = tracks_msg.liveTracks
+    slots = self.tracks.active()
+    slots = slots[np.argsort(self.tracks.identifier[slots], kind="stable")]
+    for index, (tid, d_rel, y_rel, v_rel) in enumerate(zip(self.tracks.identifier[slots].tolist(), self.tracks.dRel[slots].tolist(),
+                                                          self.tracks.yRel[slots].tolist(), self.tracks.vRel[slots].tolist(), strict=True)):
+      point = live_tracks[index]
+      point.trackId = tid
+      point.dRel = d_rel
+      point.yRel = y_rel
+      point.vRel = v_rel
     pm.send('liveTracks', tracks_msg)
 
 
@@ -0,0 +1,197 @@
+import math
+import random
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from catpilot.common.filter_simple import FirstOrderFilter
+from catpilot.common.numpy_fast import interp
+from catpilot.common.realtime import DT_MDL
+from catpilot.common.simple_kalman import KF1D
+from catpilot.selfdrive.controls.radard import (_LEAD_ACCEL_TAU, ACCEL, RADAR_TO_CAMERA, SPEED, V_EGO_STATIONARY, KalmanParams, TrackTable,
+                                                get_adjacent_lead, get_lead, get_RadarState_from_vision)
+
+
+class LegacyTrack:
+  # what radard kept per track before TrackTable, one KF1D and aLeadTau filter each
+  def __init__(self, identifier, v_lead, kalman_params):
+    self.identifier = identifier
+    self.cnt = 0
+    self.aLeadTau = FirstOrderFilter(_LEAD_ACCEL_TAU, 0.45, DT_MDL)
+    self.kf = KF1D([[v_lead], [0.0]], kalman_params.A, kalman_params.C, kalman_params.K)
+    self.lead_track_id = 0
+
+  def update(self, d_rel, y_rel, v_rel, v_lead, measured):
+    self.dRel, self.yRel, self.vRel, self.vLead, self.measured = d_rel, y_rel, v_rel, v_lead, measured
+    if self.cnt > 0:
+      self.kf.update(self.vLead)
+    self.vLeadK = float(self.kf.x[SPEED][0])
+    self.aLeadK = float(self.kf.x[ACCEL][0])
+    if abs(self.aLeadK) < 0.5:
+      self.aLeadTau.x = _LEAD_ACCEL_TAU
+    else:
+      self.aLeadTau.update(0.0)
+    self.cnt += 1
+
+  def get_RadarState(self, model_prob=0.0):
+    return {
+      "dRel": float(self.dRel), "yRel": float(self.yRel), "vRel": float(self.vRel), "vLead": float(self.vLead),
+      "vLeadK": float(self.vLeadK), "aLeadK": float(self.aLeadK), "aLeadTau": float(self.aLeadTau.x), "status": True,
+      "fcw": model_prob > .9, "modelProb": model_prob, "radar": True, "radarTrackId": self.identifier, "farLead": False,
+    }
+
+  def potential_adjacent_lead(self, left, standstill, model_data):
+    if standstill or self.vLeadK < 1 or self.lead_track_id == self.identifier:
+      return False
+    if left:
+      return -self.yRel < interp(self.dRel, model_data.laneLines[1].x, model_data.laneLines[1].y)
+    return -self.yRel > interp(self.dRel, model_data.laneLines[2].x, model_data.laneLines[2].y)
+
+  def potential_far_lead(self, standstill, model_data):
+    if standstill or self.vLeadK < 1 or abs(self.yRel) > 1:
+      return False
+    left_lane = interp(self.dRel, model_data.laneLines[1].x, model_data.laneLines[1].y)
+    right_lane = interp(self.dRel, model_data.laneLines[2].x, model_data.laneLines[2].y)
+    return left_lane < -self.yRel < right_lane
+
+  def potential_low_speed_lead(self, v_ego):
+    return abs(self.yRel) < 1.0 and (v_ego < V_EGO_STATIONARY) and (0.75 < self.dRel < 25)
+
+
+def legacy_update(tracks, kalman_params, scan, v_ego):
+  for identifier in list(tracks.keys()):
+    if identifier not in scan:
+      tracks.pop(identifier)
+  for identifier, (d_rel, y_rel, v_rel, measured) in scan.items():
+    v_lead = v_rel + v_ego
+    if identifier not in tracks:
+      tracks[identifier] = LegacyTrack(identifier, v_lead, kalman_params)
+    tracks[identifier].update(d_rel, y_rel, v_rel, v_lead, measured)
+
+
+def legacy_match_vision_to_track(v_ego, lead, tracks):
+  offset_vision_dist = lead.x[0] - RADAR_TO_CAMERA
+
+  def prob(c):
+    laplacian_pdf = lambda x, mu, b: math.exp(-abs(x - mu) / max(b, 1e-4))
+    return laplacian_pdf(c.dRel, offset_vision_dist, lead.xStd[0]) * laplacian_pdf(c.yRel, -lead.y[0], lead.yStd[0]) * \
+           laplacian_pdf(c.vRel + v_ego, lead.v[0], lead.vStd[0])
+
+  track = max(tracks.values(), key=prob)
+  dist_sane = abs(track.dRel - offset_vision_dist) < max([(offset_vision_dist)*.25, 5.0])
+  vel_sane = (abs(track.vRel + v_ego - lead.v[0]) < 10) or (v_ego + track.vRel > 3)
+  return track if dist_sane and vel_sane else None
+
+
+def legacy_get_lead(v_ego, ready, tracks, lead_msg, model_v_ego, model_data, standstill, toggles, car_state, low_speed_override=True):
+  if len(tracks) > 0 and ready and lead_msg.prob > toggles.lead_detection_probability:
+    track = legacy_match_vision_to_track(v_ego, lead_msg, tracks)
+  else:
+    track = None
+
+  lead_dict = {'status': False}
+  if track is not None:
+    lead_dict = track.get_RadarState(lead_msg.prob)
+  elif ready and lead_msg.prob > toggles.lead_detection_probability:
+    lead_dict = get_RadarState_from_vision(lead_msg, v_ego, model_v_ego)
+
+  if low_speed_override:
+    low_speed_tracks = [c for c in tracks.values() if c.potential_low_speed_lead(v_ego)]
+    if len(low_speed_tracks) > 0:
+      closest_track = min(low_speed_tracks, key=lambda c: c.dRel)
+      if (not lead_dict['status']) or (closest_track.dRel < lead_dict['dRel']):
+        lead_dict = closest_track.get_RadarState()
+
+    if not lead_dict['status'] and len(tracks) > 0:
+      far_lead_tracks = [c for c in tracks.values() if c.potential_far_lead(standstill, model_data)]
+      if len(far_lead_tracks) > 0:
+        lead_dict = min(far_lead_tracks, key=lambda c: c.dRel).get_RadarState()
+        lead_dict['farLead'] = True
+        lead_dict['vLead'] = lead_dict['vLeadK']
+
+  for track in tracks.values():
+    track.lead_track_id = lead_dict.get('radarTrackId', -1)
+
+  if 'dRel' in lead_dict:
+    lead_dict['dRel'] -= toggles.increased_stopped_distance if not car_state.trafficModeEnabled else 0
+  return lead_dict
+
+
+def legacy_get_adjacent_lead(tracks, standstill, model_data, left=True):
+  adjacent_tracks = [c for c in tracks.values() if c.potential_adjacent_lead(left, standstill, model_data)]
+  if len(adjacent_tracks) > 0:
+    return min(adjacent_tracks, key=lambda c: c.dRel).get_RadarState()
+  return {'status': False}
+
+
+def synthetic_model(points=33):
+  x = np.linspace(0, 100, points).tolist()
+  lanes = [SimpleNamespace(x=x, y=[offset + 0.01 * d for d in x]) for offset in (-5.4, -1.8, 1.8, 5.4)]
+  return SimpleNamespace(laneLines=lanes)
+
+
+def synthetic_lead(scan, rng):
+  # mostly near one of the radar points so vision matching picks a track, sometimes nowhere near any
+  d_rel, y_rel, v_rel = rng.uniform(5, 80), rng.uniform(-1, 1), rng.uniform(-10, 5)
+  if scan and rng.random() < 0.8:
+    d_rel, y_rel, v_rel, _ = rng.choice(list(scan.values()))
+  return SimpleNamespace(prob=rng.uniform(0.3, 1.0), x=[d_rel + RADAR_TO_CAMERA + rng.gauss(0, 1)], y=[-y_rel + rng.gauss(0, 0.3)],
+                         v=[v_rel + rng.uniform(0, 30)], a=[rng.uniform(-2, 2)], xStd=[1.0], yStd=[0.5], vStd=[1.0])
+
+
+def assert_same_lead(lead, expected):
+  assert lead.keys() == expected.keys()
+  for key, value in expected.items():
+    if isinstance(value, float):
+      assert lead[key] == pytest.approx(value, rel=1e-9, abs=1e-9), key
+    else:
+      assert lead[key] == value, key
+
+
+class TestTrackTable:
+  @pytest.fixture(autouse=True)
+  def setup(self):
+    self.kalman_params = KalmanParams(0.05)
+    self.model = synthetic_model()
+    self.toggles = SimpleNamespace(lead_detection_probability=0.5, increased_stopped_distance=1.0)
+    self.car_state = SimpleNamespace(trafficModeEnabled=False)
+
+  @pytest.mark.parametrize("seed", range(5))
+  def test_matches_per_track_path(self, seed):
+    rng = random.Random(seed)
+    tracks = TrackTable(self.kalman_params, capacity=4)
+    legacy_tracks = {}
+
+    scan = {}
+    for _ in range(500):
+      # tracks drop out and appear, ids come back after a gap, and some scans repeat the previous ids
+      if rng.random() < 0.7:
+        for identifier in list(scan):
+          if rng.random() < 0.1:
+            del scan[identifier]
+        for _ in range(rng.randrange(4)):
+          scan[rng.randrange(40)] = None
+        if rng.random() < 0.05:
+          scan = {}
+      scan = {identifier: (rng.uniform(0.5, 80), rng.uniform(-6, 6), rng.uniform(-10, 5), float(rng.random() < 0.9)) for identifier in scan}
+
+      v_ego = rng.choice([rng.uniform(0, V_EGO_STATIONARY), rng.uniform(0, 30)])
+      standstill = v_ego < 0.5 and rng.random() < 0.5
+      ready = rng.random() < 0.95
+      lead_one, lead_two = synthetic_lead(scan, rng), synthetic_lead(scan, rng)
+      model_v_ego = v_ego + rng.gauss(0, 0.5)
+
+      identifiers = np.fromiter(scan.keys(), dtype=np.int64, count=len(scan))
+      points = np.array(list(scan.values()), dtype=np.float64).reshape(-1, 4)
+      tracks.update(identifiers, points[:, 0], points[:, 1], points[:, 2], points[:, 2] + v_ego, points[:, 3])
+      legacy_update(legacy_tracks, self.kalman_params, scan, v_ego)
+      assert len(tracks) == len(legacy_tracks)
+
+      for lead_msg, low_speed_override in ((lead_one, True), (lead_two, False)):
+        lead = get_lead(v_ego, ready, tracks, lead_msg, model_v_ego, self.model, standstill, self.toggles, self.car_state, low_speed_override)
+        expected = legacy_get_lead(v_ego, ready, legacy_tracks, lead_msg, model_v_ego, self.model, standstill, self.toggles, self.car_state,
+                                   low_speed_override)
+        assert_same_lead(lead, expected)
+      for left in (True, False):
+        assert_same_lead(get_adjacent_lead(tracks, standstill, self.model, left), legacy_get_adjacent_lead(legacy_tracks, standstill, self.model, left))
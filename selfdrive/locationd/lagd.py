@@ -400,4 +400,4 @@ def main():
 
     # Update CatPilot variables
     if sm['catpilotPlan'].togglesUpdated:
-      catpilot_toggles = get_catpilot_toggles()
+      catpilot_toggles.refresh()
@@ -264,7 +264,7 @@ def main():
 
     # Update CatPilot variables
     if sm['catpilotPlan'].togglesUpdated:
-      catpilot_toggles = get_catpilot_toggles()
+      catpilot_toggles.refresh()
 
 if __name__ == "__main__":
   main()
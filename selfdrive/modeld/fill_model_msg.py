@@ -9,6 +9,9 @@ SEND_RAW_PRED = os.getenv('SEND_RAW_PRED')
 
 ConfidenceClass = log.ModelDataV2.ConfidenceClass
 
+T_IDXS = np.array(ModelConstants.T_IDXS)
+X_IDXS = np.array(ModelConstants.X_IDXS)
+
 def curv_from_psis(psi_target, psi_rate, vego, delay):
   vego = np.clip(vego, MIN_SPEED, np.inf)
   curv_from_psi = psi_target / (vego * delay)  # epsilon to prevent divide-by-zero
@@ -25,32 +28,34 @@ class PublishState:
     self.prev_brake_5ms2_probs = np.zeros(ModelConstants.FCW_5MS2_PROBS_WIDTH, dtype=np.float32)
     self.prev_brake_3ms2_probs = np.zeros(ModelConstants.FCW_3MS2_PROBS_WIDTH, dtype=np.float32)
 
+# the fill helpers take lists, convert each model output with a single tolist() rather than once per field
+
 def fill_xyzt(builder, t, x, y, z, x_std=None, y_std=None, z_std=None):
   builder.t = t
-  builder.x = x.tolist()
-  builder.y = y.tolist()
-  builder.z = z.tolist()
+  builder.x = x
+  builder.y = y
+  builder.z = z
   if x_std is not None:
-    builder.xStd = x_std.tolist()
+    builder.xStd = x_std
   if y_std is not None:
-    builder.yStd = y_std.tolist()
+    builder.yStd = y_std
   if z_std is not None:
-    builder.zStd = z_std.tolist()
+    builder.zStd = z_std
 
 def fill_xyvat(builder, t, x, y, v, a, x_std=None, y_std=None, v_std=None, a_std=None):
   builder.t = t
-  builder.x = x.tolist()
-  builder.y = y.tolist()
-  builder.v = v.tolist()
-  builder.a = a.tolist()
+  builder.x = x
+  builder.y = y
+  builder.v = v
+  builder.a = a
   if x_std is not None:
-    builder.xStd = x_std.tolist()
+    builder.xStd = x_std
   if y_std is not None:
-    builder.yStd = y_std.tolist()
+    builder.yStd = y_std
   if v_std is not None:
-    builder.vStd = v_std.tolist()
+    builder.vStd = v_std
   if a_std is not None:
-    builder.aStd = a_std.tolist()
+    builder.aStd = a_std
 
 def fill_xyz_poly(builder, degree, x, y, z):
   xyz = np.stack([x, y, z], axis=1)
@@ -65,6 +70,52 @@ def fill_lane_line_meta(builder, lane_lines, lane_line_probs):
   builder.rightY = lane_lines[2].y[0]
   builder.rightProb = lane_line_probs[2]
 
+def fill_lane_lines(modelV2, net_output_data, t_idxs):
+  # y and z of the four lines, then of the left and right lanes between them
+  lines = net_output_data['lane_lines'][0].transpose(0, 2, 1)
+  lanes = np.concatenate([lines, 0.5 * (lines[0:1] + lines[1:2]), 0.5 * (lines[2:3] + lines[3:4])]).tolist()
+  modelV2.init('laneLines', len(lanes))
+  for lane_line, (y, z) in zip(modelV2.laneLines, lanes, strict=True):
+    fill_xyzt(lane_line, t_idxs, ModelConstants.X_IDXS, y, z)
+
+def fill_road_edges(modelV2, net_output_data, t_idxs):
+  edges = net_output_data['road_edges'][0].transpose(0, 2, 1).tolist()
+  modelV2.init('roadEdges', len(edges))
+  for road_edge, (y, z) in zip(modelV2.roadEdges, edges, strict=True):
+    fill_xyzt(road_edge, t_idxs, ModelConstants.X_IDXS, y, z)
+
+def fill_leads(modelV2, net_output_data):
+  leads = net_output_data['lead'][0].transpose(0, 2, 1).tolist()
+  lead_stds = net_output_data['lead_stds'][0].transpose(0, 2, 1).tolist()
+  lead_probs = net_output_data['lead_prob'][0].tolist()
+  modelV2.init('leadsV3', len(leads))
+  for i, lead in enumerate(modelV2.leadsV3):
+    fill_xyvat(lead, ModelConstants.LEAD_T_IDXS, *leads[i], *lead_stds[i])
+    lead.prob = lead_probs[i]
+    lead.probTime = ModelConstants.LEAD_T_OFFSETS[i]
+
+def get_plan_t_idxs(plan_x):
+  # times at X_IDXS according to model plan, for each xidx interpolate between the first plan point that's
+  # further away and the one before it. If the plan doesn't extend far enough, the first xidx past it gets
+  # the max time (10s) and the rest are left unknown
+  plan_x = plan_x.astype(np.float64)
+  further_x = np.maximum.accumulate(np.where(np.isnan(plan_x[1:]), np.inf, plan_x[1:]))
+  tidx = np.searchsorted(further_x, X_IDXS[1:])
+  n_reached = int(np.searchsorted(tidx, ModelConstants.IDX_N - 1))
+  tidx = tidx[:n_reached]
+
+  current_x_val = plan_x[tidx]
+  next_x_val = plan_x[tidx + 1]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    p = np.where(np.abs(next_x_val - current_x_val) > 1e-9, (X_IDXS[1:n_reached + 1] - current_x_val) / (next_x_val - current_x_val), np.nan)
+
+  plan_t_idxs = np.full(ModelConstants.IDX_N, np.nan)
+  plan_t_idxs[0] = 0.0
+  plan_t_idxs[1:n_reached + 1] = p * T_IDXS[tidx + 1] + (1 - p) * T_IDXS[tidx]
+  if n_reached + 1 < ModelConstants.IDX_N:
+    plan_t_idxs[n_reached + 1] = ModelConstants.T_IDXS[ModelConstants.IDX_N - 1]
+  return plan_t_idxs.tolist()
+
 def fill_model_msg(base_msg: capnp._DynamicStructBuilder, extended_msg: capnp._DynamicStructBuilder,
                    net_output_data: dict[str, np.ndarray], v_ego: float, delay: float,
                    publish_state: PublishState, vipc_frame_id: int, vipc_frame_id_extra: int,
@@ -96,16 +147,17 @@ def fill_model_msg(base_msg: capnp._DynamicStructBuilder, extended_msg: capnp._D
   modelV2.modelExecutionTime = model_execution_time
 
   # plan
+  plan = net_output_data['plan'][0]
   position = modelV2.position
-  fill_xyzt(position, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.POSITION].T, *net_output_data['plan_stds'][0,:,Plan.POSITION].T)
+  fill_xyzt(position, ModelConstants.T_IDXS, *plan[:,Plan.POSITION].T.tolist(), *net_output_data['plan_stds'][0,:,Plan.POSITION].T.tolist())
   velocity = modelV2.velocity
-  fill_xyzt(velocity, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.VELOCITY].T)
+  fill_xyzt(velocity, ModelConstants.T_IDXS, *plan[:,Plan.VELOCITY].T.tolist())
   acceleration = modelV2.acceleration
-  fill_xyzt(acceleration, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.ACCELERATION].T)
+  fill_xyzt(acceleration, ModelConstants.T_IDXS, *plan[:,Plan.ACCELERATION].T.tolist())
   orientation = modelV2.orientation
-  fill_xyzt(orientation, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.T_FROM_CURRENT_EULER].T)
+  fill_xyzt(orientation, ModelConstants.T_IDXS, *plan[:,Plan.T_FROM_CURRENT_EULER].T.tolist())
   orientation_rate = modelV2.orientationRate
-  fill_xyzt(orientation_rate, ModelConstants.T_IDXS, *net_output_data['plan'][0,:,Plan.ORIENTATION_RATE].T)
+  fill_xyzt(orientation_rate, ModelConstants.T_IDXS, *plan[:,Plan.ORIENTATION_RATE].T.tolist())
 
   # temporal pose
   temporal_pose = modelV2.temporalPose
@@ -122,39 +174,9 @@ def fill_model_msg(base_msg: capnp._DynamicStructBuilder, extended_msg: capnp._D
   action = modelV2.action
   action.desiredCurvature = desired_curv
 
-  # times at X_IDXS according to model plan
-  PLAN_T_IDXS = [np.nan] * ModelConstants.IDX_N
-  PLAN_T_IDXS[0] = 0.0
-  plan_x = net_output_data['plan'][0,:,Plan.POSITION][:,0].tolist()
-  for xidx in range(1, ModelConstants.IDX_N):
-    tidx = 0
-    # increment tidx until we find an element that's further away than the current xidx
-    while tidx < ModelConstants.IDX_N - 1 and plan_x[tidx+1] < ModelConstants.X_IDXS[xidx]:
-      tidx += 1
-    if tidx == ModelConstants.IDX_N - 1:
-      # if the Plan doesn't extend far enough, set plan_t to the max value (10s), then break
-      PLAN_T_IDXS[xidx] = ModelConstants.T_IDXS[ModelConstants.IDX_N - 1]
-      break
-    # interpolate to find `t` for the current xidx
-    current_x_val = plan_x[tidx]
-    next_x_val = plan_x[tidx+1]
-    p = (ModelConstants.X_IDXS[xidx] - current_x_val) / (next_x_val - current_x_val) if abs(next_x_val - current_x_val) > 1e-9 else float('nan')
-    PLAN_T_IDXS[xidx] = p * ModelConstants.T_IDXS[tidx+1] + (1 - p) * ModelConstants.T_IDXS[tidx]
-
   # lane lines
-  modelV2.init('laneLines', 6)
-  for i in range(6):
-    lane_line = modelV2.laneLines[i]
-    if i < 4:
-      fill_xyzt(lane_line, PLAN_T_IDXS, np.array(ModelConstants.X_IDXS), net_output_data['lane_lines'][0,i,:,0], net_output_data['lane_lines'][0,i,:,1])
-    elif i == 4:
-      leftLane_x = 0.5 * (net_output_data['lane_lines'][0,0,:,0] + net_output_data['lane_lines'][0,1,:,0])
-      leftLane_y = 0.5 * (net_output_data['lane_lines'][0,0,:,1] + net_output_data['lane_lines'][0,1,:,1])
-      fill_xyzt(lane_line, PLAN_T_IDXS, np.array(ModelConstants.X_IDXS), leftLane_x, leftLane_y)
-    elif i == 5:
-      rightLane_x = 0.5 * (net_output_data['lane_lines'][0,2,:,0] + net_output_data['lane_lines'][0,3,:,0])
-      rightLane_y = 0.5 * (net_output_data['lane_lines'][0,2,:,1] + net_output_data['lane_lines'][0,3,:,1])
-      fill_xyzt(lane_line, PLAN_T_IDXS, np.array(ModelConstants.X_IDXS), rightLane_x, rightLane_y)
+  PLAN_T_IDXS = get_plan_t_idxs(plan[:,Plan.POSITION][:,0])
+  fill_lane_lines(modelV2, net_output_data, PLAN_T_IDXS)
   modelV2.laneLineStds = net_output_data['lane_lines_stds'][0,:,0,0].tolist()
   modelV2.laneLineProbs = net_output_data['lane_lines_prob'][0,1::2].tolist()
 
@@ -162,19 +184,11 @@ def fill_model_msg(base_msg: capnp._DynamicStructBuilder, extended_msg: capnp._D
   fill_lane_line_meta(lane_line_meta, modelV2.laneLines, modelV2.laneLineProbs)
 
   # road edges
-  modelV2.init('roadEdges', 2)
-  for i in range(2):
-    road_edge = modelV2.roadEdges[i]
-    fill_xyzt(road_edge, PLAN_T_IDXS, np.array(ModelConstants.X_IDXS), net_output_data['road_edges'][0,i,:,0], net_output_data['road_edges'][0,i,:,1])
+  fill_road_edges(modelV2, net_output_data, PLAN_T_IDXS)
   modelV2.roadEdgeStds = net_output_data['road_edges_stds'][0,:,0,0].tolist()
 
   # leads
-  modelV2.init('leadsV3', 3)
-  for i in range(3):
-    lead = modelV2.leadsV3[i]
-    fill_xyvat(lead, ModelConstants.LEAD_T_IDXS, *net_output_data['lead'][0,i].T, *net_output_data['lead_stds'][0,i].T)
-    lead.prob = net_output_data['lead_prob'][0,i].tolist()
-    lead.probTime = ModelConstants.LEAD_T_OFFSETS[i]
+  fill_leads(modelV2, net_output_data)
 
   # meta
   meta = modelV2.meta
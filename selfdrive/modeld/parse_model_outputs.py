@@ -1,44 +1,71 @@
 import numpy as np
 from catpilot.selfdrive.modeld.constants import ModelConstants
 
+# -11 is around 10**14, more causes float16 overflow
+EXP_CLIP = 11
+
 def safe_exp(x, out=None):
-  # -11 is around 10**14, more causes float16 overflow
-  return np.exp(np.clip(x, -np.inf, 11), out=out)
+  return np.exp(np.clip(x, -np.inf, EXP_CLIP), out=out)
 
 def sigmoid(x):
   return 1. / (1. + safe_exp(-x))
 
-def softmax(x, axis=-1):
+def softmax(x, axis=-1, clip_exp=True):
   x -= np.max(x, axis=axis, keepdims=True)
+  if clip_exp:
+    np.minimum(x, EXP_CLIP, out=x)
   if x.dtype == np.float32 or x.dtype == np.float64:
-    safe_exp(x, out=x)
+    np.exp(x, out=x)
   else:
-    x = safe_exp(x)
+    x = np.exp(x)
   x /= np.sum(x, axis=axis, keepdims=True)
   return x
 
 class Parser:
-  def __init__(self, ignore_missing=False):
+  """Decodes the raw outputs of the driving models, shared by every modeld stack.
+
+  Each stack subclasses it with the outputs its model has. Results are written to buffers kept per
+  output, so like the sliced model outputs they're only valid until the next frame is parsed.
+  """
+  def __init__(self, ignore_missing=False, clip_exp=True):
     self.ignore_missing = ignore_missing
+    self.clip_exp = clip_exp
+    self.buffers: dict[str, np.ndarray] = {}
 
   def check_missing(self, outs, name):
     if name not in outs and not self.ignore_missing:
       raise ValueError(f"Missing output {name}")
     return name not in outs
 
+  def buffer(self, name, shape, dtype):
+    buf = self.buffers.get(name)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+      buf = self.buffers[name] = np.empty(shape, dtype=dtype)
+    return buf
+
+  def exp(self, x, out):
+    if self.clip_exp:
+      np.minimum(x, EXP_CLIP, out=out)
+    else:
+      np.copyto(out, x)
+    return np.exp(out, out=out)
+
   def parse_categorical_crossentropy(self, name, outs, out_shape=None):
     if self.check_missing(outs, name):
       return
     raw = outs[name]
     if out_shape is not None:
       raw = raw.reshape((raw.shape[0],) + out_shape)
-    outs[name] = softmax(raw, axis=-1)
+    outs[name] = softmax(raw, axis=-1, clip_exp=self.clip_exp)
 
   def parse_binary_crossentropy(self, name, outs):
     if self.check_missing(outs, name):
       return
     raw = outs[name]
-    outs[name] = sigmoid(raw)
+    out = self.buffer(name, raw.shape, raw.dtype)
+    self.exp(np.negative(raw, out=out), out=out)
+    out += 1.
+    outs[name] = np.divide(1., out, out=out)
 
   def parse_mdn(self, name, outs, in_N=0, out_N=1, out_shape=None):
     if self.check_missing(outs, name):
@@ -48,31 +75,29 @@ class Parser:
 
     n_values = (raw.shape[2] - out_N)//2
     pred_mu = raw[:,:,:n_values]
-    pred_std = safe_exp(raw[:,:,n_values: 2*n_values])
+    pred_std = self.exp(raw[:,:,n_values: 2*n_values], out=self.buffer(name + '_stds', pred_mu.shape, raw.dtype))
 
     if in_N > 1:
-      weights = np.zeros((raw.shape[0], in_N, out_N), dtype=raw.dtype)
-      for i in range(out_N):
-        weights[:,:,i - out_N] = softmax(raw[:,:,i - out_N], axis=-1)
+      # every selection column is a distribution over the hypotheses
+      weights = softmax(raw[:,:,2*n_values:], axis=1, clip_exp=self.clip_exp)
+      frames = np.arange(raw.shape[0])[:, np.newaxis]
 
       if out_N == 1:
-        for fidx in range(weights.shape[0]):
-          idxs = np.argsort(weights[fidx][:,0])[::-1]
-          weights[fidx] = weights[fidx][idxs]
-          pred_mu[fidx] = pred_mu[fidx][idxs]
-          pred_std[fidx] = pred_std[fidx][idxs]
+        order = np.argsort(weights[:,:,0], axis=1)[:, ::-1]
+        weights = weights[frames, order]
+        pred_mu = pred_mu[frames, order]
+        pred_std = pred_std[frames, order]
+      else:
+        weights = weights.copy()
       full_shape = tuple([raw.shape[0], in_N] + list(out_shape))
       outs[name + '_weights'] = weights
       outs[name + '_hypotheses'] = pred_mu.reshape(full_shape)
       outs[name + '_stds_hypotheses'] = pred_std.reshape(full_shape)
 
-      pred_mu_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
-      pred_std_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
-      for fidx in range(weights.shape[0]):
-        for hidx in range(out_N):
-          idxs = np.argsort(weights[fidx,:,hidx])[::-1]
-          pred_mu_final[fidx, hidx] = pred_mu[fidx, idxs[0]]
-          pred_std_final[fidx, hidx] = pred_std[fidx, idxs[0]]
+      # the most likely hypothesis of each selection
+      best = np.argsort(weights, axis=1)[:, -1, :]
+      pred_mu_final = pred_mu[frames, best]
+      pred_std_final = pred_std[frames, best]
     else:
       pred_mu_final = pred_mu
       pred_std_final = pred_std
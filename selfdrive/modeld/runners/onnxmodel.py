@@ -1,11 +1,10 @@
 import os
-import onnx
 import sys
 import numpy as np
 from typing import Any
 
 from catpilot.selfdrive.modeld.runners.runmodel_pyx import RunModel
-from catpilot.selfdrive.modeld.runners.ort_helpers import convert_fp16_to_fp32, ORT_TYPES_TO_NP_TYPES
+from catpilot.selfdrive.modeld.runners.ort_helpers import ModelCache, ORT_TYPES_TO_NP_TYPES
 
 
 def create_ort_session(path, fp16_to_fp32):
@@ -29,9 +28,8 @@ def create_ort_session(path, fp16_to_fp32):
     options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
     provider = 'CPUExecutionProvider'
 
-  model_data = convert_fp16_to_fp32(onnx.load(path)) if fp16_to_fp32 else path
   print("Onnx selected provider: ", [provider], file=sys.stderr)
-  ort_session = ort.InferenceSession(model_data, options, providers=[provider])
+  ort_session = ModelCache(path, fp16_to_fp32, provider if isinstance(provider, str) else provider[0]).create_session(options, provider)
   print("Onnx using ", ort_session.get_providers(), file=sys.stderr)
   return ort_session
 
@@ -46,6 +44,17 @@ class ONNXModel(RunModel):
     self.input_shapes = {x.name: [1, *x.shape[1:]] for x in self.session.get_inputs()}
     self.input_dtypes = {x.name: ORT_TYPES_TO_NP_TYPES[x.type] for x in self.session.get_inputs()}
 
+    outputs = self.session.get_outputs()
+    assert len(outputs) == 1, "Only single model outputs are supported"
+    output_shape = [1, *outputs[0].shape[1:]]
+    output_dtype = ORT_TYPES_TO_NP_TYPES[outputs[0].type]
+
+    # the model writes straight into the output buffer when it has the right type and size
+    self.binding = self.session.io_binding()
+    self.output_bound = output.dtype == output_dtype and output.size == np.prod(output_shape) and output.flags.c_contiguous
+    self.output_buffer = output.reshape(output_shape) if self.output_bound else np.empty(output_shape, dtype=output_dtype)
+    self.binding.bind_output(outputs[0].name, 'cpu', 0, output_dtype, output_shape, self.output_buffer.ctypes.data)
+
     # run once to initialize CUDA provider
     if "CUDAExecutionProvider" in self.session.get_providers():
       self.session.run(None, {k: np.zeros(self.input_shapes[k], dtype=self.input_dtypes[k]) for k in self.input_names})
@@ -63,9 +72,11 @@ class ONNXModel(RunModel):
     return None
 
   def execute(self):
-    inputs = {k: v.view(self.input_dtypes[k]) for k,v in self.inputs.items()}
-    inputs = {k: v.reshape(self.input_shapes[k]).astype(self.input_dtypes[k]) for k,v in inputs.items()}
-    outputs = self.session.run(None, inputs)
-    assert len(outputs) == 1, "Only single model outputs are supported"
-    self.output[:] = outputs[0]
+    # the buffers already hold the model's input type, so viewing them is enough and they're bound without a copy
+    bound = {k: np.ascontiguousarray(v.view(self.input_dtypes[k]).reshape(self.input_shapes[k])) for k, v in self.inputs.items()}
+    for k, v in bound.items():
+      self.binding.bind_cpu_input(k, v)
+    self.session.run_with_iobinding(self.binding)
+    if not self.output_bound:
+      self.output[:] = self.output_buffer
     return self.output
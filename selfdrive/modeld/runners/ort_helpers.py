@@ -1,7 +1,17 @@
+import hashlib
+import itertools
+import os
+import platform
+import re
+import sys
+from pathlib import Path
+
 import onnx
 import onnxruntime as ort
 import numpy as np
-import itertools
+
+from catpilot.common.file_helpers import atomic_write_in_dir
+from catpilot.system.hardware.hw import Paths
 
 ORT_TYPES_TO_NP_TYPES = {'tensor(float16)': np.float16, 'tensor(float)': np.float32, 'tensor(uint8)': np.uint8}
 
@@ -27,6 +37,76 @@ def convert_fp16_to_fp32(model):
   return model.SerializeToString()
 
 
+class ModelCache:
+  """Converted and optimized copies of an onnx model, keyed by its content.
+
+  The key covers the model bytes, whether it's converted to fp32, the onnxruntime version, the
+  provider and the machine, since the optimized graph is only valid where it was optimized.
+  Entries of older versions of the same model are removed when a new one is written.
+  """
+  def __init__(self, path: str, fp16_to_fp32: bool, provider: str, root: str | None = None):
+    self.path = path
+    self.fp16_to_fp32 = fp16_to_fp32
+    self.root = Path(root or Paths.model_cache_root())
+
+    with open(path, "rb") as f:
+      digest = hashlib.file_digest(f, "sha256")
+    digest.update(f"{fp16_to_fp32}:{ort.__version__}:{provider}:{platform.machine()}".encode())
+    self.prefix = f"{Path(path).stem}_"
+    self.name = f"{self.prefix}{digest.hexdigest()[:32]}"
+
+    self.converted_path = self.root / f"{self.name}.onnx"
+    self.optimized_path = self.root / f"{self.name}.optimized.onnx"
+
+  def evict_stale(self) -> None:
+    stale = re.compile(re.escape(self.prefix) + r"[0-9a-f]{32}\.")
+    for entry in self.root.glob(f"{self.prefix}*"):
+      if stale.match(entry.name) and not entry.name.startswith(self.name):
+        entry.unlink(missing_ok=True)
+
+  def model_data(self) -> str | bytes:
+    # the fp32 model, converted only on a cache miss
+    if not self.fp16_to_fp32:
+      return self.path
+    if self.converted_path.exists():
+      return str(self.converted_path)
+
+    model_data = convert_fp16_to_fp32(onnx.load(self.path))
+    try:
+      with atomic_write_in_dir(str(self.converted_path), mode="wb", overwrite=True) as f:
+        f.write(model_data)
+    except OSError as e:
+      print(f"Onnx model cache not writable: {e}", file=sys.stderr)
+    return model_data
+
+  def create_session(self, options: ort.SessionOptions, provider) -> ort.InferenceSession:
+    try:
+      self.root.mkdir(parents=True, exist_ok=True)
+      self.evict_stale()
+    except OSError as e:
+      print(f"Onnx model cache not writable: {e}", file=sys.stderr)
+
+    optimize = options.graph_optimization_level != ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+    if optimize and self.optimized_path.exists():
+      # optimized when it was cached, loading it doesn't need another pass
+      options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+      return ort.InferenceSession(str(self.optimized_path), options, providers=[provider])
+
+    model_data = self.model_data()
+    if not optimize or not os.access(self.root, os.W_OK):
+      return ort.InferenceSession(model_data, options, providers=[provider])
+
+    # onnxruntime writes the optimized graph out while creating the session
+    tmp_path = self.optimized_path.with_suffix(f".{os.getpid()}.tmp")
+    options.optimized_model_filepath = str(tmp_path)
+    try:
+      session = ort.InferenceSession(model_data, options, providers=[provider])
+      os.replace(tmp_path, self.optimized_path)
+    finally:
+      tmp_path.unlink(missing_ok=True)
+    return session
+
+
 def make_onnx_cpu_runner(model_path):
   options = ort.SessionOptions()
   options.intra_op_num_threads = 4
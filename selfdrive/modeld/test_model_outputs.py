@@ -0,0 +1,244 @@
+import hashlib
+
+import numpy as np
+import pytest
+
+import cereal.messaging as messaging
+from cereal import log
+from catpilot.catpilot.classic_modeld import constants as classic_constants
+from catpilot.catpilot.classic_modeld import fill_model_msg as classic_fill
+from catpilot.catpilot.classic_modeld.parse_model_outputs import Parser as ClassicParser
+from catpilot.catpilot.tinygrad_modeld import constants as tinygrad_constants
+from catpilot.catpilot.tinygrad_modeld import fill_model_msg as tinygrad_fill
+from catpilot.catpilot.tinygrad_modeld.parse_model_outputs import Parser as TinygradParser
+from catpilot.selfdrive.modeld import constants as modeld_constants
+from catpilot.selfdrive.modeld import fill_model_msg as modeld_fill
+from catpilot.selfdrive.modeld.parse_model_outputs import Parser, safe_exp, softmax
+
+FRAMES = 4
+
+# sha256 of the modelV2, drivingModelData and cameraOdometry each stack publishes for each frame of fill_frames, as built by the
+# fill_model_msg of each stack before the parsers were shared and the fills vectorized
+FILL_DIGESTS = {
+  'modeld': [
+    ('e330c1d6e04261cc9adcf0cea9c8c4741b108657d7a9e427e0d2f69d3424f66c', '0eee8f365c5d3f8ec744a14d5556b6c7383d96bfb289a2378afed87b37b54e67', '5387256a6e5ef374405bf0a129298d78ffb632908bcc4b8bb6e86a040d538d94'),
+    ('5a07bab928b00a3141a2435e327ca5f0ebae3ecffcccce6ecf2766018dc48862', 'e7fc7afae522391280095cd0b81498b1d8ba6afce7ddb4ed472a9381971fd45e', '5267ce4889d464562f9a01019c854d449064076b8a7aa52ebaac423213169596'),
+    ('e67c298e0510cadc7828b84934be3e20777d29415515a341b9897c88a09c0c2d', 'e0973792169026b8f1a85a879285f589e58878e8769749c4987cd9240c716f7a', 'e4ac5f2a063dcd0520188e4a75b19919e41fe559e9a127581373871a50346170'),
+    ('8703ed3f269afadbdc15005c05dbadc31bafbfbc6009ae1126b735c3324a372a', '7a43e3bf8850e2f77209540b392664c246b442c5805e6b834b6e8dbd6d71c1f8', '45d4eab066899833e583666d5c3834ca746fa536022ff2e3e4913da6a10f2712'),
+  ],
+  'classic': [
+    ('e1b9760c7a923d1f6479e0a7ac465185e8679ea992f405b750f5ab2befecb4ba', '39e7eb608165de2d0042b465a3792b1db017907c84a89165808d912f3edf85ca'),
+    ('a15121ce7845eac0f8c17ec82ba8a72f07c93f68e45b6051ceaae3b9606a2dd3', '2f8648450a009fe667b85b17335b74211547f953a4eb6f092ff26ddec66a62a8'),
+    ('53963293b81f8ac32a72afc12b515a64d0482d09422e1015eab92cbbc19d74f2', 'ba71c55cd6ea1773d9d7a0d1f8423446b478b23cedda50cb109cbf2a3991288b'),
+    ('4378e2cbd83e93a751bc1f17890e646e066fdc421525040b9a35eb65ce3c90be', '76c6da1785771f11a44e2014df08751035284ad5e4f99485092ccff180a65680'),
+  ],
+  'tinygrad': [
+    ('b6130cef9f03f8de61d852a18e32370f6e10ab6b042f4fc38e7e4fcd376f39ca', '17aa676a7d3be31c6a8dbb1a3fe9736075ed671348b5859baf2272428510a222', '51488ad0f2ce198cab996674262d33a067c2b221f390bc23bb543f45ddb83705'),
+    ('2bd7de675d0289e00e185eb14df0931e01755526edf3ca350b2a4e1f625934c8', '916892efba7e309bc8c75f6c27282b1c07b8b39d988e08818080033cac9a0832', 'e9ed33fba555449d7e516f15d6d6085bbe4460f7d16e4517e1a9748f121405c9'),
+    ('466d307765439d88b9b1b3fdddc3dc4271756aa53d5f4291438b755d765c93eb', 'e98994c08ec9ae6a2315b28062c12654663ba3734735f24cf15c0efbf08da30a', 'cc9172e3c488c986bfb7c9a56601eb5db85576037e6dea402f2c40be1035fc6a'),
+    ('77bce056c63bd8b1ac5a2fa1840bb41a46d2592dd9d44cafa54b755e55f9ce10', '62676984b530c14f49618de54ff13f46104a76276573114082e2b69011b87e38', '6126d1a51cbb7e9f8661f7369e59ec5ff96a8f5b9fd801e4f5b47995dbcc6c0e'),
+  ],
+}
+
+
+class LegacyParser:
+  # parse_mdn and parse_binary_crossentropy as they were before they were vectorized, one softmax and argsort per hypothesis
+  def legacy_exp(self, x):
+    return safe_exp(x) if self.clip_exp else np.exp(x)
+
+  def parse_binary_crossentropy(self, name, outs):
+    if self.check_missing(outs, name):
+      return
+    outs[name] = 1. / (1. + self.legacy_exp(-outs[name]))
+
+  def parse_mdn(self, name, outs, in_N=0, out_N=1, out_shape=None):
+    if self.check_missing(outs, name):
+      return
+    raw = outs[name]
+    raw = raw.reshape((raw.shape[0], max(in_N, 1), -1))
+
+    n_values = (raw.shape[2] - out_N)//2
+    pred_mu = raw[:,:,:n_values]
+    pred_std = self.legacy_exp(raw[:,:,n_values: 2*n_values])
+
+    if in_N > 1:
+      weights = np.zeros((raw.shape[0], in_N, out_N), dtype=raw.dtype)
+      for i in range(out_N):
+        weights[:,:,i - out_N] = softmax(raw[:,:,i - out_N], axis=-1, clip_exp=self.clip_exp)
+
+      if out_N == 1:
+        for fidx in range(weights.shape[0]):
+          idxs = np.argsort(weights[fidx][:,0])[::-1]
+          weights[fidx] = weights[fidx][idxs]
+          pred_mu[fidx] = pred_mu[fidx][idxs]
+          pred_std[fidx] = pred_std[fidx][idxs]
+      full_shape = tuple([raw.shape[0], in_N] + list(out_shape))
+      outs[name + '_weights'] = weights
+      outs[name + '_hypotheses'] = pred_mu.reshape(full_shape)
+      outs[name + '_stds_hypotheses'] = pred_std.reshape(full_shape)
+
+      pred_mu_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
+      pred_std_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
+      for fidx in range(weights.shape[0]):
+        for hidx in range(out_N):
+          idxs = np.argsort(weights[fidx,:,hidx])[::-1]
+          pred_mu_final[fidx, hidx] = pred_mu[fidx, idxs[0]]
+          pred_std_final[fidx, hidx] = pred_std[fidx, idxs[0]]
+    else:
+      pred_mu_final = pred_mu
+      pred_std_final = pred_std
+
+    if out_N > 1:
+      final_shape = tuple([raw.shape[0], out_N] + list(out_shape))
+    else:
+      final_shape = tuple([raw.shape[0],] + list(out_shape))
+    outs[name] = pred_mu_final.reshape(final_shape)
+    outs[name + '_stds'] = pred_std_final.reshape(final_shape)
+
+
+def meta_width(Meta):
+  return max(v.stop for v in vars(Meta).values() if isinstance(v, slice))
+
+
+def mdn_width(in_N, out_N, out_shape):
+  n_values = int(np.prod(out_shape))
+  return 2 * n_values if in_N == 0 else in_N * (2 * n_values + out_N)
+
+
+def output_widths(constants, names):
+  MC = constants.ModelConstants
+  widths = {
+    'plan': mdn_width(MC.PLAN_MHP_N, MC.PLAN_MHP_SELECTION, (MC.IDX_N, MC.PLAN_WIDTH)),
+    'lane_lines': mdn_width(0, 0, (MC.NUM_LANE_LINES, MC.IDX_N, MC.LANE_LINES_WIDTH)),
+    'road_edges': mdn_width(0, 0, (MC.NUM_ROAD_EDGES, MC.IDX_N, MC.LANE_LINES_WIDTH)),
+    'pose': mdn_width(0, 0, (MC.POSE_WIDTH,)),
+    'road_transform': mdn_width(0, 0, (MC.POSE_WIDTH,)),
+    'sim_pose': mdn_width(0, 0, (MC.POSE_WIDTH,)),
+    'wide_from_device_euler': mdn_width(0, 0, (MC.WIDE_FROM_DEVICE_WIDTH,)),
+    'desired_curvature': mdn_width(0, 0, (MC.DESIRED_CURV_WIDTH,)),
+    'lead': mdn_width(MC.LEAD_MHP_N, MC.LEAD_MHP_SELECTION, (MC.LEAD_TRAJ_LEN, MC.LEAD_WIDTH)),
+    'lead_prob': MC.LEAD_MHP_SELECTION,
+    'lane_lines_prob': 2 * MC.NUM_LANE_LINES,
+    'meta': meta_width(constants.Meta),
+    'desire_state': MC.DESIRE_PRED_WIDTH,
+    'desire_pred': MC.DESIRE_PRED_LEN * MC.DESIRE_PRED_WIDTH,
+  }
+  return {name: widths[name] for name in names}
+
+
+def raw_outputs(rng, widths, constants, tie=False):
+  # raw outputs shaped like the model's, with plans that move forward
+  MC = constants.ModelConstants
+  outs = {name: rng.standard_normal((1, width)).astype(np.float32) for name, width in widths.items()}
+  if 'plan' in outs:
+    hypotheses = outs['plan'].reshape(MC.PLAN_MHP_N, -1)
+    for plan in hypotheses[:, :MC.IDX_N * MC.PLAN_WIDTH].reshape(MC.PLAN_MHP_N, MC.IDX_N, MC.PLAN_WIDTH):
+      plan[:, constants.Plan.POSITION.start] = np.cumsum(rng.uniform(0, 10, MC.IDX_N))
+    if tie:
+      hypotheses[:, -MC.PLAN_MHP_SELECTION:] = hypotheses[0, -MC.PLAN_MHP_SELECTION:]
+  if 'lead' in outs and tie:
+    hypotheses = outs['lead'].reshape(MC.LEAD_MHP_N, -1)
+    hypotheses[:, -MC.LEAD_MHP_SELECTION:] = hypotheses[0, -MC.LEAD_MHP_SELECTION:]
+  return outs
+
+
+MODELD_OUTPUTS = ['plan', 'lane_lines', 'road_edges', 'pose', 'road_transform', 'wide_from_device_euler', 'lead',
+                  'lead_prob', 'lane_lines_prob', 'meta', 'desire_state', 'desire_pred']
+TINYGRAD_VISION_OUTPUTS = ['pose', 'wide_from_device_euler', 'road_transform', 'lane_lines', 'road_edges', 'lane_lines_prob',
+                           'desire_pred', 'meta', 'lead_prob', 'lead']
+TINYGRAD_POLICY_OUTPUTS = ['plan', 'lane_lines', 'road_edges', 'sim_pose', 'desired_curvature', 'lead_prob', 'lane_lines_prob',
+                           'desire_state', 'lead']
+
+STACKS = {
+  'modeld': (modeld_constants, Parser, [MODELD_OUTPUTS]),
+  'classic': (classic_constants, ClassicParser, [MODELD_OUTPUTS + ['sim_pose', 'desired_curvature']]),
+  'tinygrad': (tinygrad_constants, TinygradParser, [TINYGRAD_VISION_OUTPUTS, TINYGRAD_POLICY_OUTPUTS]),
+}
+
+
+def parse(parser, stack, outputs):
+  # tinygrad parses its vision and policy outputs separately, later outputs of the same name win as in tinygrad_modeld
+  if stack == 'tinygrad':
+    vision, policy = outputs
+    vision = parser.parse_vision_outputs(vision)
+    policy = parser.parse_policy_outputs(policy)
+    return {k: v.copy() for k, v in {**vision, **policy}.items()}
+  return {k: v.copy() for k, v in parser.parse_outputs(outputs[0]).items()}
+
+
+def fill_frames(stack):
+  """Parsed outputs for each frame, drawn directly instead of parsed so the fills don't depend on the exps of the parser"""
+  constants, parser_cls, names = STACKS[stack]
+  MC = constants.ModelConstants
+  rng = np.random.default_rng(1)
+  shapes = parse(parser_cls(), stack, [raw_outputs(rng, output_widths(constants, n), constants) for n in names])
+
+  frames = []
+  for i in range(FRAMES):
+    outs = {}
+    for name, value in sorted(shapes.items()):
+      if name.endswith(('_prob', '_weights')) or name in ('meta', 'desire_state', 'desire_pred'):
+        outs[name] = rng.uniform(0, 1, value.shape).astype(value.dtype)
+      elif '_stds' in name:
+        outs[name] = rng.uniform(0.1, 2, value.shape).astype(value.dtype)
+      else:
+        outs[name] = rng.standard_normal(value.shape).astype(value.dtype)
+    # the last frame's plan stops short of the furthest X_IDXS
+    step = 0.5 if i == FRAMES - 1 else 10
+    outs['plan'][0, :, constants.Plan.POSITION.start] = np.cumsum(rng.uniform(0, step, MC.IDX_N)).astype(np.float32)
+    frames.append(outs)
+  return frames
+
+
+def fill(stack, fill_module, outs, publish_state, frame):
+  model_msg = messaging.new_message('modelV2')
+  driving_msg = messaging.new_message('drivingModelData')
+  pose_msg = messaging.new_message('cameraOdometry')
+  timestamp = 50_000_000 * frame
+  if stack == 'modeld':
+    fill_module.fill_model_msg(driving_msg, model_msg, outs, 20., 0.2, publish_state, frame, frame, frame + 1, 0.,
+                               timestamp, 0.01, True)
+  elif stack == 'classic':
+    # classic doesn't publish drivingModelData
+    driving_msg = None
+    fill_module.fill_model_msg(model_msg, outs, publish_state, frame, frame, frame + 1, 0., timestamp, timestamp, 0.01, True, False)
+  else:
+    action = log.ModelDataV2.Action(desiredCurvature=0.01, desiredAcceleration=0.5, shouldStop=False)
+    fill_module.fill_model_msg(driving_msg, model_msg, outs, action, publish_state, frame, frame, frame + 1, 0., timestamp, 0.01, True)
+  fill_module.fill_pose_msg(pose_msg, outs, frame, 0, timestamp, True)
+
+  digests = []
+  for msg in (model_msg, driving_msg, pose_msg):
+    if msg is None:
+      continue
+    msg.logMonoTime = 0
+    digests.append(hashlib.sha256(msg.to_bytes()).hexdigest())
+  return tuple(digests)
+
+
+def fill_digests(stack, fill_module):
+  publish_state = fill_module.PublishState()
+  return [fill(stack, fill_module, outs, publish_state, frame) for frame, outs in enumerate(fill_frames(stack))]
+
+
+class TestModelOutputs:
+  @pytest.mark.parametrize("stack", STACKS.keys())
+  def test_parse_matches_legacy(self, stack):
+    constants, parser_cls, names = STACKS[stack]
+    legacy_cls = type('Legacy' + parser_cls.__name__, (LegacyParser, parser_cls), {})
+    parser, legacy = parser_cls(), legacy_cls()
+
+    rng = np.random.default_rng(0)
+    for i in range(20):
+      outputs = [raw_outputs(rng, output_widths(constants, n), constants, tie=i % 5 == 0) for n in names]
+      expected = parse(legacy, stack, [{k: v.copy() for k, v in o.items()} for o in outputs])
+      parsed = parse(parser, stack, outputs)
+
+      assert parsed.keys() == expected.keys()
+      for k in expected:
+        assert parsed[k].dtype == expected[k].dtype, k
+        assert parsed[k].tobytes() == expected[k].tobytes(), k
+
+  @pytest.mark.parametrize("stack, fill_module", [('modeld', modeld_fill), ('classic', classic_fill), ('tinygrad', tinygrad_fill)])
+  def test_fill_matches_legacy(self, stack, fill_module):
+    assert fill_digests(stack, fill_module) == FILL_DIGESTS[stack]
@@ -93,7 +93,7 @@ class RouteEngine:
 
     # Update CatPilot variables
     if self.sm['catpilotPlan'].togglesUpdated:
-      self.catpilot_toggles = get_catpilot_toggles()
+      self.catpilot_toggles.refresh()
 
   def update_location(self):
     location = self.sm['liveLocationKalman']
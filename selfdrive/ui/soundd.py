@@ -222,7 +222,7 @@ class Soundd:
 
         # Update CatPilot variables
         if sm['catpilotPlan'].togglesUpdated:
-          self.catpilot_toggles = get_catpilot_toggles()
+          self.catpilot_toggles.refresh()
 
           self.update_catpilot_sounds()
 
@@ -22,6 +22,7 @@ from catpilot.system.loggerd.config import get_available_bytes, get_available_pe
 from catpilot.system.statsd import statlog
 from catpilot.common.swaglog import cloudlog
 from catpilot.system.hardware.power_monitoring import PowerMonitoring
+from catpilot.system.hardware.sysfs import sysfs
 from catpilot.system.hardware.fan_controller import TiciFanController
 from catpilot.system.version import terms_version, training_version
 
@@ -53,14 +54,16 @@ OFFROAD_DANGER_TEMP = 75
 
 prev_offroad_states: dict[str, tuple[bool, str | None]] = {}
 
+THERMAL_PATH = "/sys/devices/virtual/thermal"
+
 tz_by_type: dict[str, int] | None = None
 def populate_tz_by_type():
   global tz_by_type
   tz_by_type = {}
-  for n in os.listdir("/sys/devices/virtual/thermal"):
+  for n in os.listdir(sysfs.path(THERMAL_PATH)):
     if not n.startswith("thermal_zone"):
       continue
-    with open(os.path.join("/sys/devices/virtual/thermal", n, "type")) as f:
+    with open(sysfs.path(os.path.join(THERMAL_PATH, n, "type"))) as f:
       tz_by_type[f.read().strip()] = int(n.removeprefix("thermal_zone"))
 
 def read_tz(x):
@@ -72,11 +75,8 @@ def read_tz(x):
       populate_tz_by_type()
     x = tz_by_type[x]
 
-  try:
-    with open(f"/sys/devices/virtual/thermal/thermal_zone{x}/temp") as f:
-      return int(f.read())
-  except FileNotFoundError:
-    return 0
+  # sampled with the rest of the sensors by sysfs.update()
+  return sysfs.get(f"{THERMAL_PATH}/thermal_zone{x}/temp")
 
 
 def read_thermal(thermal_config):
@@ -240,6 +240,7 @@ def hardware_thread(end_event, hw_queue) -> None:
     if (sm.frame % round(SERVICE_LIST['pandaStates'].frequency * DT_HW) != 0) and not ign_edge:
       continue
 
+    sysfs.update()
     msg = read_thermal(thermal_config)
     msg.deviceState.deviceType = HARDWARE.get_device_type()
 
@@ -331,8 +332,7 @@ def hardware_thread(end_event, hw_queue) -> None:
         else:
           # check for bad NVMe
           try:
-            with open("/sys/block/nvme0n1/device/model") as f:
-              model = f.read().strip()
+            model = sysfs.read("/sys/block/nvme0n1/device/model", lambda s: s.decode().strip(), default=None, interval=None)
             if not model.startswith("Samsung SSD 980") and params.get("Offroad_BadNvme") is None:
               set_offroad_alert_if_changed("Offroad_BadNvme", True)
               cloudlog.event("Unsupported NVMe", model=model, error=True)
@@ -466,7 +466,7 @@ def hardware_thread(end_event, hw_queue) -> None:
 
     # Update CatPilot variables
     if sm['catpilotPlan'].togglesUpdated:
-      catpilot_toggles = get_catpilot_toggles()
+      catpilot_toggles.refresh()
 
 def main():
   hw_queue = queue.Queue(maxsize=1)
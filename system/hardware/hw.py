@@ -40,6 +40,15 @@ class Paths:
       return os.environ['COMMA_CACHE'] + "/"
     return DEFAULT_DOWNLOAD_CACHE_ROOT + os.environ.get("CATPILOT_PREFIX", "") + "/"
 
+  @staticmethod
+  def model_cache_root() -> str:
+    if os.environ.get('MODEL_CACHE', False):
+      return os.environ['MODEL_CACHE']
+    elif PC:
+      return os.path.join(Paths.comma_home(), "model_cache")
+    else:
+      return "/data/model_cache/"
+
   @staticmethod
   def persist_root() -> str:
     if PC:
@@ -0,0 +1,117 @@
+import os
+import tempfile
+import time
+from collections.abc import Callable
+from typing import Any
+
+READ_SIZE = 4096  # sysfs attributes are at most a page
+
+
+class SysfsSensor:
+  def __init__(self, path: str, parser: Callable[[bytes], Any], default: Any, interval: float | None):
+    self.path = path
+    self.parser = parser
+    self.default = default
+    self.interval = interval  # None for files that never change
+    self.fd: int | None = None
+    self.value = default
+    self.sampled: float | None = None
+
+  def due(self, now: float) -> bool:
+    if self.sampled is None:
+      return True
+    return self.interval is not None and now - self.sampled >= self.interval
+
+  def sample(self, now: float):
+    self.sampled = now
+    try:
+      if self.fd is None:
+        self.fd = os.open(self.path, os.O_RDONLY | os.O_CLOEXEC)
+      self.value = self.parser(os.pread(self.fd, READ_SIZE, 0))
+    except Exception:
+      # missing sensors are retried on the next sample, files that never change on the next read
+      self.close()
+      self.value = self.default
+      if self.interval is None:
+        self.sampled = None
+
+  def close(self):
+    if self.fd is not None:
+      os.close(self.fd)
+      self.fd = None
+
+
+class SysfsSampler:
+  """Samples sysfs files through descriptors that stay open, re-reading them with pread.
+
+  Sensors are added with an interval, 0 to sample them on every update and None for files that
+  never change. update() samples every added sensor that is due in one pass, get() returns what it
+  read. read() is for callers outside of that loop, sampling the file if its value is older than
+  interval.
+  """
+  def __init__(self, root: str = "/"):
+    self.root = root
+    self.sensors: dict[str, SysfsSensor] = {}
+    self.files: dict[str, SysfsSensor] = {}
+
+  def path(self, path: str) -> str:
+    return os.path.join(self.root, path.lstrip("/"))
+
+  def add(self, path: str, parser: Callable[[bytes], Any] = int, default: Any = 0, interval: float | None = 0.) -> SysfsSensor:
+    sensor = self.sensors.get(path)
+    if sensor is None:
+      sensor = self.sensors[path] = SysfsSensor(self.path(path), parser, default, interval)
+    return sensor
+
+  def update(self):
+    now = time.monotonic()
+    for sensor in self.sensors.values():
+      if sensor.due(now):
+        sensor.sample(now)
+
+  def get(self, path: str) -> Any:
+    sensor = self.sensors.get(path) or self.add(path)
+    if sensor.sampled is None:
+      sensor.sample(time.monotonic())
+    return sensor.value
+
+  def read(self, path: str, parser: Callable[[bytes], Any] = int, default: Any = 0, interval: float | None = 0.) -> Any:
+    sensor = self.files.get(path)
+    if sensor is None:
+      sensor = self.files[path] = SysfsSensor(self.path(path), parser, default, interval)
+    now = time.monotonic()
+    if sensor.due(now):
+      sensor.sample(now)
+    return sensor.value
+
+  def close(self):
+    for sensor in (*self.sensors.values(), *self.files.values()):
+      sensor.close()
+
+
+class FakeSysfs:
+  """A sysfs tree in a temporary directory, for running the samplers off device."""
+  def __init__(self, files: dict[str, Any] | None = None):
+    self.tmpdir = tempfile.TemporaryDirectory()
+    self.root = self.tmpdir.name
+    for path, value in (files or {}).items():
+      self.write(path, value)
+
+  def write(self, path: str, value: Any):
+    # in place like the kernel, so descriptors held by a sampler see the new value
+    full_path = os.path.join(self.root, path.lstrip("/"))
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, "w") as f:
+      f.write(f"{value}\n")
+
+  def remove(self, path: str):
+    os.unlink(os.path.join(self.root, path.lstrip("/")))
+
+  def sampler(self) -> SysfsSampler:
+    return SysfsSampler(self.root)
+
+  def cleanup(self):
+    self.tmpdir.cleanup()
+
+
+sysfs = SysfsSampler()
@@ -0,0 +1,98 @@
+import pytest
+
+from catpilot.system.hardware import sysfs
+from catpilot.system.hardware.sysfs import FakeSysfs
+
+TEMP_PATH = "/sys/devices/virtual/thermal/thermal_zone0/temp"
+POWER_PATH = "/sys/class/hwmon/hwmon1/power1_input"
+MODEL_PATH = "/sys/block/nvme0n1/device/model"
+
+
+class FakeClock:
+  def __init__(self):
+    self.t = 100.
+
+  def monotonic(self):
+    return self.t
+
+
+class TestSysfs:
+  @pytest.fixture(autouse=True)
+  def setup(self, monkeypatch):
+    self.clock = FakeClock()
+    monkeypatch.setattr(sysfs, "time", self.clock)
+    self.fake = FakeSysfs({TEMP_PATH: 40000, POWER_PATH: 3500000, MODEL_PATH: "Samsung SSD 980"})
+    self.sampler = self.fake.sampler()
+    yield
+    self.sampler.close()
+    self.fake.cleanup()
+
+  def test_intervals(self):
+    self.sampler.add(TEMP_PATH)
+    self.sampler.add(POWER_PATH, interval=1.)
+    self.sampler.update()
+    self.fake.write(TEMP_PATH, 41000)
+    self.fake.write(POWER_PATH, 4000000)
+
+    self.clock.t += 0.5
+    self.sampler.update()
+    assert self.sampler.get(TEMP_PATH) == 41000
+    assert self.sampler.get(POWER_PATH) == 3500000
+
+    self.clock.t += 0.5
+    self.sampler.update()
+    assert self.sampler.get(POWER_PATH) == 4000000
+
+  def test_read_interval(self):
+    assert self.sampler.read(POWER_PATH, interval=1.) == 3500000
+    self.fake.write(POWER_PATH, 4000000)
+    assert self.sampler.read(POWER_PATH, interval=1.) == 3500000
+    self.clock.t += 1.
+    assert self.sampler.read(POWER_PATH, interval=1.) == 4000000
+
+  def test_interval_none(self):
+    parse = lambda s: s.decode().strip()
+    assert self.sampler.read(MODEL_PATH, parse, default=None, interval=None) == "Samsung SSD 980"
+    self.sampler.add(TEMP_PATH, interval=None)
+    self.sampler.update()
+
+    # read once, no matter how long ago
+    self.fake.write(MODEL_PATH, "Other SSD")
+    self.fake.write(TEMP_PATH, 41000)
+    self.clock.t += 1e6
+    self.sampler.update()
+    assert self.sampler.read(MODEL_PATH, parse, default=None, interval=None) == "Samsung SSD 980"
+    assert self.sampler.get(TEMP_PATH) == 40000
+
+  def test_missing_file(self):
+    missing = "/sys/class/power_supply/bms/voltage_now"
+    self.sampler.add(missing, default=-1)
+    self.sampler.update()
+    assert self.sampler.get(missing) == -1
+    assert self.sampler.read(missing, default=-1, interval=None) == -1
+
+    # retried on the next update, also files that are otherwise read once
+    self.fake.write(missing, 4200000)
+    self.sampler.update()
+    assert self.sampler.get(missing) == 4200000
+    assert self.sampler.read(missing, default=-1, interval=None) == 4200000
+
+  def test_unparsable_file(self):
+    self.fake.write(TEMP_PATH, "garbage")
+    assert self.sampler.get(TEMP_PATH) == 0
+    self.fake.write(TEMP_PATH, 40000)
+    self.sampler.update()
+    assert self.sampler.get(TEMP_PATH) == 40000
+
+  def test_held_descriptor(self):
+    sensor = self.sampler.add(TEMP_PATH)
+    self.sampler.update()
+    fd = sensor.fd
+    assert fd is not None
+
+    # written in place, like the kernel updates an attribute, the open descriptor sees every value
+    for temp in (41000, 39000, 123456):
+      self.fake.write(TEMP_PATH, temp)
+      self.sampler.update()
+      assert self.sampler.get(TEMP_PATH) == temp
+      assert sensor.fd == fd
@@ -17,6 +17,10 @@ CAIBX_URL = "https://commadist.azureedge.net/agnosupdate/"
 
 AGNOS_MANIFEST_FILE = "system/hardware/tici/agnos.json"
 
+# verified chunks of an update in progress, kept across retries and reboots until it's flashed
+CHUNK_STORE_PATH = "/data/agnos_chunks"
+CHUNK_STORE_MAX_BYTES = 1024 * 1024 * 1024
+
 
 class StreamingDecompressor:
   def __init__(self, url: str) -> None:
@@ -180,7 +184,7 @@ def extract_compressed_image(target_slot_number: int, partition: dict, cloudlog)
     os.sync()
 
 
-def extract_casync_image(target_slot_number: int, partition: dict, cloudlog):
+def extract_casync_image(target_slot_number: int, partition: dict, cloudlog, store: casync.ChunkStore | None = None):
   path = get_partition_path(target_slot_number, partition)
   seed_path = path[:-1] + ('b' if path[-1] == 'a' else 'a')
 
@@ -195,13 +199,19 @@ def extract_casync_image(target_slot_number: int, partition: dict, cloudlog):
 
     try:
       cloudlog.info(f"casync fetching {caibx_url}")
-      sources += [('seed', casync.FileChunkReader(seed_path), casync.build_chunk_dict(casync.parse_caibx(caibx_url)))]
+      seed_chunks = casync.parse_caibx(caibx_url)
+      seed_reader = casync.FileChunkReader(seed_path)
+      sources += [('seed', seed_reader, casync.build_chunk_dict(seed_chunks))]
     except requests.RequestException:
       cloudlog.error(f"casync failed to load {caibx_url}")
   except Exception:
     cloudlog.exception("casync failed to hash seed partition")
 
-  # Second source is the target partition, this allows for resuming
+  # Then the chunk store, with what earlier attempts downloaded. Chunks shared with the seed slot stay there
+  if store is not None:
+    sources += [('store', store, store.chunk_dict(target))]
+
+  # Next source is the target partition, this allows for resuming
   sources += [('target', casync.FileChunkReader(path), casync.build_chunk_dict(target))]
 
   # Finally we add the remote source to download any missing chunks
@@ -216,7 +226,7 @@ def extract_casync_image(target_slot_number: int, partition: dict, cloudlog):
       last_p = p
       print(f"Installing {partition['name']}: {p}", flush=True)
 
-  stats = casync.extract(target, sources, path, progress)
+  stats = casync.extract(target, sources, path, progress, store=store)
   cloudlog.error(f'casync done {json.dumps(stats)}')
 
   os.sync()
@@ -224,7 +234,7 @@ def extract_casync_image(target_slot_number: int, partition: dict, cloudlog):
     raise Exception(f"Raw hash mismatch '{partition['hash_raw'].lower()}'")
 
 
-def flash_partition(target_slot_number: int, partition: dict, cloudlog, standalone=False):
+def flash_partition(target_slot_number: int, partition: dict, cloudlog, standalone=False, store: casync.ChunkStore | None = None):
   cloudlog.info(f"Downloading and writing {partition['name']}")
 
   if verify_partition(target_slot_number, partition):
@@ -239,7 +249,7 @@ def flash_partition(target_slot_number: int, partition: dict, cloudlog, standalo
   path = get_partition_path(target_slot_number, partition)
 
   if ('casync_caibx' in partition) and not standalone:
-    extract_casync_image(target_slot_number, partition, cloudlog)
+    extract_casync_image(target_slot_number, partition, cloudlog, store)
   else:
     extract_compressed_image(target_slot_number, partition, cloudlog)
 
@@ -265,9 +275,14 @@ def swap(manifest_path: str, target_slot_number: int, cloudlog) -> None:
       cloudlog.error(f"Swap failed {out}")
 
 
-def flash_agnos_update(manifest_path: str, target_slot_number: int, cloudlog, standalone=False) -> None:
+def flash_agnos_update(manifest_path: str, target_slot_number: int, cloudlog, standalone=False,
+                       chunk_store_path: str | None = None) -> None:
   update = json.load(open(manifest_path))
 
+  store = None
+  if chunk_store_path is not None and not standalone:
+    store = casync.ChunkStore(chunk_store_path, CHUNK_STORE_MAX_BYTES)
+
   cloudlog.info(f"Target slot {target_slot_number}")
 
   # set target slot as unbootable
@@ -278,7 +293,7 @@ def flash_agnos_update(manifest_path: str, target_slot_number: int, cloudlog, st
 
     for retries in range(10):
       try:
-        flash_partition(target_slot_number, partition, cloudlog, standalone)
+        flash_partition(target_slot_number, partition, cloudlog, standalone, store)
         success = True
         break
 
@@ -291,6 +306,11 @@ def flash_agnos_update(manifest_path: str, target_slot_number: int, cloudlog, st
       cloudlog.info(f"Failed to flash {partition['name']}, aborting")
       raise Exception("Maximum retries exceeded")
 
+  if store is not None:
+    # every partition is flashed and verified, nothing in the store is needed anymore
+    freed = store.collect_garbage(set())
+    cloudlog.info(f"casync removed {freed} bytes from chunk store")
+
   cloudlog.info(f"AGNOS ready on slot {target_slot_number}")
 
 
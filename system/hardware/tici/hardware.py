@@ -11,6 +11,7 @@ from pathlib import Path
 from cereal import log
 from catpilot.common.gpio import gpio_set, gpio_init, get_irqs_for_action
 from catpilot.system.hardware.base import HardwareBase, ThermalConfig
+from catpilot.system.hardware.sysfs import sysfs
 from catpilot.system.hardware.tici import iwlist
 from catpilot.system.hardware.tici.pins import GPIO
 from catpilot.system.hardware.tici.amplifier import Amplifier
@@ -333,10 +334,10 @@ class Tici(HardwareBase):
     return ret
 
   def get_current_power_draw(self):
-    return (self.read_param_file("/sys/class/hwmon/hwmon1/power1_input", int) / 1e6)
+    return (sysfs.read("/sys/class/hwmon/hwmon1/power1_input") / 1e6)
 
   def get_som_power_draw(self):
-    return (self.read_param_file("/sys/class/power_supply/bms/voltage_now", int) * self.read_param_file("/sys/class/power_supply/bms/current_now", int) / 1e12)
+    return (sysfs.read("/sys/class/power_supply/bms/voltage_now") * sysfs.read("/sys/class/power_supply/bms/current_now") / 1e12)
 
   def shutdown(self):
     os.system("sudo poweroff")
@@ -351,8 +352,7 @@ class Tici(HardwareBase):
 
   def set_screen_brightness(self, percentage):
     try:
-      with open("/sys/class/backlight/panel0-backlight/max_brightness") as f:
-        max_brightness = float(f.read().strip())
+      max_brightness = sysfs.read("/sys/class/backlight/panel0-backlight/max_brightness", float, default=None, interval=None)
 
       val = int(percentage * (max_brightness / 100.))
       with open("/sys/class/backlight/panel0-backlight/brightness", "w") as f:
@@ -362,11 +362,8 @@ class Tici(HardwareBase):
 
   def get_screen_brightness(self):
     try:
-      with open("/sys/class/backlight/panel0-backlight/max_brightness") as f:
-        max_brightness = float(f.read().strip())
-
-      with open("/sys/class/backlight/panel0-backlight/brightness") as f:
-        return int(float(f.read()) / (max_brightness / 100.))
+      max_brightness = sysfs.read("/sys/class/backlight/panel0-backlight/max_brightness", float, default=None, interval=None)
+      return int(sysfs.read("/sys/class/backlight/panel0-backlight/brightness", float, default=None) / (max_brightness / 100.))
     except Exception:
       return 0
 
@@ -402,8 +399,7 @@ class Tici(HardwareBase):
 
   def get_gpu_usage_percent(self):
     try:
-      with open('/sys/class/kgsl/kgsl-3d0/gpubusy') as f:
-        used, total = f.read().strip().split()
+      used, total = sysfs.read('/sys/class/kgsl/kgsl-3d0/gpubusy', bytes.split, default=None)
       return 100.0 * int(used) / int(total)
     except Exception:
       return 0
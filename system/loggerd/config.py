@@ -8,6 +8,8 @@ SEGMENT_LENGTH = 60
 STATS_DIR_FILE_LIMIT = 10000
 STATS_SOCKET = "ipc:///tmp/stats"
 STATS_FLUSH_TIME_S = 60
+STATS_BATCH_TIME_S = 1
+STATS_BATCH_SIZE = 1000
 
 def get_available_percent(default=None):
   try:
@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
+import heapq
 import os
 import shutil
 import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
 from catpilot.system.hardware.hw import Paths
 from catpilot.common.swaglog import cloudlog
 from catpilot.system.loggerd.config import get_available_bytes, get_available_percent
-from catpilot.system.loggerd.uploader import listdir_by_creation
-from catpilot.system.loggerd.xattr_cache import getxattr
+from catpilot.system.loggerd.uploader import RECONCILE_INTERVAL, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE, listdir_by_creation
+from catpilot.system.loggerd.xattr_cache import getxattr, read_xattr
 
 MIN_BYTES = 5 * 1024 * 1024 * 1024
 MIN_PERCENT = 10
@@ -22,9 +26,9 @@ def has_preserve_xattr(d: str) -> bool:
   return getxattr(os.path.join(Paths.log_root(), d), PRESERVE_ATTR_NAME) == PRESERVE_ATTR_VALUE
 
 
-def get_preserved_segments(dirs_by_creation: list[str]) -> list[str]:
+def get_preserved_segments(dirs_by_creation: list[str], is_preserved: Callable[[str], bool] = has_preserve_xattr) -> list[str]:
   preserved = []
-  for n, d in enumerate(filter(has_preserve_xattr, reversed(dirs_by_creation))):
+  for n, d in enumerate(filter(is_preserved, reversed(dirs_by_creation))):
     if n == PRESERVE_COUNT:
       break
     date_str, _, seg_str = d.rpartition("--")
@@ -44,35 +48,190 @@ def get_preserved_segments(dirs_by_creation: list[str]) -> list[str]:
   return preserved
 
 
+@dataclass
+class SegmentUsage:
+  ctime_ns: int
+  bytes: int = 0
+  uploaded_bytes: int = 0
+  locked: bool = False
+  preserved: bool = False
+
+
+class DiskUsageIndex:
+  """Size, lock, preserve and upload state of every log directory, and the order they get deleted in.
+
+  Every directory is stat'ed on each refresh and only rescanned when its ctime moved, which happens when
+  loggerd adds a file or drops the segment's lock and when the preserve xattr is set on it. The log root
+  is only listed again when its mtime changes. Upload xattrs are set on the files instead, so those are
+  picked up by the full rescan every RECONCILE_INTERVAL. Deletion candidates come off a heap
+  that's only rebuilt when the index changes, so picking one doesn't depend on how many segments there are.
+  """
+  def __init__(self, root: str):
+    self.root = root
+    self.segments: dict[str, SegmentUsage] = {}
+    self.order: list[str] = []
+    self.root_mtime_ns = -1
+    self.last_reconcile = 0.0
+
+    self.queue: list[tuple[bool, bool, int, str]] | None = None
+    self.priorities: dict[str, tuple[bool, bool, int, str]] = {}
+
+  def _scan_dir(self, logdir: str, ctime_ns: int) -> SegmentUsage | None:
+    path = os.path.join(self.root, logdir)
+    try:
+      usage = SegmentUsage(ctime_ns, preserved=read_xattr(path, PRESERVE_ATTR_NAME) == PRESERVE_ATTR_VALUE)
+      with os.scandir(path) as entries:
+        for entry in entries:
+          if entry.name.endswith(".lock"):
+            usage.locked = True
+          if entry.is_file(follow_symlinks=False):
+            size = entry.stat(follow_symlinks=False).st_size
+            usage.bytes += size
+            if read_xattr(entry.path, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE:
+              usage.uploaded_bytes += size
+    except OSError:
+      return None
+    return usage
+
+  def refresh(self) -> None:
+    force = time.monotonic() - self.last_reconcile > RECONCILE_INTERVAL
+    if force:
+      self.last_reconcile = time.monotonic()
+
+    try:
+      root_mtime_ns = os.stat(self.root).st_mtime_ns
+    except OSError:
+      self.segments, self.order, self.queue = {}, [], None
+      return
+
+    if force or root_mtime_ns != self.root_mtime_ns:
+      self.root_mtime_ns = root_mtime_ns
+      self.order = listdir_by_creation(self.root)
+      present = set(self.order)
+      self.segments = {logdir: usage for logdir, usage in self.segments.items() if logdir in present}
+      self.queue = None
+
+    # one stat per directory, a closed segment's ctime still moves when the_pond preserves it
+    for logdir in self.order:
+      try:
+        ctime_ns = os.stat(os.path.join(self.root, logdir)).st_ctime_ns
+      except OSError:
+        ctime_ns = None
+
+      usage = self.segments.get(logdir)
+      if not force and usage is not None and usage.ctime_ns == ctime_ns:
+        continue
+
+      usage = self._scan_dir(logdir, ctime_ns) if ctime_ns is not None else None
+      if usage is None:
+        self.segments.pop(logdir, None)
+      else:
+        self.segments[logdir] = usage
+      self.queue = None
+
+  def preserve_changed(self, logdir: str) -> bool:
+    """Re-reads the preserve xattr of a directory about to be deleted and of the segment after it, which
+    protects it as its prior. Returns True, and invalidates the queue, if either was set since the last refresh."""
+    date_str, _, seg_str = logdir.rpartition("--")
+    logdirs = [logdir]
+    if date_str and seg_str.isdigit():
+      logdirs.append(f"{date_str}--{int(seg_str) + 1}")
+
+    changed = False
+    for d in logdirs:
+      usage = self.segments.get(d)
+      if usage is None:
+        continue
+      try:
+        preserved = read_xattr(os.path.join(self.root, d), PRESERVE_ATTR_NAME) == PRESERVE_ATTR_VALUE
+      except OSError:
+        continue
+      if preserved != usage.preserved:
+        usage.preserved = preserved
+        changed = True
+    if changed:
+      self.queue = None
+    return changed
+
+  def _build_queue(self) -> None:
+    # same order as a stable sort of the directories by (delete last, preserved), oldest first within each
+    preserved = set(get_preserved_segments(self.order, lambda d: d in self.segments and self.segments[d].preserved))
+    self.priorities = {d: (d in DELETE_LAST, d in preserved, i, d) for i, d in enumerate(self.order) if d in self.segments}
+    self.queue = list(self.priorities.values())
+    heapq.heapify(self.queue)
+
+  def pop(self) -> str | None:
+    """Takes the next directory to delete off the queue, hand it back with requeue() if it couldn't be deleted."""
+    if self.queue is None:
+      self._build_queue()
+    while self.queue:
+      logdir = heapq.heappop(self.queue)[-1]
+      if logdir in self.segments:
+        return logdir
+    return None
+
+  def requeue(self, logdirs: list[str]) -> None:
+    for logdir in logdirs:
+      if self.queue is not None and logdir in self.priorities:
+        heapq.heappush(self.queue, self.priorities[logdir])
+
+  def remove(self, logdir: str) -> None:
+    self.segments.pop(logdir, None)
+    if logdir in self.order:
+      self.order.remove(logdir)
+    # our own deletion moved the root's mtime, don't take that as a reason to list it again
+    try:
+      self.root_mtime_ns = os.stat(self.root).st_mtime_ns
+    except OSError:
+      pass
+
+
 def deleter_thread(exit_event):
+  index = DiskUsageIndex(Paths.log_root())
+
   while not exit_event.is_set():
     out_of_bytes = get_available_bytes(default=MIN_BYTES + 1) < MIN_BYTES
     out_of_percent = get_available_percent(default=MIN_PERCENT + 1) < MIN_PERCENT
 
     if out_of_percent or out_of_bytes:
-      dirs = listdir_by_creation(Paths.log_root())
+      index.refresh()
 
-      # skip deleting most recent N preserved segments (and their prior segment)
-      preserved_dirs = get_preserved_segments(dirs)
-
-      # remove the earliest directory we can
-      for delete_dir in sorted(dirs, key=lambda d: (d in DELETE_LAST, d in preserved_dirs)):
+      # remove the earliest directory we can, skipping the most recent N preserved segments (and their prior segment)
+      skipped = []
+      while (delete_dir := index.pop()) is not None:
         delete_path = os.path.join(Paths.log_root(), delete_dir)
+        usage = index.segments[delete_dir]
 
-        if any(name.endswith(".lock") for name in os.listdir(delete_path)):
+        # the index can be a refresh behind loggerd, so check the lock of the one being deleted
+        try:
+          locked = usage.locked or any(name.endswith(".lock") for name in os.listdir(delete_path))
+        except OSError:
+          index.remove(delete_dir)
           continue
+        if locked:
+          skipped.append(delete_dir)
+          continue
+
+        # a preserve set since the last refresh reorders the queue, pick again on the next pass
+        if index.preserve_changed(delete_dir):
+          break
 
         try:
-          cloudlog.info(f"deleting {delete_path}")
+          cloudlog.info(f"deleting {delete_path} ({usage.bytes} bytes, {usage.uploaded_bytes} uploaded)")
           if os.path.isfile(delete_path):
             os.remove(delete_path)
           else:
             shutil.rmtree(delete_path)
+          index.remove(delete_dir)
           break
         except OSError:
           cloudlog.exception(f"issue deleting {delete_path}")
+          skipped.append(delete_dir)
+      index.requeue(skipped)
       exit_event.wait(.1)
     else:
+      # keep the index warm, so the first deletion once the disk fills doesn't have to scan every segment
+      index.refresh()
       exit_event.wait(30)
 
 
@@ -0,0 +1,128 @@
+import bz2
+import http.server
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from catpilot.common import api
+from catpilot.system.loggerd import uploader
+from catpilot.system.loggerd.xattr_cache import setxattr
+
+SEGMENT = "0000001a--0123456789--0"
+
+
+class UploadHandler(http.server.BaseHTTPRequestHandler):
+  # hands out upload urls pointing back at itself and keeps what gets PUT there
+  def do_GET(self):
+    key = self.path.split("path=", 1)[1].split("&", 1)[0].replace("%2F", "/")
+    body = json.dumps({"url": f"http://127.0.0.1:{self.server.server_address[1]}/upload/{key}", "headers": {}}).encode()
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_PUT(self):
+    data = self.rfile.read(int(self.headers["Content-Length"]))
+    if self.server.failures > 0:
+      self.server.failures -= 1
+      self.send_response(500)
+    else:
+      self.server.uploads[self.path.removeprefix("/upload/")] = data
+      self.send_response(200)
+    self.send_header("Content-Length", "0")
+    self.end_headers()
+
+  def log_message(self, *args):
+    pass
+
+
+class FakeApi(api.Api):
+  def __init__(self, dongle_id):
+    self.dongle_id = dongle_id
+
+  def get_token(self, expiry_hours=1):
+    return "token"
+
+
+class TestUploader:
+  @pytest.fixture(autouse=True)
+  def setup(self, tmp_path, monkeypatch):
+    self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), UploadHandler)
+    self.server.uploads, self.server.failures = {}, 0
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    host = f"http://127.0.0.1:{self.server.server_address[1]}"
+    monkeypatch.setattr(api, "API_HOST", host)
+    monkeypatch.setattr(api, "KONIK_API_HOST", host)
+    monkeypatch.setattr(api, "use_konik_server", lambda: False)
+    monkeypatch.setattr(uploader, "Api", FakeApi)
+
+    self.compressions = 0
+    compress_to_file = uploader.compress_to_file
+    def count_compressions(fn, temp_dir):
+      self.compressions += 1
+      assert temp_dir == str(self.root)
+      return compress_to_file(fn, temp_dir)
+    monkeypatch.setattr(uploader, "compress_to_file", count_compressions)
+
+    self.root = tmp_path / "log"
+    self.segment = self.root / SEGMENT
+    self.segment.mkdir(parents=True)
+    self.uploader = uploader.Uploader("0123456789abcdef", str(self.root))
+    yield
+    self.uploader.clear_compressed()
+    self.server.shutdown()
+    self.server.server_close()
+
+  def write(self, name, data):
+    (self.segment / name).write_bytes(data)
+
+  def step(self):
+    return self.uploader.step(0, False)
+
+  def reconcile(self):
+    self.uploader.index.last_reconcile = time.monotonic() - uploader.RECONCILE_INTERVAL - 1
+
+  def test_index_refresh_on_segment_close(self):
+    self.write("qlog", os.urandom(1000))
+    self.write("rlog.lock", b"")
+    assert self.step() is None
+
+    # loggerd dropping the lock moves the segment's mtime, that alone makes the index list it again
+    os.unlink(self.segment / "rlog.lock")
+    assert self.step()
+    assert bz2.decompress(self.server.uploads[f"{SEGMENT}/qlog.bz2"]) == (self.segment / "qlog").read_bytes()
+    assert self.step() is None
+
+  def test_reconcile(self):
+    self.write("qlog", b"qlog")
+    self.write("qcamera.ts", b"qcamera")
+    assert self.uploader.next_file_to_upload(False)[0] == "qlog"
+
+    # changes that leave the directory mtime alone only show up on the next reconcile
+    st = os.stat(self.segment)
+    self.write("rlog", b"rlog")
+    setxattr(str(self.segment / "qlog"), uploader.UPLOAD_ATTR_NAME, uploader.UPLOAD_ATTR_VALUE)
+    os.utime(self.segment, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert self.uploader.next_file_to_upload(False)[0] == "qlog"
+
+    self.reconcile()
+    assert [name for name, _, _ in self.uploader.list_upload_files(False)] == ["qcamera.ts", "rlog"]
+
+  def test_compressed_retry(self):
+    data = os.urandom(3 * uploader.COMPRESS_CHUNK_SIZE)
+    self.write("qlog", data)
+
+    self.server.failures = 2
+    assert not self.step()
+    assert not self.step()
+    assert self.step()
+
+    # compressed once for all three attempts, and dropped once it's uploaded
+    assert self.compressions == 1
+    assert self.uploader.compressed is None
+    assert bz2.decompress(self.server.uploads[f"{SEGMENT}/qlog.bz2"]) == data
+    assert os.getxattr(self.segment / "qlog", uploader.UPLOAD_ATTR_NAME) == uploader.UPLOAD_ATTR_VALUE
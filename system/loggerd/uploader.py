@@ -1,14 +1,15 @@
 #!/usr/bin/env python3
 import bz2
-import io
 import json
 import os
 import random
 import requests
+import tempfile
 import threading
 import time
 import traceback
 import datetime
+from dataclasses import dataclass, field
 from typing import BinaryIO
 from collections.abc import Iterator
 
@@ -33,6 +34,10 @@ MAX_UPLOAD_SIZES = {
   "qcam": 5*1e6,
 }
 
+# full rescan of the log root to pick up changes the directory mtimes can't show
+RECONCILE_INTERVAL = 10 * 60
+COMPRESS_CHUNK_SIZE = 1024 * 1024
+
 allow_sleep = bool(os.getenv("UPLOADER_SLEEP", "1"))
 force_wifi = os.getenv("FORCEWIFI") is not None
 fake_upload = os.getenv("FAKEUPLOAD") is not None
@@ -77,6 +82,118 @@ def clear_locks(root: str) -> None:
       cloudlog.exception("clear_locks failed")
 
 
+def compress_to_file(fn: str, temp_dir: str) -> BinaryIO:
+  """bz2 compress fn into an anonymous temporary file in temp_dir, a chunk at a time so memory use stays flat.
+  temp_dir should be on the log partition, /tmp is a small tmpfs on device."""
+  out = tempfile.TemporaryFile(dir=temp_dir)
+  try:
+    compressor = bz2.BZ2Compressor()
+    with open(fn, "rb") as f:
+      while dat := f.read(COMPRESS_CHUNK_SIZE):
+        out.write(compressor.compress(dat))
+    out.write(compressor.flush())
+    out.seek(0)
+  except Exception:
+    out.close()
+    raise
+  return out
+
+
+@dataclass
+class LogDirEntry:
+  mtime_ns: int
+  locked: bool = False
+  # (name, ctime) of every file not uploaded yet, in upload priority order
+  pending: list[tuple[str, float]] = field(default_factory=list)
+
+
+class UploadIndex:
+  """Files waiting for upload, kept per log directory.
+
+  A directory is only listed again when its mtime moves, which happens whenever loggerd adds a file or
+  drops the segment's lock, so a step normally costs one stat per directory instead of a stat and
+  xattr read per file. A full rescan runs every RECONCILE_INTERVAL to catch anything else.
+  """
+  def __init__(self, root: str, priority: dict[str, int]):
+    self.root = root
+    self.priority = priority
+    self.dirs: dict[str, LogDirEntry] = {}
+    self.order: list[str] = []
+    self.root_mtime_ns = -1
+    self.last_reconcile = 0.0
+
+  def _scan_dir(self, logdir: str, mtime_ns: int) -> LogDirEntry | None:
+    path = os.path.join(self.root, logdir)
+    try:
+      names = os.listdir(path)
+    except OSError:
+      return None
+
+    entry = LogDirEntry(mtime_ns)
+    if any(name.endswith(".lock") for name in names):
+      entry.locked = True
+      return entry
+
+    for name in sorted(names, key=lambda n: self.priority.get(n, 1000)):
+      fn = os.path.join(path, name)
+      # skip files already uploaded
+      try:
+        ctime = os.path.getctime(fn)
+        is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
+      except OSError:
+        cloudlog.event("uploader_getxattr_failed", key=os.path.join(logdir, name), fn=fn)
+        # deleter could have deleted, so skip
+        continue
+      if not is_uploaded:
+        entry.pending.append((name, ctime))
+    return entry
+
+  def refresh(self) -> None:
+    force = time.monotonic() - self.last_reconcile > RECONCILE_INTERVAL
+    if force:
+      self.last_reconcile = time.monotonic()
+
+    try:
+      root_mtime_ns = os.stat(self.root).st_mtime_ns
+    except OSError:
+      self.dirs, self.order = {}, []
+      return
+
+    if force or root_mtime_ns != self.root_mtime_ns:
+      self.root_mtime_ns = root_mtime_ns
+      self.order = listdir_by_creation(self.root)
+      present = set(self.order)
+      self.dirs = {logdir: entry for logdir, entry in self.dirs.items() if logdir in present}
+
+    for logdir in self.order:
+      try:
+        mtime_ns = os.stat(os.path.join(self.root, logdir)).st_mtime_ns
+      except OSError:
+        self.dirs.pop(logdir, None)
+        continue
+
+      entry = self.dirs.get(logdir)
+      if force or entry is None or entry.mtime_ns != mtime_ns:
+        entry = self._scan_dir(logdir, mtime_ns)
+        if entry is None:
+          self.dirs.pop(logdir, None)
+        else:
+          self.dirs[logdir] = entry
+
+  def pending(self) -> Iterator[tuple[str, str, float]]:
+    for logdir in self.order:
+      entry = self.dirs.get(logdir)
+      if entry is None or entry.locked:
+        continue
+      for name, ctime in entry.pending:
+        yield logdir, name, ctime
+
+  def mark_uploaded(self, logdir: str, name: str) -> None:
+    entry = self.dirs.get(logdir)
+    if entry is not None:
+      entry.pending = [(n, ctime) for n, ctime in entry.pending if n != name]
+
+
 class Uploader:
   def __init__(self, dongle_id: str, root: str):
     self.dongle_id = dongle_id
@@ -91,57 +208,56 @@ class Uploader:
     self.immediate_folders = ["crash/", "boot/"]
     self.immediate_priority = {"qlog": 0, "qlog.bz2": 0, "qcamera.ts": 1}
 
+    self.index = UploadIndex(root, self.immediate_priority)
+
+    # compressed copy of the last file that failed to upload, so retries don't compress it again
+    self.compressed: tuple[tuple[str, int, int], BinaryIO] | None = None
+
   def list_upload_files(self, metered: bool) -> Iterator[tuple[str, str, str]]:
     r = self.params.get("AthenadRecentlyViewedRoutes", encoding="utf8")
     requested_routes = [] if r is None else r.split(",")
 
-    for logdir in listdir_by_creation(self.root):
-      path = os.path.join(self.root, logdir)
-      try:
-        names = os.listdir(path)
-      except OSError:
-        continue
-
-      if any(name.endswith(".lock") for name in names):
-        continue
+    self.index.refresh()
+    for logdir, name, ctime in self.index.pending():
+      key = os.path.join(logdir, name)
+      fn = os.path.join(self.root, logdir, name)
 
-      for name in sorted(names, key=lambda n: self.immediate_priority.get(n, 1000)):
-        key = os.path.join(logdir, name)
-        fn = os.path.join(path, name)
-        # skip files already uploaded
-        try:
-          ctime = os.path.getctime(fn)
-          is_uploaded = getxattr(fn, UPLOAD_ATTR_NAME) == UPLOAD_ATTR_VALUE
-        except OSError:
-          cloudlog.event("uploader_getxattr_failed", key=key, fn=fn)
-          # deleter could have deleted, so skip
+      # limit uploading on metered connections
+      if metered:
+        dt = datetime.timedelta(hours=12)
+        if logdir in self.immediate_folders and (datetime.datetime.now() - datetime.datetime.fromtimestamp(ctime)) < dt:
           continue
-        if is_uploaded:
-          continue
-
-        # limit uploading on metered connections
-        if metered:
-          dt = datetime.timedelta(hours=12)
-          if logdir in self.immediate_folders and (datetime.datetime.now() - datetime.datetime.fromtimestamp(ctime)) < dt:
-            continue
 
-          if name == "qcamera.ts" and not any(logdir.startswith(r.split('|')[-1]) for r in requested_routes):
-            continue
+        if name == "qcamera.ts" and not any(logdir.startswith(r.split('|')[-1]) for r in requested_routes):
+          continue
 
-        yield name, key, fn
+      yield name, key, fn
 
   def next_file_to_upload(self, metered: bool) -> tuple[str, str, str] | None:
-    upload_files = list(self.list_upload_files(metered))
-
-    for name, key, fn in upload_files:
+    # files in the immediate folders go first, then the first file with an upload priority
+    candidate = None
+    for name, key, fn in self.list_upload_files(metered):
       if any(f in fn for f in self.immediate_folders):
         return name, key, fn
-
-    for name, key, fn in upload_files:
-      if name in self.immediate_priority:
-        return name, key, fn
-
-    return None
+      if candidate is None and name in self.immediate_priority:
+        candidate = name, key, fn
+
+    return candidate
+
+  def compressed_file(self, fn: str) -> BinaryIO:
+    st = os.stat(fn)
+    ident = (fn, st.st_size, st.st_mtime_ns)
+    if self.compressed is None or self.compressed[0] != ident:
+      self.clear_compressed()
+      self.compressed = ident, compress_to_file(fn, self.root)
+    data = self.compressed[1]
+    data.seek(0)
+    return data
+
+  def clear_compressed(self) -> None:
+    if self.compressed is not None:
+      self.compressed[1].close()
+      self.compressed = None
 
   def do_upload(self, key: str, fn: str):
     url_resp = self.api.get("v1.4/" + self.dongle_id + "/upload_url/", timeout=10, path=key, access_token=self.api.get_token())
@@ -156,15 +272,11 @@ class Uploader:
     if fake_upload:
       return FakeResponse()
 
-    with open(fn, "rb") as f:
-      data: BinaryIO
-      if key.endswith('.bz2') and not fn.endswith('.bz2'):
-        compressed = bz2.compress(f.read())
-        data = io.BytesIO(compressed)
-      else:
-        data = f
+    if key.endswith('.bz2') and not fn.endswith('.bz2'):
+      return requests.put(url, data=self.compressed_file(fn), headers=headers, timeout=10)
 
-      return requests.put(url, data=data, headers=headers, timeout=10)
+    with open(fn, "rb") as f:
+      return requests.put(url, data=f, headers=headers, timeout=10)
 
   def upload(self, name: str, key: str, fn: str, network_type: int, metered: bool) -> bool:
     try:
@@ -207,6 +319,10 @@ class Uploader:
         cloudlog.event("upload_failed", stat=stat, exc=last_exc, key=key, fn=fn, sz=sz, network_type=network_type, metered=metered)
 
     if success:
+      self.clear_compressed()
+      logdir, _, fname = os.path.relpath(fn, self.root).rpartition(os.sep)
+      self.index.mark_uploaded(logdir, fname)
+
       # tag file as uploaded
       try:
         setxattr(fn, UPLOAD_ATTR_NAME, UPLOAD_ATTR_VALUE)
@@ -279,7 +395,7 @@ def main(exit_event: threading.Event = None) -> None:
 
     # Update CatPilot variables
     if sm['catpilotPlan'].togglesUpdated:
-      catpilot_toggles = get_catpilot_toggles()
+      catpilot_toggles.refresh()
 
 if __name__ == "__main__":
   main()
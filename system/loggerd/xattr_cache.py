@@ -1,21 +1,32 @@
 import os
 import errno
+from collections import OrderedDict
 
-_cached_attributes: dict[tuple, bytes | None] = {}
+# least recently used attributes are dropped past this, daemons read the xattrs of every file they ever see
+MAX_CACHED_ATTRIBUTES = 4096
+
+_cached_attributes: OrderedDict[tuple, bytes | None] = OrderedDict()
+
+def read_xattr(path: str, attr_name: str) -> bytes | None:
+  try:
+    return os.getxattr(path, attr_name)
+  except OSError as e:
+    # ENODATA means attribute hasn't been set
+    if e.errno == errno.ENODATA:
+      return None
+    raise
 
 def getxattr(path: str, attr_name: str) -> bytes | None:
   key = (path, attr_name)
-  if key not in _cached_attributes:
-    try:
-      response = os.getxattr(path, attr_name)
-    except OSError as e:
-      # ENODATA means attribute hasn't been set
-      if e.errno == errno.ENODATA:
-        response = None
-      else:
-        raise
-    _cached_attributes[key] = response
-  return _cached_attributes[key]
+  if key in _cached_attributes:
+    _cached_attributes.move_to_end(key)
+    return _cached_attributes[key]
+
+  response = read_xattr(path, attr_name)
+  _cached_attributes[key] = response
+  if len(_cached_attributes) > MAX_CACHED_ATTRIBUTES:
+    _cached_attributes.popitem(last=False)
+  return response
 
 def setxattr(path: str, attr_name: str, attr_value: bytes) -> None:
   _cached_attributes.pop((path, attr_name), None)
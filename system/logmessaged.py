@@ -23,24 +23,25 @@ def main() -> NoReturn:
 
   try:
     while True:
-      dat = b''.join(sock.recv_multipart())
-      level = dat[0]
-      record = dat[1:].decode("utf-8")
-      if level >= log_level:
-        log_handler.emit(record)
-
-      if len(record) > 2*1024*1024:
-        print("WARNING: log too big to publish", len(record))
-        print(print(record[:100]))
-        continue
-
-      # then we publish them
-      msg = messaging.new_message(None, valid=True, logMessage=record)
-      log_message_sock.send(msg.to_bytes())
-
-      if level >= 40:  # logging.ERROR
-        msg = messaging.new_message(None, valid=True, errorLogMessage=record)
-        error_log_message_sock.send(msg.to_bytes())
+      # records come in batches, one per part
+      for dat in sock.recv_multipart():
+        level = dat[0]
+        record = dat[1:].decode("utf-8")
+        if level >= log_level:
+          log_handler.emit(record)
+
+        if len(record) > 2*1024*1024:
+          print("WARNING: log too big to publish", len(record))
+          print(print(record[:100]))
+          continue
+
+        # then we publish them
+        msg = messaging.new_message(None, valid=True, logMessage=record)
+        log_message_sock.send(msg.to_bytes())
+
+        if level >= 40:  # logging.ERROR
+          msg = messaging.new_message(None, valid=True, errorLogMessage=record)
+          error_log_message_sock.send(msg.to_bytes())
   finally:
     sock.close()
     ctx.term()
@@ -168,7 +168,7 @@ def manager_thread() -> None:
       params.clear_all(ParamKeyType.CLEAR_ON_ONROAD_TRANSITION)
 
       # CatPilot variables
-      catpilot_toggles = get_catpilot_toggles()
+      catpilot_toggles.refresh()
 
       classic_model = catpilot_toggles.classic_model
       tinygrad_model = catpilot_toggles.tinygrad_model
@@ -208,7 +208,7 @@ def manager_thread() -> None:
 
     # Update CatPilot variables
     if sm['catpilotPlan'].togglesUpdated:
-      catpilot_toggles = get_catpilot_toggles()
+      catpilot_toggles.refresh()
 
 def main() -> None:
   manager_init()
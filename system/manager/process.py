@@ -1,4 +1,6 @@
+import gc
 import importlib
+import multiprocessing
 import os
 import signal
 import struct
@@ -19,9 +21,49 @@ from catpilot.common.swaglog import cloudlog
 
 WATCHDOG_FN = "/dev/shm/wd_"
 ENABLE_WATCHDOG = os.getenv("NO_WATCHDOG") is None
-
-
-def launcher(proc: str, name: str) -> None:
+ENABLE_ZYGOTE = os.getenv("NO_ZYGOTE") is None
+
+# heavy modules most python daemons import, loaded once in the zygote
+ZYGOTE_PRELOAD = [
+  "numpy",
+  "capnp",
+  "cereal.messaging",
+  "catpilot.common.params",
+  "catpilot.common.realtime",
+  "catpilot.selfdrive.car.interfaces",
+  # every child re-runs the manager's main script like any non-fork start method, this makes that only a few cached imports
+  "catpilot.system.manager.manager",
+]
+
+
+class Zygote:
+  """Warm process the python daemons are forked from instead of the manager.
+
+  A multiprocessing forkserver started on the first PythonProcess start, with ZYGOTE_PRELOAD and
+  every prepared daemon module already imported. Unlike the manager it runs no threads, so forking
+  it is safe, and daemons don't inherit the manager's sockets and state. Daemons set their realtime
+  priority and core affinity in their own main(), after the fork, so the zygote stays unconfigured.
+  """
+  def __init__(self, preload: list[str]):
+    self.preload = list(preload)
+    self.context: multiprocessing.context.ForkServerContext | None = None
+
+  def add_preload(self, module: str) -> None:
+    if self.context is not None:
+      cloudlog.warning(f"zygote already started, {module} isn't preloaded")
+    elif module not in self.preload:
+      self.preload.append(module)
+
+  def get_context(self) -> multiprocessing.context.ForkServerContext:
+    if self.context is None:
+      self.context = multiprocessing.get_context("forkserver")
+      self.context.set_forkserver_preload(self.preload)
+    return self.context
+
+zygote = Zygote(ZYGOTE_PRELOAD)
+
+
+def launcher(proc: str, name: str, log_ctx: dict | None = None, init_sentry: bool = False) -> None:
   try:
     # import the process
     mod = importlib.import_module(proc)
@@ -32,6 +74,15 @@ def launcher(proc: str, name: str) -> None:
     # create new context since we forked
     messaging.context = messaging.Context()
 
+    if log_ctx is not None:
+      # forked from the zygote, which has neither the manager's logging context nor its sentry client
+      cloudlog.bind_global(**log_ctx)
+      if init_sentry:
+        sentry.init(sentry.SentryProject.SELFDRIVE, start_session=False)
+
+      # keep the preloaded objects out of collections so their pages stay shared with the zygote
+      gc.freeze()
+
     # add daemon name tag to logs
     cloudlog.bind(daemon=name)
     sentry.set_tag("daemon", name)
@@ -210,7 +261,10 @@ class PythonProcess(ManagerProcess):
   def prepare(self) -> None:
     if self.enabled:
       cloudlog.info(f"preimporting {self.module}")
-      importlib.import_module(self.module)
+      if ENABLE_ZYGOTE:
+        zygote.add_preload(self.module)
+      else:
+        importlib.import_module(self.module)
 
   def start(self) -> None:
     # In case we only tried a non blocking stop we need to stop it before restarting
@@ -221,7 +275,11 @@ class PythonProcess(ManagerProcess):
       return
 
     cloudlog.info(f"starting python {self.module}")
-    self.proc = Process(name=self.name, target=self.launcher, args=(self.module, self.name))
+    if ENABLE_ZYGOTE:
+      args = (self.module, self.name, cloudlog.global_ctx, sentry.is_initialized())
+      self.proc = zygote.get_context().Process(name=self.name, target=self.launcher, args=args)
+    else:
+      self.proc = Process(name=self.name, target=self.launcher, args=(self.module, self.name))
     self.proc.start()
     self.watchdog_seen = False
     self.shutting_down = False
@@ -66,6 +66,10 @@ def capture_report(discord_user, report, catpilot_toggles):
     sentry_sdk.flush()
 
 
+def is_initialized() -> bool:
+  return sentry_sdk.Hub.current.client is not None
+
+
 def set_tag(key: str, value: str) -> None:
   sentry_sdk.set_tag(key, value)
 
@@ -84,7 +88,7 @@ def save_exception(exc_text: str, crash_log) -> None:
       file_path.write_text(exc_text)
 
 
-def init(project: SentryProject) -> bool:
+def init(project: SentryProject, start_session: bool = True) -> bool:
   build_metadata = get_build_metadata()
   CatPilot = "catai" in build_metadata.catpilot.git_origin.lower()
   if not CatPilot or PC:
@@ -128,7 +132,8 @@ def init(project: SentryProject) -> bool:
   sentry_sdk.set_tag("updated", updated)
   sentry_sdk.set_tag("installed", installed)
 
-  if project == SentryProject.SELFDRIVE:
+  # one release health session for the manager, daemons forked from the zygote only report their crashes
+  if project == SentryProject.SELFDRIVE and start_session:
     sentry_sdk.Hub.current.start_session()
 
   return True
@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 import os
 import zmq
+import math
 import time
+import struct
+import threading
+import multiprocessing.util
 from pathlib import Path
 from collections import defaultdict
 from datetime import datetime, UTC
@@ -14,19 +18,153 @@ from catpilot.common.swaglog import cloudlog
 from catpilot.system.hardware import HARDWARE
 from catpilot.common.file_helpers import atomic_write_in_dir
 from catpilot.system.version import get_build_metadata
-from catpilot.system.loggerd.config import STATS_DIR_FILE_LIMIT, STATS_SOCKET, STATS_FLUSH_TIME_S
+from catpilot.system.loggerd.config import STATS_DIR_FILE_LIMIT, STATS_SOCKET, STATS_FLUSH_TIME_S, \
+                                         STATS_BATCH_TIME_S, STATS_BATCH_SIZE
 
 
 class METRIC_TYPE:
   GAUGE = 'g'
   SAMPLE = 'sa'
 
+class QuantileSketch:
+  """Mergeable streaming histogram of samples with a bounded relative error (DDSketch).
+
+  Samples are counted in logarithmically sized buckets, so any quantile is within RELATIVE_ACCURACY
+  of the true value no matter how many samples were added, and two sketches merge by adding counts.
+  """
+  RELATIVE_ACCURACY = 0.01
+  GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+  LOG_GAMMA = math.log(GAMMA)
+  MIN_INDEXABLE = 1e-9
+
+  def __init__(self):
+    self.count = 0
+    self.sum = 0.
+    self.min = math.inf
+    self.max = -math.inf
+    self.zero_count = 0
+    self.positive: dict[int, int] = defaultdict(int)
+    self.negative: dict[int, int] = defaultdict(int)
+
+  def bucket_value(self, key: int) -> float:
+    return 2 * self.GAMMA ** key / (self.GAMMA + 1)
+
+  def add(self, value: float) -> None:
+    self.count += 1
+    self.sum += value
+    if value < self.min:
+      self.min = value
+    if value > self.max:
+      self.max = value
+    if value > self.MIN_INDEXABLE:
+      self.positive[math.ceil(math.log(value) / self.LOG_GAMMA)] += 1
+    elif value < -self.MIN_INDEXABLE:
+      self.negative[math.ceil(math.log(-value) / self.LOG_GAMMA)] += 1
+    else:
+      self.zero_count += 1
+
+  def merge(self, other: 'QuantileSketch') -> None:
+    self.count += other.count
+    self.sum += other.sum
+    self.min = min(self.min, other.min)
+    self.max = max(self.max, other.max)
+    self.zero_count += other.zero_count
+    for key, count in other.positive.items():
+      self.positive[key] += count
+    for key, count in other.negative.items():
+      self.negative[key] += count
+
+  def quantile(self, q: float) -> float:
+    # same nearest rank the sorted sample list was indexed with
+    rank = round(q * (self.count - 1))
+    seen = 0
+    for key in sorted(self.negative, reverse=True):
+      seen += self.negative[key]
+      if seen > rank:
+        return max(-self.bucket_value(key), self.min)
+    seen += self.zero_count
+    if seen > rank:
+      return 0.
+    for key in sorted(self.positive):
+      seen += self.positive[key]
+      if seen > rank:
+        return min(self.bucket_value(key), self.max)
+    return self.max
+
+# Batches are a header followed by the gauges and then the sketches, names are length prefixed utf-8
+BATCH_VERSION = 1
+BATCH_HEADER = struct.Struct("<BHH")
+NAME_LENGTH = struct.Struct("<H")
+GAUGE = struct.Struct("<d")
+SKETCH = struct.Struct("<QdddQHH")
+
+def _pack_name(name: str) -> bytes:
+  name = name.encode()
+  return NAME_LENGTH.pack(len(name)) + name
+
+def _unpack_name(dat: bytes, offset: int) -> tuple[str, int]:
+  length, = NAME_LENGTH.unpack_from(dat, offset)
+  offset += NAME_LENGTH.size
+  return dat[offset:offset+length].decode(), offset + length
+
+def encode_batch(gauges: dict[str, float], sketches: dict[str, QuantileSketch]) -> bytes:
+  parts = [BATCH_HEADER.pack(BATCH_VERSION, len(gauges), len(sketches))]
+  for name, value in gauges.items():
+    parts += [_pack_name(name), GAUGE.pack(value)]
+  for name, sketch in sketches.items():
+    parts += [_pack_name(name), SKETCH.pack(sketch.count, sketch.sum, sketch.min, sketch.max, sketch.zero_count, len(sketch.positive), len(sketch.negative))]
+    for buckets in (sketch.positive, sketch.negative):
+      parts.append(struct.pack(f"<{len(buckets)}i{len(buckets)}Q", *buckets.keys(), *buckets.values()))
+  return b"".join(parts)
+
+def decode_batch(dat: bytes) -> tuple[dict[str, float], dict[str, QuantileSketch]]:
+  version, gauge_count, sketch_count = BATCH_HEADER.unpack_from(dat)
+  if version != BATCH_VERSION:
+    raise ValueError(f"unknown batch version {version}")
+  offset = BATCH_HEADER.size
+
+  gauges = {}
+  for _ in range(gauge_count):
+    name, offset = _unpack_name(dat, offset)
+    gauges[name], = GAUGE.unpack_from(dat, offset)
+    offset += GAUGE.size
+
+  sketches = {}
+  for _ in range(sketch_count):
+    name, offset = _unpack_name(dat, offset)
+    sketch = sketches[name] = QuantileSketch()
+    sketch.count, sketch.sum, sketch.min, sketch.max, sketch.zero_count, positive_count, negative_count = SKETCH.unpack_from(dat, offset)
+    offset += SKETCH.size
+    for buckets, n in ((sketch.positive, positive_count), (sketch.negative, negative_count)):
+      fmt = f"<{n}i{n}Q"
+      values = struct.unpack_from(fmt, dat, offset)
+      buckets.update(zip(values[:n], values[n:], strict=True))
+      offset += struct.calcsize(fmt)
+
+  if offset != len(dat):
+    raise ValueError("trailing bytes in batch")
+  return gauges, sketches
+
 class StatLog:
+  """Client side of statsd.
+
+  Metrics are pre-aggregated in process, the last value of each gauge and a QuantileSketch of each
+  sample, and pushed as one binary batch every STATS_BATCH_TIME_S or STATS_BATCH_SIZE metrics. A
+  batch is only sent from a gauge or sample call, or at exit, so a process that stops reporting keeps
+  its last batch until then. The exit flush is a multiprocessing finalizer like swaglog's, atexit
+  doesn't run in daemons forked by the manager.
+  """
   def __init__(self):
     self.pid = None
     self.zctx = None
     self.sock = None
 
+    self.lock = threading.Lock()
+    self.gauges: dict[str, float] = {}
+    self.sketches: dict[str, QuantileSketch] = {}
+    self.pending = 0
+    self.last_send_time = 0.
+
   def connect(self) -> None:
     self.zctx = zmq.Context()
     self.sock = self.zctx.socket(zmq.PUSH)
@@ -34,29 +172,77 @@ class StatLog:
     self.sock.connect(STATS_SOCKET)
     self.pid = os.getpid()
 
+    # a forked child starts with an empty batch, its parent sends its own
+    self.gauges = {}
+    self.sketches = {}
+    self.pending = 0
+    multiprocessing.util.Finalize(self, self.close, exitpriority=0)
+
   def __del__(self):
     if self.sock is not None:
       self.sock.close()
     if self.zctx is not None:
       self.zctx.term()
 
-  def _send(self, metric: str) -> None:
-    if os.getpid() != self.pid:
-      self.connect()
+  def _send(self) -> None:
+    dat = encode_batch(self.gauges, self.sketches)
+    self.gauges = {}
+    self.sketches = {}
+    self.pending = 0
+    self.last_send_time = time.monotonic()
 
     try:
-      self.sock.send_string(metric, zmq.NOBLOCK)
+      self.sock.send(dat, zmq.NOBLOCK)
     except zmq.error.Again:
       # drop :/
       pass
 
+  def _record(self, name: str, value: float, metric_type: str) -> None:
+    try:
+      value = float(value)
+    except (TypeError, ValueError):
+      cloudlog.event("malformed metric", name=name, value=repr(value))
+      return
+
+    with self.lock:
+      if os.getpid() != self.pid:
+        self.connect()
+
+      if metric_type == METRIC_TYPE.GAUGE:
+        self.gauges[name] = value
+      else:
+        sketch = self.sketches.get(name)
+        if sketch is None:
+          sketch = self.sketches[name] = QuantileSketch()
+        sketch.add(value)
+
+      self.pending += 1
+      if self.pending >= STATS_BATCH_SIZE or time.monotonic() > self.last_send_time + STATS_BATCH_TIME_S:
+        self._send()
+
+  def flush(self) -> None:
+    with self.lock:
+      if self.pending and os.getpid() == self.pid:
+        self._send()
+
+  def close(self) -> None:
+    # sends what's pending and lingers until it's out, the next gauge or sample reconnects
+    with self.lock:
+      if os.getpid() != self.pid:
+        return
+      if self.pending:
+        self._send()
+      self.sock.close()
+      self.zctx.term()
+      self.sock = self.zctx = self.pid = None
+
   def gauge(self, name: str, value: float) -> None:
-    self._send(f"{name}:{value}|{METRIC_TYPE.GAUGE}")
+    self._record(name, value, METRIC_TYPE.GAUGE)
 
-  # Samples will be recorded in a buffer and at aggregation time,
+  # Samples will be recorded in a sketch and at aggregation time,
   # statistical properties will be logged (mean, count, percentiles, ...)
   def sample(self, name: str, value: float):
-    self._send(f"{name}:{value}|{METRIC_TYPE.SAMPLE}")
+    self._record(name, value, METRIC_TYPE.SAMPLE)
 
 
 def main() -> NoReturn:
@@ -103,8 +289,8 @@ def main() -> NoReturn:
 
   idx = 0
   last_flush_time = time.monotonic()
-  gauges = {}
-  samples: dict[str, list[float]] = defaultdict(list)
+  gauges: dict[str, float] = {}
+  sketches: dict[str, QuantileSketch] = {}
   try:
     while True:
       started_prev = sm['deviceState'].started
@@ -113,20 +299,19 @@ def main() -> NoReturn:
       # Update metrics
       while True:
         try:
-          metric = sock.recv_string(zmq.NOBLOCK)
+          dat = sock.recv(zmq.NOBLOCK)
           try:
-            metric_type = metric.split('|')[1]
-            metric_name = metric.split(':')[0]
-            metric_value = float(metric.split('|')[0].split(':')[1])
-
-            if metric_type == METRIC_TYPE.GAUGE:
-              gauges[metric_name] = metric_value
-            elif metric_type == METRIC_TYPE.SAMPLE:
-              samples[metric_name].append(metric_value)
-            else:
-              cloudlog.event("unknown metric type", metric_type=metric_type)
+            batch_gauges, batch_sketches = decode_batch(dat)
           except Exception:
-            cloudlog.event("malformed metric", metric=metric)
+            cloudlog.event("malformed metric batch", size=len(dat))
+            continue
+
+          gauges.update(batch_gauges)
+          for name, sketch in batch_sketches.items():
+            if name in sketches:
+              sketches[name].merge(sketch)
+            else:
+              sketches[name] = sketch
         except zmq.error.Again:
           break
 
@@ -139,26 +324,21 @@ def main() -> NoReturn:
         for key, value in gauges.items():
           result += get_influxdb_line(f"gauge.{key}", value, current_time, tags)
 
-        for key, values in samples.items():
-          values.sort()
-          sample_count = len(values)
-          sample_sum = sum(values)
-
+        for key, sketch in sketches.items():
           stats = {
-            'count': sample_count,
-            'min': values[0],
-            'max': values[-1],
-            'mean': sample_sum / sample_count,
+            'count': sketch.count,
+            'min': sketch.min,
+            'max': sketch.max,
+            'mean': sketch.sum / sketch.count,
           }
           for percentile in [0.05, 0.5, 0.95]:
-            value = values[int(round(percentile * (sample_count - 1)))]
-            stats[f"p{int(percentile * 100)}"] = value
+            stats[f"p{int(percentile * 100)}"] = sketch.quantile(percentile)
 
           result += get_influxdb_line(f"sample.{key}", stats, current_time, tags)
 
         # clear intermediate data
         gauges.clear()
-        samples.clear()
+        sketches.clear()
         last_flush_time = time.monotonic()
 
         # check that we aren't filling up the drive
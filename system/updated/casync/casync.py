@@ -5,12 +5,15 @@ import os
 import pathlib
 import struct
 import sys
+import threading
 import time
 from abc import ABC, abstractmethod
-from collections import defaultdict, namedtuple
+from collections import defaultdict, deque, namedtuple
 from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import IO
 
+import numpy as np
 import requests
 from Crypto.Hash import SHA512
 from catpilot.system.updated.casync import tar
@@ -31,6 +34,13 @@ CHUNK_DOWNLOAD_RETRIES = 3
 
 CAIBX_DOWNLOAD_TIMEOUT = 120
 
+# chunks fetched and verified concurrently, and how far ahead of the oldest unwritten chunk they may run
+EXTRACT_WORKERS = 8
+EXTRACT_WINDOW = EXTRACT_WORKERS * 4
+
+# caibx table entry: offset of the end of the chunk, then its SHA512/256
+CA_TABLE_ENTRY_DTYPE = np.dtype([('end', '<u8'), ('sha', 'V32')])
+
 Chunk = namedtuple('Chunk', ['sha', 'offset', 'length'])
 ChunkDict = dict[bytes, Chunk]
 
@@ -41,15 +51,26 @@ class ChunkReader(ABC):
     ...
 
 
+def chunk_hash(dat: bytes) -> bytes:
+  return SHA512.new(dat, truncate="256").digest()
+
+
 class BinaryChunkReader(ChunkReader):
   """Reads chunks from a local file"""
   def __init__(self, file_like: IO[bytes]) -> None:
     super().__init__()
     self.f = file_like
+    self.lock = threading.Lock()
 
   def read(self, chunk: Chunk) -> bytes:
-    self.f.seek(chunk.offset)
-    return self.f.read(chunk.length)
+    try:
+      fd = self.f.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+      # in-memory files have no descriptor to pread from
+      with self.lock:
+        self.f.seek(chunk.offset)
+        return self.f.read(chunk.length)
+    return os.pread(fd, chunk.length, chunk.offset)
 
 
 class FileChunkReader(BinaryChunkReader):
@@ -66,7 +87,14 @@ class RemoteChunkReader(ChunkReader):
   def __init__(self, url: str) -> None:
     super().__init__()
     self.url = url
-    self.session = requests.Session()
+    self.local = threading.local()
+
+  @property
+  def session(self) -> requests.Session:
+    # sessions aren't thread safe, give every extract worker its own connection pool
+    if not hasattr(self.local, "session"):
+      self.local.session = requests.Session()
+    return self.local.session
 
   def read(self, chunk: Chunk) -> bytes:
     sha_hex = chunk.sha.hex()
@@ -106,6 +134,111 @@ class DirectoryTarChunkReader(BinaryChunkReader):
     os.unlink(self.f.name)
 
 
+class ChunkStore(ChunkReader):
+  """Persistent content-addressed store of uncompressed chunks, laid out like a casync store.
+
+  Chunks are only ever written after their hash is verified, so anything in the store can be used
+  as a source without downloading it again, e.g. to resume an interrupted update or to share chunks
+  between builds. Writes past max_bytes are dropped, collect_garbage() removes what's no longer needed.
+  """
+
+  def __init__(self, path: str, max_bytes: int | None = None) -> None:
+    super().__init__()
+    self.path = path
+    self.max_bytes = max_bytes
+    os.makedirs(path, exist_ok=True)
+    self.lock = threading.Lock()
+    self.shas = self._scan()
+    self.bytes = sum(self.shas.values())
+
+  def _chunk_path(self, sha: bytes) -> str:
+    sha_hex = sha.hex()
+    return os.path.join(self.path, sha_hex[:4], sha_hex + ".chunk")
+
+  def _scan(self) -> dict[bytes, int]:
+    shas = {}
+    for prefix in os.listdir(self.path):
+      prefix_path = os.path.join(self.path, prefix)
+      if not os.path.isdir(prefix_path):
+        continue
+      with os.scandir(prefix_path) as entries:
+        for entry in entries:
+          if entry.name.endswith(".chunk"):
+            shas[bytes.fromhex(entry.name[:-len(".chunk")])] = entry.stat().st_size
+          elif entry.name.endswith(".tmp"):
+            # left behind by a write that was interrupted
+            os.unlink(entry.path)
+    return shas
+
+  def __contains__(self, sha: bytes) -> bool:
+    return sha in self.shas
+
+  def __len__(self) -> int:
+    return len(self.shas)
+
+  def read(self, chunk: Chunk) -> bytes:
+    with open(self._chunk_path(chunk.sha), 'rb') as f:
+      return f.read()
+
+  def write(self, sha: bytes, dat: bytes) -> bool:
+    """Saves a verified chunk, returns False if it didn't fit under max_bytes."""
+    with self.lock:
+      if sha in self.shas:
+        return True
+      if self.max_bytes is not None and self.bytes + len(dat) > self.max_bytes:
+        return False
+      # reserve the space, so concurrent writers can't overshoot the cap together
+      self.bytes += len(dat)
+
+    path = self._chunk_path(sha)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+      f.write(dat)
+    os.replace(tmp_path, path)
+
+    with self.lock:
+      if sha in self.shas:
+        self.bytes -= len(dat)
+      self.shas[sha] = len(dat)
+    return True
+
+  def chunk_dict(self, chunks: list[Chunk]) -> ChunkDict:
+    """Chunks of the given list that are already in the store"""
+    return {c.sha: c for c in chunks if c.sha in self.shas}
+
+  def seed(self, chunks: list[Chunk], reader: ChunkReader) -> int:
+    """Copy the chunks of another source into the store, e.g. the installed build through a
+    DirectoryTarChunkReader. Returns the number of chunks added."""
+    added = 0
+    for chunk in build_chunk_dict(chunks).values():
+      if chunk.sha in self.shas:
+        continue
+      if self.max_bytes is not None and self.bytes + chunk.length > self.max_bytes:
+        break
+      dat = reader.read(chunk)
+      if len(dat) == chunk.length and chunk_hash(dat) == chunk.sha and self.write(chunk.sha, dat):
+        added += 1
+    return added
+
+  def collect_garbage(self, keep: set[bytes]) -> int:
+    """Removes every chunk not in keep. Returns the number of bytes freed."""
+    with self.lock:
+      remove = [sha for sha in self.shas if sha not in keep]
+      freed = sum(self.shas.pop(sha) for sha in remove)
+      self.bytes -= freed
+
+    for sha in remove:
+      path = self._chunk_path(sha)
+      try:
+        os.unlink(path)
+        os.rmdir(os.path.dirname(path))
+      except OSError:
+        # the prefix directory is shared with chunks that are kept
+        pass
+    return freed
+
+
 def parse_caibx(caibx_path: str) -> list[Chunk]:
   """Parses the chunks from a caibx file. Can handle both local and remote files.
   Returns a list of chunks with hash, offset and length"""
@@ -133,23 +266,19 @@ def parse_caibx(caibx_path: str) -> list[Chunk]:
 
   # Parse chunks
   num_chunks = (caibx_len - CA_HEADER_LEN - CA_TABLE_MIN_LEN) // CA_TABLE_ENTRY_LEN
-  chunks = []
-
-  offset = 0
-  for i in range(num_chunks):
-    new_offset = struct.unpack("<Q", caibx.read(8))[0]
+  table = np.frombuffer(caibx.read(num_chunks * CA_TABLE_ENTRY_LEN), dtype=CA_TABLE_ENTRY_DTYPE, count=num_chunks)
 
-    sha = caibx.read(32)
-    length = new_offset - offset
+  ends = table['end'].astype(np.int64)
+  offsets = np.concatenate(([0], ends[:-1]))
+  lengths = ends - offsets
 
-    assert length <= max_size
+  assert np.all(lengths <= max_size)
 
-    # Last chunk can be smaller
-    if i < num_chunks - 1:
-      assert length >= min_size
+  # Last chunk can be smaller
+  assert np.all(lengths[:-1] >= min_size)
 
-    chunks.append(Chunk(sha, offset, length))
-    offset = new_offset
+  shas = table['sha'].tobytes()
+  chunks = [Chunk(shas[i * 32:(i + 1) * 32], offset, length) for i, (offset, length) in enumerate(zip(offsets.tolist(), lengths.tolist(), strict=True))]
 
   caibx.close()
   return chunks
@@ -165,41 +294,78 @@ def build_chunk_dict(chunks: list[Chunk]) -> ChunkDict:
   return r
 
 
-def extract(target: list[Chunk],
-            sources: list[tuple[str, ChunkReader, ChunkDict]],
-            out_path: str,
-            progress: Callable[[int], None] = None):
-  stats: dict[str, int] = defaultdict(int)
+def read_chunk(chunk: Chunk, sources: list[tuple[str, ChunkReader, ChunkDict]]) -> tuple[str, ChunkReader, bytes]:
+  """Read a chunk from the first source that has it with a matching length and hash"""
+  for name, chunk_reader, store_chunks in sources:
+    if chunk.sha in store_chunks:
+      bts = chunk_reader.read(store_chunks[chunk.sha])
 
-  mode = 'rb+' if os.path.exists(out_path) else 'wb'
-  with open(out_path, mode) as out:
-    for cur_chunk in target:
+      # Check length
+      if len(bts) != chunk.length:
+        continue
 
-      # Find source for desired chunk
-      for name, chunk_reader, store_chunks in sources:
-        if cur_chunk.sha in store_chunks:
-          bts = chunk_reader.read(store_chunks[cur_chunk.sha])
+      # Check hash
+      if chunk_hash(bts) != chunk.sha:
+        continue
 
-          # Check length
-          if len(bts) != cur_chunk.length:
-            continue
+      return name, chunk_reader, bts
 
-          # Check hash
-          if SHA512.new(bts, truncate="256").digest() != cur_chunk.sha:
-            continue
+  raise RuntimeError("Desired chunk not found in provided stores")
 
-          # Write to output
-          out.seek(cur_chunk.offset)
-          out.write(bts)
 
-          stats[name] += cur_chunk.length
+def extract(target: list[Chunk],
+            sources: list[tuple[str, ChunkReader, ChunkDict]],
+            out_path: str,
+            progress: Callable[[int], None] = None,
+            store: ChunkStore = None,
+            workers: int = EXTRACT_WORKERS):
+  """Assemble target into out_path. Every distinct chunk is read and verified once on a pool of workers,
+  then written with pwrite to each offset it appears at. Chunks read from a RemoteChunkReader are
+  saved to store when one is given. stats has the bytes written per source, bytes of repeated chunks
+  under "dedup"."""
+  stats: dict[str, int] = defaultdict(int)
 
-          if progress is not None:
-            progress(sum(stats.values()))
+  # offsets of every distinct chunk, in order of first appearance
+  offsets: dict[bytes, list[int]] = {}
+  for chunk in target:
+    offsets.setdefault(chunk.sha, []).append(chunk.offset)
+  unique = build_chunk_dict(target)
+
+  def fetch(chunk: Chunk) -> tuple[str, bytes]:
+    name, chunk_reader, bts = read_chunk(chunk, sources)
+    if store is not None and isinstance(chunk_reader, RemoteChunkReader):
+      store.write(chunk.sha, bts)
+    return name, bts
+
+  written = 0
+  fd = os.open(out_path, os.O_WRONLY | os.O_CREAT, 0o644)
+  try:
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="casync") as pool:
+      pending: deque[tuple[Chunk, Future]] = deque()
+      remaining = iter(unique.values())
+      try:
+        while True:
+          while len(pending) < EXTRACT_WINDOW and (chunk := next(remaining, None)) is not None:
+            pending.append((chunk, pool.submit(fetch, chunk)))
+          if not pending:
+            break
+
+          # write in target order, the window keeps the workers busy while the oldest chunk is still in flight
+          chunk, future = pending.popleft()
+          name, bts = future.result()
+
+          for i, offset in enumerate(offsets[chunk.sha]):
+            os.pwrite(fd, bts, offset)
+            stats["dedup" if i else name] += chunk.length
+            written += chunk.length
 
-          break
-      else:
-        raise RuntimeError("Desired chunk not found in provided stores")
+          if progress is not None:
+            progress(written)
+      finally:
+        for _, future in pending:
+          future.cancel()
+  finally:
+    os.close(fd)
 
   return stats
 
@@ -223,10 +389,10 @@ def print_stats(stats: dict[str, int]):
   total_bytes = sum(stats.values())
   print(f"Total size: {total_bytes / 1024 / 1024:.2f} MB")
   for name, total in stats.items():
-    print(f"  {name}: {total / 1024 / 1024:.2f} MB ({total / total_bytes * 100:.1f}%)")
+    print(f"  {name}: {total / 1024 / 1024:.2f} MB ({total / max(total_bytes, 1) * 100:.1f}%)")
 
 
-def extract_simple(caibx_path, out_path, store_path):
+def extract_simple(caibx_path, out_path, store_path, chunk_store_path=None):
   # (name, callback, chunks)
   target = parse_caibx(caibx_path)
   sources = [
@@ -234,13 +400,19 @@ def extract_simple(caibx_path, out_path, store_path):
     (store_path, FileChunkReader(store_path), build_chunk_dict(target)),
   ]
 
-  return extract(target, sources, out_path)
+  store = None
+  if chunk_store_path is not None:
+    store = ChunkStore(chunk_store_path)
+    sources.insert(0, ('store', store, store.chunk_dict(target)))
+
+  return extract(target, sources, out_path, store=store)
 
 
 if __name__ == "__main__":
   caibx = sys.argv[1]
   out = sys.argv[2]
   store = sys.argv[3]
+  chunk_store = sys.argv[4] if len(sys.argv) > 4 else None
 
-  stats = extract_simple(caibx, out, store)
+  stats = extract_simple(caibx, out, store, chunk_store)
   print_stats(stats)
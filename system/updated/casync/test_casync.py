@@ -0,0 +1,200 @@
+import functools
+import http.server
+import lzma
+import os
+import pathlib
+import struct
+import threading
+
+import pytest
+
+from catpilot.system.updated.casync import casync
+
+CHUNK_SIZE = 4096
+
+
+def make_caibx(path, dat, chunk_size=CHUNK_SIZE):
+  """Writes a caibx for dat cut into fixed size chunks, returns the chunks"""
+  chunks = []
+  for offset in range(0, len(dat), chunk_size):
+    piece = dat[offset:offset + chunk_size]
+    chunks.append(casync.Chunk(casync.chunk_hash(piece), offset, len(piece)))
+
+  with open(path, 'wb') as f:
+    f.write(struct.pack("<QQQQQQ", casync.CA_HEADER_LEN, casync.CA_FORMAT_INDEX, casync.FLAGS, 1, chunk_size, chunk_size))
+    f.write(struct.pack("<QQ", 0xFFFFFFFFFFFFFFFF, casync.CA_FORMAT_TABLE))
+    for chunk in chunks:
+      f.write(struct.pack("<Q", chunk.offset + chunk.length) + chunk.sha)
+    f.write(struct.pack("<QQQQQ", 0, 0, casync.CA_HEADER_LEN, len(chunks) * casync.CA_TABLE_ENTRY_LEN, casync.CA_FORMAT_TABLE_TAIL_MARKER))
+  return chunks
+
+
+def make_remote_store(path, dat, chunks):
+  for chunk in chunks:
+    sha_hex = chunk.sha.hex()
+    os.makedirs(os.path.join(path, sha_hex[:4]), exist_ok=True)
+    with open(os.path.join(path, sha_hex[:4], sha_hex + ".cacnk"), 'wb') as f:
+      f.write(lzma.compress(dat[chunk.offset:chunk.offset + chunk.length]))
+
+
+def random_data(blocks, repeated=0):
+  # repeated copies of the first block exercise the dedup path
+  first = os.urandom(CHUNK_SIZE)
+  return first * (repeated + 1) + os.urandom(blocks * CHUNK_SIZE - 100)
+
+
+class TestCasync:
+  @pytest.fixture(autouse=True)
+  def setup(self, tmp_path):
+    self.tmp_path = tmp_path
+    self.target_dat = random_data(20, repeated=3)
+    self.target_caibx = str(tmp_path / "target.caibx")
+    self.target = make_caibx(self.target_caibx, self.target_dat)
+
+    self.remote_path = str(tmp_path / "remote")
+    make_remote_store(self.remote_path, self.target_dat, self.target)
+    self.out_path = str(tmp_path / "out")
+
+  def extract(self, sources, store=None):
+    return casync.extract(self.target, sources, self.out_path, store=store)
+
+  def assert_extracted(self):
+    with open(self.out_path, 'rb') as f:
+      assert f.read() == self.target_dat
+
+  def test_parse_caibx(self):
+    assert casync.parse_caibx(self.target_caibx) == self.target
+
+  def test_local_store(self):
+    sources = [('remote', casync.RemoteChunkReader(self.remote_path), casync.build_chunk_dict(self.target))]
+    stats = self.extract(sources)
+    self.assert_extracted()
+    assert stats['dedup'] == 3 * CHUNK_SIZE
+    assert stats['remote'] == len(self.target_dat) - stats['dedup']
+
+  def test_http_store(self):
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=self.remote_path)
+    handler.log_message = lambda *args: None
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+      url = f"http://127.0.0.1:{server.server_address[1]}"
+      sources = [('remote', casync.RemoteChunkReader(url), casync.build_chunk_dict(self.target))]
+      stats = self.extract(sources)
+    finally:
+      server.shutdown()
+      server.server_close()
+
+    self.assert_extracted()
+    assert stats['remote'] == len(self.target_dat) - 3 * CHUNK_SIZE
+
+  def test_seed(self):
+    # the seed shares the second half of the target
+    half = len(self.target) // 2 * CHUNK_SIZE
+    seed_dat = os.urandom(half) + self.target_dat[half:]
+    seed_path = self.tmp_path / "seed"
+    seed_path.write_bytes(seed_dat)
+    seed = make_caibx(str(self.tmp_path / "seed.caibx"), seed_dat)
+
+    sources = [
+      ('seed', casync.FileChunkReader(str(seed_path)), casync.build_chunk_dict(seed)),
+      ('remote', casync.RemoteChunkReader(self.remote_path), casync.build_chunk_dict(self.target)),
+    ]
+    stats = self.extract(sources)
+    self.assert_extracted()
+    assert stats['seed'] == len(self.target_dat) - half
+
+  def test_chunk_store_source_and_sink(self):
+    store = casync.ChunkStore(str(self.tmp_path / "store"))
+    sources = [
+      ('store', store, store.chunk_dict(self.target)),
+      ('remote', casync.RemoteChunkReader(self.remote_path), casync.build_chunk_dict(self.target)),
+    ]
+    self.extract(sources, store)
+    assert len(store) == len(casync.build_chunk_dict(self.target))
+
+    # everything comes from the store once the remote is gone, also after reopening it
+    os.unlink(self.out_path)
+    for chunk in self.target:
+      sha_hex = chunk.sha.hex()
+      pathlib.Path(self.remote_path, sha_hex[:4], sha_hex + ".cacnk").unlink(missing_ok=True)
+    store = casync.ChunkStore(str(self.tmp_path / "store"))
+    sources = [
+      ('store', store, store.chunk_dict(self.target)),
+      ('remote', casync.RemoteChunkReader(self.remote_path), casync.build_chunk_dict(self.target)),
+    ]
+    stats = self.extract(sources, store)
+    self.assert_extracted()
+    assert stats.keys() == {'store', 'dedup'}
+
+  def test_chunk_store_only_keeps_remote_chunks(self):
+    # chunks the seed slot has stay there, the store only takes what had to be downloaded
+    half = len(self.target) // 2 * CHUNK_SIZE
+    seed_path = self.tmp_path / "seed"
+    seed_path.write_bytes(os.urandom(half) + self.target_dat[half:])
+    seed = make_caibx(str(self.tmp_path / "seed.caibx"), seed_path.read_bytes())
+
+    store = casync.ChunkStore(str(self.tmp_path / "store"))
+    sources = [
+      ('seed', casync.FileChunkReader(str(seed_path)), casync.build_chunk_dict(seed)),
+      ('store', store, store.chunk_dict(self.target)),
+      ('remote', casync.RemoteChunkReader(self.remote_path), casync.build_chunk_dict(self.target)),
+    ]
+    self.extract(sources, store)
+    self.assert_extracted()
+
+    seed_shas = {c.sha for c in seed}
+    assert set(store.shas) == {c.sha for c in self.target if c.sha not in seed_shas}
+    assert store.bytes == sum(store.shas.values())
+
+  def test_seed_chunk_store_from_directory(self):
+    build = self.tmp_path / "build"
+    (build / "selfdrive").mkdir(parents=True)
+    (build / "selfdrive" / "model.bin").write_bytes(random_data(8))
+    (build / "README").write_bytes(os.urandom(1000))
+    (build / "link").symlink_to("README")
+
+    reader = casync.DirectoryTarChunkReader(str(build), str(self.tmp_path / "build.tar"))
+    tar_dat = reader.read(casync.Chunk(b"", 0, os.fstat(reader.f.fileno()).st_size))
+    build_caibx = make_caibx(str(self.tmp_path / "build.caibx"), tar_dat)
+
+    store = casync.ChunkStore(str(self.tmp_path / "store"))
+    assert store.seed(build_caibx, reader) == len(casync.build_chunk_dict(build_caibx))
+    assert store.seed(build_caibx, reader) == 0
+
+    out = self.tmp_path / "extracted"
+    casync.extract_directory(build_caibx, [('store', store, store.chunk_dict(build_caibx))], str(out), str(self.tmp_path / "out.tar"))
+    assert (out / "selfdrive" / "model.bin").read_bytes() == (build / "selfdrive" / "model.bin").read_bytes()
+    assert os.readlink(out / "link") == "README"
+
+  def test_chunk_store_max_bytes(self):
+    max_bytes = 5 * CHUNK_SIZE
+    store = casync.ChunkStore(str(self.tmp_path / "store"), max_bytes)
+    sources = [('remote', casync.RemoteChunkReader(self.remote_path), casync.build_chunk_dict(self.target))]
+    self.extract(sources, store)
+    self.assert_extracted()
+    assert len(store) == 5
+    assert store.bytes == max_bytes
+
+    store = casync.ChunkStore(str(self.tmp_path / "store"), max_bytes)
+    assert store.bytes == max_bytes
+    assert store.seed(self.target, casync.FileChunkReader(self.out_path)) == 0
+
+  def test_collect_garbage(self):
+    store = casync.ChunkStore(str(self.tmp_path / "store"))
+    target_path = self.tmp_path / "target"
+    target_path.write_bytes(self.target_dat)
+    store.seed(self.target, casync.FileChunkReader(str(target_path)))
+    keep = {self.target[0].sha}
+    freed = store.collect_garbage(keep)
+
+    assert freed == len(self.target_dat) - 4 * CHUNK_SIZE
+    assert set(store.shas) == keep
+    assert store.bytes == CHUNK_SIZE
+    assert set(casync.ChunkStore(str(self.tmp_path / "store")).shas) == keep
+
+    store.collect_garbage(set())
+    assert len(store) == 0
+    assert os.listdir(self.tmp_path / "store") == []
+
@@ -221,7 +221,7 @@ def finalize_update(manual_update_requested, params, catpilot_toggles) -> None:
 
 
 def handle_agnos_update() -> None:
-  from catpilot.system.hardware.tici.agnos import flash_agnos_update, get_target_slot_number
+  from catpilot.system.hardware.tici.agnos import CHUNK_STORE_PATH, flash_agnos_update, get_target_slot_number
 
   cur_version = HARDWARE.get_os_version()
   updated_version = run(["bash", "-c", r"unset AGNOS_VERSION && source launch_env.sh && \
@@ -229,6 +229,8 @@ def handle_agnos_update() -> None:
 
   cloudlog.info(f"AGNOS version check: {cur_version} vs {updated_version}")
   if cur_version == updated_version:
+    # drop the chunks of an update that was superseded before it was flashed
+    shutil.rmtree(CHUNK_STORE_PATH, ignore_errors=True)
     return
 
   # prevent an catpilot getting swapped in with a mismatched or partially downloaded agnos
@@ -239,7 +241,7 @@ def handle_agnos_update() -> None:
 
   manifest_path = os.path.join(OVERLAY_MERGED, "system/hardware/tici/agnos.json")
   target_slot_number = get_target_slot_number()
-  flash_agnos_update(manifest_path, target_slot_number, cloudlog)
+  flash_agnos_update(manifest_path, target_slot_number, cloudlog, chunk_store_path=CHUNK_STORE_PATH)
   set_offroad_alert("Offroad_NeosUpdate", False)
 
 
@@ -463,7 +465,7 @@ def main() -> None:
     while True:
       wait_helper.ready_event.clear()
 
-      catpilot_toggles = get_catpilot_toggles()
+      catpilot_toggles.refresh()
 
       manual_update_requested = params_memory.get_bool("ManualUpdateInitiated")
 
@@ -1,6 +1,8 @@
 import capnp
 from typing import Any
 
+from cereal import log
+
 
 def generate_type(type_walker, schema_walker) -> str | list[Any] | dict[str, Any]:
   data_type = next(type_walker)
@@ -41,3 +43,13 @@ def generate_field(field: capnp.lib.capnp._StructSchemaField) -> str | list[Any]
     return generate_type(type_gen, schema_gen)
   else:
     return generate_struct(field.schema)
+
+
+def is_valid_field_path(service: str, path: str) -> bool:
+  schema = log.Event.schema
+  for name in [service, *path.split(".")]:
+    if schema is None or name not in schema.fields:
+      return False
+    field = schema.fields[name]
+    schema = field.schema if field.proto.which() == "group" or field.proto.slot.type.which() == "struct" else None
+  return True
@@ -3,6 +3,8 @@
 import argparse
 import asyncio
 import json
+import threading
+import time
 import uuid
 import logging
 from dataclasses import dataclass, field
@@ -17,14 +19,33 @@ from aiohttp import web
 if TYPE_CHECKING:
   from aiortc.rtcdatachannel import RTCDataChannel
 
-from catpilot.system.webrtc.schema import generate_field
+from catpilot.system.webrtc.schema import generate_field, is_valid_field_path
 from cereal import messaging, log
 
 
+DT_JSON = 0.01
+DT_FRAME = 0.05  # delta messages are batched once per camera frame
+KEYFRAME_INTERVAL = int(1e9)  # ns between full messages of a service in the delta encoding
+ENCODINGS = ("json", "delta")
+
+
 class CerealOutgoingMessageProxy:
-  def __init__(self, sm: messaging.SubMaster):
+  """Encodes the updated services for the outgoing data channels.
+
+  "json" sends every updated message as its own JSON object. "delta" batches the updates of a tick
+  into one JSON list, where each message only carries the dotted paths of the fields that changed
+  since that service was last sent (null for ones that went away), with a full keyframe every
+  KEYFRAME_INTERVAL. Services in fields are projected to the listed field paths instead of being
+  converted whole.
+  """
+  def __init__(self, sm: messaging.SubMaster, fields: dict[str, list[str]] | None = None, encoding: str = "json"):
     self.sm = sm
     self.channels: list[RTCDataChannel] = []
+    self.fields = {service: [path.split(".") for path in paths] for service, paths in (fields or {}).items()}
+    self.encoding = encoding
+    self.interval = DT_FRAME if encoding == "delta" else DT_JSON
+    self.last_sent: dict[str, dict[str, Any]] = {}
+    self.last_keyframe: dict[str, int] = {}
 
   def add_channel(self, channel: 'RTCDataChannel'):
     self.channels.append(channel)
@@ -34,6 +55,8 @@ class CerealOutgoingMessageProxy:
       msg_dict = msg_content.to_dict()
     elif isinstance(msg_content, capnp._DynamicListReader):
       msg_dict = [self.to_json(msg) for msg in msg_content]
+    elif isinstance(msg_content, capnp.lib.capnp._DynamicEnum):
+      msg_dict = msg_content._as_str()
     elif isinstance(msg_content, bytes):
       msg_dict = msg_content.decode()
     else:
@@ -41,16 +64,67 @@ class CerealOutgoingMessageProxy:
 
     return msg_dict
 
-  def update(self):
-    # this is blocking in async context...
-    self.sm.update(0)
-    for service, updated in self.sm.updated.items():
-      if not updated:
+  def project(self, service: str):
+    msg = self.sm[service]
+    if service not in self.fields:
+      return self.to_json(msg)
+
+    msg_dict: dict[str, Any] = {}
+    for path in self.fields[service]:
+      try:
+        value = msg
+        for name in path:
+          value = getattr(value, name)
+      except capnp.KjException:
+        # a union member that isn't set
         continue
-      msg_dict = self.to_json(self.sm[service])
+      node = msg_dict
+      for name in path[:-1]:
+        node = node.setdefault(name, {})
+      node[path[-1]] = self.to_json(value)
+    return msg_dict
+
+  def flatten(self, msg_dict: dict[str, Any], prefix: str = "", out: dict[str, Any] | None = None):
+    out = {} if out is None else out
+    for key, value in msg_dict.items():
+      if isinstance(value, dict) and value:
+        self.flatten(value, f"{prefix}{key}.", out)
+      else:
+        out[prefix + key] = value
+    return out
+
+  def delta(self, service: str):
+    fields = self.flatten(self.project(service))
+    mono_time = self.sm.logMonoTime[service]
+    last = self.last_sent.get(service)
+    keyframe = last is None or mono_time - self.last_keyframe[service] >= KEYFRAME_INTERVAL
+    if keyframe:
+      changed = fields
+      self.last_keyframe[service] = mono_time
+    else:
+      changed = {key: value for key, value in fields.items() if key not in last or last[key] != value}
+      changed.update(dict.fromkeys(last.keys() - fields.keys()))
+    self.last_sent[service] = fields
+    return {"type": service, "logMonoTime": mono_time, "valid": self.sm.valid[service], "keyframe": keyframe, "data": changed}
+
+  def update(self) -> list[bytes]:
+    self.sm.update(0)
+    services = [service for service, updated in self.sm.updated.items() if updated]
+    if self.encoding == "delta":
+      if not services:
+        return []
+      return [json.dumps([self.delta(service) for service in services], separators=(",", ":")).encode()]
+
+    encoded_msgs = []
+    for service in services:
+      msg_dict = self.project(service)
       mono_time, valid = self.sm.logMonoTime[service], self.sm.valid[service]
       outgoing_msg = {"type": service, "logMonoTime": mono_time, "valid": valid, "data": msg_dict}
-      encoded_msg = json.dumps(outgoing_msg).encode()
+      encoded_msgs.append(json.dumps(outgoing_msg).encode())
+    return encoded_msgs
+
+  def send(self, encoded_msgs: list[bytes]):
+    for encoded_msg in encoded_msgs:
       for channel in self.channels:
         channel.send(encoded_msg)
 
@@ -72,34 +146,51 @@ class CerealIncomingMessageProxy:
 
 
 class CerealProxyRunner:
+  """Polls and encodes the outgoing services on a thread, so the event loop only sends the results."""
   def __init__(self, proxy: CerealOutgoingMessageProxy):
     self.proxy = proxy
-    self.is_running = False
-    self.task = None
+    self.loop: asyncio.AbstractEventLoop | None = None
+    self.thread: threading.Thread | None = None
+    self.stop_event = threading.Event()
     self.logger = logging.getLogger("webrtcd")
 
   def start(self):
-    assert self.task is None
-    self.task = asyncio.create_task(self.run())
+    assert self.thread is None
+    self.loop = asyncio.get_running_loop()
+    self.thread = threading.Thread(target=self.run, name="webrtcd_bridge", daemon=True)
+    self.thread.start()
 
   def stop(self):
-    if self.task is None or self.task.done():
-      return
-    self.task.cancel()
-    self.task = None
+    self.stop_event.set()
 
-  async def run(self):
+  def send(self, encoded_msgs: list[bytes]):
     from aiortc.exceptions import InvalidStateError
 
-    while True:
+    if self.stop_event.is_set():
+      return
+    try:
+      self.proxy.send(encoded_msgs)
+    except InvalidStateError:
+      self.logger.warning("Cereal outgoing proxy invalid state (connection closed)")
+      self.stop()
+    except Exception:
+      self.logger.exception("Cereal outgoing proxy failure")
+
+  def run(self):
+    next_update = time.monotonic()
+    while not self.stop_event.is_set():
       try:
-        self.proxy.update()
-      except InvalidStateError:
-        self.logger.warning("Cereal outgoing proxy invalid state (connection closed)")
+        encoded_msgs = self.proxy.update()
+        if encoded_msgs:
+          self.loop.call_soon_threadsafe(self.send, encoded_msgs)
+      except RuntimeError:
+        # the event loop closed
         break
       except Exception:
         self.logger.exception("Cereal outgoing proxy failure")
-      await asyncio.sleep(0.01)
+
+      next_update += self.proxy.interval
+      self.stop_event.wait(max(next_update - time.monotonic(), 0))
 
 
 class DynamicPubMaster(messaging.PubMaster):
@@ -117,7 +208,8 @@ class DynamicPubMaster(messaging.PubMaster):
 class StreamSession:
   shared_pub_master = DynamicPubMaster([])
 
-  def __init__(self, sdp: str, cameras: list[str], incoming_services: list[str], outgoing_services: list[str], debug_mode: bool = False):
+  def __init__(self, sdp: str, cameras: list[str], incoming_services: list[str], outgoing_services: list[str], debug_mode: bool = False,
+               outgoing_fields: dict[str, list[str]] | None = None, outgoing_encoding: str = "json"):
     from aiortc.mediastreams import VideoStreamTrack, AudioStreamTrack
     from aiortc.contrib.media import MediaBlackhole
     from catpilot.system.webrtc.device.video import LiveStreamVideoStreamTrack
@@ -149,7 +241,7 @@ class StreamSession:
     if len(incoming_services) > 0:
       self.incoming_bridge = CerealIncomingMessageProxy(self.shared_pub_master)
     if len(outgoing_services) > 0:
-      self.outgoing_bridge = CerealOutgoingMessageProxy(messaging.SubMaster(outgoing_services))
+      self.outgoing_bridge = CerealOutgoingMessageProxy(messaging.SubMaster(outgoing_services), outgoing_fields, outgoing_encoding)
       self.outgoing_bridge_runner = CerealProxyRunner(self.outgoing_bridge)
 
     self.audio_output: AudioOutputSpeaker | MediaBlackhole | None = None
@@ -217,14 +309,20 @@ class StreamRequestBody:
   cameras: list[str]
   bridge_services_in: list[str] = field(default_factory=list)
   bridge_services_out: list[str] = field(default_factory=list)
+  bridge_fields_out: dict[str, list[str]] = field(default_factory=dict)
+  bridge_encoding_out: str = "json"
 
 
 async def get_stream(request: 'web.Request'):
   stream_dict, debug_mode = request.app['streams'], request.app['debug']
   raw_body = await request.json()
   body = StreamRequestBody(**raw_body)
+  assert body.bridge_encoding_out in ENCODINGS, "Invalid encoding"
+  assert all(s in body.bridge_services_out and all(is_valid_field_path(s, path) for path in paths)
+             for s, paths in body.bridge_fields_out.items()), "Invalid field path"
 
-  session = StreamSession(body.sdp, body.cameras, body.bridge_services_in, body.bridge_services_out, debug_mode)
+  session = StreamSession(body.sdp, body.cameras, body.bridge_services_in, body.bridge_services_out, debug_mode,
+                          body.bridge_fields_out, body.bridge_encoding_out)
   answer = await session.get_answer()
   session.start()
 
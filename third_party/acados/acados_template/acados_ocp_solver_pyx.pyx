@@ -789,6 +789,93 @@ cdef class AcadosOcpSolverCython:
         return
 
 
+    def set_all(self, str field_, value_):
+        """
+        Set a field on consecutive shooting nodes starting at stage 0, in one call instead of one set per stage.
+
+            :param field: string in ['p', 'yref', 'y_ref', 'lbx', 'ubx', 'lbu', 'ubu', 'x', 'u', 'pi', 'lam', 't', 'sl', 'su']
+            :param value: 2D numpy array with one row per stage, rows wider than the dimension of
+                          their stage are cut, e.g. the terminal yref
+        """
+        if not isinstance(value_, np.ndarray) or value_.ndim != 2:
+            raise Exception(f"set_all: value must be a 2D numpy array, got {type(value_)}.")
+        cost_fields = ['y_ref', 'yref']
+        constraints_fields = ['lbx', 'ubx', 'lbu', 'ubu']
+        out_fields = ['x', 'u', 'pi', 'lam', 't', 'sl', 'su']
+
+        if field_ not in ['p'] + cost_fields + constraints_fields + out_fields:
+            raise Exception("AcadosOcpSolverCython.set_all(): {} is not a valid argument.\
+                \nPossible values are {}.".format(field_, ['p'] + cost_fields + constraints_fields + out_fields))
+
+        if value_.shape[0] > self.N + 1:
+            raise Exception(f'AcadosOcpSolverCython.set_all(): got {value_.shape[0]} stages, the solver has {self.N + 1}.')
+
+        field = field_.encode('utf-8')
+        cdef const char *c_field = field
+        cdef cnp.ndarray[cnp.float64_t, ndim=2] value = np.ascontiguousarray(value_, dtype=np.float64)
+        cdef int n_stages = value.shape[0]
+        cdef int width = value.shape[1]
+        cdef int stage, dims
+
+        if field_ == 'p':
+            for stage in range(n_stages):
+                assert acados_solver.acados_update_params(self.capsule, stage, &value[stage, 0], width) == 0
+            return
+
+        for stage in range(n_stages):
+            dims = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                self.nlp_dims, self.nlp_out, stage, c_field)
+            if dims > width:
+                raise Exception(f'AcadosOcpSolverCython.set_all(): mismatching dimension for field "{field_}" '
+                                f'at stage {stage} with dimension {dims} (you have {width})')
+
+            if field_ in constraints_fields:
+                acados_solver_common.ocp_nlp_constraints_model_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_in, stage, c_field, <void *> &value[stage, 0])
+            elif field_ in cost_fields:
+                acados_solver_common.ocp_nlp_cost_model_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_in, stage, c_field, <void *> &value[stage, 0])
+            else:
+                acados_solver_common.ocp_nlp_out_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_out, stage, c_field, <void *> &value[stage, 0])
+
+
+    def get_all(self, str field_, int n_stages=-1):
+        """
+        Get a field of the last solution on consecutive shooting nodes starting at stage 0, in one call instead of one get per stage.
+
+            :param field: string in ['x', 'u', 'z', 'pi', 'lam', 't', 'sl', 'su']
+            :param n_stages: number of stages, by default N for 'u' and 'pi' and N+1 otherwise
+            :returns: 2D numpy array with one row per stage
+        """
+        out_fields = ['x', 'u', 'z', 'pi', 'lam', 't', 'sl', 'su']
+        if field_ not in out_fields:
+            raise Exception('AcadosOcpSolverCython.get_all(): {} is an invalid argument.\
+                    \n Possible values are {}.'.format(field_, out_fields))
+
+        if n_stages < 0:
+            n_stages = self.N if field_ in ['u', 'pi'] else self.N + 1
+        if n_stages > self.N + 1 or (field_ == 'pi' and n_stages > self.N):
+            raise Exception(f'AcadosOcpSolverCython.get_all(): field {field_} does not exist on {n_stages} stages.')
+
+        field = field_.encode('utf-8')
+        cdef const char *c_field = field
+        cdef int dims = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+            self.nlp_dims, self.nlp_out, 0, c_field)
+        cdef cnp.ndarray[cnp.float64_t, ndim=2] out = np.zeros((n_stages, dims))
+        cdef int stage
+        if dims == 0:
+            return out
+
+        for stage in range(n_stages):
+            if acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config, self.nlp_dims, self.nlp_out, stage, c_field) != dims:
+                raise Exception(f'AcadosOcpSolverCython.get_all(): field {field_} changes dimension at stage {stage}, use get().')
+            acados_solver_common.ocp_nlp_out_get(self.nlp_config,
+                self.nlp_dims, self.nlp_out, stage, c_field, <void *> &out[stage, 0])
+
+        return out
+
+
     def __del__(self):
         if self.solver_created:
             acados_solver.acados_free(self.capsule)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zstandard as zstd
+
+from pathlib import Path
+
+from catpilot.common.basedir import BASEDIR
+from catpilot.catpilot.common.backup_store import BackupStore, write_archive
+
+
+class DiskUsageSampler:
+  # peak growth of the used space on the filesystem holding path while running
+  def __init__(self, path, interval=0.01):
+    self.path, self.interval = path, interval
+    self.baseline = shutil.disk_usage(path).used
+    self.peak = 0
+    self.done = threading.Event()
+    self.thread = threading.Thread(target=self.run, daemon=True)
+
+  def run(self):
+    while not self.done.wait(self.interval):
+      self.peak = max(self.peak, shutil.disk_usage(self.path).used - self.baseline)
+
+  def __enter__(self):
+    self.thread.start()
+    return self
+
+  def __exit__(self, *args):
+    self.done.set()
+    self.thread.join()
+    self.peak = max(self.peak, shutil.disk_usage(self.path).used - self.baseline)
+
+
+def legacy_backup(source, destination):
+  # what backup_directory did before, copy the tree (rsync on the device), tar the copy, then compress the tar
+  in_progress = destination.parent / (destination.name + "_in_progress")
+  shutil.copytree(source, in_progress, symlinks=True)
+  tar_file = destination.parent / (destination.name + "_in_progress.tar")
+  with tarfile.open(tar_file, "w") as tar:
+    tar.add(in_progress, arcname=destination.name)
+  shutil.rmtree(in_progress)
+
+  compressed_file = destination.parent / (destination.name + "_in_progress.tar.zst")
+  with open(compressed_file, "wb") as f:
+    cctx = zstd.ZstdCompressor(level=2)
+    with open(tar_file, "rb") as tar_f, cctx.stream_writer(f) as compressor:
+      while chunk := tar_f.read(65536):
+        compressor.write(chunk)
+  tar_file.unlink()
+  compressed_file.rename(destination.parent / (destination.name + ".tar.zst"))
+
+
+def archive_members(path):
+  with open(path, "rb") as f, tarfile.open(fileobj=zstd.ZstdDecompressor().stream_reader(f), mode="r|") as tar:
+    return [(member.name, member.size, member.mode, member.mtime, member.linkname, tar.extractfile(member).read() if member.isfile() else None)
+            for member in tar]
+
+
+def run(name, fn, output):
+  with DiskUsageSampler(output) as sampler:
+    start = time.monotonic()
+    written = fn()
+    elapsed = time.monotonic() - start
+  print(f"{name:>22}: {elapsed:6.2f} s, {written / 1e6:8.2f} MB written, {sampler.peak / 1e6:8.2f} MB peak disk usage")
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Backing up a directory by copying, tarring and compressing it against the single-pass archive "
+                                               "and the incremental chunk store")
+  parser.add_argument("--source", type=Path, default=Path(BASEDIR))
+  parser.add_argument("--modified", type=int, default=20, help="files to change between the incremental snapshots")
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    tmp = Path(tmp)
+    source = tmp / "source"
+    shutil.copytree(args.source, source, symlinks=True)
+    legacy_output, single_pass_output, store_output = tmp / "legacy", tmp / "single_pass", tmp / "store"
+    for output in (legacy_output, single_pass_output, store_output):
+      output.mkdir()
+
+    run("copy, tar, compress", lambda: legacy_backup(source, legacy_output / "backup_auto") or (legacy_output / "backup_auto.tar.zst").stat().st_size,
+        legacy_output)
+    run("single pass", lambda: write_archive(source, single_pass_output / "backup_auto.tar.zst", "backup_auto") or
+        (single_pass_output / "backup_auto.tar.zst").stat().st_size, single_pass_output)
+    assert archive_members(legacy_output / "backup_auto.tar.zst") == archive_members(single_pass_output / "backup_auto.tar.zst"), \
+      "single pass archive differs from the legacy one"
+
+    store = BackupStore(store_output)
+    run("incremental, first", lambda: store.snapshot(source, "first_auto"), store_output)
+
+    files = sorted(path for path in source.rglob("*") if path.is_file() and not path.is_symlink())
+    for path in files[::max(len(files) // max(args.modified, 1), 1)][:args.modified]:
+      with open(path, "ab") as f:
+        f.write(b"\n# modified\n")
+    run(f"incremental, {args.modified} changed", lambda: store.snapshot(source, "second_auto"), store_output)
+
+    restored = tmp / "restored"
+    store.restore("second_auto", restored)
+    for path in files:
+      assert (restored / path.relative_to(source)).read_bytes() == path.read_bytes(), f"{path} differs after restoring"
+    print(f"{'chunk store':>22}: {sum(f.stat().st_size for f in store_output.rglob('*') if f.is_file()) / 1e6:8.2f} MB for both snapshots, "
+          f"{sum(len(files) for _, _, files in os.walk(store.chunks_path))} chunks")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+from catpilot.catpilot.assets.download_functions import DownloadProgress, download_file, download_queue, git_blob_hasher
+from catpilot.catpilot.common.catpilot_variables import params_memory
+
+CANCEL_PARAM = "CancelModelDownload"
+PROGRESS_PARAM = "ModelDownloadProgress"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+  # serves the files in server.files with range requests, at server.bandwidth bytes/s per connection,
+  # dropping each connection once after server.drop_after bytes
+  protocol_version = "HTTP/1.1"
+
+  def log_message(self, *args):
+    pass
+
+  def do_HEAD(self):
+    self.respond(body=False)
+
+  def do_GET(self):
+    self.respond(body=True)
+
+  def respond(self, body):
+    data = self.server.files.get(self.path)
+    if data is None:
+      self.send_error(404)
+      return
+
+    etag = f'"{hashlib.md5(data).hexdigest()}"'
+    start = 0
+    range_header = self.headers.get("Range")
+    if range_header and self.headers.get("If-Range", etag) == etag:
+      start = int(range_header.removeprefix("bytes=").split("-")[0])
+      self.send_response(206)
+      self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+    else:
+      self.send_response(200)
+    self.send_header("Content-Length", str(len(data) - start))
+    self.send_header("ETag", etag)
+    self.end_headers()
+    if not body:
+      return
+
+    time.sleep(self.server.latency)
+    drop = self.server.drop_after if self.path not in self.server.dropped else None
+    sent = 0
+    block = max(self.server.bandwidth // 100, 1)
+    for offset in range(start, len(data), block):
+      if drop is not None and sent >= drop:
+        self.server.dropped.add(self.path)
+        self.close_connection = True
+        return
+      self.wfile.write(data[offset:offset + block])
+      sent += block
+      time.sleep(block / self.server.bandwidth)
+
+
+def legacy_download(destination, url, session, files, file_number, counters):
+  # what download_file and verify_download did before, a size HEAD, 16 KiB chunks with a params write each,
+  # and a second HEAD to verify the size afterwards
+  total_size = int(session.head(url, headers={"Accept-Encoding": "identity"}, timeout=10).headers.get("Content-Length", 0))
+  with session.get(url, stream=True, timeout=10) as response, tempfile.NamedTemporaryFile(delete=False, dir=destination.parent) as temp_file:
+    downloaded_size = 0
+    for chunk in response.iter_content(chunk_size=16384):
+      params_memory.get_bool(CANCEL_PARAM)
+      temp_file.write(chunk)
+      downloaded_size += len(chunk)
+      params_memory.put(PROGRESS_PARAM, f"{((file_number - 1) + downloaded_size / total_size) / files * 100:.0f}%")
+      counters["params"] += 2
+  Path(temp_file.name).rename(destination)
+  return int(session.head(url, timeout=10).headers.get("Content-Length", 0)) == destination.stat().st_size
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Downloading a batch of models from a local stand-in server, one after another in 16 KiB chunks "
+                                               "against the resumable download queue")
+  parser.add_argument("--files", type=int, default=6)
+  parser.add_argument("--size", type=int, default=8 * 1024 * 1024, help="bytes per file")
+  parser.add_argument("--bandwidth", type=int, default=16 * 1024 * 1024, help="bytes/s per connection")
+  parser.add_argument("--latency", type=float, default=0.2, help="seconds before each response body")
+  parser.add_argument("--drop-after", type=int, default=None, help="drop every file's first connection after this many bytes")
+  args = parser.parse_args()
+
+  server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+  server.daemon_threads = True
+  server.files = {f"/Models/model_{i}.thneed": bytes(range(256)) * (args.size // 256) for i in range(args.files)}
+  server.checksums = {}
+  for path, data in server.files.items():
+    hasher = git_blob_hasher(len(data))
+    hasher.update(data)
+    server.checksums[path] = hasher.hexdigest()
+  server.bandwidth, server.latency, server.drop_after = args.bandwidth, args.latency, args.drop_after
+  server.dropped = set()
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+  session = requests.Session()
+  params_memory.remove(CANCEL_PARAM)
+  with tempfile.TemporaryDirectory() as tmp:
+    legacy_dir, queued_dir = Path(tmp) / "legacy", Path(tmp) / "queued"
+    legacy_dir.mkdir()
+    queued_dir.mkdir()
+
+    if args.drop_after is None:
+      counters = {"params": 0}
+      start = time.monotonic()
+      for file_number, path in enumerate(server.files, start=1):
+        assert legacy_download(legacy_dir / Path(path).name, base_url + path, session, args.files, file_number, counters)
+      print(f"{'sequential':>12}: {time.monotonic() - start:6.2f} s, {counters['params']} params reads and writes")
+    else:
+      print(f"{'sequential':>12}: can't resume, a dropped connection fails the download")
+
+    server.dropped = set()
+    progress = DownloadProgress(PROGRESS_PARAM, CANCEL_PARAM, files=args.files)
+    start = time.monotonic()
+    downloads = [download_queue.submit(download_file, CANCEL_PARAM, queued_dir / Path(path).name, PROGRESS_PARAM, base_url + path, "ModelToDownload",
+                                       session, server.checksums[path], progress) for path in server.files]
+    results = [download.result() for download in downloads]
+    print(f"{'queued':>12}: {time.monotonic() - start:6.2f} s, {len(server.dropped)} connections dropped and resumed")
+
+    assert all(results), "a queued download failed"
+    for path, data in server.files.items():
+      assert (queued_dir / Path(path).name).read_bytes() == data
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from catpilot.system.hardware.sysfs import FakeSysfs
+
+THERMAL_PATH = "/sys/devices/virtual/thermal"
+POWER_PATH = "/sys/class/hwmon/hwmon1/power1_input"
+VOLTAGE_PATH = "/sys/class/power_supply/bms/voltage_now"
+CURRENT_PATH = "/sys/class/power_supply/bms/current_now"
+MAX_BRIGHTNESS_PATH = "/sys/class/backlight/panel0-backlight/max_brightness"
+BRIGHTNESS_PATH = "/sys/class/backlight/panel0-backlight/brightness"
+GPUBUSY_PATH = "/sys/class/kgsl/kgsl-3d0/gpubusy"
+
+opens = 0
+
+
+def count_opens(event, args):
+  global opens
+  if event == "open":
+    opens += 1
+
+
+def read_syscalls():
+  with open("/proc/self/io", "rb") as f:
+    return int(f.read().split(b"syscr: ")[1].split(b"\n")[0])
+
+
+def legacy_tick(fake, zones):
+  # what a deviceState publish read before, an open and read per file through read_tz and read_param_file
+  def read_file(path, parser):
+    try:
+      with open(os.path.join(fake.root, path.lstrip("/"))) as f:
+        return parser(f.read())
+    except Exception:
+      return 0
+
+  temps = [read_file(f"{THERMAL_PATH}/thermal_zone{z}/temp", int) for z in zones]
+  used, total = read_file(GPUBUSY_PATH, str.split)
+  brightness = read_file(BRIGHTNESS_PATH, float) / (read_file(MAX_BRIGHTNESS_PATH, float) / 100.)
+  power = [read_file(POWER_PATH, int) for _ in range(2)]  # hardwared and PowerMonitoring
+  som_power = read_file(VOLTAGE_PATH, int) * read_file(CURRENT_PATH, int)
+  return temps, int(used) / int(total), brightness, power, som_power
+
+
+def sampler_tick(sampler, zones):
+  sampler.update()
+  temps = [sampler.get(f"{THERMAL_PATH}/thermal_zone{z}/temp") for z in zones]
+  used, total = sampler.read(GPUBUSY_PATH, bytes.split, default=None)
+  brightness = sampler.read(BRIGHTNESS_PATH, float) / (sampler.read(MAX_BRIGHTNESS_PATH, float, interval=None) / 100.)
+  power = [sampler.read(POWER_PATH) for _ in range(2)]
+  som_power = sampler.read(VOLTAGE_PATH) * sampler.read(CURRENT_PATH)
+  return temps, int(used) / int(total), brightness, power, som_power
+
+
+def measure(name, tick, ticks):
+  global opens
+  cpu_times = np.empty(ticks)
+  opens, reads = 0, read_syscalls()
+  for i in range(ticks):
+    start = time.thread_time()
+    result = tick()
+    cpu_times[i] = time.thread_time() - start
+  reads = read_syscalls() - reads - 1
+  print(f"{name:>8}: {opens / ticks:5.1f} opens and {reads / ticks:5.1f} reads per publish, "
+        f"cpu mean {cpu_times.mean() * 1e6:6.1f} us  p99 {np.percentile(cpu_times, 99) * 1e6:6.1f} us")
+  return result
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Syscalls and CPU time of the sysfs reads behind each deviceState publish, opening every file "
+                                               "against the sampler's open descriptors, on a fake sysfs tree laid out like a tici")
+  parser.add_argument("--ticks", type=int, default=2000)
+  parser.add_argument("--zones", type=int, default=13, help="thermal zones read per publish")
+  args = parser.parse_args()
+
+  zones = list(range(args.zones))
+  files = {f"{THERMAL_PATH}/thermal_zone{z}/temp": 40000 + z for z in zones}
+  files.update({POWER_PATH: 3500000, VOLTAGE_PATH: 4200000, CURRENT_PATH: 900000, MAX_BRIGHTNESS_PATH: 1023, BRIGHTNESS_PATH: 512,
+                GPUBUSY_PATH: "120 1000"})
+  fake = FakeSysfs(files)
+  sampler = fake.sampler()
+  for z in zones:
+    sampler.add(f"{THERMAL_PATH}/thermal_zone{z}/temp")
+
+  sys.addaudithook(count_opens)
+  legacy = measure("legacy", lambda: legacy_tick(fake, zones), args.ticks)
+  sampled = measure("sampler", lambda: sampler_tick(sampler, zones), args.ticks)
+  assert legacy == sampled, "sampler read different values"
+
+  sampler.close()
+  fake.cleanup()
+
+
+if __name__ == "__main__":
+  main()
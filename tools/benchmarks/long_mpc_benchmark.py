@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import numpy as np
+
+from catpilot.common.numpy_fast import clip
+from catpilot.selfdrive.controls.lib.longitudinal_mpc_lib.long_mpc import COST_E_DIM, N, T_IDXS, LongitudinalMpc, get_T_FOLLOW
+from catpilot.selfdrive.controls.lib.longitudinal_planner import LongitudinalPlanner
+from catpilot.tools.lib.logreader import LogReader
+
+
+class LegacyLongitudinalMpc(LongitudinalMpc):
+  # what run did before the bulk transfers, one set and get per horizon node
+  def set_cost_weights(self, cost_weights, constraint_cost_weights):
+    self.cost_weights = None
+    super().set_cost_weights(cost_weights, constraint_cost_weights)
+
+  def run(self):
+    for i in range(N):
+      self.solver.set(i, "yref", self.yref[i])
+    self.solver.set(N, "yref", self.yref[N][:COST_E_DIM])
+    for i in range(N+1):
+      self.solver.set(i, 'p', self.params[i])
+    self.solver.constraints_set(0, "lbx", self.x0)
+    self.solver.constraints_set(0, "ubx", self.x0)
+
+    self.solution_status = self.solver.solve()
+    self.solve_time = float(self.solver.get_stats('time_tot')[0])
+
+    self.x_sol = np.zeros_like(self.x_sol)
+    self.u_sol = np.zeros_like(self.u_sol)
+    for i in range(N+1):
+      self.x_sol[i] = self.solver.get(i, 'x')
+    for i in range(N):
+      self.u_sol[i] = self.solver.get(i, 'u')
+
+    self.v_solution = self.x_sol[:,1]
+    self.a_solution = self.x_sol[:,2]
+    self.j_solution = self.u_sol[:,0]
+    self.prev_a = np.interp(T_IDXS + self.dt, T_IDXS, self.a_solution)
+
+    if self.solution_status != 0:
+      self.reset()
+
+
+def read_inputs(route):
+  # planner inputs for every modelV2, with the latest radarState and carState before it
+  inputs, radar_state, car_state = [], None, None
+  for msg in LogReader(route, sort_by_time=True).filter(["modelV2", "radarState", "carState"]):
+    which = msg.which()
+    if which == "radarState":
+      radar_state = msg.radarState
+    elif which == "carState":
+      car_state = msg.carState
+    elif radar_state is not None and car_state is not None:
+      inputs.append((msg.modelV2, radar_state, car_state))
+  return inputs
+
+
+def measure(name, mpc, inputs, mode):
+  mpc.mode = mode
+  mpc.set_accel_limits(-3.5, 2.0)
+  solve_times, overhead_times, solutions = [], [], []
+  for model, radar_state, car_state in inputs:
+    x, v, a, j, _ = LongitudinalPlanner.parse_model(model, 0.0, car_state.vEgo, False)
+    start = time.perf_counter()
+    mpc.set_weights()
+    mpc.set_cur_state(car_state.vEgo, clip(car_state.aEgo, -3.5, 2.0))
+    mpc.update(radar_state.leadOne, radar_state.leadTwo, car_state.cruiseState.speed, x, v, a, j, get_T_FOLLOW(), True)
+    elapsed = time.perf_counter() - start
+    solve_times.append(mpc.solve_time)
+    overhead_times.append(elapsed - mpc.solve_time)
+    solutions.append(np.copy(mpc.x_sol))
+
+  solve_times, overhead_times = np.array(solve_times) * 1e6, np.array(overhead_times) * 1e6
+  print(f"{name:>15}: solve mean {solve_times.mean():7.1f} us  p99 {np.percentile(solve_times, 99):7.1f} us, "
+        f"overhead mean {overhead_times.mean():7.1f} us  p99 {np.percentile(overhead_times, 99):7.1f} us")
+  return np.array(solutions)
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Solve time and Python overhead of the longitudinal MPC on recorded modelV2 and radarState, "
+                                               "setting and reading every horizon node on its own against the bulk transfers")
+  parser.add_argument("route", help="route or log to replay, anything LogReader takes")
+  parser.add_argument("--mode", choices=["acc", "blended"], default="acc")
+  args = parser.parse_args()
+
+  inputs = read_inputs(args.route)
+  print(f"{len(inputs)} planner cycles")
+
+  legacy = measure("per node", LegacyLongitudinalMpc(), inputs, args.mode)
+  bulk = measure("bulk", LongitudinalMpc(), inputs, args.mode)
+  assert np.array_equal(legacy, bulk), "bulk transfers changed the solution"
+
+  shifted = measure("bulk, shifted", LongitudinalMpc(shift_solution=True), inputs, args.mode)
+  print(f"warm start shifting moves the trajectory by at most {np.abs(shifted - bulk).max():.3g}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import numpy as np
+
+import cereal.messaging as messaging
+from catpilot.selfdrive.modeld.constants import ModelConstants, Plan
+from catpilot.selfdrive.modeld.fill_model_msg import PublishState, fill_model_msg, get_plan_t_idxs
+from catpilot.selfdrive.modeld.parse_model_outputs import Parser, safe_exp, sigmoid, softmax
+
+META_WIDTH = 55
+
+
+class LegacyParser(Parser):
+  # what parse_mdn and parse_binary_crossentropy did before they were vectorized, one softmax and argsort per hypothesis
+  def parse_binary_crossentropy(self, name, outs):
+    if self.check_missing(outs, name):
+      return
+    outs[name] = sigmoid(outs[name])
+
+  def parse_mdn(self, name, outs, in_N=0, out_N=1, out_shape=None):
+    if self.check_missing(outs, name):
+      return
+    raw = outs[name]
+    raw = raw.reshape((raw.shape[0], max(in_N, 1), -1))
+
+    n_values = (raw.shape[2] - out_N)//2
+    pred_mu = raw[:,:,:n_values]
+    pred_std = safe_exp(raw[:,:,n_values: 2*n_values])
+
+    if in_N > 1:
+      weights = np.zeros((raw.shape[0], in_N, out_N), dtype=raw.dtype)
+      for i in range(out_N):
+        weights[:,:,i - out_N] = softmax(raw[:,:,i - out_N], axis=-1)
+
+      if out_N == 1:
+        for fidx in range(weights.shape[0]):
+          idxs = np.argsort(weights[fidx][:,0])[::-1]
+          weights[fidx] = weights[fidx][idxs]
+          pred_mu[fidx] = pred_mu[fidx][idxs]
+          pred_std[fidx] = pred_std[fidx][idxs]
+      full_shape = tuple([raw.shape[0], in_N] + list(out_shape))
+      outs[name + '_weights'] = weights
+      outs[name + '_hypotheses'] = pred_mu.reshape(full_shape)
+      outs[name + '_stds_hypotheses'] = pred_std.reshape(full_shape)
+
+      pred_mu_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
+      pred_std_final = np.zeros((raw.shape[0], out_N, n_values), dtype=raw.dtype)
+      for fidx in range(weights.shape[0]):
+        for hidx in range(out_N):
+          idxs = np.argsort(weights[fidx,:,hidx])[::-1]
+          pred_mu_final[fidx, hidx] = pred_mu[fidx, idxs[0]]
+          pred_std_final[fidx, hidx] = pred_std[fidx, idxs[0]]
+    else:
+      pred_mu_final = pred_mu
+      pred_std_final = pred_std
+
+    if out_N > 1:
+      final_shape = tuple([raw.shape[0], out_N] + list(out_shape))
+    else:
+      final_shape = tuple([raw.shape[0],] + list(out_shape))
+    outs[name] = pred_mu_final.reshape(final_shape)
+    outs[name + '_stds'] = pred_std_final.reshape(final_shape)
+
+
+def legacy_plan_t_idxs(plan_x):
+  plan_t_idxs = [np.nan] * ModelConstants.IDX_N
+  plan_t_idxs[0] = 0.0
+  plan_x = plan_x.tolist()
+  for xidx in range(1, ModelConstants.IDX_N):
+    tidx = 0
+    while tidx < ModelConstants.IDX_N - 1 and plan_x[tidx+1] < ModelConstants.X_IDXS[xidx]:
+      tidx += 1
+    if tidx == ModelConstants.IDX_N - 1:
+      plan_t_idxs[xidx] = ModelConstants.T_IDXS[ModelConstants.IDX_N - 1]
+      break
+    current_x_val = plan_x[tidx]
+    next_x_val = plan_x[tidx+1]
+    p = (ModelConstants.X_IDXS[xidx] - current_x_val) / (next_x_val - current_x_val) if abs(next_x_val - current_x_val) > 1e-9 else float('nan')
+    plan_t_idxs[xidx] = p * ModelConstants.T_IDXS[tidx+1] + (1 - p) * ModelConstants.T_IDXS[tidx]
+  return plan_t_idxs
+
+
+def mdn_width(in_N, out_N, out_shape):
+  n_values = int(np.prod(out_shape))
+  return 2 * n_values if in_N == 0 else in_N * (2 * n_values + out_N)
+
+
+def random_outputs(rng):
+  # raw outputs shaped like the driving model's, with a plan that moves forward
+  widths = {
+    'plan': mdn_width(ModelConstants.PLAN_MHP_N, ModelConstants.PLAN_MHP_SELECTION, (ModelConstants.IDX_N, ModelConstants.PLAN_WIDTH)),
+    'lane_lines': mdn_width(0, 0, (ModelConstants.NUM_LANE_LINES, ModelConstants.IDX_N, ModelConstants.LANE_LINES_WIDTH)),
+    'road_edges': mdn_width(0, 0, (ModelConstants.NUM_ROAD_EDGES, ModelConstants.IDX_N, ModelConstants.LANE_LINES_WIDTH)),
+    'pose': mdn_width(0, 0, (ModelConstants.POSE_WIDTH,)),
+    'road_transform': mdn_width(0, 0, (ModelConstants.POSE_WIDTH,)),
+    'wide_from_device_euler': mdn_width(0, 0, (ModelConstants.WIDE_FROM_DEVICE_WIDTH,)),
+    'lead': mdn_width(ModelConstants.LEAD_MHP_N, ModelConstants.LEAD_MHP_SELECTION, (ModelConstants.LEAD_TRAJ_LEN, ModelConstants.LEAD_WIDTH)),
+    'lead_prob': ModelConstants.LEAD_MHP_SELECTION,
+    'lane_lines_prob': 2 * ModelConstants.NUM_LANE_LINES,
+    'meta': META_WIDTH,
+    'desire_state': ModelConstants.DESIRE_PRED_WIDTH,
+    'desire_pred': ModelConstants.DESIRE_PRED_LEN * ModelConstants.DESIRE_PRED_WIDTH,
+  }
+  outs = {name: rng.standard_normal((1, width)).astype(np.float32) for name, width in widths.items()}
+  plan = outs['plan'].reshape(ModelConstants.PLAN_MHP_N, -1)[:, :ModelConstants.IDX_N * ModelConstants.PLAN_WIDTH]
+  for hypothesis in plan.reshape(ModelConstants.PLAN_MHP_N, ModelConstants.IDX_N, ModelConstants.PLAN_WIDTH):
+    hypothesis[:, Plan.POSITION.start] = np.cumsum(rng.uniform(0, 10, ModelConstants.IDX_N))
+  return outs
+
+
+def measure(fn, frames):
+  timings = np.empty(len(frames))
+  results = []
+  for i, outs in enumerate(frames):
+    outs = {k: v.copy() for k, v in outs.items()}
+    start = time.perf_counter()
+    result = fn(outs)
+    timings[i] = time.perf_counter() - start
+    # the parser reuses its buffers, keep a copy of this frame
+    results.append({k: v.copy() for k, v in result.items()} if isinstance(result, dict) else result)
+  return timings * 1e6, results
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Per-frame cost of decoding the driving model outputs and building modelV2, "
+                                               "looping over hypotheses against the vectorized parser")
+  parser.add_argument("--frames", type=int, default=2000)
+  args = parser.parse_args()
+
+  rng = np.random.default_rng(0)
+  frames = [random_outputs(rng) for _ in range(args.frames)]
+
+  def fill(outs):
+    base_msg, extended_msg = messaging.new_message('drivingModelData'), messaging.new_message('modelV2')
+    fill_model_msg(base_msg, extended_msg, outs, 20., 0.2, PublishState(), 0, 0, 0, 0., 0, 0., True)
+    return extended_msg
+
+  parsers = {"legacy": LegacyParser(), "vectorized": Parser()}
+  for name, p in parsers.items():
+    timings, parsed = measure(p.parse_outputs, frames)
+    parsers[name] = parsed
+    print(f"{'parse ' + name:>22}: mean {timings.mean():6.1f} us  p99 {np.percentile(timings, 99):6.1f} us")
+
+  for legacy, vectorized in zip(parsers["legacy"], parsers["vectorized"], strict=True):
+    assert legacy.keys() == vectorized.keys()
+    assert all(np.array_equal(legacy[k], vectorized[k]) for k in legacy), "vectorized parser differs from the legacy one"
+
+  plan_x = [outs['plan'][0, :, Plan.POSITION][:, 0] for outs in parsers["vectorized"]]
+  for name, fn in (("legacy", legacy_plan_t_idxs), ("vectorized", get_plan_t_idxs)):
+    timings = np.empty(len(plan_x))
+    for i, x in enumerate(plan_x):
+      start = time.perf_counter()
+      fn(x)
+      timings[i] = time.perf_counter() - start
+    timings *= 1e6
+    print(f"{'plan t idxs ' + name:>22}: mean {timings.mean():6.1f} us  p99 {np.percentile(timings, 99):6.1f} us")
+  assert all(np.array_equal(legacy_plan_t_idxs(x), get_plan_t_idxs(x), equal_nan=True) for x in plan_x)
+
+  vectorized = Parser()
+  timings, _ = measure(lambda outs: fill(vectorized.parse_outputs(outs)), frames)
+  print(f"{'parse and fill':>22}: mean {timings.mean():6.1f} us  p99 {np.percentile(timings, 99):6.1f} us")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import time
+import tracemalloc
+
+import numpy as np
+
+from catpilot.catpilot.common.catpilot_variables import TORQUE_NN_MODEL_PATH
+from catpilot.catpilot.controls.lib.neural_network_feedforward import FluxModel
+
+
+def synthetic_tick():
+  v_ego, roll = random.uniform(5, 35), random.uniform(-0.1, 0.1)
+  setpoint, measurement = random.uniform(-2, 2), random.uniform(-2, 2)
+  jerk_setpoint, jerk_measurement = random.uniform(-1, 1), random.uniform(-1, 1)
+  history = [random.uniform(-2, 2) for _ in range(7)]
+  common = [random.uniform(-0.1, 0.1) for _ in range(7)]
+  return v_ego, roll, setpoint, measurement, jerk_setpoint, jerk_measurement, history, common
+
+
+def per_query(model, tick):
+  # what compute_nnff did before batching, four evaluate calls built from lists
+  v_ego, roll, setpoint, measurement, jerk_setpoint, jerk_measurement, history, common = tick
+  model.evaluate([v_ego, setpoint, jerk_setpoint, roll] + [setpoint] * 7 + common)
+  model.evaluate([v_ego, measurement, jerk_measurement, roll] + [measurement] * 7 + common)
+  model.evaluate([v_ego, setpoint - measurement, jerk_setpoint - jerk_measurement, 0.0])
+  model.evaluate([v_ego, setpoint, jerk_setpoint, roll] + history + common)
+
+
+def batched(model, nn_inputs, tick):
+  v_ego, roll, setpoint, measurement, jerk_setpoint, jerk_measurement, history, common = tick
+  nn_inputs.fill(0.0)
+  nn_inputs[:, 0] = v_ego
+  nn_inputs[0, 1:4] = (setpoint, jerk_setpoint, roll)
+  nn_inputs[0, 4:11] = setpoint
+  nn_inputs[1, 1:4] = (measurement, jerk_measurement, roll)
+  nn_inputs[1, 4:11] = measurement
+  nn_inputs[2, 1:3] = (setpoint - measurement, jerk_setpoint - jerk_measurement)
+  nn_inputs[3, 1:4] = (setpoint, jerk_setpoint, roll)
+  nn_inputs[3, 4:11] = history
+  nn_inputs[(0, 1, 3), 11:] = common
+  model.evaluate_batch(nn_inputs).tolist()
+
+
+def measure(fn, ticks):
+  timings = np.empty(len(ticks))
+  for i, tick in enumerate(ticks):
+    start = time.perf_counter()
+    fn(tick)
+    timings[i] = time.perf_counter() - start
+
+  # peak of the temporaries a single tick allocates
+  tracemalloc.start()
+  fn(ticks[0])
+  tracemalloc.reset_peak()
+  fn(ticks[1])
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return timings * 1e6, peak
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Per-tick cost of the NNFF torque model, one evaluate per query against one batched pass")
+  parser.add_argument("--model", default="TOYOTA_RAV4_TSS2")
+  parser.add_argument("--ticks", type=int, default=10000)
+  args = parser.parse_args()
+
+  model = FluxModel(TORQUE_NN_MODEL_PATH / f"{args.model}.json")
+  nn_inputs = np.zeros((4, model.input_size), dtype=np.float32)
+  ticks = [synthetic_tick() for _ in range(args.ticks)]
+
+  for name, fn in (("per query", lambda tick: per_query(model, tick)), ("batched", lambda tick: batched(model, nn_inputs, tick))):
+    timings, peak = measure(fn, ticks)
+    print(f"{name:>10}: mean {timings.mean():6.1f} us  p99 {np.percentile(timings, 99):6.1f} us  peak allocated per tick {peak / 1024:.1f} KiB")
+
+
+if __name__ == "__main__":
+  main()
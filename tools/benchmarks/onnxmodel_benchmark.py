@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import onnx
+import onnxruntime as ort
+from onnx import TensorProto, helper, numpy_helper
+
+from catpilot.selfdrive.modeld.runners.onnxmodel import ONNXModel, create_ort_session
+from catpilot.selfdrive.modeld.runners.ort_helpers import ORT_TYPES_TO_NP_TYPES, convert_fp16_to_fp32
+
+
+def synthetic_model(path, channels=32, size=(128, 256), outputs=6504):
+  # fp16 conv stack ending in a dense layer, shaped like a small driving model
+  rng = np.random.default_rng(0)
+  nodes, initializers = [], []
+  prev, prev_channels = "input_imgs", 12
+  for i in range(4):
+    weight = numpy_helper.from_array((rng.standard_normal((channels, prev_channels, 3, 3)) * 0.1).astype(np.float16), f"w{i}")
+    initializers.append(weight)
+    nodes.append(helper.make_node("Conv", [prev, f"w{i}"], [f"c{i}"], strides=[2, 2], pads=[1, 1, 1, 1]))
+    nodes.append(helper.make_node("Relu", [f"c{i}"], [f"r{i}"]))
+    prev, prev_channels = f"r{i}", channels
+  flat = channels * (size[0] // 16) * (size[1] // 16)
+  initializers.append(numpy_helper.from_array((rng.standard_normal((flat, outputs)) * 0.01).astype(np.float16), "dense"))
+  nodes.append(helper.make_node("Flatten", [prev], ["flat"]))
+  nodes.append(helper.make_node("MatMul", ["flat", "dense"], ["outputs"]))
+
+  graph = helper.make_graph(nodes, "synthetic",
+                            [helper.make_tensor_value_info("input_imgs", TensorProto.FLOAT16, [1, 12, *size])],
+                            [helper.make_tensor_value_info("outputs", TensorProto.FLOAT16, [1, outputs])], initializers)
+  onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)], ir_version=8), path)
+  return outputs
+
+
+def uncached_session(path):
+  # what create_ort_session did on every start before the model cache
+  options = ort.SessionOptions()
+  options.intra_op_num_threads = 2
+  options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+  options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+  return ort.InferenceSession(convert_fp16_to_fp32(onnx.load(path)), options, providers=['CPUExecutionProvider'])
+
+
+def timed(fn):
+  start = time.perf_counter()
+  result = fn()
+  return result, (time.perf_counter() - start) * 1e3
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Start up and per inference cost of the onnx runner on CPU, with and without the model cache and IOBinding")
+  parser.add_argument("model", nargs="?", help="onnx model with a single output, a synthetic one by default")
+  parser.add_argument("--runs", type=int, default=200)
+  args = parser.parse_args()
+
+  with tempfile.TemporaryDirectory() as tmpdir:
+    os.environ["MODEL_CACHE"] = os.path.join(tmpdir, "cache")
+    os.environ["ONNXCPU"] = "1"
+    path = args.model or os.path.join(tmpdir, "synthetic.onnx")
+    if args.model is None:
+      synthetic_model(path)
+
+    session, uncached_ms = timed(lambda: uncached_session(path))
+    _, cold_ms = timed(lambda: create_ort_session(path, fp16_to_fp32=True))
+    _, warm_ms = timed(lambda: create_ort_session(path, fp16_to_fp32=True))
+    print(f"start up: uncached {uncached_ms:7.1f} ms  cold cache {cold_ms:7.1f} ms  warm cache {warm_ms:7.1f} ms")
+
+    output = np.zeros(int(np.prod(session.get_outputs()[0].shape[1:])), dtype=np.float32)
+    model = ONNXModel(path, output, None, False, None)
+    inputs = {}
+    for x in session.get_inputs():
+      inputs[x.name] = np.random.rand(int(np.prod(x.shape[1:]))).astype(np.float32)
+      model.addInput(x.name, inputs[x.name])
+    input_shapes = {x.name: [1, *x.shape[1:]] for x in session.get_inputs()}
+    input_dtypes = {x.name: ORT_TYPES_TO_NP_TYPES[x.type] for x in session.get_inputs()}
+
+    def run_copying():
+      # what ONNXModel.execute did before IOBinding
+      feed = {k: v.view(input_dtypes[k]) for k, v in inputs.items()}
+      feed = {k: v.reshape(input_shapes[k]).astype(input_dtypes[k]) for k, v in feed.items()}
+      output[:] = session.run(None, feed)[0]
+
+    for name, fn in (("copying", run_copying), ("iobinding", model.execute)):
+      fn()
+      timings = np.empty(args.runs)
+      for i in range(args.runs):
+        _, timings[i] = timed(fn)
+      print(f"{name:>10}: mean {timings.mean():6.2f} ms  p99 {np.percentile(timings, 99):6.2f} ms per inference")
+
+
+if __name__ == "__main__":
+  main()
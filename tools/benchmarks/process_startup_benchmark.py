@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import cereal.messaging as messaging
+from cereal.services import SERVICE_LIST
+import catpilot.system.manager.process as process
+from catpilot.system.manager.process import PythonProcess
+from catpilot.system.manager.process_config import managed_processes
+
+
+def first_message(socks, timeout):
+  deadline = time.monotonic() + timeout
+  while time.monotonic() < deadline:
+    for service, sock in socks.items():
+      if sock.receive(non_blocking=True) is not None:
+        return service
+    time.sleep(0.001)
+  return None
+
+
+def measure(p, socks, timeout):
+  for sock in socks.values():
+    while sock.receive(non_blocking=True) is not None:
+      pass
+
+  # the start ensure_running does for a process that should run, until the process publishes anything
+  start = time.perf_counter()
+  p.start()
+  try:
+    service = first_message(socks, timeout)
+    return service, time.perf_counter() - start
+  finally:
+    p.stop()
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Time from starting each python daemon to its first published message, forked from the manager "
+                                               "against forked from the zygote. Run with the manager stopped.")
+  parser.add_argument("processes", nargs="*", help="daemons to start, all enabled python daemons by default")
+  parser.add_argument("--timeout", type=float, default=10.)
+  args = parser.parse_args()
+
+  procs = [p for p in managed_processes.values() if isinstance(p, PythonProcess) and p.enabled and (not args.processes or p.name in args.processes)]
+  socks = {s: messaging.sub_sock(s, conflate=True) for s in SERVICE_LIST}
+
+  results = {}
+  for mode in ("manager", "zygote"):
+    process.ENABLE_ZYGOTE = mode == "zygote"
+    for p in procs:
+      p.prepare()
+
+    if process.ENABLE_ZYGOTE:
+      # start the zygote and let it finish preloading before timing anything
+      warmup = process.zygote.get_context().Process(target=time.sleep, args=(0,))
+      warmup.start()
+      warmup.join()
+
+    for p in procs:
+      results[(mode, p.name)] = measure(p, socks, args.timeout)
+
+  print(f"{'daemon':>24} {'first message':>24} {'manager':>10} {'zygote':>10}")
+  for p in procs:
+    service, manager_s = results[("manager", p.name)]
+    _, zygote_s = results[("zygote", p.name)]
+    if service is None:
+      print(f"{p.name:>24} {'(none)':>24} {'-':>10} {'-':>10}")
+    else:
+      print(f"{p.name:>24} {service:>24} {manager_s * 1e3:8.1f}ms {zygote_s * 1e3:8.1f}ms")
+
+
+if __name__ == "__main__":
+  main()
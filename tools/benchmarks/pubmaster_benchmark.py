@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+import cereal.messaging as messaging
+
+LIST_SIZES = {"liveTracks": 32, "onroadEvents": 4}
+
+
+def fill(service, dat):
+  # populate the message like its publisher does, so the builder sees realistic sizes
+  msg = getattr(dat, service)
+  if service == "modelV2":
+    for field in ("position", "orientation", "velocity", "orientationRate", "acceleration"):
+      xyzt = getattr(msg, field)
+      for axis in ("x", "y", "z", "t", "xStd", "yStd", "zStd"):
+        setattr(xyzt, axis, np.random.rand(33).tolist())
+    lanes = msg.init("laneLines", 4)
+    for lane in lanes:
+      lane.x, lane.y, lane.z, lane.t = (np.random.rand(33).tolist() for _ in range(4))
+    edges = msg.init("roadEdges", 2)
+    for edge in edges:
+      edge.x, edge.y, edge.z, edge.t = (np.random.rand(33).tolist() for _ in range(4))
+    leads = msg.init("leadsV3", 3)
+    for lead in leads:
+      lead.x, lead.y, lead.v, lead.a, lead.t = (np.random.rand(6).tolist() for _ in range(5))
+  elif service == "liveTracks":
+    for index, point in enumerate(msg):
+      point.trackId = index
+      point.dRel, point.yRel, point.vRel = np.random.rand(3).tolist()
+  elif service == "controlsState":
+    msg.alertText1 = "TAKE CONTROL IMMEDIATELY"
+    msg.alertText2 = "Steering Temporarily Unavailable"
+    msg.lateralControlState.init("torqueState").output = 0.5
+  elif service == "carState":
+    msg.vEgo = 20.0
+    msg.init("buttonEvents", 2)
+    msg.init("events", 4)
+
+
+def measure(fn, iterations):
+  timings = np.empty(iterations)
+  for i in range(iterations):
+    start = time.perf_counter()
+    fn()
+    timings[i] = time.perf_counter() - start
+
+  tracemalloc.start()
+  fn()
+  tracemalloc.reset_peak()
+  fn()
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return timings * 1e6, peak
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Cost of building and serializing a message, messaging.new_message against a PubMaster builder")
+  parser.add_argument("--services", nargs="+", default=["modelV2", "liveTracks", "controlsState", "carState"])
+  parser.add_argument("--iterations", type=int, default=5000)
+  args = parser.parse_args()
+
+  for service in args.services:
+    size = LIST_SIZES.get(service)
+    builder = messaging.MessageBuilder(service)
+
+    def default():
+      dat = messaging.new_message(service, size)
+      fill(service, dat)
+      return dat.to_bytes()
+
+    def sized():
+      dat = builder.new_message(size)
+      fill(service, dat)
+      return builder.to_bytes(dat)
+
+    print(f"{service} ({len(default())} bytes)")
+    for name, fn in (("new_message", default), ("builder", sized)):
+      timings, peak = measure(fn, args.iterations)
+      print(f"  {name:>12}: mean {timings.mean():6.1f} us  p99 {np.percentile(timings, 99):6.1f} us  peak allocated {peak / 1024:.1f} KiB")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import argparse
+import random
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from catpilot.selfdrive.controls.radard import KalmanParams, TrackTable, get_adjacent_lead, get_lead
+
+
+def synthetic_model(points=33):
+  x = np.linspace(0, 100, points).tolist()
+  lanes = [SimpleNamespace(x=x, y=[offset + 0.01 * d for d in x]) for offset in (-5.4, -1.8, 1.8, 5.4)]
+  return SimpleNamespace(laneLines=lanes)
+
+
+def synthetic_lead():
+  return SimpleNamespace(prob=0.9, x=[random.uniform(5, 80)], y=[random.uniform(-1, 1)], v=[random.uniform(0, 30)], a=[0.0],
+                         xStd=[1.0], yStd=[0.5], vStd=[1.0])
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Per-cycle latency of the radard track update and lead selection")
+  parser.add_argument("--tracks", type=int, nargs="+", default=[8, 16, 32, 64, 128])
+  parser.add_argument("--cycles", type=int, default=2000)
+  args = parser.parse_args()
+
+  model = synthetic_model()
+  toggles = SimpleNamespace(lead_detection_probability=0.5, increased_stopped_distance=0.0)
+  car_state = SimpleNamespace(trafficModeEnabled=False)
+
+  for count in args.tracks:
+    tracks = TrackTable(KalmanParams(0.05))
+    identifiers = np.arange(count, dtype=np.int64)
+    leads = [synthetic_lead() for _ in range(64)]
+
+    timings = np.empty(args.cycles)
+    for cycle in range(args.cycles):
+      # drop and replace a few tracks each cycle like a real radar does
+      identifiers[random.randrange(count)] = count + cycle
+      points = np.random.uniform((0, -6, -10, 1), (80, 6, 5, 1), (count, 4))
+      v_ego = random.uniform(0, 30)
+      lead = leads[cycle % len(leads)]
+
+      start = time.perf_counter()
+      tracks.update(identifiers, points[:, 0], points[:, 1], points[:, 2], points[:, 2] + v_ego, points[:, 3])
+      get_lead(v_ego, True, tracks, lead, v_ego, model, False, toggles, car_state, low_speed_override=True)
+      get_lead(v_ego, True, tracks, lead, v_ego, model, False, toggles, car_state, low_speed_override=False)
+      get_adjacent_lead(tracks, False, model, left=True)
+      get_adjacent_lead(tracks, False, model, left=False)
+      timings[cycle] = time.perf_counter() - start
+
+    timings *= 1e6
+    print(f"{count:4d} tracks: mean {timings.mean():7.1f} us  p50 {np.percentile(timings, 50):7.1f} us  p99 {np.percentile(timings, 99):7.1f} us")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import argparse
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from catpilot.system.loggerd.config import STATS_BATCH_SIZE
+from catpilot.system.statsd import METRIC_TYPE, QuantileSketch, decode_batch, encode_batch
+
+PERCENTILES = (0.05, 0.5, 0.95)
+
+
+def string_protocol(names, values, gauge_every):
+  # what StatLog and the statsd loop did before batching, one formatted string per metric and sorted samples
+  messages = []
+  for i, (name, value) in enumerate(zip(names, values, strict=True)):
+    metric_type = METRIC_TYPE.GAUGE if i % gauge_every == 0 else METRIC_TYPE.SAMPLE
+    messages.append(f"{name}:{value}|{metric_type}")
+
+  gauges = {}
+  samples = defaultdict(list)
+  for metric in messages:
+    metric_type = metric.split('|')[1]
+    metric_name = metric.split(':')[0]
+    metric_value = float(metric.split('|')[0].split(':')[1])
+    if metric_type == METRIC_TYPE.GAUGE:
+      gauges[metric_name] = metric_value
+    else:
+      samples[metric_name].append(metric_value)
+
+  results = {}
+  for key, sample_values in samples.items():
+    sample_values.sort()
+    results[key] = [sample_values[int(round(p * (len(sample_values) - 1)))] for p in PERCENTILES]
+  return results
+
+
+def batched_protocol(names, values, gauge_every):
+  batches = []
+  gauges = {}
+  sketches = {}
+  for i, (name, value) in enumerate(zip(names, values, strict=True)):
+    if i % gauge_every == 0:
+      gauges[name] = value
+    else:
+      sketch = sketches.get(name)
+      if sketch is None:
+        sketch = sketches[name] = QuantileSketch()
+      sketch.add(value)
+    if (i + 1) % STATS_BATCH_SIZE == 0:
+      batches.append(encode_batch(gauges, sketches))
+      gauges, sketches = {}, {}
+  batches.append(encode_batch(gauges, sketches))
+
+  merged_gauges = {}
+  merged = {}
+  for dat in batches:
+    batch_gauges, batch_sketches = decode_batch(dat)
+    merged_gauges.update(batch_gauges)
+    for key, sketch in batch_sketches.items():
+      if key in merged:
+        merged[key].merge(sketch)
+      else:
+        merged[key] = sketch
+  return {key: [sketch.quantile(p) for p in PERCENTILES] for key, sketch in merged.items()}
+
+
+def main():
+  parser = argparse.ArgumentParser(description="CPU cost of statsd per million metrics, string protocol against binary pre-aggregated batches")
+  parser.add_argument("--samples", type=int, default=1_000_000)
+  parser.add_argument("--names", type=int, default=50)
+  parser.add_argument("--gauge-every", type=int, default=4, help="every Nth metric is a gauge, the rest samples")
+  args = parser.parse_args()
+
+  rng = np.random.default_rng(0)
+  names = [f"metric_{i}" for i in rng.integers(0, args.names, args.samples)]
+  values = rng.lognormal(0, 1, args.samples).tolist()
+
+  results = {}
+  for name, fn in (("string", string_protocol), ("batched", batched_protocol)):
+    start = time.process_time()
+    results[name] = fn(names, values, args.gauge_every)
+    cpu_s = time.process_time() - start
+    print(f"{name:>8}: {cpu_s * 1e6 / args.samples:.2f} s CPU per million metrics")
+
+  errors = [abs(b - s) / abs(s) for key in results["string"] for s, b in zip(results["string"][key], results["batched"][key], strict=True)]
+  print(f"percentile relative error: max {max(errors):.4f}  (sketch accuracy {QuantileSketch.RELATIVE_ACCURACY})")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+import numpy as np
+
+import cereal.messaging as messaging
+from cereal.services import SERVICE_LIST
+
+DT = 0.01  # update at 100Hz like controlsd
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Cost of SubMaster.update_msgs with every service subscribed")
+  parser.add_argument("--updates", type=int, default=10000)
+  args = parser.parse_args()
+
+  services = list(SERVICE_LIST.keys())
+  sm = messaging.SubMaster(services)
+
+  # one reader per service, delivered at the service's own rate
+  msgs = {}
+  for s in services:
+    try:
+      msgs[s] = messaging.new_message(s).as_reader()
+    except Exception:
+      msgs[s] = messaging.new_message(s, 0).as_reader()
+  periods = {s: max(round(1. / (SERVICE_LIST[s].frequency * DT)), 1) for s in services if SERVICE_LIST[s].frequency > 0}
+
+  timings = np.empty(args.updates)
+  for i in range(args.updates):
+    batch = [msgs[s] for s, period in periods.items() if i % period == 0]
+    start = time.perf_counter()
+    sm.update_msgs(i * DT, batch)
+    timings[i] = time.perf_counter() - start
+
+  timings *= 1e6
+  print(f"{len(services)} services, {args.updates} updates")
+  print(f"  update_msgs: mean {timings.mean():.1f} us  p50 {np.percentile(timings, 50):.1f} us  p99 {np.percentile(timings, 99):.1f} us")
+  for s in ("carState", "modelV2", "deviceState"):
+    if s in sm.data:
+      stats = ", ".join(f"{k} {v:.4f}" for k, v in sm.service_stats(s).items())
+      print(f"  {s}: {stats}")
+
+
+if __name__ == "__main__":
+  main()
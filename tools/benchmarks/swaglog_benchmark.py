@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+import zmq
+
+os.environ.setdefault("CATPILOT_PREFIX", "_swaglog_benchmark")
+
+from catpilot.common.logging_extra import SwagFormatter, SwagLogger
+from catpilot.common.swaglog import UnixDomainSocketHandler
+from catpilot.system.hardware.hw import Paths
+
+DT = 0.01  # 100Hz like controlsd
+
+
+class SynchronousSocketHandler(logging.Handler):
+  # what UnixDomainSocketHandler did before batching, format and send on the logging thread
+  def __init__(self, formatter, sock):
+    super().__init__()
+    self.setFormatter(formatter)
+    self.sock = sock
+
+  def emit(self, record):
+    msg = self.format(record).rstrip('\n')
+    try:
+      self.sock.send((chr(record.levelno) + msg).encode('utf8'), zmq.NOBLOCK)
+    except zmq.error.Again:
+      pass
+
+
+def control_loop(log, cycles, logs_per_cycle):
+  # time spent in the loop body, where each cycle logs a few events next to its real work
+  timings = np.empty(cycles)
+  next_cycle = time.monotonic()
+  for i in range(cycles):
+    start = time.perf_counter()
+    for j in range(logs_per_cycle):
+      log.event("controlsd step", frame=i, index=j, v_ego=20.0, curvature=0.001, enabled=True)
+    timings[i] = time.perf_counter() - start
+
+    next_cycle += DT
+    time.sleep(max(next_cycle - time.monotonic(), 0))
+  return timings * 1e6
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Jitter logging adds to a 100Hz loop, formatting and sending inline against the batched handler")
+  parser.add_argument("--cycles", type=int, default=1000)
+  parser.add_argument("--logs-per-cycle", type=int, default=5)
+  args = parser.parse_args()
+
+  # stand in for logmessaged
+  ctx = zmq.Context.instance()
+  receiver = ctx.socket(zmq.PULL)
+  receiver.bind(Paths.swaglog_ipc())
+
+  for name in ("inline", "batched"):
+    log = SwagLogger()
+    log.setLevel(logging.DEBUG)
+    if name == "inline":
+      sender = ctx.socket(zmq.PUSH)
+      sender.connect(Paths.swaglog_ipc())
+      handler = SynchronousSocketHandler(SwagFormatter(log), sender)
+    else:
+      handler = UnixDomainSocketHandler(SwagFormatter(log))
+    log.addHandler(handler)
+
+    timings = control_loop(log, args.cycles, args.logs_per_cycle)
+    handler.flush()
+
+    received = 0
+    while True:
+      try:
+        received += len(receiver.recv_multipart(zmq.NOBLOCK))
+      except zmq.error.Again:
+        break
+    handler.close()
+
+    print(f"{name:>8}: mean {timings.mean():6.1f} us  p99 {np.percentile(timings, 99):6.1f} us  max {timings.max():7.1f} us per cycle, "
+          f"{received} of {args.cycles * args.logs_per_cycle} records received")
+
+
+if __name__ == "__main__":
+  main()
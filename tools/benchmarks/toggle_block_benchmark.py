@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+
+from catpilot.catpilot.common.catpilot_toggle_block import BlockToggles, ToggleBlockReader, ToggleBlockWriter
+
+
+def synthetic_toggles(count):
+  # roughly the mix of the real CatPilotToggles: mostly bools, then numbers, a few strings and lists
+  toggles = {}
+  for i in range(count):
+    kind = random.random()
+    if kind < 0.6:
+      toggles[f"toggle_{i}"] = random.random() < 0.5
+    elif kind < 0.75:
+      toggles[f"toggle_{i}"] = random.randint(0, 100)
+    elif kind < 0.9:
+      toggles[f"toggle_{i}"] = random.uniform(0, 10)
+    elif kind < 0.97:
+      toggles[f"toggle_{i}"] = f"value {i}"
+    else:
+      toggles[f"toggle_{i}"] = [random.random() for _ in range(4)]
+  return toggles
+
+
+def timeit(fn, iterations):
+  start = time.perf_counter()
+  for _ in range(iterations):
+    fn()
+  return (time.perf_counter() - start) / iterations * 1e6
+
+
+def time_refresh(publish, toggles, consumer, changed, iterations):
+  # what a consumer pays after each togglesUpdated, the writer publishes with `changed` toggles flipped in between
+  names = [name for name, value in toggles.items() if isinstance(value, bool)][:changed]
+  elapsed = 0.
+  for _ in range(iterations):
+    for name in names:
+      toggles[name] = not toggles[name]
+    publish(toggles)
+    start = time.perf_counter()
+    consumer()
+    elapsed += time.perf_counter() - start
+  return elapsed / iterations * 1e6
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Compare CatPilotToggles JSON reloads against the shared memory toggle block, "
+                                               "rebuilding the consumer's toggles against refreshing them in place")
+  parser.add_argument("--fields", type=int, default=400)
+  parser.add_argument("--iterations", type=int, default=10000)
+  args = parser.parse_args()
+
+  toggles = synthetic_toggles(args.fields)
+  encoded = json.dumps(toggles).encode()
+
+  with tempfile.TemporaryDirectory() as tmp:
+    path = os.path.join(tmp, "catpilot_toggles")
+    writer = ToggleBlockWriter(path)
+    reader = ToggleBlockReader(path)
+
+    writer.publish(toggles)
+    assert reader.read() == toggles
+
+    results = {
+      "publish json.dumps": timeit(lambda: json.dumps(toggles), args.iterations),
+      "publish toggle block": timeit(lambda: writer.publish(toggles), args.iterations),
+      "reload json.loads": timeit(lambda: SimpleNamespace(**json.loads(encoded)), args.iterations),
+      "reload toggle block": timeit(lambda: SimpleNamespace(**reader.read()), args.iterations),
+      "single field read": timeit(lambda: reader.get("toggle_0"), args.iterations),
+      "sequence poll": timeit(lambda: reader.sequence, args.iterations),
+    }
+
+    # the consumer path, as the daemons reload on togglesUpdated
+    published = {}
+    results["consumer json.loads"] = time_refresh(lambda toggles: published.update(json=json.dumps(toggles)), toggles,
+                                                  lambda: SimpleNamespace(**json.loads(published["json"])), 1, args.iterations)
+    results["consumer rebuild"] = time_refresh(writer.publish, toggles, lambda: SimpleNamespace(**reader.read()), 1, args.iterations)
+
+    consumer = BlockToggles(reader)
+    consumer.refresh()
+    for changed in (0, 1, 10):
+      results[f"consumer refresh, {changed} changed"] = time_refresh(writer.publish, toggles, consumer.refresh, changed, args.iterations)
+    assert vars(consumer) == toggles
+
+  print(f"{args.fields} fields, {len(encoded)} bytes of JSON")
+  for name, us in results.items():
+    print(f"  {name:<28} {us:8.2f} us")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+
+from catpilot.common.params import Params
+from catpilot.common.realtime import DT_MDL
+
+from catpilot.catpilot.common.stats_store import StatsStore, read_stats
+from catpilot.catpilot.controls.lib.catpilot_tracking import TRACKING_COUNTERS, CatPilotTracking
+
+python_threads = 0
+
+
+def count_threads(event, args):
+  global python_threads
+  if event in ("_thread.start_new_thread", "_thread.start_joinable_thread"):
+    python_threads += 1
+
+
+def written_bytes():
+  with open("/proc/self/io", "rb") as f:
+    return int(f.read().split(b"wchar: ")[1].split(b"\n")[0])
+
+
+class LegacyTracking:
+  # what CatPilotTracking.update did before the stats store, a JSON rewrite and a nonblocking put, each its own thread, per flush
+  def __init__(self, params, params_tracking):
+    self.params, self.params_tracking = params, params_tracking
+    self.catpilot_stats = json.loads(params.get("CatPilotStats") or "{}")
+    self.total_drives = params_tracking.get_int("CatPilotDrives")
+    self.total_kilometers = params_tracking.get_float("CatPilotKilometers")
+    self.total_minutes = params_tracking.get_float("CatPilotMinutes")
+    self.drive_added = self.enabled = False
+    self.aol_engaged_time = self.drive_distance = self.drive_time = self.lateral_engaged_time = self.longitudinal_engaged_time = 0
+    self.put_threads = 0
+
+  def update(self, sm):
+    self.enabled |= sm["controlsState"].enabled or sm["catpilotCarState"].alwaysOnLateralEnabled
+    self.drive_distance += sm["carState"].vEgo * DT_MDL
+    self.drive_time += DT_MDL
+    if sm["carControl"].latActive:
+      self.lateral_engaged_time += DT_MDL
+    if sm["carControl"].longActive:
+      self.longitudinal_engaged_time += DT_MDL
+    elif sm["catpilotCarState"].alwaysOnLateralEnabled:
+      self.aol_engaged_time += DT_MDL
+
+    if self.drive_time > 60 and sm["carState"].standstill and self.enabled:
+      self.total_kilometers += self.drive_distance / 1000
+      self.params_tracking.put_float_nonblocking("CatPilotKilometers", self.total_kilometers)
+      self.total_minutes += self.drive_time / 60
+      self.params_tracking.put_float_nonblocking("CatPilotMinutes", self.total_minutes)
+      self.put_threads += 2
+      for key, elapsed in (("TotalAOLTime", self.aol_engaged_time), ("TotalLateralTime", self.lateral_engaged_time),
+                           ("TotalLongitudinalTime", self.longitudinal_engaged_time), ("TotalTrackedTime", self.drive_time)):
+        self.catpilot_stats[key] = self.catpilot_stats.get(key, 0) + elapsed
+      self.params.put("CatPilotStats", json.dumps(self.catpilot_stats))
+      self.aol_engaged_time = self.drive_distance = self.drive_time = self.lateral_engaged_time = self.longitudinal_engaged_time = 0
+      if not self.drive_added:
+        self.total_drives += 1
+        self.params_tracking.put_int_nonblocking("CatPilotDrives", self.total_drives)
+        self.put_threads += 1
+        self.drive_added = True
+
+
+def drive(minutes, stop_every):
+  # a drive that comes to a stop for a few seconds every stop_every seconds
+  frames = int(minutes * 60 / DT_MDL)
+  for frame in range(frames):
+    t = frame * DT_MDL
+    standstill = t % stop_every > stop_every - 3
+    yield {
+      "carState": SimpleNamespace(vEgo=0. if standstill else 20. + 5. * np.sin(t / 30), standstill=standstill),
+      "carControl": SimpleNamespace(latActive=frame % 7 != 0, longActive=frame % 5 != 0),
+      "controlsState": SimpleNamespace(enabled=True),
+      "catpilotCarState": SimpleNamespace(alwaysOnLateralEnabled=frame % 5 == 0),
+    }
+
+
+def measure(name, make_tracking, frames, threads):
+  global python_threads
+  python_threads, written = 0, written_bytes()
+  tracking = make_tracking()
+  update_times = []
+  for sm in frames:
+    start = time.thread_time()
+    tracking.update(sm)
+    update_times.append(time.thread_time() - start)
+  time.sleep(0.5)  # let the nonblocking puts and the flush thread finish
+  update_times = np.array(update_times) * 1e6
+  print(f"{name:>12}: update mean {update_times.mean():6.2f} us  p99 {np.percentile(update_times, 99):6.2f} us  max {update_times.max():8.1f} us, "
+        f"{threads(tracking) + python_threads} threads started, {(written_bytes() - written) / 1e3:7.1f} kB written")
+  return tracking
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Planner thread time, threads and bytes written by the drive statistics, JSON rewrites and "
+                                               "nonblocking Params puts against the write-behind stats store")
+  parser.add_argument("--minutes", type=float, default=240.)
+  parser.add_argument("--stop-every", type=float, default=65., help="seconds between stops, the statistics flush on the first stop after a minute")
+  args = parser.parse_args()
+
+  frames = list(drive(args.minutes, args.stop_every))
+  sys.addaudithook(count_threads)
+
+  with tempfile.TemporaryDirectory() as tmp:
+    params, params_tracking = Params(f"{tmp}/params"), Params(f"{tmp}/tracking")
+    legacy = measure("legacy", lambda: LegacyTracking(params, params_tracking), frames, lambda tracking: tracking.put_threads)
+    store = measure("stats store", lambda: CatPilotTracking(StatsStore(Path(tmp) / "tracking_stats", TRACKING_COUNTERS)), frames,
+                    lambda tracking: 0).stats
+    store.close()
+
+    stats, _, _, _ = read_stats(Path(tmp) / "tracking_stats")
+    legacy_stats = {**legacy.catpilot_stats, "CatPilotDrives": legacy.total_drives, "CatPilotKilometers": legacy.total_kilometers,
+                    "CatPilotMinutes": legacy.total_minutes}
+    for name, value in legacy_stats.items():
+      assert abs(stats[name] - value) < 1e-6 * max(abs(value), 1.), f"{name} differs, {stats[name]} against {value}"
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from catpilot.tools.lib.filereader import FileReader
+from catpilot.tools.lib.vidindex import HEVC_CODED_SLICE_SEGMENT_NAL_UNITS, HEVC_PARAMETER_SET_NAL_UNITS, HevcIndexer, hevc_index, \
+                                        get_hevc_nal_unit_length, get_hevc_nal_unit_type, get_hevc_slice_type, require_nal_unit_start
+
+CAMERA_FPS = 20
+GOP_SIZE = 20
+
+
+def nal_unit(nal_unit_type, payload):
+  return b"\x00\x00\x00\x01" + bytes(((nal_unit_type << 1) & 0x7E, 0x01)) + payload
+
+
+def synthetic_stream(frames, frame_size, rng):
+  # parameter sets followed by one IDR every GOP_SIZE frames and P frames between them, payloads carry
+  # emulation prevention bytes so the only start codes are the real ones
+  dat = bytearray(nal_unit(32, b"\x0c\x01") + nal_unit(33, b"\x01\x01") + nal_unit(34, b"\xc1\x72"))
+  for i in range(frames):
+    payload = rng.integers(0, 256, frame_size, dtype=np.uint8).tobytes().replace(b"\x00\x00", b"\x00\x00\x03")
+    if i % GOP_SIZE == 0:
+      dat += nal_unit(19, bytes((0b10101100,)) + payload)  # first slice, no_output_of_prior_pics, pps 0, I slice
+    else:
+      dat += nal_unit(1, bytes((0b11010000,)) + payload)  # first slice, pps 0, P slice
+  return bytes(dat)
+
+
+def bytewise_hevc_index(hevc_file_name):
+  # the NAL unit walk hevc_index did before it was vectorized
+  with FileReader(hevc_file_name) as f:
+    dat = f.read()
+
+  prefix_dat = b""
+  frame_types = []
+  i = 1
+  while i < len(dat):
+    require_nal_unit_start(dat, i)
+    nal_unit_len = get_hevc_nal_unit_length(dat, i)
+    nal_unit_type = get_hevc_nal_unit_type(dat, i)
+    if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
+      prefix_dat += dat[i:i+nal_unit_len]
+    elif nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
+      slice_type, is_first_slice = get_hevc_slice_type(dat, i, nal_unit_type)
+      if is_first_slice:
+        frame_types.append((slice_type, i))
+    i += nal_unit_len
+  return frame_types, len(dat), prefix_dat
+
+
+def timed(fn, runs):
+  timings = []
+  for _ in range(runs):
+    start = time.perf_counter()
+    result = fn()
+    timings.append(time.perf_counter() - start)
+  return result, min(timings) * 1e3
+
+
+def main():
+  parser = argparse.ArgumentParser(description="hevc_index against the bytewise NAL unit walk, and the cost of indexing a growing file")
+  parser.add_argument("files", nargs="*", help="real .hevc files to index as well")
+  parser.add_argument("--frame-sizes", type=int, nargs="+", default=[2000, 40000], help="synthetic frame sizes, qcamera and fcamera like")
+  parser.add_argument("--seconds", type=int, default=60)
+  parser.add_argument("--runs", type=int, default=3)
+  args = parser.parse_args()
+
+  rng = np.random.default_rng(0)
+  with tempfile.TemporaryDirectory() as tmpdir:
+    streams = list(args.files)
+    for frame_size in args.frame_sizes:
+      path = os.path.join(tmpdir, f"synthetic_{frame_size}.hevc")
+      with open(path, "wb") as f:
+        f.write(synthetic_stream(args.seconds * CAMERA_FPS, frame_size, rng))
+      streams.append(path)
+
+    for path in streams:
+      expected, bytewise_ms = timed(lambda: bytewise_hevc_index(path), args.runs)
+      result, vectorized_ms = timed(lambda: hevc_index(path), args.runs)
+      assert result == expected, f"{path}: index mismatch"
+      print(f"{os.path.basename(path)} ({os.path.getsize(path) / 1e6:.1f} MB, {len(result[0])} frames)")
+      print(f"  bytewise {bytewise_ms:7.1f} ms  vectorized {vectorized_ms:7.1f} ms")
+
+      # replay the file being recorded a second at a time, once with a full reindex per second and once incrementally
+      with open(path, "rb") as f:
+        dat = f.read()
+      growing = os.path.join(tmpdir, "growing.hevc")
+      steps = np.linspace(0, len(dat), args.seconds + 1).astype(int)
+
+      open(growing, "wb").close()
+      start = time.perf_counter()
+      for begin, end in zip(steps[:-1], steps[1:], strict=True):
+        with open(growing, "ab") as f:
+          f.write(dat[begin:end])
+        hevc_index(growing)
+      full_ms = (time.perf_counter() - start) * 1e3
+
+      open(growing, "wb").close()
+      indexer = HevcIndexer(growing)
+      start = time.perf_counter()
+      for begin, end in zip(steps[:-1], steps[1:], strict=True):
+        with open(growing, "ab") as f:
+          f.write(dat[begin:end])
+        indexer.update(final=end == len(dat))
+      incremental_ms = (time.perf_counter() - start) * 1e3
+      assert indexer.index() == expected, f"{path}: incremental index mismatch"
+      print(f"  {args.seconds} appends: full reindex {full_ms:7.1f} ms  incremental {incremental_ms:7.1f} ms")
+
+
+if __name__ == "__main__":
+  main()
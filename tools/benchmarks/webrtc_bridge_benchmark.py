@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+import numpy as np
+
+import cereal.messaging as messaging
+from catpilot.system.webrtc.webrtcd import CerealOutgoingMessageProxy, CerealProxyRunner
+
+SERVICES = {"carState": 100, "controlsState": 100, "modelV2": 20, "deviceState": 2}
+FIELDS = {"carState": ["vEgo", "fuelGauge", "cruiseState.speed"], "controlsState": ["enabled", "curvature"], "modelV2": ["position.x", "position.y"],
+          "deviceState": ["cpuTempC"]}
+
+
+class FakeChannel:
+  # stands in for the peer's RTCDataChannel, which sends on the event loop
+  def __init__(self):
+    self.sent_bytes = 0
+    self.sent_msgs = 0
+
+  def send(self, data):
+    self.sent_bytes += len(data)
+    self.sent_msgs += 1
+
+
+class LegacyOutgoingMessageProxy(CerealOutgoingMessageProxy):
+  # what update did before the bridge thread, every service converted whole and sent from the event loop
+  def update(self):
+    self.sm.update(0)
+    for service, updated in self.sm.updated.items():
+      if not updated:
+        continue
+      msg_dict = self.to_json(self.sm[service])
+      mono_time, valid = self.sm.logMonoTime[service], self.sm.valid[service]
+      outgoing_msg = {"type": service, "logMonoTime": mono_time, "valid": valid, "data": msg_dict}
+      encoded_msg = json.dumps(outgoing_msg).encode()
+      for channel in self.channels:
+        channel.send(encoded_msg)
+
+
+def publish(stop_event):
+  pm = messaging.PubMaster(list(SERVICES))
+  frame = 0
+  while not stop_event.is_set():
+    for service, freq in SERVICES.items():
+      if frame % (100 // freq):
+        continue
+      msg = messaging.new_message(service)
+      if service == "carState":
+        msg.carState.vEgo = 20. + float(np.sin(frame / 100))
+        msg.carState.fuelGauge = 0.8
+      elif service == "controlsState":
+        msg.controlsState.enabled = True
+        msg.controlsState.curvature = 0.001 * float(np.cos(frame / 100))
+      elif service == "modelV2":
+        for name in ("position", "velocity", "acceleration", "orientation", "orientationRate"):
+          xyzt = getattr(msg.modelV2, name)
+          xyzt.x, xyzt.y, xyzt.z, xyzt.t = (np.random.standard_normal(33).tolist() for _ in range(4))
+        msg.modelV2.laneLines = [msg.modelV2.position] * 4
+        msg.modelV2.roadEdges = [msg.modelV2.position] * 2
+      elif service == "deviceState":
+        msg.deviceState.cpuTempC = [50., 51., 52., 53.]
+      pm.send(service, msg)
+    frame += 1
+    time.sleep(0.01)
+
+
+async def probe_stalls(seconds, interval=0.001):
+  # how late the event loop wakes up a task sleeping for interval
+  stalls = []
+  end = time.monotonic() + seconds
+  while time.monotonic() < end:
+    start = time.perf_counter()
+    await asyncio.sleep(interval)
+    stalls.append(time.perf_counter() - start - interval)
+  return np.array(stalls) * 1e3
+
+
+async def legacy_run(proxy, seconds):
+  end = time.monotonic() + seconds
+  while time.monotonic() < end:
+    proxy.update()
+    await asyncio.sleep(0.01)
+
+
+async def measure(name, proxy, legacy, seconds):
+  channel = FakeChannel()
+  proxy.add_channel(channel)
+  if legacy:
+    task = asyncio.create_task(legacy_run(proxy, seconds))
+    stalls = await probe_stalls(seconds)
+    await task
+  else:
+    runner = CerealProxyRunner(proxy)
+    runner.start()
+    stalls = await probe_stalls(seconds)
+    runner.stop()
+    runner.thread.join()
+  print(f"{name:>20}: loop stall p99 {np.percentile(stalls, 99):6.2f} ms  max {stalls.max():6.2f} ms, "
+        f"{channel.sent_bytes / seconds / 1e3:8.1f} kB/s in {channel.sent_msgs / seconds:6.1f} sends/s")
+
+
+async def main():
+  parser = argparse.ArgumentParser(description="Event loop stalls and bandwidth of the outgoing webrtcd bridge against a local fake peer, "
+                                               "polling and converting on the loop against the bridge thread with projection and delta encoding")
+  parser.add_argument("--seconds", type=float, default=5.)
+  args = parser.parse_args()
+
+  stop_event = threading.Event()
+  publisher = threading.Thread(target=publish, args=(stop_event,), daemon=True)
+  publisher.start()
+
+  configs = [
+    ("legacy", LegacyOutgoingMessageProxy, {}, True),
+    ("json", CerealOutgoingMessageProxy, {}, False),
+    ("json, projected", CerealOutgoingMessageProxy, {"fields": FIELDS}, False),
+    ("delta", CerealOutgoingMessageProxy, {"encoding": "delta"}, False),
+    ("delta, projected", CerealOutgoingMessageProxy, {"fields": FIELDS, "encoding": "delta"}, False),
+  ]
+  for name, proxy_cls, kwargs, legacy in configs:
+    await measure(name, proxy_cls(messaging.SubMaster(list(SERVICES)), **kwargs), legacy, args.seconds)
+
+  stop_event.set()
+  publisher.join()
+
+
+if __name__ == "__main__":
+  asyncio.run(main())
@@ -1,14 +1,15 @@
 import json
 import os
-import pickle
+import queue
+import select
 import struct
 import subprocess
 import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from enum import IntEnum
-from functools import wraps
 
 import numpy as np
-from lru import LRU
 
 import _io
 from catpilot.tools.lib.cache import cache_path_for_file_path, DEFAULT_CACHE_DIR
@@ -22,6 +23,17 @@ HEVC_SLICE_B = 0
 HEVC_SLICE_P = 1
 HEVC_SLICE_I = 2
 
+# end of sequence NAL unit, appended to every GOP sent to a persistent decoder so it flushes all pending frames
+HEVC_EOS_NAL_UNIT = b"\x00\x00\x01\x48\x01"
+
+# a worker that outputs nothing for this long is stuck on a GOP that decoded to fewer frames than expected
+DECODE_TIMEOUT = 10.
+MAX_DECODERS = 4
+GOP_CACHE_BYTES = 512 * 1024 * 1024
+
+VIDEO_INDEX_MAGIC = b"GOPIDX01"
+VIDEO_INDEX_HEADER = struct.Struct("<8sIII")  # magic, index rows, prefix length, probe length
+
 
 class GOPReader:
   def get_gop(self, num):
@@ -29,14 +41,6 @@ class GOPReader:
     raise NotImplementedError
 
 
-class DoNothingContextManager:
-  def __enter__(self):
-    return self
-
-  def __exit__(self, *x):
-    pass
-
-
 class FrameType(IntEnum):
   raw = 1
   h265_stream = 2
@@ -74,43 +78,57 @@ def ffprobe(fn, fmt=None):
   return json.loads(ffprobe_output)
 
 
-def cache_fn(func):
-  @wraps(func)
-  def cache_inner(fn, *args, **kwargs):
-    if kwargs.pop('no_cache', None):
-      cache_path = None
-    else:
-      cache_dir = kwargs.pop('cache_dir', DEFAULT_CACHE_DIR)
-      cache_path = cache_path_for_file_path(fn, cache_dir)
-
-    if cache_path and os.path.exists(cache_path):
-      with open(cache_path, "rb") as cache_file:
-        cache_value = pickle.load(cache_file)
-    else:
-      cache_value = func(fn, *args, **kwargs)
-      if cache_path:
-        with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as cache_file:
-          pickle.dump(cache_value, cache_file, -1)
-
-    return cache_value
-
-  return cache_inner
+def save_video_index(path, index_data):
+  index = np.ascontiguousarray(index_data['index'], dtype=np.uint32)
+  probe = json.dumps(index_data['probe']).encode()
+  with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+    f.write(VIDEO_INDEX_HEADER.pack(VIDEO_INDEX_MAGIC, index.shape[0], len(index_data['global_prefix']), len(probe)))
+    f.write(index_data['global_prefix'])
+    f.write(probe)
+    f.write(index.tobytes())
+
+
+def load_video_index(path):
+  with open(path, "rb") as f:
+    dat = f.read()
+  if len(dat) < VIDEO_INDEX_HEADER.size:
+    return None
+  magic, rows, prefix_len, probe_len = VIDEO_INDEX_HEADER.unpack_from(dat)
+  if magic != VIDEO_INDEX_MAGIC:
+    return None
+
+  prefix_start = VIDEO_INDEX_HEADER.size
+  probe_start = prefix_start + prefix_len
+  index_start = probe_start + probe_len
+  return {
+    'index': np.frombuffer(dat, dtype=np.uint32, count=rows * 2, offset=index_start).reshape(rows, 2),
+    'global_prefix': dat[prefix_start:probe_start],
+    'probe': json.loads(dat[probe_start:index_start]),
+  }
 
 
-@cache_fn
-def index_stream(fn, ft):
+def index_stream(fn, ft, cache_dir=DEFAULT_CACHE_DIR, no_cache=False):
   if ft != FrameType.h265_stream:
     raise NotImplementedError("Only h265 supported")
 
+  cache_path = None if no_cache else cache_path_for_file_path(fn, cache_dir)
+  if cache_path and os.path.exists(cache_path):
+    index_data = load_video_index(cache_path)
+    if index_data is not None:
+      return index_data
+
   frame_types, dat_len, prefix = hevc_index(fn)
   index = np.array(frame_types + [(0xFFFFFFFF, dat_len)], dtype=np.uint32)
   probe = ffprobe(fn, "hevc")
 
-  return {
+  index_data = {
     'index': index,
     'global_prefix': prefix,
     'probe': probe
   }
+  if cache_path:
+    save_video_index(cache_path, index_data)
+  return index_data
 
 
 def get_video_index(fn, frame_type, cache_dir=DEFAULT_CACHE_DIR):
@@ -166,6 +184,29 @@ def rgb24tonv12(rgb):
   return nv12.clip(0, 255).astype('uint8')
 
 
+def frame_size(w, h, pix_fmt):
+  if pix_fmt in ("nv12", "yuv420p"):
+    return w*h*3//2
+  elif pix_fmt in ("rgb24", "yuv444p"):
+    return w*h*3
+  raise NotImplementedError
+
+
+def reshape_frames(dat, w, h, pix_fmt):
+  if pix_fmt == "rgb24":
+    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, h, w, 3)
+  elif pix_fmt == "nv12":
+    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
+  elif pix_fmt == "yuv420p":
+    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
+  elif pix_fmt == "yuv444p":
+    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, 3, h, w)
+  else:
+    raise NotImplementedError
+
+  return ret
+
+
 def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt):
   threads = os.getenv("FFMPEG_THREADS", "0")
   cuda = os.getenv("FFMPEG_CUDA", "0") == "1"
@@ -182,19 +223,121 @@ def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt):
           "-pix_fmt", pix_fmt,
           "-"]
   dat = subprocess.check_output(args, input=rawdat)
+  return reshape_frames(dat, w, h, pix_fmt)
 
-  if pix_fmt == "rgb24":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, h, w, 3)
-  elif pix_fmt == "nv12":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
-  elif pix_fmt == "yuv420p":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
-  elif pix_fmt == "yuv444p":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, 3, h, w)
-  else:
-    raise NotImplementedError
 
-  return ret
+class DecoderWorker:
+  """A long-lived ffmpeg process that decodes one GOP at a time streamed over its pipes.
+
+  Every GOP is terminated with an end of sequence NAL unit, which makes the decoder output all of its
+  frames without waiting for more input, so the number of frames to read back is known up front.
+  """
+  def __init__(self, vid_fmt, w, h, pix_fmt):
+    self.w, self.h, self.pix_fmt = w, h, pix_fmt
+    self.out_size = frame_size(w, h, pix_fmt)
+    cuda = os.getenv("FFMPEG_CUDA", "0") == "1"
+    cmd = [
+      "ffmpeg", "-v", "quiet",
+      # frame threading delays output, parallelism comes from running one worker per core instead
+      "-threads", "1",
+      "-hwaccel", "none" if not cuda else "cuda",
+      "-c:v", "hevc",
+      "-analyzeduration", "0",
+      "-probesize", "32",
+      "-fflags", "nobuffer",
+      "-vsync", "0",
+      "-f", vid_fmt,
+      "-flags2", "showall",
+      "-i", "pipe:0",
+      "-f", "rawvideo",
+      "-pix_fmt", pix_fmt,
+      "-flush_packets", "1",
+      "pipe:1"
+    ]
+    self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+    self.write_q: queue.Queue[bytes | None] = queue.Queue()
+    self.t = threading.Thread(target=self.write_thread, daemon=True)
+    self.t.start()
+
+  def write_thread(self):
+    # writes happen on their own thread so a large GOP can't deadlock against a full stdout pipe
+    try:
+      while (dat := self.write_q.get()) is not None:
+        self.proc.stdin.write(dat)
+    except (BrokenPipeError, ValueError):
+      pass
+
+  def alive(self):
+    return self.proc.poll() is None
+
+  def decode(self, rawdat, count):
+    self.write_q.put(rawdat + HEVC_EOS_NAL_UNIT)
+
+    size = count * self.out_size
+    dat = bytearray(size)
+    view = memoryview(dat)
+    pos = 0
+    poller = select.poll()
+    poller.register(self.proc.stdout, select.POLLIN)
+    while pos < size:
+      # ffmpeg doesn't exit on a corrupt or truncated GOP, it just waits for more input
+      if not poller.poll(DECODE_TIMEOUT * 1000):
+        raise DataUnreadableError(f"decoder stalled after {pos // self.out_size}/{count} frames")
+      n = self.proc.stdout.readinto(view[pos:])
+      if not n:
+        raise DataUnreadableError(f"decoder exited after {pos // self.out_size}/{count} frames")
+      pos += n
+    return reshape_frames(dat, self.w, self.h, self.pix_fmt)
+
+  def close(self):
+    self.write_q.put(None)
+    self.proc.kill()
+    self.proc.wait()
+    self.t.join()
+
+
+class DecoderPool:
+  """Idle ffmpeg workers for one output format, started on demand up to max_workers."""
+  def __init__(self, vid_fmt, w, h, pix_fmt, max_workers):
+    self.args = (vid_fmt, w, h, pix_fmt)
+    self.max_workers = max_workers
+    self.idle: queue.LifoQueue[DecoderWorker] = queue.LifoQueue()
+    self.lock = threading.Lock()
+    self.workers: list[DecoderWorker] = []
+
+  def _acquire(self):
+    try:
+      return self.idle.get_nowait()
+    except queue.Empty:
+      pass
+    with self.lock:
+      if len(self.workers) < self.max_workers:
+        worker = DecoderWorker(*self.args)
+        self.workers.append(worker)
+        return worker
+    return self.idle.get()
+
+  def _discard(self, worker):
+    with self.lock:
+      self.workers.remove(worker)
+    worker.close()
+
+  def decode(self, rawdat, count):
+    worker = self._acquire()
+    try:
+      ret = worker.decode(rawdat, count)
+    except Exception:
+      # the stream state of a failed worker is unknown, replace it and fall back to a one-shot decode
+      self._discard(worker)
+      return decompress_video_data(rawdat, *self.args)
+    self.idle.put(worker)
+    return ret
+
+  def close(self):
+    with self.lock:
+      workers, self.workers = self.workers, []
+    for worker in workers:
+      worker.close()
 
 
 class BaseFrameReader:
@@ -281,12 +424,7 @@ class VideoStreamDecompressor:
     self.h = h
     self.pix_fmt = pix_fmt
 
-    if pix_fmt in ("nv12", "yuv420p"):
-      self.out_size = w*h*3//2  # yuv420p
-    elif pix_fmt in ("rgb24", "yuv444p"):
-      self.out_size = w*h*3
-    else:
-      raise NotImplementedError
+    self.out_size = frame_size(w, h, pix_fmt)
 
     self.proc = None
     self.t = threading.Thread(target=self.write_thread)
@@ -383,17 +521,21 @@ class StreamGOPReader(GOPReader):
 
     self.frame_count = len(self.index) - 1
 
+    # GOP boundaries: every I-frame, the first frame and the end marker
+    iframes = np.flatnonzero(self.index[:-1, 0] == HEVC_SLICE_I)
+    self.gop_starts = np.union1d(iframes, [0])
+    self.gop_bounds = np.append(self.gop_starts, self.frame_count)
+
     self.w = probe['streams'][0]['width']
     self.h = probe['streams'][0]['height']
 
-  def _lookup_gop(self, num):
-    frame_b = num
-    while frame_b > 0 and self.index[frame_b, 0] != HEVC_SLICE_I:
-      frame_b -= 1
+  def gop_number(self, num):
+    return int(np.searchsorted(self.gop_starts, num, side='right')) - 1
 
-    frame_e = num + 1
-    while frame_e < (len(self.index) - 1) and self.index[frame_e, 0] != HEVC_SLICE_I:
-      frame_e += 1
+  def _lookup_gop(self, num):
+    gop = self.gop_number(num)
+    frame_b = int(self.gop_bounds[gop])
+    frame_e = int(self.gop_bounds[gop + 1])
 
     offset_b = self.index[frame_b, 1]
     offset_e = self.index[frame_e, 1]
@@ -424,78 +566,92 @@ class StreamGOPReader(GOPReader):
 
 
 class GOPFrameReader(BaseFrameReader):
-  #FrameReader with caching and readahead for formats that are group-of-picture based
+  #FrameReader with GOP caching and prefetch for formats that are group-of-picture based
 
-  def __init__(self, readahead=False, readbehind=False):
+  def __init__(self, readahead=False, readbehind=False, decoders=None, cache_bytes=GOP_CACHE_BYTES):
     self.open_ = True
 
+    # readahead/readbehind always prefetch in their direction, otherwise prefetch starts once access looks sequential
     self.readahead = readahead
     self.readbehind = readbehind
-    self.frame_cache = LRU(64)
-
-    if self.readahead:
-      self.cache_lock = threading.RLock()
-      self.readahead_last = None
-      self.readahead_len = 30
-      self.readahead_c = threading.Condition()
-      self.readahead_thread = threading.Thread(target=self._readahead_thread)
-      self.readahead_thread.daemon = True
-      self.readahead_thread.start()
-    else:
-      self.cache_lock = DoNothingContextManager()
+    self.decoders = decoders or int(os.getenv("FFMPEG_DECODERS", str(min(os.cpu_count() or 1, MAX_DECODERS))))
+    self.prefetch_gops = self.decoders
+    # decoded GOPs are large, a 20 frame rgb24 GOP of a road camera is ~140 MB, so the cache is bounded by bytes
+    self.cache_bytes = cache_bytes
+
+    self.executor = ThreadPoolExecutor(max_workers=self.decoders)
+    self.pools: dict[str, DecoderPool] = {}
+    self.gop_cache: OrderedDict[tuple[int, str], Future] = OrderedDict()
+    self.cache_lock = threading.Lock()
+    self.last_gop = None
 
   def close(self):
     if not self.open_:
       return
     self.open_ = False
 
-    if self.readahead:
-      self.readahead_c.acquire()
-      self.readahead_c.notify()
-      self.readahead_c.release()
-      self.readahead_thread.join()
-
-  def _readahead_thread(self):
-    while True:
-      self.readahead_c.acquire()
-      try:
-        if not self.open_:
-          break
-        self.readahead_c.wait()
-      finally:
-        self.readahead_c.release()
-      if not self.open_:
-        break
-      assert self.readahead_last
-      num, pix_fmt = self.readahead_last
-
-      if self.readbehind:
-        for k in range(num - 1, max(0, num - self.readahead_len), -1):
-          self._get_one(k, pix_fmt)
-      else:
-        for k in range(num, min(self.frame_count, num + self.readahead_len)):
-          self._get_one(k, pix_fmt)
+    self.executor.shutdown(wait=True, cancel_futures=True)
+    for pool in self.pools.values():
+      pool.close()
 
-  def _get_one(self, num, pix_fmt):
-    assert num < self.frame_count
-
-    if (num, pix_fmt) in self.frame_cache:
-      return self.frame_cache[(num, pix_fmt)]
+  def _decode_gop(self, num, pix_fmt):
+    frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
+    ret = self.pools[pix_fmt].decode(rawdat, num_frames + skip_frames)
+    ret = ret[skip_frames:]
+    assert ret.shape[0] == num_frames
+    return ret
 
+  def _request_gop(self, gop, pix_fmt):
+    key = (gop, pix_fmt)
     with self.cache_lock:
-      if (num, pix_fmt) in self.frame_cache:
-        return self.frame_cache[(num, pix_fmt)]
-
-      frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
-
-      ret = decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt)
-      ret = ret[skip_frames:]
-      assert ret.shape[0] == num_frames
+      fut = self.gop_cache.get(key)
+      if fut is not None:
+        self.gop_cache.move_to_end(key)
+        return fut
+
+      if pix_fmt not in self.pools:
+        self.pools[pix_fmt] = DecoderPool(self.vid_fmt, self.w, self.h, pix_fmt, self.decoders)
+      fut = self.executor.submit(self._decode_gop, int(self.gop_starts[gop]), pix_fmt)
+      self.gop_cache[key] = fut
+      self._evict(key)
+      return fut
+
+  def _evict(self, keep):
+    # least recently used decoded GOPs go first, ones still decoding aren't counted and are never dropped
+    decoded = [(key, fut.result().nbytes) for key, fut in self.gop_cache.items() if fut.done() and fut.exception() is None]
+    cached_bytes = sum(nbytes for _, nbytes in decoded)
+    for key, nbytes in decoded:
+      if cached_bytes <= self.cache_bytes:
+        break
+      if key != keep:
+        del self.gop_cache[key]
+        cached_bytes -= nbytes
+    # failed decodes are retried on the next request
+    for key in [key for key, fut in self.gop_cache.items() if fut.done() and fut.exception() is not None and key != keep]:
+      del self.gop_cache[key]
+
+  def _prefetch(self, gop, pix_fmt):
+    direction = 0
+    if self.readbehind:
+      direction = -1
+    elif self.readahead:
+      direction = 1
+    elif self.last_gop is not None and abs(gop - self.last_gop) == 1:
+      direction = gop - self.last_gop
+    self.last_gop = gop
+
+    for k in range(1, self.prefetch_gops + 1 if direction else 1):
+      nxt = gop + direction * k
+      if not (0 <= nxt < len(self.gop_starts)):
+        break
+      self._request_gop(nxt, pix_fmt)
 
-      for i in range(ret.shape[0]):
-        self.frame_cache[(frame_b+i, pix_fmt)] = ret[i]
+  def _get_one(self, num, pix_fmt):
+    assert num < self.frame_count
 
-      return self.frame_cache[(num, pix_fmt)]
+    gop = self.gop_number(num)
+    frames = self._request_gop(gop, pix_fmt).result()
+    return frames[num - int(self.gop_starts[gop])]
 
   def get(self, num, count=1, pix_fmt="yuv420p"):
     assert self.frame_count is not None
@@ -506,15 +662,13 @@ class GOPFrameReader(BaseFrameReader):
     if pix_fmt not in ("nv12", "yuv420p", "rgb24", "yuv444p"):
       raise ValueError(f"Unsupported pixel format {pix_fmt!r}")
 
-    ret = [self._get_one(num + i, pix_fmt) for i in range(count)]
+    # queue every GOP the request spans before waiting on the first, so they decode in parallel
+    first_gop, last_gop = self.gop_number(num), self.gop_number(num + count - 1)
+    for gop in range(first_gop, last_gop + 1):
+      self._request_gop(gop, pix_fmt)
+    self._prefetch(last_gop if not self.readbehind else first_gop, pix_fmt)
 
-    if self.readahead:
-      self.readahead_last = (num+count, pix_fmt)
-      self.readahead_c.acquire()
-      self.readahead_c.notify()
-      self.readahead_c.release()
-
-    return ret
+    return [self._get_one(num + i, pix_fmt) for i in range(count)]
 
 
 class StreamFrameReader(StreamGOPReader, GOPFrameReader):
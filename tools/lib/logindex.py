@@ -0,0 +1,179 @@
+import bz2
+import mmap
+import os
+import struct
+import urllib.parse
+import warnings
+from hashlib import sha256
+
+import capnp
+import numpy as np
+
+from cereal.messaging import log_from_bytes
+from catpilot.common.file_helpers import atomic_write_in_dir
+from catpilot.system.hardware.hw import Paths
+from catpilot.tools.lib.filereader import FileReader
+from catpilot.tools.lib.url_file import URLFile
+
+INDEX_MAGIC = b"LOGIDX01"
+INDEX_HEADER = struct.Struct("<8sII")  # magic, message count, length of the service name table
+READ_CHUNK_SIZE = 1024 * 1024
+
+# per message: byte offset and length in the decompressed log, logMonoTime, service id
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4"), ("mono_time", "<u8"), ("service", "<u2")])
+NO_SERVICE = np.iinfo(np.uint16).max  # the event has no known union member
+
+
+def _cache_key(fn: str) -> str:
+  # local files can change under the same name, so include size and mtime
+  if urllib.parse.urlparse(fn).scheme == "":
+    st = os.stat(fn)
+    fn = f"{os.path.abspath(fn)}:{st.st_size}:{st.st_mtime_ns}"
+  return sha256(fn.split("?")[0].encode("utf-8")).hexdigest()
+
+
+def cache_paths(fn: str) -> tuple[str, str]:
+  base = os.path.join(Paths.download_cache_root(), _cache_key(fn))
+  return base + "_log", base + "_log.idx"
+
+
+def message_length(buf, offset: int) -> int:
+  """Size in bytes of the capnp message starting at offset, computed from its segment table."""
+  segment_count = struct.unpack_from("<I", buf, offset)[0] + 1
+  sizes = struct.unpack_from(f"<{segment_count}I", buf, offset + 4)
+  header_words = (segment_count + 2) // 2  # segment table is padded to a whole word
+  return (header_words + sum(sizes)) * 8
+
+
+def decompress_to(fn: str, dest: str) -> None:
+  """Stream fn into dest, decompressing bz2 on the fly so memory stays bounded."""
+  with FileReader(fn) as f, atomic_write_in_dir(dest, mode="wb", overwrite=True) as out:
+    decompressor = None
+    first = True
+    while True:
+      dat = f.read(READ_CHUNK_SIZE)
+      if not dat:
+        break
+      if first:
+        first = False
+        if dat.startswith(b"BZh9"):
+          decompressor = bz2.BZ2Decompressor()
+      if decompressor is not None:
+        while dat:
+          out.write(decompressor.decompress(dat))
+          # multi-stream bz2 files restart after each end of stream marker
+          dat = decompressor.unused_data if decompressor.eof else b""
+          if dat:
+            decompressor = bz2.BZ2Decompressor()
+      else:
+        out.write(dat)
+
+
+class LogIndex:
+  """Offsets, logMonoTimes and services of every event in a decompressed log, stored as a flat record array."""
+  def __init__(self, services: list[str], records: np.ndarray):
+    self.services = services
+    self.records = records
+    self._service_ids = {s: i for i, s in enumerate(services)}
+
+  def __len__(self) -> int:
+    return len(self.records)
+
+  @classmethod
+  def build(cls, buf) -> 'LogIndex':
+    services: list[str] = []
+    service_ids: dict[str, int] = {}
+    rows = []
+    offset = 0
+    try:
+      while offset < len(buf):
+        length = message_length(buf, offset)
+        if offset + length > len(buf):
+          raise capnp.KjException("truncated message")
+        ev = log_from_bytes(buf[offset:offset + length])
+        try:
+          which = ev.which()
+          sid = service_ids.get(which)
+          if sid is None:
+            sid = service_ids[which] = len(services)
+            services.append(which)
+        except capnp.KjException:
+          sid = NO_SERVICE
+        rows.append((offset, length, ev.logMonoTime, sid))
+        offset += length
+    except (capnp.KjException, struct.error):
+      warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+    return cls(services, np.array(rows, dtype=INDEX_DTYPE))
+
+  @classmethod
+  def load(cls, path: str) -> 'LogIndex':
+    with open(path, "rb") as f:
+      dat = f.read()
+    magic, count, names_len = INDEX_HEADER.unpack_from(dat)
+    if magic != INDEX_MAGIC:
+      raise ValueError(f"unknown log index format in {path}")
+    names_end = INDEX_HEADER.size + names_len
+    names = dat[INDEX_HEADER.size:names_end].decode()
+    records = np.frombuffer(dat, dtype=INDEX_DTYPE, count=count, offset=names_end)
+    return cls(names.split("\n") if names else [], records)
+
+  def save(self, path: str) -> None:
+    names = "\n".join(self.services).encode()
+    with atomic_write_in_dir(path, mode="wb", overwrite=True) as f:
+      f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(self.records), len(names)))
+      f.write(names)
+      f.write(self.records.tobytes())
+
+  def counts(self) -> dict[str, int]:
+    ids, counts = np.unique(self.records["service"], return_counts=True)
+    return {self.services[i]: int(c) for i, c in zip(ids, counts, strict=True) if i != NO_SERVICE}
+
+  def time_range(self, service: str) -> tuple[int, int] | None:
+    mono_times = self.records["mono_time"][self.records["service"] == self._service_ids.get(service, NO_SERVICE)]
+    if not len(mono_times):
+      return None
+    return int(mono_times.min()), int(mono_times.max())
+
+  def select(self, services: list[str] | None = None, only_union_types: bool = False, sort_by_time: bool = False) -> np.ndarray:
+    records = self.records
+    if services is not None:
+      ids = [self._service_ids[s] for s in services if s in self._service_ids]
+      records = records[np.isin(records["service"], ids)]
+    elif only_union_types:
+      records = records[records["service"] != NO_SERVICE]
+    if sort_by_time:
+      records = records[np.argsort(records["mono_time"], kind="stable")]
+    return records
+
+
+class IndexedLog:
+  """A decompressed log in the download cache, mmapped and read through its LogIndex.
+
+  Both files count towards the size cap of the download cache and are evicted with its chunks.
+  """
+  def __init__(self, fn: str):
+    log_path, index_path = cache_paths(fn)
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    cache = URLFile.chunk_cache()
+    if not os.path.exists(log_path):
+      decompress_to(fn, log_path)
+      cache.add(os.path.basename(log_path), os.path.getsize(log_path))
+    else:
+      cache.touch(os.path.basename(log_path))
+
+    with open(log_path, "rb") as f:
+      size = os.fstat(f.fileno()).st_size
+      self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    try:
+      self.index = LogIndex.load(index_path)
+      cache.touch(os.path.basename(index_path))
+    except (OSError, ValueError, struct.error):
+      self.index = LogIndex.build(self._buf)
+      self.index.save(index_path)
+      cache.add(os.path.basename(index_path), os.path.getsize(index_path))
+
+  def events(self, records: np.ndarray):
+    buf = self._buf
+    for offset, length in zip(records["offset"].tolist(), records["length"].tolist(), strict=True):
+      yield log_from_bytes(buf[offset:offset + length])
@@ -19,6 +19,7 @@ from catpilot.common.swaglog import cloudlog
 from catpilot.tools.lib.comma_car_segments import get_url as get_comma_segments_url
 from catpilot.tools.lib.catpilotci import get_url
 from catpilot.tools.lib.filereader import FileReader, file_exists, internal_source_available
+from catpilot.tools.lib.logindex import IndexedLog
 from catpilot.tools.lib.route import Route, SegmentRange
 
 LogMessage = type[capnp._DynamicStructReader]
@@ -27,9 +28,13 @@ RawLogIterable = Iterable[bytes]
 
 
 class _LogFileReader:
-  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None):
+  def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None,
+               services: list[str] | None = None, stream=False):
     self.data_version = None
     self._only_union_types = only_union_types
+    self._sort_by_time = sort_by_time
+    self._services = services
+    self._indexed: IndexedLog | None = None
 
     ext = None
     if not dat:
@@ -38,6 +43,12 @@ class _LogFileReader:
         # old rlogs weren't bz2 compressed
         raise Exception(f"unknown extension {ext}")
 
+      # streaming mode decompresses once into the download cache and reads single events through an index,
+      # so memory stays constant per segment and service filtered reads only touch the events they need
+      if stream or services is not None:
+        self._indexed = IndexedLog(fn)
+        return
+
       with FileReader(fn) as f:
         dat = f.read()
 
@@ -56,7 +67,20 @@ class _LogFileReader:
     self._ents = list(sorted(_ents, key=lambda x: x.logMonoTime) if sort_by_time else _ents)
     self._ts = [x.logMonoTime for x in self._ents]
 
+  def filter(self, services: list[str]) -> Iterator[capnp._DynamicStructReader]:
+    if self._indexed is not None:
+      if self._services is not None:
+        services = [s for s in services if s in self._services]
+      yield from self._indexed.events(self._indexed.index.select(services, sort_by_time=self._sort_by_time))
+    else:
+      yield from (ent for ent in self if ent.which() in services)
+
   def __iter__(self) -> Iterator[capnp._DynamicStructReader]:
+    if self._indexed is not None:
+      records = self._indexed.index.select(self._services, self._only_union_types, self._sort_by_time)
+      yield from self._indexed.events(records)
+      return
+
     for ent in self._ents:
       if self._only_union_types:
         try:
@@ -244,20 +268,24 @@ are uploaded or auto fallback to qlogs with '/a' selector at the end of the rout
     return identifiers
 
   def __init__(self, identifier: str | list[str], default_mode: ReadMode = ReadMode.RLOG,
-               default_source=auto_source, sort_by_time=False, only_union_types=False):
+               default_source=auto_source, sort_by_time=False, only_union_types=False,
+               services: list[str] | None = None, stream=False):
     self.default_mode = default_mode
     self.default_source = default_source
     self.identifier = identifier
 
     self.sort_by_time = sort_by_time
     self.only_union_types = only_union_types
+    self.services = services
+    self.stream = stream
 
     self.__lrs: dict[int, _LogFileReader] = {}
     self.reset()
 
   def _get_lr(self, i):
     if i not in self.__lrs:
-      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types)
+      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types,
+                                     services=self.services, stream=self.stream)
     return self.__lrs[i]
 
   def __iter__(self):
@@ -283,6 +311,8 @@ are uploaded or auto fallback to qlogs with '/a' selector at the end of the rout
     return _LogFileReader("", dat=dat)
 
   def filter(self, msg_type: str):
+    if self.stream or self.services is not None:
+      return (getattr(m, msg_type) for i in range(len(self.logreader_identifiers)) for m in self._get_lr(i).filter([msg_type]))
     return (getattr(m, m.which()) for m in filter(lambda m: m.which() == msg_type, self))
 
   def first(self, msg_type: str):
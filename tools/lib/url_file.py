@@ -1,7 +1,11 @@
 import logging
 import os
+import re
 import socket
+import sqlite3
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from hashlib import sha256
 from urllib3 import PoolManager, Retry
 from urllib3.response import BaseHTTPResponse
@@ -13,6 +17,16 @@ from catpilot.system.hardware.hw import Paths
 K = 1000
 CHUNK_SIZE = 1000 * K
 
+# the chunk cache is capped, past the limit the least recently (lru) or least frequently (lfu) used chunks are evicted
+CACHE_SIZE_LIMIT = int(os.environ.get("FILEREADER_CACHE_SIZE", str(20 * 1000 * 1000 * K)))
+CACHE_EVICTION_POLICY = os.environ.get("FILEREADER_CACHE_POLICY", "lru")
+CACHE_MANIFEST = "url_file_manifest.db"
+CHUNK_FILE_RE = re.compile(r"[0-9a-f]{64}(_\d+\.0|_log|_log\.idx)")
+
+# chunks downloaded ahead of a sequential reader, and the downloads run at once across all files
+PREFETCH_WINDOW = int(os.environ.get("FILEREADER_PREFETCH", "4"))
+DOWNLOAD_WORKERS = 8
+
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
 def hash_256(link: str) -> str:
@@ -24,12 +38,112 @@ class URLFileException(Exception):
   pass
 
 
+class ChunkCache:
+  """Size capped store of downloaded chunks, with a SQLite manifest of their sizes, last use and hit counts.
+
+  The manifest is shared by every process using the cache directory. Chunk files already in the directory
+  when the manifest is created are adopted with their mtime as the last use. Files written into the directory
+  by others, like the decompressed logs and indexes of IndexedLog, are accounted for with add() and touch().
+  """
+  def __init__(self, root: str, size_limit: int=CACHE_SIZE_LIMIT, policy: str=CACHE_EVICTION_POLICY):
+    if policy not in ("lru", "lfu"):
+      raise ValueError(f"unknown cache eviction policy {policy}")
+    self.root = root
+    self.size_limit = size_limit
+    self.eviction_order = "last_access" if policy == "lru" else "hits, last_access"
+
+    self.db = sqlite3.connect(os.path.join(root, CACHE_MANIFEST), timeout=30, check_same_thread=False)
+    self.db.execute("PRAGMA journal_mode=WAL")
+    self.db.execute("PRAGMA synchronous=NORMAL")
+    self.lock = threading.Lock()
+    with self.lock, self.db:
+      created = self.db.execute("SELECT name FROM sqlite_master WHERE name = 'chunks'").fetchone() is None
+      self.db.execute("CREATE TABLE IF NOT EXISTS chunks (name TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL, hits INTEGER NOT NULL)")
+      self.db.execute("CREATE INDEX IF NOT EXISTS chunks_last_access ON chunks (last_access)")
+      if created:
+        self.db.executemany("INSERT OR IGNORE INTO chunks VALUES (?, ?, ?, 0)", self._scan())
+
+      # running total of the chunk sizes, summed once and then kept by triggers so every process sees the same one
+      self.db.execute("CREATE TABLE IF NOT EXISTS cache_size (total INTEGER NOT NULL)")
+      self.db.execute("INSERT INTO cache_size SELECT (SELECT COALESCE(SUM(size), 0) FROM chunks) WHERE NOT EXISTS (SELECT * FROM cache_size)")
+      self.db.execute("CREATE TRIGGER IF NOT EXISTS chunks_insert AFTER INSERT ON chunks BEGIN UPDATE cache_size SET total = total + new.size; END")
+      self.db.execute("CREATE TRIGGER IF NOT EXISTS chunks_delete AFTER DELETE ON chunks BEGIN UPDATE cache_size SET total = total - old.size; END")
+      self.db.execute("CREATE TRIGGER IF NOT EXISTS chunks_update AFTER UPDATE OF size ON chunks BEGIN UPDATE cache_size SET total = total + new.size - old.size; END")
+
+  def _scan(self):
+    with os.scandir(self.root) as entries:
+      for entry in entries:
+        if CHUNK_FILE_RE.fullmatch(entry.name):
+          st = entry.stat()
+          yield entry.name, st.st_size, st.st_mtime
+
+  def path(self, name: str) -> str:
+    return os.path.join(self.root, name)
+
+  def __contains__(self, name: str) -> bool:
+    return os.path.exists(self.path(name))
+
+  def get(self, name: str) -> bytes|None:
+    try:
+      with open(self.path(name), "rb") as f:
+        data = f.read()
+    except FileNotFoundError:
+      return None
+
+    self.touch(name)
+    return data
+
+  def touch(self, name: str) -> None:
+    with self.lock, self.db:
+      self.db.execute("UPDATE chunks SET last_access = ?, hits = hits + 1 WHERE name = ?", (time.time(), name))
+
+  def put(self, name: str, data: bytes) -> None:
+    with atomic_write_in_dir(self.path(name), mode="wb", overwrite=True) as f:
+      f.write(data)
+    self.add(name, len(data))
+
+  def add(self, name: str, size: int) -> None:
+    with self.lock, self.db:
+      # an upsert rather than INSERT OR REPLACE, whose implicit delete doesn't fire the triggers
+      self.db.execute("INSERT INTO chunks VALUES (?, ?, ?, 1) ON CONFLICT (name) DO UPDATE SET size = excluded.size, last_access = excluded.last_access, hits = 1",
+                      (name, size, time.time()))
+      total = self.total()
+      if total > self.size_limit:
+        self._evict(total - self.size_limit)
+
+  def total(self) -> int:
+    return self.db.execute("SELECT total FROM cache_size").fetchone()[0]
+
+  def _evict(self, excess: int) -> None:
+    evicted = []
+    for name, size in self.db.execute(f"SELECT name, size FROM chunks ORDER BY {self.eviction_order}"):
+      if excess <= 0:
+        break
+      evicted.append((name,))
+      excess -= size
+
+    self.db.executemany("DELETE FROM chunks WHERE name = ?", evicted)
+    for name, in evicted:
+      try:
+        os.remove(self.path(name))
+      except FileNotFoundError:
+        pass
+
+
 class URLFile:
   _pool_manager: PoolManager|None = None
+  _chunk_caches: dict[str, ChunkCache] = {}
+  _download_pool: ThreadPoolExecutor|None = None
+  _downloads: dict[str, Future] = {}
+  _downloads_lock = threading.Lock()
 
   @staticmethod
   def reset() -> None:
     URLFile._pool_manager = None
+    URLFile._chunk_caches = {}
+    URLFile._download_pool = None
+    URLFile._downloads = {}
+    URLFile._downloads_lock = threading.Lock()
 
   @staticmethod
   def pool_manager() -> PoolManager:
@@ -39,11 +153,26 @@ class URLFile:
       URLFile._pool_manager = PoolManager(num_pools=10, maxsize=100, socket_options=socket_options, retries=retries)
     return URLFile._pool_manager
 
+  @staticmethod
+  def chunk_cache() -> ChunkCache:
+    root = Paths.download_cache_root()
+    if root not in URLFile._chunk_caches:
+      URLFile._chunk_caches[root] = ChunkCache(root)
+    return URLFile._chunk_caches[root]
+
+  @staticmethod
+  def download_pool() -> ThreadPoolExecutor:
+    if URLFile._download_pool is None:
+      URLFile._download_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS, thread_name_prefix="url_file")
+    return URLFile._download_pool
+
   def __init__(self, url: str, timeout: int=10, debug: bool=False, cache: bool|None=None):
     self._url = url
+    self._url_hash = hash_256(url)
     self._timeout = Timeout(connect=timeout, read=timeout)
     self._pos = 0
     self._length: int|None = None
+    self._last_read_end: int|None = None
     self._debug = debug
     #  True by default, false if FILEREADER_CACHE is defined, but can be overwritten by the cache input
     self._force_download = not int(os.environ.get("FILEREADER_CACHE", "0"))
@@ -86,37 +215,97 @@ class URLFile:
         file_length.write(str(self._length))
     return self._length
 
+  def _chunk_name(self, chunk: int) -> str:
+    return f"{self._url_hash}_{float(chunk)}"
+
+  def _fetch_chunk(self, chunk: int) -> bytes:
+    name = self._chunk_name(chunk)
+    try:
+      start = chunk * CHUNK_SIZE
+      data = self._download(start, min(start + CHUNK_SIZE, self.get_length()))
+      URLFile.chunk_cache().put(name, data)
+      return data
+    finally:
+      with URLFile._downloads_lock:
+        URLFile._downloads.pop(name, None)
+
+  def _chunk_future(self, chunk: int) -> Future:
+    # a chunk is only downloaded once however many readers want it
+    name = self._chunk_name(chunk)
+    with URLFile._downloads_lock:
+      future = URLFile._downloads.get(name)
+      if future is None:
+        future = URLFile._downloads[name] = URLFile.download_pool().submit(self._fetch_chunk, chunk)
+    return future
+
+  def _read_chunks(self, file_begin: int, file_end: int):
+    """Yields views of the cached chunks covering file_begin to file_end, downloading the missing ones concurrently.
+
+    Sequential reads also start downloading the PREFETCH_WINDOW chunks after file_end, so they're cached by the next read.
+    """
+    first_chunk = file_begin // CHUNK_SIZE
+    last_chunk = (file_end - 1) // CHUNK_SIZE
+    prefetch_end = last_chunk + 1
+    if file_begin == self._last_read_end:
+      prefetch_end = min(prefetch_end + PREFETCH_WINDOW, (self.get_length() + CHUNK_SIZE - 1) // CHUNK_SIZE)
+    self._last_read_end = file_end
+
+    cache = URLFile.chunk_cache()
+    futures = {chunk: self._chunk_future(chunk) for chunk in range(first_chunk, prefetch_end) if self._chunk_name(chunk) not in cache}
+
+    for chunk in range(first_chunk, last_chunk + 1):
+      data = futures[chunk].result() if chunk in futures else cache.get(self._chunk_name(chunk))
+      if data is None:
+        # evicted between the check and the read
+        data = self._chunk_future(chunk).result()
+
+      chunk_start = chunk * CHUNK_SIZE
+      yield memoryview(data)[max(0, file_begin - chunk_start):min(CHUNK_SIZE, file_end - chunk_start)]
+
+  def _read_range(self, ll: int|None) -> tuple[int, int]:
+    length = self.get_length()
+    assert length != -1, f"Remote file is empty or doesn't exist: {self._url}"
+    file_begin = min(self._pos, length)
+    file_end = length if ll is None else min(file_begin + ll, length)
+    return file_begin, file_end
+
   def read(self, ll: int|None=None) -> bytes:
     if self._force_download:
       return self.read_aux(ll=ll)
 
-    file_begin = self._pos
-    file_end = self._pos + ll if ll is not None else self.get_length()
-    assert file_end != -1, f"Remote file is empty or doesn't exist: {self._url}"
-    #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_256(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(Paths.download_cache_root(), str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write_in_dir(full_path, mode="wb") as new_cached_file:
-          new_cached_file.write(data)
-      else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
-
-      response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
+    file_begin, file_end = self._read_range(ll)
+    if file_begin == file_end:
+      return b""
+    # join sizes the result from the views and copies each chunk into it once
+    response = b"".join(self._read_chunks(file_begin, file_end))
+    self._pos = file_end
+    return response
 
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
+  def readinto(self, b) -> int:
+    if self._force_download:
+      data = self.read_aux(ll=len(b))
+      b[:len(data)] = data
+      return len(data)
+
+    file_begin, file_end = self._read_range(len(b))
+    view = memoryview(b).cast("B")
+    pos = 0
+    if file_begin < file_end:
+      for data in self._read_chunks(file_begin, file_end):
+        view[pos:pos + len(data)] = data
+        pos += len(data)
+    self._pos = file_end
+    return pos
+
+  def _download(self, start: int, end: int) -> bytes:
+    headers = {'Range': f"bytes={start}-{end - 1}"}
+    t1 = time.time()
+    response = self._request('GET', self._url, headers=headers)
+    if self._debug and time.time() - t1 > 0.1:
+      print(f"get {self._url} {headers!r} {time.time() - t1:.3f} slow")
+    if response.status != 206:  # Partial Content
+      raise URLFileException(f"Error, requested range but got unexpected response {response.status} {headers} ({self._url}): {repr(response.data)[:500]}")
+    return response.data
 
   def read_aux(self, ll: int|None=None) -> bytes:
     download_range = False
@@ -126,7 +315,7 @@ class URLFile:
         end = self.get_length() - 1
       else:
         end = min(self._pos + ll, self.get_length()) - 1
-      if self._pos >= end:
+      if self._pos > end:
         return b""
       headers['Range'] = f"bytes={self._pos}-{end}"
       download_range = True
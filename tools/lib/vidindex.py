@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 import argparse
+import mmap
 import os
 import struct
 from enum import IntEnum
 
-from catpilot.tools.lib.filereader import FileReader
+import numpy as np
+
+from catpilot.tools.lib.filereader import FileReader, resolve_name
 
 DEBUG = int(os.getenv("DEBUG", "0"))
 
@@ -258,38 +261,182 @@ def get_hevc_slice_type(dat: bytes, nal_unit_start: int, nal_unit_type: HevcNalU
     raise VideoFileInvalid("slice_type must be 0, 1, or 2")
   return slice_type, is_first_slice
 
-def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, int, bytes]:
-  with FileReader(hevc_file_name) as f:
-    dat = f.read()
-
-  if len(dat) < NAL_UNIT_START_CODE_SIZE + 1:
-    raise VideoFileInvalid("data is too short")
-
-  if dat[0] != 0x00:
-    raise VideoFileInvalid("first byte must be 0x00")
+def find_nal_unit_starts(dat, start: int, end: int) -> np.ndarray:
+  """Offsets of every NAL unit start code that lies within dat[start:end]."""
+  # start codes can't overlap so repeated finds see every one, the search runs in C and is faster than comparing
+  # chunks in numpy and without the scratch arrays
+  starts = []
+  pos = dat.find(NAL_UNIT_START_CODE, start, end)
+  while pos != -1:
+    starts.append(pos)
+    pos = dat.find(NAL_UNIT_START_CODE, pos + NAL_UNIT_START_CODE_SIZE, end)
+  return np.array(starts, dtype=np.int64)
+
+def read_ue(words: np.ndarray, skip_bits: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  # get_ue over a column of 32 bit big endian words, returns values, sizes and whether the code fit in the word
+  x = (words << np.minimum(skip_bits, 32)) & 0xFFFFFFFF
+  leading_zeros = 32 - np.frexp(x.astype(np.float64))[1]
+  size = 2 * leading_zeros + 1
+  valid = (x != 0) & (size <= 32 - skip_bits)
+  return (x >> np.clip(32 - size, 0, 32)) - 1, size, valid
+
+def get_hevc_slice_types(buf: np.ndarray, nal_unit_starts: np.ndarray, nal_unit_types: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """Vectorized get_hevc_slice_type for slice headers whose fields fit in their first four bytes.
+
+  Returns the slice types, the first slice flags and which rows were decoded, the rest need get_hevc_slice_type.
+  """
+  rbsp_starts = nal_unit_starts + NAL_UNIT_START_CODE_SIZE + NAL_UNIT_HEADER_SIZE
+  in_bounds = rbsp_starts + 4 <= len(buf)
+  header = buf[rbsp_starts[in_bounds, None] + np.arange(4)].astype(np.int64)
+  words = np.zeros(len(rbsp_starts), dtype=np.int64)
+  words[in_bounds] = (header[:, 0] << 24) | (header[:, 1] << 16) | (header[:, 2] << 8) | header[:, 3]
+
+  # first_slice_segment_in_pic_flag, then no_output_of_prior_pics_flag for IRAP pictures
+  is_first_slice = (words >> 31) & 1 == 1
+  skip_bits = 1 + ((nal_unit_types >= HevcNalUnitType.BLA_W_LP) & (nal_unit_types <= HevcNalUnitType.RSV_IRAP_VCL23))
+  _, pps_id_size, pps_id_valid = read_ue(words, skip_bits)
+  slice_types, _, slice_type_valid = read_ue(words, skip_bits + pps_id_size)
+
+  decoded = in_bounds & (~is_first_slice | (pps_id_valid & slice_type_valid & (slice_types <= 2)))
+  return np.where(is_first_slice, slice_types, -1), is_first_slice, decoded
+
+class HevcIndexer:
+  """Frame index of an HEVC stream, built from a memory map so memory use doesn't grow with the file.
+
+  update() can be called repeatedly while the file is still being written, each call only scans the bytes appended
+  since the previous one. A NAL unit's length is only known once the next start code is written, so the unit at
+  the end of the file is left pending until the next update or a final one, which runs it to the end of the file.
+  """
+  def __init__(self, hevc_file_name: str, allow_corrupt: bool=False):
+    self.hevc_file_name = resolve_name(hevc_file_name)
+    self.allow_corrupt = allow_corrupt
+
+    self.frame_types: list[tuple[int, int]] = []
+    self.prefix_dat = b""
+    self.dat_len = 0
+
+    self.pending: int | None = None  # start of the NAL unit whose end hasn't been found yet
+    self.scanned = 0
+    self.finished = False
+
+  def _read(self):
+    if self.hevc_file_name.startswith(("http://", "https://")):
+      with FileReader(self.hevc_file_name) as f:
+        return f.read()
+
+    with open(self.hevc_file_name, "rb") as f:
+      size = os.fstat(f.fileno()).st_size
+      return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else b""
+
+  def update(self, final: bool=False) -> int:
+    """Indexes the data appended since the last call and returns the number of new frames."""
+    if self.finished:
+      return 0
+
+    dat = self._read()
+    try:
+      frame_count = len(self.frame_types)
+      self._update(dat, final)
+      return len(self.frame_types) - frame_count
+    finally:
+      if isinstance(dat, mmap.mmap):
+        dat.close()
+
+  def _update(self, dat, final: bool) -> None:
+    if len(dat) < self.scanned:
+      raise VideoFileInvalid("file is shorter than its index")
+
+    if self.pending is None:
+      if len(dat) < NAL_UNIT_START_CODE_SIZE + 1:
+        if final:
+          raise VideoFileInvalid("data is too short")
+        return
+      if dat[0] != 0x00:
+        raise VideoFileInvalid("first byte must be 0x00")
+
+      try:
+        require_nal_unit_start(dat, 1)
+      except Exception as e:
+        self._skip_corrupt(e, 1, dat)
+        return
+      self.pending = 1 # skip past first byte 0x00
+      self.scanned = 1
+
+    nal_unit_starts = find_nal_unit_starts(dat, max(self.pending + NAL_UNIT_START_CODE_SIZE, self.scanned - 2), len(dat))
+    self.scanned = len(dat)
+
+    starts = np.concatenate(([self.pending], nal_unit_starts))
+    ends = np.concatenate((nal_unit_starts, [len(dat)]))
+    if not final:
+      starts, ends = starts[:-1], ends[:-1]
+
+    stopped_at = self._index_nal_units(dat, starts, ends, final)
+    if self.finished:
+      return
+    if stopped_at is not None:
+      # the unit's header runs past what has been written so far, rescan from it once there's more
+      self.pending = self.scanned = stopped_at
+    elif len(ends):
+      self.pending = int(ends[-1])
+    self.dat_len = len(dat) if final else self.pending
+    self.finished = final
+
+  def _skip_corrupt(self, e: Exception, nal_unit_start: int, dat) -> None:
+    if not self.allow_corrupt:
+      raise e
+    print(f"ERROR: NAL unit skipped @ {nal_unit_start}\n", str(e))
+    # like a full parse, nothing after a corrupt NAL unit is indexed
+    self.dat_len = len(dat)
+    self.finished = True
+
+  def _index_nal_units(self, dat, starts: np.ndarray, ends: np.ndarray, final: bool) -> int | None:
+    # returns the start of the NAL unit indexing stopped at, if it didn't get through all of them
+    buf = np.frombuffer(dat, dtype=np.uint8)
+    has_header = starts + NAL_UNIT_START_CODE_SIZE + NAL_UNIT_HEADER_SIZE <= len(buf)
+    nal_unit_types = np.full(len(starts), -1, dtype=np.int64)
+    nal_unit_types[has_header] = (buf[starts[has_header] + NAL_UNIT_START_CODE_SIZE] >> 1) & 0x3F
+
+    is_slice = np.isin(nal_unit_types, HEVC_CODED_SLICE_SEGMENT_NAL_UNITS)
+    slice_rows = np.flatnonzero(is_slice)
+    slice_types, is_first_slice, decoded = get_hevc_slice_types(buf, starts[slice_rows], nal_unit_types[slice_rows])
+    del buf
+
+    frame_rows = decoded & is_first_slice
+    frame_types = np.column_stack((slice_types[frame_rows], starts[slice_rows[frame_rows]])).tolist()
+
+    # parameter sets, truncated headers and unusual slice headers go through the bytewise parser in stream order
+    bytewise = ~has_header | np.isin(nal_unit_types, HEVC_PARAMETER_SET_NAL_UNITS)
+    bytewise[slice_rows[~decoded]] = True
+    for row in np.flatnonzero(bytewise).tolist():
+      nal_unit_start, nal_unit_end = int(starts[row]), int(ends[row])
+      try:
+        nal_unit_type = get_hevc_nal_unit_type(dat, nal_unit_start)
+        if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
+          self.prefix_dat += dat[nal_unit_start:nal_unit_end]
+        else:
+          slice_type, is_first = get_hevc_slice_type(dat, nal_unit_start, nal_unit_type)
+          if is_first:
+            frame_types.append([slice_type, nal_unit_start])
+      except Exception as e:
+        if final:
+          self._skip_corrupt(e, nal_unit_start, dat)
+        stopped_at = nal_unit_start
+        frame_types = [frame for frame in frame_types if frame[1] < nal_unit_start]
+        break
+    else:
+      stopped_at = None
+
+    frame_types.sort(key=lambda frame: frame[1])
+    self.frame_types += [(slice_type, offset) for slice_type, offset in frame_types]
+    return stopped_at
+
+  def index(self) -> tuple[list, int, bytes]:
+    return self.frame_types, self.dat_len, self.prefix_dat
 
-  prefix_dat = b""
-  frame_types = list()
-
-  i = 1 # skip past first byte 0x00
-  try:
-    while i < len(dat):
-      require_nal_unit_start(dat, i)
-      nal_unit_len = get_hevc_nal_unit_length(dat, i)
-      nal_unit_type = get_hevc_nal_unit_type(dat, i)
-      if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
-        prefix_dat += dat[i:i+nal_unit_len]
-      elif nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
-        slice_type, is_first_slice = get_hevc_slice_type(dat, i, nal_unit_type)
-        if is_first_slice:
-          frame_types.append((slice_type, i))
-      i += nal_unit_len
-  except Exception as e:
-    if not allow_corrupt:
-      raise
-    print(f"ERROR: NAL unit skipped @ {i}\n", str(e))
-
-  return frame_types, len(dat), prefix_dat
+def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, int, bytes]:
+  indexer = HevcIndexer(hevc_file_name, allow_corrupt)
+  indexer.update(final=True)
+  return indexer.index()
 
 def main() -> None:
   parser = argparse.ArgumentParser()